@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark: `python -X importtime -c "import techaudit_agent"` in
+fresh interpreters, reporting the module's own and cumulative import cost
+and its heaviest dependencies.
+
+Importing the module must not load the UI or any provider SDK (they are
+imported lazily on first use), so the run fails if one of FORBIDDEN shows
+up, or if the median cumulative time exceeds --budget-ms.
+
+    python benchmarks/bench_import.py [--runs 7] [--budget-ms 100] [--top 10]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = "techaudit_agent"
+FORBIDDEN = ("streamlit", "google.genai", "anthropic", "requests", "asyncio")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module: str = MODULE) -> dict[str, tuple[int, int]]:
+    """{module: (self µs, cumulative µs)} for one cold import in a fresh interpreter."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)    # time the import, not the compile
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if not m:
+            continue
+        if m.group(4) == "site" and m.group(3) == " ":
+            times.clear()               # interpreter startup, not our import
+        else:
+            times[m.group(4)] = (int(m.group(1)), int(m.group(2)))
+    return times
+
+
+def forbidden_imports(times: dict) -> list[str]:
+    return sorted(name for name in times
+                  if any(name == f or name.startswith(f + ".") for f in FORBIDDEN))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--runs", type=int, default=7, help="fresh interpreters to time")
+    ap.add_argument("--budget-ms", type=float, default=100.0, help="max median cumulative ms")
+    ap.add_argument("--top", type=int, default=10, help="heaviest dependencies to list")
+    args = ap.parse_args()
+
+    import_times()                      # warm-up: writes the .pyc files
+    runs = [import_times() for _ in range(args.runs)]
+    self_ms = statistics.median(r[MODULE][0] for r in runs) / 1000
+    cum_ms = statistics.median(r[MODULE][1] for r in runs) / 1000
+    print(f"{MODULE}: self {self_ms:.1f} ms, cumulative {cum_ms:.1f} ms "
+          f"(median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+
+    print(f"\n{'dependency':<36}{'cumulative ms':>14}")
+    heaviest = sorted(runs[-1].items(), key=lambda kv: kv[1][1], reverse=True)
+    for name, (_, cum) in [kv for kv in heaviest if kv[0] != MODULE][:args.top]:
+        print(f"{name:<36}{cum / 1000:>14.1f}")
+
+    failed = False
+    bad = forbidden_imports(runs[-1])
+    if bad:
+        print(f"\nFAIL: import pulled in {', '.join(bad)}")
+        failed = True
+    if cum_ms > args.budget_ms:
+        print(f"\nFAIL: {cum_ms:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: _parse_json (single-pass TolerantJSONParser) vs the previous
+multi-pass implementation (fence regex → json.loads → balanced-bracket walk
+for "[" then "{" → regex repairs → json.loads).
+
+The corpus mirrors the malformed outputs seen from the models: fenced JSON
+with trailing commas, grounded answers with prose and [n] footnotes, smart
+quotes, // comments, and an ~8k-token article object that fails the direct
+parse.
+
+    python benchmarks/bench_parse_json.py [--number 200]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from techaudit_agent import _parse_json  # noqa: E402
+
+
+def legacy_parse_json(text: str | None) -> list | dict:
+    """_parse_json as it was before TolerantJSONParser (kept verbatim)."""
+    if not text:
+        raise ValueError("Empty response — model returned no content.")
+
+    clean = re.sub(r"^```(?:json)?\s*", "", text.strip(), flags=re.M)
+    clean = re.sub(r"\s*```\s*$", "", clean.strip(), flags=re.M)
+    try:
+        return json.loads(clean)
+    except json.JSONDecodeError:
+        pass
+
+    def _extract_balanced(src: str, open_ch: str, close_ch: str) -> str | None:
+        start = src.find(open_ch)
+        if start == -1:
+            return None
+        depth, in_str, esc, i = 0, False, False, start
+        while i < len(src):
+            ch = src[i]
+            if esc:
+                esc = False
+            elif ch == "\\" and in_str:
+                esc = True
+            elif ch == '"':
+                in_str = not in_str
+            elif not in_str:
+                if ch == open_ch:
+                    depth += 1
+                elif ch == close_ch:
+                    depth -= 1
+                    if depth == 0:
+                        return src[start : i + 1]
+            i += 1
+        return None
+
+    for open_ch, close_ch in [("[", "]"), ("{", "}")]:
+        block = _extract_balanced(clean, open_ch, close_ch)
+        if block is None:
+            continue
+        try:
+            return json.loads(block)
+        except json.JSONDecodeError:
+            pass
+        repaired = block
+        repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
+        repaired = re.sub(r"(?<!:)//[^\n\"]*", "", repaired)
+        repaired = repaired.replace("‘", "'").replace("’", "'")
+        repaired = repaired.replace("“", '"').replace("”", '"')
+        try:
+            return json.loads(repaired)
+        except json.JSONDecodeError:
+            pass
+
+    raise ValueError("Could not parse JSON from model response.")
+
+
+# ── corpus ──────────────────────────────────────────────────────
+def _articles(n: int) -> list[dict]:
+    return [
+        {"title": f"Article {i}: Blackwell vs MI300X inference throughput",
+         "url": f"https://example.com/posts/{i}",
+         "date": "2025-02-10",
+         "relevance": "Covers GPU memory bandwidth and TCO for LLM serving."}
+        for i in range(n)
+    ]
+
+
+def _article_body() -> dict:
+    para = ("Memory bandwidth, not peak FLOPS, bounds decode throughput for "
+            "large-batch LLM serving; the benchmarks below isolate that effect. ") * 12
+    return {
+        "article_title": "H100 vs MI300X: What the Benchmarks Don't Tell You",
+        "meta_description": "An evidence-based comparison of inference TCO.",
+        "sections": [{"heading": f"Section {i}", "body": para, "sources": [1, 2, 3]}
+                     for i in range(16)],
+        "tco_analysis": {"summary": para, "rows": [[f"Item {i}", i * 100] for i in range(20)]},
+        "anti_recommendation": para,
+    }
+
+
+def build_corpus() -> dict[str, str]:
+    arts = json.dumps(_articles(3), indent=2)
+    article = json.dumps(_article_body(), indent=2, ensure_ascii=False)
+    return {
+        "fenced_trailing_comma": "```json\n" + arts[:-2] + ",\n]\n```",
+        "grounded_prose_footnotes": (
+            "Based on the search results [1][2], here are the latest posts:\n\n"
+            + arts + "\n\nSources:\n[1] https://example.com\n[2] https://example.org"
+        ),
+        "smart_quotes_comments": arts.replace('"date"', "“date”").replace(
+            '"relevance":', '// relevance\n  "relevance":'),
+        "article_8k_trailing_comma": (
+            "Here is the article JSON:\n```json\n" + article[:-2] + ",\n}\n```\n"
+        ),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--number", type=int, default=200, help="iterations per case")
+    args = ap.parse_args()
+
+    print(f"{'case':<28}{'bytes':>8}{'legacy µs':>12}{'new µs':>10}{'speedup':>9}")
+    for name, text in build_corpus().items():
+        new = _parse_json(text)
+        try:
+            same = legacy_parse_json(text) == new
+        except ValueError:
+            same = False
+        t_old = timeit.timeit(lambda: _try(legacy_parse_json, text), number=args.number)
+        t_new = timeit.timeit(lambda: _parse_json(text), number=args.number)
+        us_old, us_new = t_old / args.number * 1e6, t_new / args.number * 1e6
+        note = "" if same else "  (legacy result differs / fails)"
+        print(f"{name:<28}{len(text):>8}{us_old:>12.1f}{us_new:>10.1f}{us_old / us_new:>8.1f}x{note}")
+
+
+def _try(fn, text):
+    try:
+        return fn(text)
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    main()
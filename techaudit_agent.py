@@ -8,34 +8,87 @@ from __future__ import annotations
 ╚══════════════════════════════════════════════════════════════════╝
 """
 
-import streamlit as st
-from google import genai
-from google.genai import types
-import os, json, re, time, requests, textwrap, hashlib
+import os, sys, json, re, time, textwrap, hashlib, uuid, base64, contextlib, contextvars, functools
+import collections, concurrent.futures, math, random, sqlite3, threading, weakref
+import importlib, importlib.util
+import logging as _logging
 from datetime import datetime
 from typing import Optional
 from urllib.parse import quote, urlparse
+from json.decoder import scanstring as _scanstring
+from logging.handlers import RotatingFileHandler
+
+
+class _LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+    Importing this file then pulls in no UI or provider SDK: the headless
+    engine, tests and pool workers only pay for what they actually call.
+    """
+
+    def __init__(self, name: str):
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def __getattr__(self, attr: str):
+        if self._lazy_module is None:
+            self._lazy_module = importlib.import_module(self._lazy_name)
+        return getattr(self._lazy_module, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._lazy_name!r}>"
 
-try:
-    import anthropic as _anthropic
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    ANTHROPIC_AVAILABLE = False
+
+def _installed(name: str) -> bool:
+    """True if the package can be imported — found without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ValueError:      # already in sys.modules without a spec (e.g. a test double)
+        return True
+
+
+def _cache_resource(fn):
+    """
+    st.cache_resource when Streamlit is loaded (shared across reruns and
+    sessions), a plain process-wide lru_cache otherwise — chosen on first call.
+    """
+    cached = None
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        nonlocal cached
+        if cached is None:
+            cached = (st.cache_resource(fn) if "streamlit" in sys.modules
+                      else functools.lru_cache(maxsize=None)(fn))
+        return cached(*args, **kwargs)
+    return wrapper
+
+
+st         = _LazyModule("streamlit")
+genai      = _LazyModule("google.genai")
+types      = _LazyModule("google.genai.types")
+requests   = _LazyModule("requests")
+_anthropic = _LazyModule("anthropic")
+asyncio    = _LazyModule("asyncio")     # ~40 ms — only needed once the dispatcher loop starts
+ANTHROPIC_AVAILABLE = _installed("anthropic")
 
 # ══════════════════════════════════════════════════════════════════
 # 1 · PAGE CONFIG
 # ══════════════════════════════════════════════════════════════════
-st.set_page_config(
-    page_title="TechAudit Content Architect",
-    page_icon="⚙️",
-    layout="wide",
-    initial_sidebar_state="expanded",
-)
+def _setup_page():
+    """First Streamlit call of every rerun (from main(), never at import)."""
+    st.set_page_config(
+        page_title="TechAudit Content Architect",
+        page_icon="⚙️",
+        layout="wide",
+        initial_sidebar_state="expanded",
+    )
+    st.markdown(GLOBAL_CSS, unsafe_allow_html=True)
 
 # ══════════════════════════════════════════════════════════════════
 # 2 · GLOBAL STYLES
 # ══════════════════════════════════════════════════════════════════
-st.markdown("""
+GLOBAL_CSS = """
 <style>
 /* ── Base ──────────────────────────────────────────────────────── */
 [data-testid="stApp"]        { background:#0a0e1a; color:#e2e8f0; }
@@ -228,7 +281,7 @@ div[data-testid="stVerticalBlock"] .reset-btn > button {
 .stCheckbox label { font-size:.82rem!important; color:#94a3b8!important; }
 .stCheckbox label span { vertical-align:middle; }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # ══════════════════════════════════════════════════════════════════
 # 3 · CONSTANTS
@@ -270,6 +323,121 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 COMPETITORS_DATA_PATH = os.path.join(BASE_DIR, "data", "competitors_data.json")
 DEFAULT_COMPETITORS_PATH = os.path.join(BASE_DIR, "data", "default_competitors.json")
 COMPETITORS_SS_KEY = "competitors_data_cache"
+COMPETITORS_VER_KEY = "competitors_data_version"   # shared-cache version the session copy came from
+COMPETITOR_FETCH_WORKERS = 4   # max competitors fetched in parallel per collection
+COMPETITOR_TTL_SECONDS   = 24 * 3600   # re-query a competitor once its articles are older than this
+
+# ── Gemini response cache (SQLite, content-addressed) ────────────
+RESPONSE_CACHE_PATH      = os.path.join(BASE_DIR, "data", "response_cache.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# TTL in seconds per call type; call types not listed here are never cached
+RESPONSE_CACHE_TTLS: dict[str, int] = {
+    "fetch_topics":  6 * 3600,
+    "fetch_titles":  24 * 3600,
+    "deep_research": 24 * 3600,
+    "notebooklm":    24 * 3600,
+    "rubric":        7 * 24 * 3600,
+    "competitor":    6 * 3600,
+}
+
+# ── Async LLM dispatcher: max in-flight calls per provider (process-wide) ──
+PROVIDER_CONCURRENCY: dict[str, int] = {
+    "gemini":    8,
+    "anthropic": 4,
+}
+
+# ── Hedged grounded search (opt-in via the sidebar) ──
+# Start the JSON-mode call once the grounded call is slower than this
+# percentile of recent grounded latencies for the same call type
+SEARCH_HEDGE_PERCENTILE = 0.90
+SEARCH_HEDGE_DEFAULT_DELAY = 20.0   # seconds, until SEARCH_HEDGE_MIN_SAMPLES are known
+SEARCH_HEDGE_MIN_SAMPLES = 5
+
+# ── Speculative prefetch (opt-in via the sidebar) ──
+# While the user reads Step 2 / Step 3, titles for every topic and research for
+# the top-ranked titles run in the background. Budget is per article run.
+PREFETCH_WORKERS = 4
+PREFETCH_RESEARCH_TOP = int(os.environ.get("TECHAUDIT_PREFETCH_RESEARCH_TOP", "2"))
+PREFETCH_MAX_CALLS = int(os.environ.get("TECHAUDIT_PREFETCH_MAX_CALLS", "10"))
+PREFETCH_MAX_TOKENS = int(os.environ.get("TECHAUDIT_PREFETCH_MAX_TOKENS", "120000"))
+# Budget charged per speculative job: (LLM calls, estimated tokens in + out)
+PREFETCH_COSTS: dict[str, tuple[int, int]] = {
+    "titles":   (1, 4_000),
+    "research": (2, 30_000),     # grounded search + NotebookLM synthesis
+}
+
+# ── Background job queue for Step 5 (SQLite, survives reruns and reloads) ──
+JOBS_DB_PATH = os.environ.get(
+    "TECHAUDIT_JOBS_PATH", os.path.join(BASE_DIR, "data", "jobs.sqlite3")
+)
+JOB_WORKERS = int(os.environ.get("TECHAUDIT_JOB_WORKERS", "2"))   # worker threads per process
+JOB_POLL_SECONDS = 2.0              # Step 5 status refresh / idle worker poll interval
+JOB_STALE_SECONDS = 15 * 60         # a running job silent this long is re-queued (worker died)
+JOB_RETENTION_SECONDS = 7 * 24 * 3600   # finished jobs kept this long for re-use by input hash
+
+# ── Workflow graph: memoized step outputs, keyed by an input fingerprint ──
+WORKFLOW_MEMO_ENTRIES = 256         # process-wide LRU of node outputs
+WORKFLOW_MEMO_TTL = 6 * 3600        # seconds; trending topics etc. go stale eventually
+
+# ── Model / provider health (circuit breaker, process-wide) ──
+HEALTH_WINDOW = 20                 # most recent calls kept for the rolling error rate
+HEALTH_MIN_CALLS = 4               # don't judge the error rate on fewer calls
+HEALTH_ERROR_THRESHOLD = 0.5       # open the circuit at ≥50% errors in the window…
+HEALTH_CONSECUTIVE_FAILURES = 3    # …or after this many failures in a row
+HEALTH_OPEN_SECONDS = 60.0         # cool-down before a half-open recovery probe
+HEALTH_LATENCY_ALPHA = 0.2         # EWMA weight of the newest latency sample
+
+# ── Rate limits per API key × model: (requests/min, input tokens/min) ──
+# Shared by every session in the process; callers queue for capacity.
+RATE_LIMITS: dict[str, tuple[int, int]] = {
+    "gemini-2.5-pro":    (150, 2_000_000),
+    "gemini-2.5-flash":  (1000, 1_000_000),
+    "claude-opus-4-6":   (1000, 450_000),
+    "claude-sonnet-4-6": (1000, 450_000),
+}
+RATE_LIMIT_DEFAULT = (60, 1_000_000)      # models not listed above
+RATE_LIMIT_RETRIES = 3                    # 429 retries on the same model before falling back
+RATE_LIMIT_BACKOFF_BASE = 2.0             # seconds; doubled per retry, ±50% jitter
+RATE_LIMIT_BACKOFF_MAX = 60.0             # longer retry-after hints (daily quota) aren't waited out
+
+# ── API key pools (optional; for batch throughput across several projects) ──
+# Keys come from GEMINI_API_KEYS / ANTHROPIC_API_KEYS (comma- or newline-
+# separated) and/or a JSON file {"gemini": [...], "anthropic": [...]} named by
+# TECHAUDIT_API_KEYS_FILE. With ≥2 keys, calls are spread across the pool.
+API_KEYS_FILE = os.environ.get("TECHAUDIT_API_KEYS_FILE", "")
+KEY_POOL_STRATEGY = os.environ.get("TECHAUDIT_KEY_STRATEGY", "least_loaded")   # or "round_robin"
+KEY_QUARANTINE_SECONDS = 15 * 60           # a key is benched this long after a credit / quota error
+
+# ── Telemetry: one JSONL record per LLM / HTTP call (rotating file) ──
+TELEMETRY_TRACE_PATH = os.environ.get(
+    "TECHAUDIT_TRACE_PATH", os.path.join(BASE_DIR, "data", "telemetry.jsonl")
+)
+TELEMETRY_TRACE_MAX_BYTES = 10 * 1024 * 1024
+TELEMETRY_TRACE_BACKUPS = 3
+# Spans (workflow run → steps → calls) in Chrome Trace Event format
+SPANS_TRACE_PATH = os.environ.get(
+    "TECHAUDIT_SPANS_PATH", os.path.join(BASE_DIR, "data", "trace_events.json")
+)
+SPANS_TRACE_MAX_BYTES = 50 * 1024 * 1024
+# USD per 1M tokens; thinking tokens bill as output, cache writes as input if not listed
+MODEL_PRICES: dict[str, dict[str, float]] = {
+    "gemini-2.5-pro":    {"input": 1.25, "output": 10.0, "cached": 0.31},
+    "gemini-2.5-flash":  {"input": 0.30, "output": 2.50, "cached": 0.075},
+    "claude-opus-4-6":   {"input": 5.00, "output": 25.0, "cached": 0.50, "cache_write": 6.25},
+    "claude-sonnet-4-6": {"input": 3.00, "output": 15.0, "cached": 0.30, "cache_write": 3.75},
+}
+
+# ── Step 5 post-processing (QA, rubric, hero image run concurrently) ──
+HERO_IMAGE_TIMEOUT = 35            # seconds, Pollinations request timeout
+RUBRIC_TIMEOUT = 90                # seconds to wait for rubric scores before committing zeros
+STAGE_WORKERS = 8                  # process-wide threads for background Step 5 stages
+
+# ── Best-of-N Step 5 (opt-in via the sidebar) ──
+BEST_OF_MAX = 4                    # most candidate articles written in parallel per run
+
+# ── Gemini explicit context cache for the Step 4/5 research context ──
+# Long enough for a Step 4 → 5 pass with QA re-runs; extended on each use
+GEMINI_CONTEXT_CACHE_TTL = 3600
 
 # ── Competitors per category ─────────────────────────────────────
 COMPETITORS_BY_CATEGORY: dict[str, dict[str, dict]] = {
@@ -319,8 +487,9 @@ def _validate_competitor_config() -> None:
 # ══════════════════════════════════════════════════════════════════
 # 4 · SESSION STATE
 # ══════════════════════════════════════════════════════════════════
-def _init():
-    defaults = {
+def _state_defaults() -> dict:
+    """Fresh per-session workflow state (shared by the UI and headless runs)."""
+    return {
         "step":               1,
         "category":           None,
         "topics":             [],
@@ -344,29 +513,92 @@ def _init():
         "fallback_reason":    "",      # human-readable reason for fallback
         "gen_error":          "",
         "rubric_scores":      None,   # dict {criterion: score} from score_article_rubric()
-        COMPETITORS_SS_KEY:   None,   # competitors data cache (session_state 1st layer)
+        "claude_usage":       None,   # session token totals incl. prompt-cache read / write (+ "last")
+        "gemini_context_cache": None, # {"key", "name", "model", "expires_at"} — see ensure_article_context_cache()
+        "hedge_search":       False,  # sidebar opt-in: hedge grounded search with a JSON-mode call
+        "speculative_prefetch": False,  # sidebar opt-in: prefetch next-step results — see PrefetchCache
+        "prefetch":           None,   # PrefetchCache for this article run (created on first use)
+        "gen_job":            None,   # id of the queued / running Step 5 generation job
+        "gen_attempt":        0,      # QA re-run / retry clicks — a draft nonce
+        "best_of_n":          1,      # sidebar opt-in: candidate articles per generation (1 = off)
+        "best_of_mix":        False,  # alternate Claude / Gemini across candidates
+        "best_of_rubric":     False,  # rank candidates by rubric score after QA
+        "candidates":         [],     # per-candidate summaries of the last best-of-N run
+        "trace_session":      uuid.uuid4().hex,  # telemetry session id (stable across reruns)
+        "trace_run":          None,   # open workflow-run / step span IDs — see begin_trace_rerun()
+        COMPETITORS_SS_KEY:   None,   # reference to the process-wide shared competitors data
+        COMPETITORS_VER_KEY:  None,   # shared-cache version of that reference
         "collection_in_progress": False,  # prevent duplicate button clicks
         "competitive_context":    "",     # build_competitive_context() result — reuse on re-run/QA retry
     }
-    for k, v in defaults.items():
+
+
+class RunState(dict):
+    """
+    Explicit workflow state for headless runs. Supports the same item,
+    attribute and .get() access as st.session_state, so core functions
+    work unchanged against either — see bind_state() / _state().
+    """
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    @classmethod
+    def new(cls, **overrides) -> "RunState":
+        state = cls(_state_defaults())
+        state.update(overrides)
+        return state
+
+
+_active_state: contextvars.ContextVar = contextvars.ContextVar("techaudit_state", default=None)
+
+
+def _state():
+    """State for the current run: the bound RunState, else st.session_state."""
+    state = _active_state.get()
+    return st.session_state if state is None else state
+
+
+@contextlib.contextmanager
+def bind_state(state: RunState):
+    """Route core-function state reads / writes to state in this context."""
+    token = _active_state.set(state)
+    try:
+        yield state
+    finally:
+        _active_state.reset(token)
+
+
+def _init():
+    for k, v in _state_defaults().items():
         if k not in st.session_state:
             st.session_state[k] = v
 
-_init()
-
 # ══════════════════════════════════════════════════════════════════
 # 5 · GEMINI CLIENT
 # ══════════════════════════════════════════════════════════════════
-@st.cache_resource
+@_cache_resource
 def get_client(api_key: str) -> genai.Client:
-    return genai.Client(api_key=api_key)
+    return _tag_client(genai.Client(api_key=api_key), api_key)
 
 
-@st.cache_resource
+@_cache_resource
 def get_anthropic_client(api_key: str):
     if not ANTHROPIC_AVAILABLE or not api_key:
         return None
-    return _anthropic.Anthropic(api_key=api_key)
+    return _tag_client(_anthropic.Anthropic(api_key=api_key), api_key)
+
+
+@_cache_resource
+def get_async_anthropic_client(api_key: str):
+    if not ANTHROPIC_AVAILABLE or not api_key:
+        return None
+    return _tag_client(_anthropic.AsyncAnthropic(api_key=api_key), api_key)
 
 
 def _search_cfg() -> types.GenerateContentConfig:
@@ -377,14 +609,16 @@ def _search_cfg() -> types.GenerateContentConfig:
     )
 
 
-def _json_cfg(schema: dict | None = None) -> types.GenerateContentConfig:
-    """GenerateContentConfig for structured JSON output (no search)."""
+def _json_cfg(schema: dict | None = None, cached_content: str | None = None) -> types.GenerateContentConfig:
+    """GenerateContentConfig for structured JSON output (no search), optionally on a context cache."""
     cfg = dict(
         response_mime_type="application/json",
         temperature=0.5,
     )
     if schema:
         cfg["response_schema"] = schema
+    if cached_content:
+        cfg["cached_content"] = cached_content
     return types.GenerateContentConfig(**cfg)
 
 
@@ -440,1059 +674,4730 @@ def _extract_text_safe(resp) -> str | None:
         return None
 
 
-def _call_search(client, prompt: str):
+def _call_search(client, prompt: str, call_type: str | None = None, schema: dict | None = None,
+                 hedge: bool | None = None):
     """
     Run a prompt with Google Search grounding.
-    If the grounded response contains no text (a known intermittent issue),
-    silently retry with plain JSON mode — which always produces text.
-    Returns the response object from whichever attempt succeeded.
+    If the grounded response contains no text (a known intermittent issue) —
+    or, given a schema, text that doesn't parse / validate against it —
+    silently retry in JSON mode with the schema enforced (Gemini can't
+    combine response_schema with the search tool).
+    hedge (default: the sidebar's "hedge_search" toggle) races the JSON-mode
+    call against a slow grounded call instead — see _acall_search.
+    Returns (response, data) from whichever attempt succeeded; data is the
+    validated value, or None without a schema or when neither reply conforms.
+    """
+    if hedge is None:
+        hedge = bool(_state().get("hedge_search", False))
+    if hedge:
+        resp, _state()["model_used"], data = get_llm_dispatcher().run(_acall_search(
+            client, prompt, MODEL_REASONING, call_type=call_type, schema=schema, hedge=True,
+        ))
+        return resp, data
+
+    started = time.monotonic()
+    resp, usable, data = _call_checked(client, prompt, _search_cfg(), schema, call_type=call_type)
+    # Feeds the hedge delay too, so it reflects unhedged sessions' grounded calls
+    hedge_tracker.record_latency((call_type or "search").split(":")[0], time.monotonic() - started)
+    if usable:
+        return resp, data
+    # No usable text from grounded response — fall back to JSON mode (no search tool)
+    resp, _, data = _call_checked(client, prompt, _json_cfg(schema), schema, call_type=call_type)
+    return resp, data
+
+
+def _call_json(client, prompt: str, schema: dict, call_type: str | None = None,
+               search: bool = False) -> tuple[list | dict, types.GenerateContentResponse]:
+    """
+    Run a JSON-producing call with its response schema enforced.
+    Returns (validated data, response); raises ValueError (incl.
+    ResponseSchemaError) when the output doesn't fit the schema.
+    """
+    if search:
+        resp, data = _call_search(client, prompt, call_type=call_type, schema=schema)
+    else:
+        resp, _, data = _call_checked(client, prompt, _json_cfg(schema), schema, call_type=call_type)
+    if data is None:        # didn't conform: re-parse for the error
+        data = _parse_validated(_extract_text(resp), schema)
+    return data, resp
+
+
+# on_part(STREAM_RESTART, None): a writer is starting a new attempt (model or
+# writer fallback, key retry); every part reported before it is void.
+STREAM_RESTART: tuple = ("<restart>",)
+
+
+class TolerantJSONParser:
+    """
+    Single-pass, incremental JSON extractor for model output.
+
+    feed() text as it arrives (a whole response or stream chunks), then
+    close() returns the largest complete top-level object / array. Prose,
+    markdown fences and citation brackets around it are skipped; trailing or
+    missing commas, // and /* */ comments, smart-quoted strings and raw
+    control characters inside strings are tolerated. A candidate that hits
+    an unrecoverable token is dropped and scanning resumes just after its
+    opening bracket; one still open when the input ends makes close() raise.
+
+    on_complete(path, value) fires for every value finished inside a
+    candidate — path is the tuple of keys / indices from the candidate root,
+    () for the root itself — so callers can act on parts while streaming.
     """
-    resp = _call(client, prompt, _search_cfg())
-    if _extract_text_safe(resp) is not None:
-        return resp
-    # No text from grounded response — fall back to JSON mode (no search tool)
-    return _call(client, prompt, _json_cfg())
+
+    _OPEN = re.compile(r"[\[{]")
+    _WS = re.compile(r"[\s\ufeff]*")
+    _NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+    _STRING_END = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+    _SMART_STRING = re.compile("[\u201c\u201d]([^\u201c\u201d]*)[\u201c\u201d]")
+    _LITERALS = (("true", True), ("false", False), ("null", None))
+
+    def __init__(self, on_complete=None):
+        self._on_complete = on_complete
+        self._buf = ""
+        self._pos = 0            # next unread index in _buf
+        self._start = 0          # _buf index of the current candidate's "[" / "{"
+        self._stack: list[list] = []   # frames: [container, pending_key, has_colon, path]
+        self._best = None
+        self._best_len = -1
+
+    @property
+    def partial(self) -> list | dict | None:
+        """Root of the candidate being parsed (filled in as values complete)."""
+        return self._stack[0][0] if self._stack else self._best
+
+    def feed(self, chunk: str) -> "TolerantJSONParser":
+        # Keep only what a dropped candidate might need to rescan
+        cut = self._start if self._stack else self._pos
+        self._buf = self._buf[cut:] + chunk
+        self._pos -= cut
+        self._start -= cut
+        self._scan(final=False)
+        return self
+
+    def close(self) -> list | dict:
+        """
+        Finish parsing; raises ValueError if no complete object / array was
+        found, or if the input ends inside an open one (truncated output,
+        e.g. max_tokens) — a value nested in a cut-off root is never returned.
+        """
+        self._scan(final=True)
+        if self._stack:
+            raise ValueError("JSON output was truncated before its root object / array closed.")
+        if self._best_len < 0:
+            raise ValueError("No complete JSON object or array found.")
+        return self._best
+
+    # ── internals ───────────────────────────────────────────────
+    def _drop(self) -> int:
+        self._stack.clear()
+        return self._start + 1
+
+    def _place(self, value) -> tuple | None:
+        """Attach value to the open container; returns its path or None if misplaced."""
+        frame = self._stack[-1]
+        container = frame[0]
+        if type(container) is list:
+            container.append(value)
+            return frame[3] + (len(container) - 1,)
+        if frame[1] is None or not frame[2]:
+            return None
+        key = frame[1]
+        container[key] = value
+        frame[1], frame[2] = None, False
+        return frame[3] + (key,)
+
+    def _scalar(self, value) -> bool:
+        path = self._place(value)
+        if path is None:
+            return False
+        if self._on_complete is not None:
+            self._on_complete(path, value)
+        return True
+
+    def _scan(self, final: bool) -> None:
+        buf, n, pos = self._buf, len(self._buf), self._pos
+        stack = self._stack
+        while pos < n:
+            if not stack:
+                m = self._OPEN.search(buf, pos)
+                if m is None:
+                    pos = n
+                    break
+                pos = self._start = m.start()
+                stack.append([{} if buf[pos] == "{" else [], None, False, ()])
+                pos += 1
+                continue
+
+            pos = self._WS.match(buf, pos).end()
+            if pos >= n:
+                break
+            ch = buf[pos]
+            ok = True
+
+            if ch == '"' or ch == "\u201c" or ch == "\u201d":
+                if ch == '"':
+                    m = self._STRING_END.match(buf, pos + 1)
+                    if m is None:
+                        if not final:
+                            break
+                        ok = False
+                    else:
+                        try:
+                            value = _scanstring(buf, pos + 1, False)[0]
+                        except ValueError:      # invalid escape — keep the raw text
+                            value = buf[pos + 1 : m.end() - 1]
+                else:
+                    m = self._SMART_STRING.match(buf, pos)
+                    if m is None:
+                        if not final:
+                            break
+                        ok = False
+                    else:
+                        value = m.group(1)
+                if ok:
+                    frame = stack[-1]
+                    if type(frame[0]) is dict and frame[1] is None:
+                        frame[1] = value
+                    else:
+                        ok = self._scalar(value)
+                    pos = m.end()
+
+            elif ch == "{" or ch == "[":
+                container = {} if ch == "{" else []
+                path = self._place(container)
+                if path is None:
+                    ok = False
+                else:
+                    stack.append([container, None, False, path])
+                    pos += 1
+
+            elif ch == "}" or ch == "]":
+                frame = stack[-1]
+                if (ch == "}") != (type(frame[0]) is dict) or frame[1] is not None:
+                    ok = False
+                else:
+                    stack.pop()
+                    pos += 1
+                    if self._on_complete is not None:
+                        self._on_complete(frame[3], frame[0])
+                    if not stack and pos - self._start > self._best_len:
+                        self._best, self._best_len = frame[0], pos - self._start
+
+            elif ch == ",":
+                ok = stack[-1][1] is None
+                pos += 1
+
+            elif ch == ":":
+                frame = stack[-1]
+                ok = frame[1] is not None and not frame[2]
+                frame[2] = True
+                pos += 1
+
+            elif ch == "/":
+                if pos + 1 >= n and not final:
+                    break
+                nxt = buf[pos + 1 : pos + 2]
+                close = "\n" if nxt == "/" else "*/" if nxt == "*" else None
+                if close is None:
+                    ok = False
+                else:
+                    end = buf.find(close, pos + 2)
+                    if end == -1:
+                        if not final:
+                            break
+                        end = n
+                    pos = end + len(close)
+
+            elif ch == "-" or "0" <= ch <= "9":
+                m = self._NUMBER.match(buf, pos)
+                if m is not None and (m.end() < n or final):
+                    text = m.group()
+                    ok = self._scalar(float(text) if any(c in text for c in ".eE") else int(text))
+                    pos = m.end()
+                elif m is None and (final or pos + 1 < n):
+                    ok = False
+                else:
+                    break                   # the number may continue in the next chunk
+
+            else:
+                for word, value in self._LITERALS:
+                    if buf.startswith(word, pos):
+                        ok = self._scalar(value)
+                        pos += len(word)
+                        break
+                else:
+                    tail = buf[pos:n]
+                    if not final and len(tail) < 5 and any(w.startswith(tail) for w, _ in self._LITERALS):
+                        break               # a literal split across chunks
+                    ok = False
+
+            if not ok:
+                pos = self._drop()
+        self._pos = pos
 
 
 def _parse_json(text: str | None) -> list | dict:
     """
     Robust JSON extraction from model output.
     Handles: markdown fences, mixed prose + JSON (grounding adds footnotes),
-    trailing commas, and unescaped characters in string values.
+    trailing commas, comments, smart quotes and unescaped characters in
+    string values.
 
-    Strategy:
-      1. Strip markdown fences and try direct parse.
-      2. Walk the text to find the outermost balanced [ ] or { } block.
-      3. Apply light repair (trailing commas, JS-style comments) and retry.
+    Well-formed (optionally fenced) JSON goes straight to json.loads;
+    anything else is read once by TolerantJSONParser.
     """
     if not text:
         raise ValueError("Empty response — model returned no content.")
 
-    # ── Step 1: fence strip + direct attempt ──────────────────────
-    clean = re.sub(r"^```(?:json)?\s*", "", text.strip(), flags=re.M)
-    clean = re.sub(r"\s*```\s*$", "", clean.strip(), flags=re.M)
+    clean = text.strip()
+    if clean.startswith("```"):
+        clean = clean[clean.find("\n") + 1 :] if "\n" in clean else clean[3:]
+        clean = clean.rstrip()
+        if clean.endswith("```"):
+            clean = clean[:-3]
     try:
         return json.loads(clean)
     except json.JSONDecodeError:
         pass
 
-    # ── Step 2: extract outermost balanced bracket block ──────────
-    def _extract_balanced(src: str, open_ch: str, close_ch: str) -> str | None:
-        start = src.find(open_ch)
-        if start == -1:
-            return None
-        depth, in_str, esc, i = 0, False, False, start
-        while i < len(src):
-            ch = src[i]
-            if esc:
-                esc = False
-            elif ch == "\\" and in_str:
-                esc = True
-            elif ch == '"':
-                in_str = not in_str
-            elif not in_str:
-                if ch == open_ch:
-                    depth += 1
-                elif ch == close_ch:
-                    depth -= 1
-                    if depth == 0:
-                        return src[start : i + 1]
-            i += 1
-        return None
+    try:
+        return TolerantJSONParser().feed(text).close()
+    except ValueError:
+        raise ValueError(
+            f"Could not parse JSON from model response.\n"
+            f"First 300 chars of response:\n{text[:300]}"
+        ) from None
 
-    for open_ch, close_ch in [("[", "]"), ("{", "}")]:
-        block = _extract_balanced(clean, open_ch, close_ch)
-        if block is None:
-            continue
-        # Try raw
-        try:
-            return json.loads(block)
-        except json.JSONDecodeError:
-            pass
-        # ── Step 3: light repair ──────────────────────────────────
-        repaired = block
-        # Remove trailing commas before ] or }
-        repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
-        # Strip JS-style single-line comments
-        repaired = re.sub(r"(?<!:)//[^\n\"]*", "", repaired)
-        # Replace curly apostrophes / smart quotes
-        repaired = repaired.replace("\u2018", "'").replace("\u2019", "'")
-        repaired = repaired.replace("\u201c", '"').replace("\u201d", '"')
-        try:
-            return json.loads(repaired)
-        except json.JSONDecodeError:
-            pass
 
-    raise ValueError(
-        f"Could not parse JSON from model response.\n"
-        f"First 300 chars of response:\n{text[:300]}"
-    )
+class ResponseSchemaError(ValueError):
+    """Model output parsed as JSON but does not match its response schema."""
+
+
+_SCHEMA_TYPES: dict[str, type | tuple[type, ...]] = {
+    "object":  dict,
+    "array":   list,
+    "string":  str,
+    "integer": int,
+    "number":  (int, float),
+    "boolean": bool,
+}
+_schema_validators: dict[int, tuple[dict, object]] = {}
 
 
-def _call(client, prompt: str, cfg, model=None) -> types.GenerateContentResponse:
-    m = model or st.session_state.model_used
+def _compile_schema(schema: dict):
+    """
+    Turn a response schema (the JSON Schema subset shared by Gemini
+    response_schema and Claude input_schema: type, properties, required,
+    items, enum, nullable, minItems / maxItems) into a check(value, path)
+    closure, so validation is a walk over the data with no schema lookups.
+    """
+    kind = str(schema.get("type", "")).lower()
+    expected = _SCHEMA_TYPES.get(kind)
+    nullable = schema.get("nullable", False)
+    props = {k: _compile_schema(v) for k, v in schema.get("properties", {}).items()}
+    required = tuple(schema.get("required", ()))
+    item_check = _compile_schema(schema["items"]) if "items" in schema else None
+    enum = schema.get("enum")
+    min_items, max_items = schema.get("minItems"), schema.get("maxItems")
+
+    def check(value, path: str) -> None:
+        if value is None and nullable:
+            return
+        if expected is not None and (
+            not isinstance(value, expected) or (isinstance(value, bool) and kind != "boolean")
+        ):
+            raise ResponseSchemaError(f"{path}: expected {kind}, got {type(value).__name__}")
+        if enum is not None and value not in enum:
+            raise ResponseSchemaError(f"{path}: {value!r} not in {enum}")
+        if props or required:
+            for key in required:
+                if key not in value:
+                    raise ResponseSchemaError(f"{path}: missing '{key}'")
+            for key, sub in props.items():
+                if key in value:
+                    sub(value[key], f"{path}.{key}")
+        if item_check is not None or min_items is not None or max_items is not None:
+            if min_items is not None and len(value) < min_items:
+                raise ResponseSchemaError(f"{path}: {len(value)} item(s), expected ≥{min_items}")
+            if max_items is not None and len(value) > max_items:
+                raise ResponseSchemaError(f"{path}: {len(value)} item(s), expected ≤{max_items}")
+            if item_check is not None:
+                for i, item in enumerate(value):
+                    item_check(item, f"{path}[{i}]")
+
+    return check
+
+
+def validate_response(data, schema: dict):
+    """Validate parsed model output against its response schema; returns data unchanged."""
+    entry = _schema_validators.get(id(schema))
+    if entry is None or entry[0] is not schema:
+        entry = _schema_validators[id(schema)] = (schema, _compile_schema(schema))
+    entry[1](data, "$")
+    return data
+
+
+def _parse_validated(text: str | None, schema: dict):
+    """_parse_json + validate_response inside a "parse" span."""
+    with span("parse", "parse", chars=len(text or "")):
+        return validate_response(_parse_json(text), schema)
+
+
+def _conforms(text: str | None, schema: dict | None) -> tuple[bool, object]:
+    """
+    (usable, data): text is present and, given a schema, parses and validates
+    — data is then the validated value (None without a schema). Callers keep
+    data, so a reply is parsed once.
+    """
+    if text is None:
+        return False, None
+    if schema is None:
+        return True, None
     try:
-        return client.models.generate_content(model=m, contents=prompt, config=cfg)
-    except Exception as e:
-        if MODEL_FALLBACK not in str(m):
-            st.session_state.model_used = MODEL_FALLBACK
-            return client.models.generate_content(
-                model=MODEL_FALLBACK, contents=prompt, config=cfg
+        return True, _parse_validated(text, schema)
+    except ValueError:
+        return False, None
+
+
+def _call(client, prompt: str, cfg, model=None, call_type: str | None = None) -> types.GenerateContentResponse:
+    """
+    Run one Gemini generate_content call, routed by model_health: the model
+    (default MODEL_REASONING) unless its circuit is open, MODEL_FALLBACK after
+    a retryable error. The serving model is shown as session "model_used".
+    When call_type has a TTL in RESPONSE_CACHE_TTLS, responses with usable
+    text are served from / stored in the on-disk response cache.
+    """
+    return _call_checked(client, prompt, cfg, None, model, call_type)[0]
+
+
+def _call_checked(client, prompt: str, cfg, schema: dict | None, model=None,
+                  call_type: str | None = None) -> tuple[types.GenerateContentResponse, bool, object]:
+    """
+    _call that checks the reply with _conforms(text, schema) before it is
+    cached: a truncated or non-conforming reply is never stored, and a
+    cached one that doesn't conform counts as a miss. Returns
+    (response, usable, data).
+    """
+    def attempt(m: str):
+        with telemetry.track(call_type, "gemini", m) as t:
+            cached = _cache_lookup(m, prompt, cfg, call_type)
+            if cached is not None:
+                usable, data = _conforms(_extract_text_safe(cached), schema)
+                if usable:
+                    t.cache_hit = True
+                    return cached, usable, data
+            resp = pooled(
+                "gemini", client, m, _estimate_tokens(prompt),
+                lambda c: c.models.generate_content(model=m, contents=prompt, config=cfg),
+                pin=_key_bound(cfg),
             )
-        raise e
+            t.usage = _gemini_usage(resp)
+        usable, data = _conforms(_extract_text_safe(resp), schema)
+        if usable:
+            _cache_store(m, prompt, cfg, call_type, resp)
+        return resp, usable, data
+
+    result, _state()["model_used"] = call_routed(
+        "gemini", attempt, model or MODEL_REASONING, MODEL_FALLBACK
+    )
+    return result
+
+
+def _call_stream(client, prompt: str, cfg, on_text, model=None, call_type: str | None = None,
+                 on_attempt=None) -> str:
+    """
+    Streaming counterpart of _call (never cached): each text chunk goes to
+    on_text as it arrives; returns the full text. Thought parts are skipped.
+    on_attempt() runs before every attempt (model fallback, key retry), so
+    the caller can drop what an abandoned attempt streamed.
+    """
+    def stream(c, m: str) -> str:
+        if on_attempt is not None:
+            on_attempt()
+        chunks: list[str] = []
+        chunk = None
+        with telemetry.track(call_type, "gemini", m) as track:
+            for chunk in c.models.generate_content_stream(model=m, contents=prompt, config=cfg):
+                try:
+                    t = chunk.text
+                except Exception:
+                    t = None
+                if t:
+                    chunks.append(t)
+                    on_text(t)
+            track.usage = _gemini_usage(chunk)      # usage_metadata rides on the last chunk
+        return "".join(chunks)
+
+    text, _state().model_used = call_routed(
+        "gemini",
+        lambda m: pooled("gemini", client, m, _estimate_tokens(prompt),
+                         lambda c: stream(c, m), pin=_key_bound(cfg)),
+        model or MODEL_REASONING, MODEL_FALLBACK,
+    )
+    return text
 
 # ══════════════════════════════════════════════════════════════════
-# 5b · COMPETITOR DATA (collection, validation, storage)
+# 5a · RESPONSE CACHE (SQLite, content-addressed, LRU by bytes)
 # ══════════════════════════════════════════════════════════════════
-import logging as _logging
 
-_comp_log = _logging.getLogger("competitor_data")
-if not _comp_log.handlers:
-    _h = _logging.StreamHandler()
-    _h.setFormatter(_logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S"))
-    _comp_log.addHandler(_h)
-    _comp_log.setLevel(_logging.INFO)
+_cache_log = _logging.getLogger("response_cache")
 
 
-class CompetitorDataError(Exception):
-    """Base error for competitor data operations."""
+def _cfg_fingerprint(cfg) -> str:
+    """Stable serialization of a GenerateContentConfig for cache keys."""
+    try:
+        return json.dumps(cfg.model_dump(mode="json", exclude_none=True), sort_keys=True)
+    except Exception:
+        return repr(cfg)
 
 
-class SchemaValidationError(CompetitorDataError):
-    """Raised when competitor data fails schema validation."""
+def response_cache_key(model: str, prompt: str, cfg) -> str:
+    """SHA-256 over (model, prompt, serialized config)."""
+    h = hashlib.sha256()
+    for part in (model, prompt, _cfg_fingerprint(cfg)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
 
 
-class DataLoadingError(CompetitorDataError):
-    """Raised when competitor data cannot be loaded from any source."""
+class ResponseCache:
+    """
+    Persistent response cache shared by every session in the process.
+    Entries expire after their call type's TTL; when the total payload size
+    exceeds max_bytes the least recently used entries are evicted first.
+    """
 
+    def __init__(self, path: str, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                   key         TEXT PRIMARY KEY,
+                   call_type   TEXT NOT NULL,
+                   payload     TEXT NOT NULL,
+                   size        INTEGER NOT NULL,
+                   expires_at  REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_lru ON responses(last_access)")
+        self._db.commit()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, call_type: str, payload: str, ttl: float) -> None:
+        now = time.time()
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, call_type, payload, size, now + ttl, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired rows, then LRU rows until under max_bytes. Caller holds the lock."""
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+
+_response_cache: ResponseCache | None = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache | None:
+    """Process-wide ResponseCache, or None if the cache file cannot be opened."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None or _response_cache.path != RESPONSE_CACHE_PATH:
+            try:
+                _response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+            except (sqlite3.Error, OSError) as e:
+                _cache_log.warning("Response cache disabled: %s", e)
+                return None
+        return _response_cache
 
-class GeminiAPIError(CompetitorDataError):
-    """Raised when Gemini API call fails during competitor collection."""
 
+def _cache_ttl(call_type: str | None) -> int:
+    if not call_type:
+        return 0
+    return RESPONSE_CACHE_TTLS.get(call_type.split(":", 1)[0], 0)
 
-def validate_url_format(url: str) -> bool:
-    """Validate URL format only — no network requests, no blocking."""
-    if not url or not isinstance(url, str):
-        return False
+
+def _cache_lookup(model: str, prompt: str, cfg, call_type: str | None):
+    """Return a cached GenerateContentResponse, or None on miss / cache disabled."""
+    if _cache_ttl(call_type) <= 0:
+        return None
+    cache = get_response_cache()
+    if cache is None:
+        return None
     try:
-        result = urlparse(url)
-        return all([result.scheme in ("http", "https"), result.netloc])
-    except Exception:
-        return False
+        payload = cache.get(response_cache_key(model, prompt, cfg))
+        if payload is None:
+            return None
+        _cache_log.info("Cache hit for %s (%s)", call_type, model)
+        return types.GenerateContentResponse.model_validate_json(payload)
+    except Exception as e:
+        _cache_log.warning("Cache read failed for %s: %s", call_type, e)
+        return None
 
 
-def dedup_articles(articles_list: list[dict]) -> list[dict]:
-    """Remove duplicate articles by URL, then sort by date descending."""
-    seen_urls: set[str] = set()
-    deduped: list[dict] = []
-    for article in articles_list:
-        url = article.get("url", "")
-        if url and url not in seen_urls:
-            seen_urls.add(url)
-            deduped.append(article)
-    deduped.sort(key=lambda a: a.get("date") or "", reverse=True)
-    return deduped
+def _cache_store(model: str, prompt: str, cfg, call_type: str | None, resp) -> None:
+    """Store a response if its call type is cacheable and it contains usable text."""
+    ttl = _cache_ttl(call_type)
+    if ttl <= 0 or _extract_text_safe(resp) is None:
+        return
+    cache = get_response_cache()
+    if cache is None:
+        return
+    try:
+        cache.put(
+            response_cache_key(model, prompt, cfg),
+            call_type,
+            resp.model_dump_json(exclude_none=True),
+            ttl,
+        )
+    except Exception as e:
+        _cache_log.warning("Cache write failed for %s: %s", call_type, e)
 
+# ══════════════════════════════════════════════════════════════════
+# 5b · ASYNC LLM DISPATCHER (one event loop, per-provider limits)
+# ══════════════════════════════════════════════════════════════════
+_llm_log = _logging.getLogger("llm_dispatcher")
 
-def validate_competitors_schema(data: dict) -> None:
-    """Validate competitors data structure. Raises SchemaValidationError on failure."""
-    if "schema_version" not in data:
-        raise SchemaValidationError("Missing schema_version")
 
-    for category, cat_data in data.items():
-        if category == "schema_version":
-            continue
-        if not isinstance(cat_data, dict) or "competitors" not in cat_data:
-            raise SchemaValidationError(f"Category '{category}' missing 'competitors'")
+class LLMDispatcher:
+    """
+    Runs every async LLM call in the process on one background event loop.
+    Each provider gets its own semaphore (PROVIDER_CONCURRENCY), so fan-outs
+    from all Streamlit sessions share the same concurrency limits.
 
-        for comp_name, competitor in cat_data["competitors"].items():
-            for field in ("name", "blog_url", "articles"):
-                if field not in competitor:
-                    raise SchemaValidationError(f"Competitor '{comp_name}' missing '{field}'")
+    Streamlit code never awaits directly — it hands coroutines to submit()
+    (returns a concurrent.futures.Future) or run() (blocks for the result).
+    """
 
-            for idx, article in enumerate(competitor["articles"]):
-                for field in ("title", "url", "date", "relevance"):
-                    if field not in article:
-                        raise SchemaValidationError(f"Article {idx} in '{comp_name}' missing '{field}'")
+    def __init__(self, limits: dict[str, int] | None = None):
+        self.limits = {**PROVIDER_CONCURRENCY, **(limits or {})}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+        # Semaphores bind to the loop that first awaits them → one set per loop
+        self._sems: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="llm-dispatcher", daemon=True
+                ).start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the dispatcher loop from any thread. It runs
+        with a copy of the caller's contextvars (telemetry session / step).
+        """
+        return asyncio.run_coroutine_threadsafe(
+            _in_context(coro, contextvars.copy_context()), self._ensure_loop()
+        )
 
+    def run(self, coro, timeout: float | None = None):
+        """Run a coroutine on the dispatcher loop and block for its result."""
+        return self.submit(coro).result(timeout)
 
-def migrate_competitors_schema(data: dict) -> Optional[dict]:
-    """Migrate competitors data between schema versions."""
-    version = data.get("schema_version", "1.0")
-    if version == "1.0":
-        return data
-    st.warning(f"Unknown schema version: {version}. Re-collect in Step 4.")
-    return None
+    def submit_bounded(self, coros: list, limit: int) -> list[concurrent.futures.Future]:
+        """Submit coroutines so that at most `limit` of them run at once."""
+        gate = self.run(self._make_gate(max(1, limit)))
 
+        async def gated(coro):
+            async with gate:
+                return await coro
 
-def save_competitors_data(data: dict) -> None:
-    """Always save to session_state, file only when possible."""
-    st.session_state[COMPETITORS_SS_KEY] = data
-    try:
-        os.makedirs(os.path.dirname(COMPETITORS_DATA_PATH), exist_ok=True)
-        with open(COMPETITORS_DATA_PATH, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        _comp_log.info("Saved competitors data to %s", COMPETITORS_DATA_PATH)
-    except (IOError, OSError) as e:
-        _comp_log.warning("File save skipped (Cloud?): %s", e)
+        return [self.submit(gated(c)) for c in coros]
 
+    @staticmethod
+    async def _make_gate(limit: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(limit)
 
-def load_competitors_data() -> Optional[dict]:
-    """1st: session_state → 2nd: file → 3rd: default fallback."""
-    # 1st: session_state
-    cached = st.session_state.get(COMPETITORS_SS_KEY)
-    if cached is not None:
-        return cached
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        sems = self._sems.setdefault(asyncio.get_running_loop(), {})
+        if provider not in sems:
+            sems[provider] = asyncio.Semaphore(self.limits.get(provider, 4))
+        return sems[provider]
 
-    # 2nd: local file
-    try:
-        with open(COMPETITORS_DATA_PATH, encoding="utf-8") as f:
-            data = json.load(f)
-        _comp_log.info("Loaded competitors from %s", COMPETITORS_DATA_PATH)
-        data = migrate_competitors_schema(data)
-        if data is None:
-            raise DataLoadingError("Schema migration failed — unknown version")
-        validate_competitors_schema(data)
-        st.session_state[COMPETITORS_SS_KEY] = data
-        return data
-    except FileNotFoundError:
-        _comp_log.info("No competitors file at %s", COMPETITORS_DATA_PATH)
-    except json.JSONDecodeError as e:
-        _comp_log.error("Invalid JSON in %s: %s", COMPETITORS_DATA_PATH, e)
-        st.warning("Competitor data file has invalid JSON. Re-collect in Step 4.")
-    except SchemaValidationError as e:
-        _comp_log.error("Schema validation failed for %s: %s", COMPETITORS_DATA_PATH, e)
-        st.warning(f"Competitor data format error: {e}")
-    except DataLoadingError as e:
-        _comp_log.error("Data loading error: %s", e)
-        st.warning(str(e))
-    except (IOError, PermissionError) as e:
-        _comp_log.error("File access error %s: %s", COMPETITORS_DATA_PATH, e)
-        st.warning("Unable to read competitor data file.")
+    async def call(self, provider: str, fn, model: str, fallback: str | None = None):
+        """
+        Await fn(model) while holding the provider's semaphore, routed by
+        model_health like _call: `fallback` is tried after a retryable error
+        (or first, while `model`'s circuit is open). Returns (result, model_used).
+        """
+        async with self._semaphore(provider):
+            return await acall_routed(provider, fn, model, fallback)
 
-    # 3rd: default fallback
-    try:
-        with open(DEFAULT_COMPETITORS_PATH, encoding="utf-8") as f:
-            data = json.load(f)
-        _comp_log.info("Loaded default competitors from %s", DEFAULT_COMPETITORS_PATH)
-        data = migrate_competitors_schema(data)
-        if data is None:
-            return None
-        validate_competitors_schema(data)
-        st.session_state[COMPETITORS_SS_KEY] = data
-        return data
-    except FileNotFoundError:
-        _comp_log.warning("No default competitors file at %s", DEFAULT_COMPETITORS_PATH)
-    except json.JSONDecodeError as e:
-        _comp_log.error("Invalid JSON in default file: %s", e)
-    except SchemaValidationError as e:
-        _comp_log.error("Default file schema error: %s", e)
-    except Exception as e:
-        _comp_log.error("Unexpected error loading defaults: %s", e)
-    return None
 
+async def _in_context(coro, ctx: contextvars.Context):
+    for var, value in ctx.items():
+        var.set(value)
+    return await coro
 
-def fetch_articles_for_competitor(
-    client: genai.Client, comp_key: str, comp_data: dict, category: str
-) -> list[dict]:
-    """Fetch articles using Gemini + Google Search grounding."""
-    blog_url = comp_data.get("blog_url", "")
-    current_year = datetime.now().year
 
-    prompt = f"""
-Find the 3 most recent technical articles from {comp_data['name']}:
-Blog: {blog_url}
+_llm_dispatcher: LLMDispatcher | None = None
+_llm_dispatcher_lock = threading.Lock()
 
-Category: {category}
 
-Return ONLY a JSON array (no markdown, no wrapping):
-[
-  {{
-    "title": "Article Title",
-    "url": "https://exact-url",
-    "date": "YYYY-MM-DD",
-    "relevance": "Why it matches {category}"
-  }}
-]
+def get_llm_dispatcher() -> LLMDispatcher:
+    """Process-wide LLMDispatcher (created on first use)."""
+    global _llm_dispatcher
+    with _llm_dispatcher_lock:
+        if _llm_dispatcher is None:
+            _llm_dispatcher = LLMDispatcher()
+        return _llm_dispatcher
 
-Requirements:
-- URLs in valid http/https format
-- Dates in YYYY-MM-DD format only
-- Published in {current_year - 1}-{current_year}
-- Max 3 articles per company
-- No "company" field
-"""
 
-    try:
-        resp = _call_search(client, prompt)
-        text = _extract_text(resp)
-        articles = _parse_json(text)
-        if not isinstance(articles, list):
-            _comp_log.warning("Non-list response for %s, got %s", comp_key, type(articles).__name__)
-            return []
-        _comp_log.info("Fetched %d articles for %s", len(articles), comp_key)
-        return articles
-    except (ValueError, json.JSONDecodeError) as e:
-        _comp_log.error("Parse error for %s: %s", comp_key, e)
-        st.warning(f"Could not parse articles for {comp_data.get('name', comp_key)}. Skipping.")
-        return []
-    except Exception as e:
-        _comp_log.error("Gemini API error for %s: %s", comp_key, e)
-        raise GeminiAPIError(f"API call failed for {comp_key}: {e}") from e
+class HedgeTracker:
+    """
+    Process-wide grounded-call latency window and hedge outcome counters,
+    per call kind (the call_type before ":"). delay() is the hedge trigger.
+    """
 
+    OUTCOMES = ("no_hedge", "fallback", "primary_won", "hedge_won")
+
+    def __init__(self, percentile: float = SEARCH_HEDGE_PERCENTILE, window: int = 100):
+        self.percentile = percentile
+        self._window = window
+        self._lock = threading.Lock()
+        self._latencies: dict[str, collections.deque] = {}
+        self._outcomes: dict[str, dict[str, int]] = {}
+
+    def record_latency(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(kind, collections.deque(maxlen=self._window)).append(seconds)
+
+    def delay(self, kind: str) -> float:
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < SEARCH_HEDGE_MIN_SAMPLES:
+            return SEARCH_HEDGE_DEFAULT_DELAY
+        return samples[max(0, math.ceil(self.percentile * len(samples)) - 1)]
+
+    def record(self, kind: str, outcome: str) -> None:
+        with self._lock:
+            counts = self._outcomes.setdefault(kind, dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """{kind: {outcome: count, "hedged": n}}; hedged = primary_won + hedge_won."""
+        with self._lock:
+            return {
+                kind: {**counts, "hedged": counts["primary_won"] + counts["hedge_won"]}
+                for kind, counts in self._outcomes.items()
+            }
 
-def collect_competitor_articles() -> tuple[int, int] | None:
-    """Collect articles for current category using Gemini + Google Search."""
-    try:
-        category = st.session_state.get("category", "")
 
-        if not category:
-            st.warning("No category selected. Please complete Step 1 first.")
-            return None
+hedge_tracker = HedgeTracker()
 
-        _validate_competitor_config()
-        _comp_log.info("Starting collection for category: %s", category)
 
-        all_data = load_competitors_data()
-        if all_data is None:
-            all_data = {"schema_version": "1.0"}
+class CircuitOpenError(RuntimeError):
+    """Every candidate model (or the whole provider) is in its open-circuit cool-down."""
 
-        if category not in all_data:
-            all_data[category] = {
-                "metadata": {
-                    "category": category,
-                    "generated_date": datetime.now().strftime("%Y-%m-%d"),
-                    "collected_timestamp": datetime.now().isoformat() + "Z",
-                    "source": "ai_deep_research",
-                },
-                "competitors": {},
+
+class ModelHealth:
+    """
+    Rolling health of one model or provider: error rate over the last
+    HEALTH_WINDOW calls, a latency EWMA, and a circuit breaker —
+    closed (normal) → open (skipped for HEALTH_OPEN_SECONDS) → half-open
+    (one probe call; success closes the circuit, failure re-opens it).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: collections.deque = collections.deque(maxlen=HEALTH_WINDOW)
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.state = self.CLOSED
+        self.latency_ewma: float | None = None
+
+    def available(self) -> bool:
+        """Would acquire() admit a call right now? (never claims the probe)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at >= HEALTH_OPEN_SECONDS
+            return self.state == self.CLOSED or not self._probing
+
+    def acquire(self) -> bool:
+        """Admit a call; in half-open state only one probe is admitted at a time."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < HEALTH_OPEN_SECONDS:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self) -> None:
+        """Give back an admitted probe without a verdict (e.g. a bad request)."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool, latency: float | None = None) -> None:
+        with self._lock:
+            if latency is not None:
+                self.latency_ewma = latency if self.latency_ewma is None else (
+                    HEALTH_LATENCY_ALPHA * latency + (1 - HEALTH_LATENCY_ALPHA) * self.latency_ewma
+                )
+            self._probing = False
+            if ok:
+                self._consecutive = 0
+                if self.state != self.CLOSED:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                self._results.append(True)
+                return
+            self._consecutive += 1
+            self._results.append(False)
+            if (
+                self.state == self.HALF_OPEN
+                or self._consecutive >= HEALTH_CONSECUTIVE_FAILURES
+                or (len(self._results) >= HEALTH_MIN_CALLS
+                    and self._error_rate() >= HEALTH_ERROR_THRESHOLD)
+            ):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def _error_rate(self) -> float:
+        return self._results.count(False) / len(self._results) if self._results else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": len(self._results),
+                "error_rate": self._error_rate(),
+                "latency_ewma": self.latency_ewma,
             }
 
-        api_key = st.session_state.get("_api_key") or os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
-        if not api_key:
-            st.warning("Gemini API key not set. Enter it in the sidebar or set GOOGLE_GENERATIVE_AI_API_KEY.")
-            return None
-        client = get_client(api_key)
 
-        if category not in COMPETITORS_BY_CATEGORY:
-            raise CompetitorDataError(f"No competitors defined for category: {category}")
+class HealthRegistry:
+    """Process-wide ModelHealth per model name and per "provider:<name>"."""
 
-        competitors = COMPETITORS_BY_CATEGORY[category]
-        failed_comps: list[str] = []
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, ModelHealth] = {}
 
-        for comp_key, comp_data in competitors.items():
-            try:
-                articles = fetch_articles_for_competitor(
-                    client, comp_key, comp_data, category
-                )
+    def __getitem__(self, key: str) -> ModelHealth:
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = ModelHealth()
+            return self._entries[key]
 
-                validated_articles = [
-                    a for a in articles
-                    if validate_url_format(a.get("url", ""))
-                ]
-                filtered_count = len(articles) - len(validated_articles)
-                if filtered_count > 0:
-                    _comp_log.info("Filtered %d invalid URLs for %s", filtered_count, comp_key)
+    def preferred(self, primary: str, fallback: str | None = None) -> str:
+        """The model the router would try first right now."""
+        for m in _route_models(primary, fallback):
+            if self[m].available():
+                return m
+        return primary
 
-                deduped_articles = dedup_articles(validated_articles)
+    def snapshot(self) -> dict[str, dict]:
+        with self._lock:
+            entries = dict(self._entries)
+        return {key: h.snapshot() for key, h in entries.items()}
 
-                if comp_key not in all_data[category]["competitors"]:
-                    all_data[category]["competitors"][comp_key] = {
-                        "name": comp_data.get("name", ""),
-                        "blog_url": comp_data.get("blog_url", ""),
-                        "tier": comp_data.get("tier", 2),
-                        "editable": False,
-                        "articles": [],
-                    }
 
-                all_data[category]["competitors"][comp_key]["articles"] = deduped_articles
+model_health = HealthRegistry()
 
-            except GeminiAPIError as e:
-                _comp_log.error("API error for %s: %s", comp_key, e)
-                failed_comps.append(comp_data.get("name", comp_key))
-                st.warning(f"API error for {comp_data.get('name', comp_key)}. Skipping.")
-                continue
-            except Exception as e:
-                _comp_log.error("Unexpected error for %s: %s", comp_key, e)
-                failed_comps.append(comp_data.get("name", comp_key))
-                st.warning(f"Failed to collect for {comp_data.get('name', comp_key)}: {str(e)}")
-                continue
+_FATAL_STATUS = {400, 401, 403}
 
-        if failed_comps and len(failed_comps) == len(competitors):
-            st.error("All competitor collections failed. Check API key and try again.")
-            return None
 
-        validate_competitors_schema(all_data)
-        save_competitors_data(all_data)
+def _route_models(primary: str, fallback: str | None) -> list[str]:
+    return [primary] if not fallback or fallback == primary else [primary, fallback]
 
-        cat_data = all_data.get(category, {})
-        companies_count = len(cat_data.get("competitors", {}))
-        articles_count = sum(
-            len(c.get("articles", []))
-            for c in cat_data.get("competitors", {}).values()
-        )
-        _comp_log.info("Collection complete: %d companies, %d articles", companies_count, articles_count)
-        if failed_comps:
-            st.warning(f"Partial collection — skipped: {', '.join(failed_comps)}")
-        return companies_count, articles_count
 
-    except SchemaValidationError as e:
-        _comp_log.error("Schema validation after collection: %s", e)
-        st.error(f"Data format error after collection: {e}")
-        return None
-    except CompetitorDataError as e:
-        _comp_log.error("Competitor data error: %s", e)
-        st.error(str(e))
-        return None
-    except Exception as e:
-        _comp_log.error("Unexpected collection error: %s", e)
-        st.error(f"Collection failed: {str(e)}")
-        return None
+def _classify_error(exc: Exception) -> str:
+    """
+    "fatal"     — bad request / auth / billing: the fallback would fail the same way;
+    "output"    — the model answered but the reply didn't parse or validate;
+    "throttled" — still rate-limited after throttled()'s retries: quota, not health;
+    "model"     — overload, 5xx, timeout…: counts against the model's health.
+    """
+    if isinstance(exc, ValueError):
+        return "output"
+    if _is_rate_limited(exc):
+        return "throttled"
+    status = getattr(exc, "status_code", None)
+    if not isinstance(status, int):
+        status = getattr(exc, "code", None)
+    if status in _FATAL_STATUS or _is_credit_error(exc):
+        return "fatal"
+    return "model"
+
+
+class _Route:
+    """
+    Bookkeeping for one routed call: primary first, fallback on a retryable
+    error, models with an open circuit skipped. Shared by call_routed and
+    acall_routed; the provider's circuit records the outcome of the whole call.
+    """
 
+    def __init__(self, provider: str, primary: str, fallback: str | None):
+        self.models = _route_models(primary, fallback)
+        self.provider = model_health[f"provider:{provider}"]
+        self.last_exc: Exception | None = None
+        self._model_failed = False
+        if not self.provider.acquire():
+            raise CircuitOpenError(f"{provider} is cooling down after repeated failures — retry shortly.")
+
+    def candidates(self):
+        for m in self.models:
+            if model_health[m].acquire():
+                yield m, time.monotonic()
+
+    def succeeded(self, m: str, started: float) -> None:
+        model_health[m].record(True, time.monotonic() - started)
+        self.provider.record(True)
+
+    def failed(self, m: str, started: float, exc: Exception) -> None:
+        """Record a failed attempt; re-raises if trying the next model is pointless."""
+        kind = _classify_error(exc)
+        if kind == "fatal":
+            model_health[m].release()
+            self.provider.release()
+            raise exc
+        if kind == "throttled":
+            model_health[m].release()
+        else:
+            model_health[m].record(kind == "output", time.monotonic() - started)
+        self._model_failed |= kind == "model"
+        self.last_exc = exc
 
-def load_competitors_for_category(category: str, available_data: Optional[dict] = None) -> Optional[dict]:
-    """Load competitors matching article category — case-insensitive exact match."""
-    if not available_data:
-        return None
-    if "schema_version" not in available_data:
-        return None
-    for cat_key in available_data:
-        if cat_key != "schema_version" and cat_key.lower() == category.lower():
-            return available_data[cat_key]
-    return None
+    def exhausted(self) -> Exception:
+        if self._model_failed:
+            self.provider.record(False)
+        else:
+            self.provider.release()
+        if self.last_exc is None:
+            return CircuitOpenError(
+                f"{' and '.join(self.models)} cooling down after repeated failures — retry shortly."
+            )
+        return self.last_exc
 
 
-def build_competitive_context(category: str, data: Optional[dict]) -> str:
-    """Generate competitor context block for injection into article generation prompt."""
-    if not data:
-        return ""
+def call_routed(provider: str, fn, primary: str, fallback: str | None = None):
+    """Run fn(model) on the first healthy model (see _Route). Returns (result, model_used)."""
+    route = _Route(provider, primary, fallback)
+    for m, started in route.candidates():
+        try:
+            result = fn(m)
+        except Exception as e:
+            route.failed(m, started, e)
+            continue
+        route.succeeded(m, started)
+        return result, m
+    raise route.exhausted()
 
-    cat_data = load_competitors_for_category(category, data)
-    if not cat_data:
-        return ""
 
-    competitor_lines: list[str] = []
-    for comp in cat_data.get("competitors", {}).values():
-        name = comp.get("name", "")
-        articles = comp.get("articles", [])
-        if articles:
-            titles = [f'  - "{a.get("title", "")}"' for a in articles[:2]]
-            competitor_lines.append(f"**{name}**:")
-            competitor_lines.extend(titles)
+async def acall_routed(provider: str, fn, primary: str, fallback: str | None = None):
+    """Async call_routed: awaits fn(model). Returns (result, model_used)."""
+    route = _Route(provider, primary, fallback)
+    for m, started in route.candidates():
+        try:
+            result = await fn(m)
+        except asyncio.CancelledError:
+            model_health[m].release()
+            route.provider.release()
+            raise
+        except Exception as e:
+            route.failed(m, started, e)
+            continue
+        route.succeeded(m, started)
+        return result, m
+    raise route.exhausted()
 
-    if not competitor_lines:
-        return ""
 
-    lines = ["## Competitive Landscape (for differentiation only)\n"]
-    lines.append("Competitors already covering this space:\n")
-    lines.extend(competitor_lines)
-    lines.append(
-        "\nInstruction: Write from a distinct angle not covered above. "
-        "Avoid duplicating their exact topics. Focus on unique insights, "
-        "different benchmarks, or underexplored sub-problems."
-    )
-    return "\n".join(lines)
+class TokenBucket:
+    """
+    Requests/min + tokens/min limiter for one API key × model. reserve()
+    books capacity immediately (balances may go negative) and returns how
+    long the caller must wait, so concurrent callers queue in FIFO order.
+    backoff() pauses the whole bucket after a 429.
+    """
 
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm, self.tpm = rpm, tpm
+        self._lock = threading.Lock()
+        self._requests, self._tokens = float(rpm), float(tpm)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._queued = 0
+        self._stats = {"calls": 0, "waits": 0, "wait_total": 0.0, "wait_max": 0.0, "throttled": 0}
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Book one request + `tokens`; returns the seconds to wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._updated = now - self._updated, now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+            self._requests -= 1
+            self._tokens -= min(tokens, self.tpm)
+            wait = max(
+                self._blocked_until - now,
+                -self._requests * 60 / self.rpm,
+                -self._tokens * 60 / self.tpm,
+                0.0,
+            )
+            self._stats["calls"] += 1
+            if wait > 0:
+                self._stats["waits"] += 1
+                self._stats["wait_total"] += wait
+                self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+            return wait
+
+    def backoff(self, retry_after: float | None, attempt: int) -> float:
+        """Block the bucket for retry_after (else jittered exponential backoff); returns the delay."""
+        delay = retry_after if retry_after is not None else (
+            min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+        )
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._stats["throttled"] += 1
+        return delay
+
+    def _queue(self, delta: int) -> None:
+        with self._lock:
+            self._queued += delta
+
+    def acquire(self, tokens: int = 0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._queue(1)
+            try:
+                time.sleep(wait)
+            finally:
+                self._queue(-1)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._queue(1)
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._queue(-1)
+
+    def peek(self, tokens: int = 0) -> float:
+        """The wait reserve(tokens) would return right now, without booking anything."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            requests = min(self.rpm, self._requests + elapsed * self.rpm / 60) - 1
+            tokens_left = min(self.tpm, self._tokens + elapsed * self.tpm / 60) - min(tokens, self.tpm)
+            return max(self._blocked_until - now, -requests * 60 / self.rpm,
+                       -tokens_left * 60 / self.tpm, 0.0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "queued": self._queued}
+
+
+class RateLimiter:
+    """Process-wide TokenBucket per (API key id, model), sized from RATE_LIMITS."""
+
+    def __init__(self, limits: dict[str, tuple[int, int]] | None = None):
+        self.limits = {**RATE_LIMITS, **(limits or {})}
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+
+    def bucket(self, key: str, model: str) -> TokenBucket:
+        with self._lock:
+            if (key, model) not in self._buckets:
+                self._buckets[(key, model)] = TokenBucket(*self.limits.get(model, RATE_LIMIT_DEFAULT))
+            return self._buckets[(key, model)]
+
+    def stats(self) -> dict[tuple[str, str], dict]:
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {k: b.stats() for k, b in buckets.items()}
+
+    def totals(self) -> dict:
+        """Sum over all buckets, plus wait_avg (per waiting call) and the overall wait_max."""
+        out = {"queued": 0, "calls": 0, "waits": 0, "wait_total": 0.0, "wait_max": 0.0, "throttled": 0}
+        for s in self.stats().values():
+            for k in ("queued", "calls", "waits", "wait_total", "throttled"):
+                out[k] += s[k]
+            out["wait_max"] = max(out["wait_max"], s["wait_max"])
+        out["wait_avg"] = out["wait_total"] / out["waits"] if out["waits"] else 0.0
+        return out
+
+
+rate_limiter = RateLimiter()
+
+_RETRY_AFTER_RES = (
+    re.compile(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.I),   # Gemini RetryInfo
+    re.compile(r"retry (?:in|after) (\d+(?:\.\d+)?)\s*s", re.I),
+)
 
-def render_competitors_dashboard(category: str, category_data: dict) -> None:
-    """Render competitive analysis dashboard inside Step 5 tab."""
-    st.markdown("### Competitive Analysis")
-    metadata = category_data.get("metadata", {})
-    collected = metadata.get("collected_timestamp", "N/A")
 
-    competitors = category_data.get("competitors", {})
-    total_articles = sum(len(c.get("articles", [])) for c in competitors.values())
+def _client_key(client) -> str:
+    """Short id of the API key behind a client (set by _tag_client)."""
+    return getattr(client, "__dict__", {}).get("_techaudit_key", "default")
 
-    st.markdown(
-        f'<p style="color:#64748b;font-size:.82rem">'
-        f'Category: <strong>{category}</strong> &nbsp;|&nbsp; '
-        f'Competitors: {len(competitors)} &nbsp;|&nbsp; '
-        f'Articles: {total_articles} &nbsp;|&nbsp; '
-        f'Collected: {collected}</p>',
-        unsafe_allow_html=True,
-    )
 
-    if not competitors:
-        st.info("No competitor data available for this category.")
-        return
+def _key_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
 
-    # Sort by tier (1 first), then name
-    sorted_comps = sorted(
-        competitors.values(),
-        key=lambda c: (c.get("tier", 99), c.get("name", "")),
-    )
 
-    # ── Competitors table ──────────────────────────────────────
-    st.markdown("#### Competitors")
-    table_rows = [
-        {
-            "Company": c.get("name", ""),
-            "Tier": c.get("tier", "—"),
-            "Articles": len(c.get("articles", [])),
-            "Blog": c.get("blog_url", ""),
-        }
-        for c in sorted_comps
-    ]
-    st.dataframe(
-        table_rows,
-        column_config={
-            "Company": st.column_config.TextColumn(width="large"),
-            "Tier": st.column_config.NumberColumn(width="small"),
-            "Articles": st.column_config.NumberColumn(width="small"),
-            "Blog": st.column_config.LinkColumn(width="medium"),
-        },
-        hide_index=True,
-        use_container_width=True,
-    )
+def _tag_client(client, api_key: str):
+    if client is not None:
+        client._techaudit_key = _key_id(api_key)
+    return client
 
-    # ── Articles accordion (sorted by tier, CLOSED by default) ─
-    st.markdown("#### Competitor Articles")
-    for comp in sorted_comps:
-        name = comp.get("name", "")
-        articles = comp.get("articles", [])
-        # Articles already sorted by dedup_articles() during collection;
-        # defensive re-sort only if loaded from file/default
-        sorted_articles = sorted(
-            articles, key=lambda a: a.get("date") or "", reverse=True
-        )
-        with st.expander(f"{name} ({len(sorted_articles)} articles)", expanded=False):
-            if not sorted_articles:
-                st.caption("No articles collected.")
-            else:
-                for a in sorted_articles:
-                    url = a.get("url", "")
-                    title_text = a.get("title", "Untitled")
-                    date = a.get("date", "—")
-                    relevance = a.get("relevance", "")
-                    link = f"[{title_text}]({url})" if url else title_text
-                    st.markdown(
-                        f"**{link}**  \n"
-                        f"Published: {date} &nbsp;|&nbsp; Relevance: {relevance}"
-                    )
 
-# ══════════════════════════════════════════════════════════════════
-# 6 · IMAGE GENERATION  (Pollinations.ai — no key required)
-# ══════════════════════════════════════════════════════════════════
-def pollinations_url(prompt: str, w: int = 1200, h: int = 630, seed: int = 42) -> str:
-    """Return a Pollinations.ai Flux image URL (no API key needed)."""
-    enc = quote(prompt[:400])
-    return (
-        f"https://image.pollinations.ai/prompt/{enc}"
-        f"?width={w}&height={h}&model=flux&nologo=true&enhance=true&seed={seed}"
-    )
+def _key_bound(cfg) -> bool:
+    """Requests on a Gemini context cache must stay on the key that created it."""
+    return getattr(cfg, "cached_content", None) is not None
 
 
-def _seed(text: str) -> int:
-    return int(hashlib.md5(text.encode()).hexdigest(), 16) % 100_000
+def _estimate_tokens(*parts) -> int:
+    """~4 characters per token over everything sent; close enough for a TPM budget."""
+    return sum(len(p if isinstance(p, str) else json.dumps(p, default=str)) for p in parts) // 4
 
-# ══════════════════════════════════════════════════════════════════
-# 7 · WORKFLOW HELPERS
-# ══════════════════════════════════════════════════════════════════
 
-# ── Step 2: trending topics ────────────────────────────────────
-def fetch_topics(client, category: str) -> list[dict]:
-    prompt = f"""
-You are a senior technical analyst. Using Google Search, identify EXACTLY 5 highly-specific,
-trending technical topics within "{category}" based on 2025-2026 data (conferences, papers,
-benchmark announcements, product launches).
+def _is_rate_limited(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None)
+    if not isinstance(status, int):
+        status = getattr(exc, "code", None)
+    if status == 429:
+        return True
+    msg = str(exc).lower()
+    return "resource_exhausted" in msg or "rate limit" in msg or "rate_limit" in msg
 
-Return ONLY a JSON array of 5 objects:
-[
-  {{"title": "<concise topic name>", "description": "<2-sentence technical rationale, cite data point or event>", "trend_signal": "<what makes it trending in 2025-2026>"}},
-  ...
-]
-Strict: no markdown wrappers, pure JSON only.
-"""
-    resp = _call_search(client, prompt)
-    return _parse_json(_extract_text(resp))
 
+def _retry_after(exc: Exception) -> float | None:
+    """Server-suggested delay in seconds: Retry-After header, else Gemini's retryDelay."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        pass
+    for pattern in _RETRY_AFTER_RES:
+        match = pattern.search(str(exc))
+        if match:
+            return float(match.group(1))
+    return None
 
-# ── Step 3: SEO/AEO title optimization ────────────────────────
-def fetch_titles(client, topic: dict) -> list[dict]:
-    prompt = f"""
-You are an SEO strategist specializing in AEO (Answer Engine Optimization) for technical content.
-Given the topic below, generate EXACTLY 5 article titles — each with a distinct technical angle.
 
-Topic: {topic['title']}
-Description: {topic['description']}
+def _backoff_or_raise(bucket: TokenBucket, model: str, exc: Exception, attempt: int) -> None:
+    if not _is_rate_limited(exc) or attempt == RATE_LIMIT_RETRIES:
+        raise exc
+    hint = _retry_after(exc)
+    if hint is not None and hint > RATE_LIMIT_BACKOFF_MAX:
+        raise exc       # quota window, not a burst — let the router fall back
+    delay = bucket.backoff(hint, attempt)
+    _llm_log.warning("429 from %s — backing off %.1fs (retry %d/%d)",
+                     model, delay, attempt + 1, RATE_LIMIT_RETRIES)
 
-Requirements per title:
-- Optimized for Google's AI Overviews and featured snippets
-- Contains a primary keyword (measurable/quantitative angle preferred)
-- 55–70 characters
-- Distinct angle: e.g. benchmark-focused, cost-analysis, architectural deep-dive, failure-case, comparative
 
-Return JSON array only:
-[
-  {{
-    "title": "<full article title>",
-    "angle": "<one of: benchmark | cost-analysis | architecture | failure-case | comparative>",
-    "primary_keyword": "<exact keyword string>",
-    "seo_rationale": "<1-sentence reason this title wins in SERPs/AEO>"
-  }},
-  ...5 items...
-]
-"""
-    resp = _call(client, prompt, _json_cfg())
-    return _parse_json(_extract_text(resp))
+def throttled(key: str, model: str, tokens: int, fn):
+    """Run fn() once the (key, model) bucket has capacity; 429s back off and retry."""
+    bucket = rate_limiter.bucket(key, model)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        bucket.acquire(tokens)
+        try:
+            return fn()
+        except Exception as e:
+            _backoff_or_raise(bucket, model, e, attempt)
 
 
-# ── Step 4: deep research — 8 high-authority sources ──────────
-def deep_research(client, title: str) -> tuple[list[dict], str]:
+async def athrottled(key: str, model: str, tokens: int, fn):
+    """Async throttled: awaits fn()."""
+    bucket = rate_limiter.bucket(key, model)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        await bucket.aacquire(tokens)
+        try:
+            return await fn()
+        except Exception as e:
+            _backoff_or_raise(bucket, model, e, attempt)
+
+
+class KeyPool:
     """
-    Returns (sources_list, notebooklm_context_text).
-    Uses Google Search grounding to find real, verifiable sources.
+    Several API keys for one provider. pick() chooses the key for the next
+    call — "least_loaded" (shortest rate-limit wait, then fewest calls in
+    flight) or "round_robin" (next key whose bucket isn't waiting) — and
+    skips keys quarantined after a credit / quota error.
     """
-    prompt = f"""
-You are a technical research auditor. Using Google Search, find EXACTLY 8 high-authority sources
-for the following article title. Sources MUST be published between 2023 and 2026.
 
-Article Title: "{title}"
+    def __init__(self, provider: str, keys: list[str], strategy: str = KEY_POOL_STRATEGY):
+        self.provider = provider
+        self.strategy = strategy
+        self.keys = list(dict.fromkeys(k for k in keys if k))
+        self._lock = threading.Lock()
+        self._in_flight = dict.fromkeys(self.keys, 0)
+        self._quarantined: dict[str, float] = {}
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def pick(self, model: str, tokens: int = 0, exclude=()) -> str | None:
+        """Lease a key for one call (pair with done()); None if every key is excluded or benched."""
+        with self._lock:
+            now = time.monotonic()
+            live = [k for k in self.keys if k not in exclude and self._quarantined.get(k, 0) <= now]
+            if not live:
+                return None
+            waits = {k: rate_limiter.bucket(_key_id(k), model).peek(tokens) for k in live}
+            if self.strategy == "round_robin":
+                start = self._next % len(self.keys)
+                ring = self.keys[start:] + self.keys[:start]
+                key = next((k for k in ring if k in waits and waits[k] == 0),
+                           min(live, key=waits.__getitem__))
+                self._next = self.keys.index(key) + 1
+            else:
+                key = min(live, key=lambda k: (waits[k], self._in_flight[k]))
+            self._in_flight[key] += 1
+            return key
+
+    def done(self, key: str) -> None:
+        with self._lock:
+            self._in_flight[key] -= 1
+
+    def quarantine(self, key: str, exc: Exception | None = None) -> None:
+        with self._lock:
+            self._quarantined[key] = time.monotonic() + KEY_QUARANTINE_SECONDS
+        _llm_log.warning("Quarantined %s key %s for %ds: %s",
+                         self.provider, _key_id(key), KEY_QUARANTINE_SECONDS, exc)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "keys": len(self.keys),
+                "quarantined": sum(1 for until in self._quarantined.values() if until > now),
+                "in_flight": sum(self._in_flight.values()),
+            }
 
-Authority tiers (you MUST cover all):
-- Tier 1 (2 sources): Peer-reviewed papers (arXiv, IEEE, ACM, Nature)
-- Tier 2 (2 sources): Official vendor whitepapers or technical documentation
-- Tier 3 (2 sources): Tier-1 tech journalism (The Register, Ars Technica, AnandTech, Tom's Hardware, IEEE Spectrum)
-- Tier 4 (2 sources): Independent benchmarks or audit reports (MLCommons, SPEC, Phoronix, TPC)
 
-For each source return:
-{{
-  "id": 1,
-  "title": "<exact article/paper title>",
-  "url": "<full URL>",
-  "publisher": "<publisher/venue>",
-  "date": "<YYYY-MM or YYYY>",
-  "tier": "<Tier 1|2|3|4>",
-  "snippet": "<2-sentence key finding or claim from this source>",
-  "key_data_point": "<specific number, metric, or fact from this source>"
-}}
+def _load_api_keys(provider: str) -> list[str]:
+    keys = re.split(r"[,\s]+", os.environ.get(f"{provider.upper()}_API_KEYS", ""))
+    if API_KEYS_FILE:
+        try:
+            with open(API_KEYS_FILE, encoding="utf-8") as f:
+                keys += json.load(f).get(provider, [])
+        except (OSError, ValueError, AttributeError) as e:
+            _llm_log.warning("Could not read API keys file %s: %s", API_KEYS_FILE, e)
+    return [k.strip() for k in keys if k and k.strip()]
 
-Return ONLY a JSON array of 8 objects.
-"""
-    resp = _call_search(client, prompt)
-    sources = _parse_json(_extract_text(resp))
 
-    # Extract any real grounding citations from the API response
-    real_urls: list[str] = []
-    try:
-        for chunk in resp.candidates[0].grounding_metadata.grounding_chunks:
-            if chunk.web and chunk.web.uri:
-                real_urls.append(chunk.web.uri)
-    except Exception:
-        pass
+_key_pools: dict[str, KeyPool] = {}
+_key_pools_lock = threading.Lock()
 
-    # Annotate sources with "verified" flag if URL appears in grounding
-    for src in sources:
-        src["grounded"] = any(
-            src.get("url", "").split("/")[2] in u for u in real_urls
-        )
 
-    # Simulate NotebookLM context synthesis
-    context = _build_notebooklm_context(client, title, sources)
-    return sources, context
+def get_key_pool(provider: str) -> KeyPool | None:
+    """The provider's process-wide KeyPool, or None unless ≥2 keys are configured."""
+    with _key_pools_lock:
+        if provider not in _key_pools:
+            _key_pools[provider] = KeyPool(provider, _load_api_keys(provider))
+        pool = _key_pools[provider]
+    return pool if len(pool) >= 2 else None
 
 
-def _build_notebooklm_context(client, title: str, sources: list[dict]) -> str:
-    """Synthesize a NotebookLM-style cross-reference knowledge base."""
-    sources_text = "\n".join(
-        f"[{s['id']}] ({s['tier']}) {s['title']} ({s['date']}) — {s['snippet']} KEY DATA: {s.get('key_data_point','N/A')}"
-        for s in sources
-    )
-    prompt = f"""
-You are simulating Google NotebookLM's deep contextual understanding layer.
-Given 8 research sources for the article "{title}", produce a structured knowledge synthesis:
+def default_api_key(provider: str) -> str:
+    """First pooled key for `provider` ("" if none) — the sidebar's default."""
+    keys = _load_api_keys(provider)
+    return keys[0] if keys else ""
 
-SOURCES:
-{sources_text}
 
-Produce a concise knowledge synthesis (400–500 words) that:
-1. Identifies 3 consensus findings across ≥3 sources
-2. Flags 2 conflicting claims between sources (with source IDs)
-3. Lists 3 critical knowledge gaps NOT covered by these sources
-4. Extracts the 5 most important quantitative data points with source IDs
-5. Rates overall evidence strength: STRONG / MODERATE / WEAK with justification
+def _pool_client(provider: str, key: str, use_async: bool = False):
+    if provider == "anthropic":
+        return get_async_anthropic_client(key) if use_async else get_anthropic_client(key)
+    return get_client(key)
 
-Format as plain prose with labeled sections. This will be injected as context for article generation.
-"""
-    resp = _call(client, prompt, _plain_cfg())
-    return _extract_text(resp)
 
+def pooled(provider: str, client, model: str, tokens: int, fn, pin: bool = False):
+    """
+    Run fn(client) under throttled(). With a key pool (and pin=False, e.g. no
+    key-bound context cache), the client comes from the pool instead; a
+    credit / quota error quarantines that key and the call moves to the next.
+    """
+    pool = None if pin else get_key_pool(provider)
+    tried: list[str] = []
+    while pool is not None and (key := pool.pick(model, tokens, exclude=tried)) is not None:
+        tried.append(key)
+        c = _pool_client(provider, key)
+        try:
+            return throttled(_key_id(key), model, tokens, lambda: fn(c))
+        except Exception as e:
+            if not _is_credit_error(e):
+                raise
+            pool.quarantine(key, e)
+        finally:
+            pool.done(key)
+    return throttled(_client_key(client), model, tokens, lambda: fn(client))
 
-# ── Step 5: Article generation ─────────────────────────────────
-ARTICLE_SCHEMA = {
-    "type": "object",
-    "properties": {
-        "article_title":       {"type": "string"},
-        "executive_summary":   {"type": "string"},
-        "sections": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "heading":        {"type": "string"},
-                    "content":        {"type": "string"},
-                    "chart_suggestion": {"type": "string"},
-                    "image_prompt":   {"type": "string"},
-                },
-            },
-        },
-        "comparison": {
-            "type": "object",
-            "properties": {
-                "heading":      {"type": "string"},
-                "alternatives": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "name":     {"type": "string"},
-                            "pros":     {"type": "string"},
-                            "cons":     {"type": "string"},
-                            "tco_note": {"type": "string"},
-                            "best_for": {"type": "string"},
-                        },
-                    },
-                },
-                "content": {"type": "string"},
-            },
-        },
-        "anti_recommendation": {
-            "type": "object",
-            "properties": {
-                "heading": {"type": "string"},
-                "content": {"type": "string"},
-            },
-        },
-        "tco_analysis": {
-            "type": "object",
-            "properties": {
-                "heading": {"type": "string"},
-                "content": {"type": "string"},
-            },
-        },
-        "conclusion":   {"type": "string"},
-        "references":   {"type": "array", "items": {"type": "string"}},
-        "metadata": {
-            "type": "object",
-            "properties": {
-                "seo_slug":        {"type": "string"},
-                "meta_description": {"type": "string"},
-                "title_tag":       {"type": "string"},
-                "word_count":      {"type": "integer"},
-            },
-        },
-        "quality_audit": {
-            "type": "array",
-            "items": {
-                "type": "object",
-                "properties": {
-                    "check":  {"type": "string"},
-                    "passed": {"type": "boolean"},
-                    "note":   {"type": "string"},
-                },
-            },
-        },
-    },
-}
 
+async def apooled(provider: str, client, model: str, tokens: int, fn, pin: bool = False):
+    """Async pooled: awaits fn(client) on the pool's async clients."""
+    pool = None if pin else get_key_pool(provider)
+    tried: list[str] = []
+    while pool is not None and (key := pool.pick(model, tokens, exclude=tried)) is not None:
+        tried.append(key)
+        c = _pool_client(provider, key, use_async=True)
+        try:
+            return await athrottled(_key_id(key), model, tokens, lambda: fn(c))
+        except Exception as e:
+            if not _is_credit_error(e):
+                raise
+            pool.quarantine(key, e)
+        finally:
+            pool.done(key)
+    return await athrottled(_client_key(client), model, tokens, lambda: fn(client))
 
-def generate_article(client, title: str, sources: list[dict], context: str, competitive_context: str = "") -> dict:
-    sources_block = "\n".join(
-        f"[{s['id']}] {s['title']} ({s['publisher']}, {s['date']}) | {s['snippet']} | KEY DATA: {s.get('key_data_point','')}"
-        for s in sources
+
+async def _acall(client, prompt: str, cfg, model: str | None = None,
+                 call_type: str | None = None, refresh: bool = False):
+    """
+    Async counterpart of _call using the google-genai `aio` client.
+    Runs off the Streamlit script thread, so it never touches session_state:
+    pass the session's model explicitly and apply the returned model_used.
+    refresh=True skips the cache lookup (the fresh response is still stored).
+    Returns (response, model_used).
+    """
+    resp, m, _, _ = await _acall_checked(client, prompt, cfg, None, model, call_type, refresh)
+    return resp, m
+
+
+async def _acall_checked(client, prompt: str, cfg, schema: dict | None, model: str | None = None,
+                         call_type: str | None = None, refresh: bool = False):
+    """Async counterpart of _call_checked. Returns (response, model_used, usable, data)."""
+    async def attempt(m: str):
+        with telemetry.track(call_type, "gemini", m) as t:
+            cached = None if refresh else _cache_lookup(m, prompt, cfg, call_type)
+            if cached is not None:
+                usable, data = _conforms(_extract_text_safe(cached), schema)
+                if usable:
+                    t.cache_hit = True
+                    return cached, usable, data
+            resp = await apooled(
+                "gemini", client, m, _estimate_tokens(prompt),
+                lambda c: c.aio.models.generate_content(model=m, contents=prompt, config=cfg),
+                pin=_key_bound(cfg),
+            )
+            t.usage = _gemini_usage(resp)
+        usable, data = _conforms(_extract_text_safe(resp), schema)
+        if usable:
+            _cache_store(m, prompt, cfg, call_type, resp)
+        return resp, usable, data
+
+    (resp, usable, data), m = await get_llm_dispatcher().call(
+        "gemini", attempt, model or MODEL_REASONING, MODEL_FALLBACK
     )
+    return resp, m, usable, data
 
-    prompt = f"""
-You are the world's most rigorous technical content auditor writing for a senior engineering audience.
-Produce a complete article JSON adhering to every rule below.
 
-━━━━━━━━━━━━ ARTICLE TITLE ━━━━━━━━━━━━
-{title}
+async def _acall_search(client, prompt: str, model: str | None = None,
+                        call_type: str | None = None, refresh: bool = False,
+                        schema: dict | None = None, hedge: bool = False):
+    """
+    Async counterpart of _call_search. Returns (response, model_used, data).
+    hedge=True starts the JSON-mode call in parallel once the grounded call
+    outlives hedge_tracker.delay(); the first usable response wins and the
+    other call is cancelled.
+    """
+    kind = (call_type or "search").split(":")[0]
+    started = time.monotonic()
+    primary = asyncio.ensure_future(
+        _acall_checked(client, prompt, _search_cfg(), schema, model, call_type, refresh))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_tracker.delay(kind) if hedge else None)
+
+    if done:
+        resp, m, usable, data = primary.result()
+        hedge_tracker.record_latency(kind, time.monotonic() - started)
+        if usable:
+            if hedge:
+                hedge_tracker.record(kind, "no_hedge")
+            return resp, m, data
+        if hedge:
+            hedge_tracker.record(kind, "fallback")
+        # No usable text from grounded response — fall back to JSON mode (no search tool)
+        resp, m, _, data = await _acall_checked(client, prompt, _json_cfg(schema), schema, m,
+                                                call_type, refresh)
+        return resp, m, data
+
+    backup = asyncio.ensure_future(
+        _acall_checked(client, prompt, _json_cfg(schema), schema, model, call_type, refresh))
+    pending, error, last = {primary, backup}, None, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if task is primary:
+                    hedge_tracker.record_latency(kind, time.monotonic() - started)
+                resp, m, usable, data = last = task.result()
+                if usable:
+                    hedge_tracker.record(kind, "primary_won" if task is primary else "hedge_won")
+                    return resp, m, data
+    finally:
+        # A cancelled grounded call records nothing: its elapsed time is only a
+        # lower bound and would drag the latency percentile down
+        for task in pending:
+            task.cancel()
+    if last is not None:            # neither was usable — same as the unhedged JSON fallback
+        hedge_tracker.record(kind, "fallback")
+        return last[0], last[1], None
+    raise error
 
-━━━━━━━━━━━━ NOTEBOOKLM CONTEXT (cross-reference this) ━━━━━━━━━━━━
-{context}
+# ══════════════════════════════════════════════════════════════════
+# 5c · COMPETITOR DATA (collection, validation, storage)
+# ══════════════════════════════════════════════════════════════════
+_comp_log = _logging.getLogger("competitor_data")
+if not _comp_log.handlers:
+    _h = _logging.StreamHandler()
+    _h.setFormatter(_logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S"))
+    _comp_log.addHandler(_h)
+    _comp_log.setLevel(_logging.INFO)
 
-━━━━━━━━━━━━ VERIFIED SOURCES (cite as [1]–[8]) ━━━━━━━━━━━━
-{sources_block}
 
-━━━━━━━━━━━━ STRICT CONTENT RULES ━━━━━━━━━━━━
-WORD COUNT      : 1,000–1,500 words total (executive summary + all sections + comparison + anti-rec + tco + conclusion).
-EXECUTIVE SUMMARY: Exactly 100 words. No bullets. Opening paragraph that captures the full argument.
-PARAGRAPHS      : No bullet points anywhere. Use 2–3 sentence paragraphs for scannability.
-EVIDENCE        : Every quantitative claim MUST include: value, source [N], methodology/test-condition, and independent-vs-vendor label.
-                  Include at least 3 perspectives per major claim.
-CRITICAL ANALYSIS: Address vendor lock-in, hidden infrastructure/training costs, and performance limitations.
-                  Include conservative AND optimistic estimates side-by-side.
-ANTI-RECOMMENDATION: Explain precisely when engineers should AVOID this technology (failure scenarios, scale limits, alternative-is-better situations).
-TCO ANALYSIS    : Cover licensing, infrastructure, training/onboarding, maintenance, and exit costs over a 3-year horizon.
-COMPARISON      : Compare 2–3 direct alternatives on: latency, throughput, cost/unit, vendor-lock-in risk, maturity.
-ACRONYMS        : Define every acronym on first use. Example: "FP8 (8-bit floating-point)".
-PHYSICAL LIMITS : Address thermal envelope, power budget, or scaling bottleneck relevant to the topic.
+class CompetitorDataError(Exception):
+    """Base error for competitor data operations."""
 
-━━━━━━━━━━━━ OUTPUT SCHEMA ━━━━━━━━━━━━
-Return a single JSON object (no markdown fences) with these keys:
 
-article_title        : string  — final optimized title
-executive_summary    : string  — exactly 100 words, paragraph form
-sections             : array of objects, each with:
-  heading            : H2 text
-  content            : 3–4 paragraphs of body text (no bullets)
-  chart_suggestion   : specific chart type + axes + what it should visualize
-  image_prompt       : detailed Flux/Stable-Diffusion prompt for a professional technical illustration
-comparison           : object with heading, alternatives (array), content
-anti_recommendation  : object with heading, content
-tco_analysis         : object with heading, content
-conclusion           : string — 1 strong closing paragraph
-references           : array of formatted citation strings [1]–[8]
-metadata             : object with seo_slug, meta_description (≤155 chars), title_tag, word_count
-quality_audit        : array of 4 objects (check, passed, note) verifying:
-  1. All numbers cited with methodology + independent validation
-  2. All acronyms defined at first use
-  3. Physical constraints (thermal/power/scaling) addressed
-  4. No repetition — themes consolidated
+class SchemaValidationError(CompetitorDataError):
+    """Raised when competitor data fails schema validation."""
 
-Output ONLY the JSON. No preamble, no explanation.
-"""
-    if competitive_context:
-        prompt += f"\n\n{competitive_context}"
-    resp = _call(client, prompt, _json_cfg())
-    return _parse_json(_extract_text(resp))
 
+class DataLoadingError(CompetitorDataError):
+    """Raised when competitor data cannot be loaded from any source."""
 
-# ── Claude article generation ───────────────────────────────────
-def generate_article_claude(
-    anthropic_client,
-    title: str,
-    accepted_sources: list[dict],
-    all_sources: list[dict],
-    context: str,
-    qa_feedback: str = "",
-    competitive_context: str = "",
-) -> dict:
-    """Generate the full article using Claude. Falls back to error dict on failure."""
 
-    # Separate accepted vs. declined for the prompt
-    accepted_ids = {s.get("id") for s in accepted_sources}
-    declined = [s for s in all_sources if s.get("id") not in accepted_ids]
+class GeminiAPIError(CompetitorDataError):
+    """Raised when Gemini API call fails during competitor collection."""
 
-    primary_block = "\n".join(
-        f"[{s['id']}] {s['title']} ({s['publisher']}, {s['date']})\n"
-        f"    Snippet: {s['snippet']}\n"
-        f"    Key data: {s.get('key_data_point','')}"
-        for s in accepted_sources
-    )
-    supp_block = (
-        "\n".join(
-            f"[{s['id']}] {s['title']} — context only, do NOT cite"
-            for s in declined
-        )
+
+class CompetitorParseError(CompetitorDataError):
+    """Raised when a competitor search reply cannot be parsed into articles."""
+
+
+def validate_url_format(url: str) -> bool:
+    """Validate URL format only — no network requests, no blocking."""
+    if not url or not isinstance(url, str):
+        return False
+    try:
+        result = urlparse(url)
+        return all([result.scheme in ("http", "https"), result.netloc])
+    except Exception:
+        return False
+
+
+def dedup_articles(articles_list: list[dict]) -> list[dict]:
+    """Remove duplicate articles by URL, then sort by date descending."""
+    seen_urls: set[str] = set()
+    deduped: list[dict] = []
+    for article in articles_list:
+        url = article.get("url", "")
+        if url and url not in seen_urls:
+            seen_urls.add(url)
+            deduped.append(article)
+    deduped.sort(key=lambda a: a.get("date") or "", reverse=True)
+    return deduped
+
+
+def validate_competitors_schema(data: dict) -> None:
+    """Validate competitors data structure. Raises SchemaValidationError on failure."""
+    if "schema_version" not in data:
+        raise SchemaValidationError("Missing schema_version")
+
+    for category, cat_data in data.items():
+        if category == "schema_version":
+            continue
+        if not isinstance(cat_data, dict) or "competitors" not in cat_data:
+            raise SchemaValidationError(f"Category '{category}' missing 'competitors'")
+
+        for comp_name, competitor in cat_data["competitors"].items():
+            for field in ("name", "blog_url", "articles"):
+                if field not in competitor:
+                    raise SchemaValidationError(f"Competitor '{comp_name}' missing '{field}'")
+
+            for idx, article in enumerate(competitor["articles"]):
+                for field in ("title", "url", "date", "relevance"):
+                    if field not in article:
+                        raise SchemaValidationError(f"Article {idx} in '{comp_name}' missing '{field}'")
+
+
+def migrate_competitors_schema(data: dict) -> Optional[dict]:
+    """Migrate competitors data between schema versions."""
+    version = data.get("schema_version", "1.0")
+    if version == "1.0":
+        return data
+    st.warning(f"Unknown schema version: {version}. Re-collect in Step 4.")
+    return None
+
+
+class CompetitorStore:
+    """
+    SQLite backend for competitor data: one table per entity (category,
+    competitor, article), indexed by category, with transactional
+    per-competitor upserts. Imports / exports the schema_version 1.0 JSON
+    layout so the JSON files (incl. default_competitors.json) keep working.
+    Category lookups are case-insensitive, like load_competitors_for_category.
+    """
+
+    _ARTICLE_FIELDS = ("title", "url", "date", "relevance")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS categories (
+                name     TEXT PRIMARY KEY COLLATE NOCASE,
+                position INTEGER NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS competitors (
+                category TEXT NOT NULL COLLATE NOCASE,
+                comp_key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                data     TEXT NOT NULL,
+                PRIMARY KEY (category, comp_key)
+            );
+            CREATE TABLE IF NOT EXISTS articles (
+                category  TEXT NOT NULL COLLATE NOCASE,
+                comp_key  TEXT NOT NULL,
+                position  INTEGER NOT NULL,
+                title     TEXT,
+                url       TEXT,
+                date      TEXT,
+                relevance TEXT,
+                extra     TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_articles_comp
+                ON articles(category, comp_key, position);
+            """
+        )
+        self._db.commit()
+
+    # ── writes ──────────────────────────────────────────────────
+    def _upsert_category_row(self, category: str, metadata: dict) -> None:
+        self._db.execute(
+            """INSERT INTO categories (name, position, metadata)
+               VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM categories), ?)
+               ON CONFLICT(name) DO UPDATE SET metadata = excluded.metadata""",
+            (category, json.dumps(metadata)),
+        )
+
+    def _upsert_competitor_rows(self, category: str, comp_key: str, comp: dict) -> None:
+        data = {k: v for k, v in comp.items() if k != "articles"}
+        self._db.execute(
+            """INSERT INTO competitors (category, comp_key, position, data)
+               VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1
+                              FROM competitors WHERE category = ?), ?)
+               ON CONFLICT(category, comp_key) DO UPDATE SET data = excluded.data""",
+            (category, comp_key, category, json.dumps(data)),
+        )
+        self._db.execute(
+            "DELETE FROM articles WHERE category = ? AND comp_key = ?", (category, comp_key)
+        )
+        self._db.executemany(
+            "INSERT INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    category, comp_key, i,
+                    *(a.get(f) for f in self._ARTICLE_FIELDS),
+                    json.dumps({k: v for k, v in a.items() if k not in self._ARTICLE_FIELDS}),
+                )
+                for i, a in enumerate(comp.get("articles", []))
+            ],
+        )
+
+    def upsert_competitor(self, category: str, comp_key: str, comp: dict,
+                          metadata: Optional[dict] = None) -> None:
+        """Insert or replace one competitor (and its articles) in a single transaction."""
+        with self._lock, self._db:
+            exists = self._db.execute(
+                "SELECT 1 FROM categories WHERE name = ?", (category,)
+            ).fetchone()
+            if metadata is not None or not exists:
+                self._upsert_category_row(category, metadata or {})
+            self._upsert_competitor_rows(category, comp_key, comp)
+
+    def upsert_category_metadata(self, category: str, metadata: dict) -> None:
+        with self._lock, self._db:
+            self._upsert_category_row(category, metadata)
+
+    def import_json(self, data: dict) -> None:
+        """Upsert every category of a schema_version 1.0 dataset in one transaction."""
+        with self._lock, self._db:
+            for category, cat_data in data.items():
+                if category == "schema_version":
+                    continue
+                self._upsert_category_row(category, cat_data.get("metadata", {}))
+                for comp_key, comp in cat_data.get("competitors", {}).items():
+                    self._upsert_competitor_rows(category, comp_key, comp)
+
+    # ── reads ───────────────────────────────────────────────────
+    def categories(self) -> list[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT name FROM categories ORDER BY position").fetchall()
+        return [r[0] for r in rows]
+
+    def load_category(self, category: str) -> Optional[dict]:
+        """One category in the 1.0 JSON layout, or None if it is not stored."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name, metadata FROM categories WHERE name = ?", (category,)
+            ).fetchone()
+            if row is None:
+                return None
+            name, metadata = row
+            comp_rows = self._db.execute(
+                "SELECT comp_key, data FROM competitors WHERE category = ? ORDER BY position",
+                (name,),
+            ).fetchall()
+            article_rows = self._db.execute(
+                """SELECT comp_key, title, url, date, relevance, extra FROM articles
+                   WHERE category = ? ORDER BY comp_key, position""",
+                (name,),
+            ).fetchall()
+        competitors = {}
+        for comp_key, data in comp_rows:
+            comp = json.loads(data)
+            comp["articles"] = []
+            competitors[comp_key] = comp
+        for comp_key, *values, extra in article_rows:
+            if comp_key in competitors:
+                article = dict(zip(self._ARTICLE_FIELDS, values))
+                article.update(json.loads(extra or "{}"))
+                competitors[comp_key]["articles"].append(article)
+        return {"metadata": json.loads(metadata), "competitors": competitors}
+
+    def export_json(self) -> dict:
+        """Whole dataset in the schema_version 1.0 JSON layout."""
+        data: dict = {"schema_version": "1.0"}
+        for category in self.categories():
+            data[category] = self.load_category(category)
+        return data
+
+
+_competitor_stores: dict[str, CompetitorStore] = {}
+_competitor_stores_lock = threading.Lock()
+
+
+def _competitor_db_path() -> str:
+    """SQLite file that sits next to the JSON export (COMPETITORS_DATA_PATH)."""
+    return os.path.splitext(COMPETITORS_DATA_PATH)[0] + ".sqlite3"
+
+
+def get_competitor_store(create: bool = True) -> Optional[CompetitorStore]:
+    """
+    Process-wide CompetitorStore for the current data path.
+    With create=False, returns None when no database exists yet.
+    Returns None as well when SQLite is unavailable (read-only FS, etc.).
+    """
+    path = _competitor_db_path()
+    with _competitor_stores_lock:
+        store = _competitor_stores.get(path)
+        if store is not None:
+            return store
+        if not create and not os.path.exists(path):
+            return None
+        try:
+            store = _competitor_stores[path] = CompetitorStore(path)
+        except (sqlite3.Error, OSError) as e:
+            _comp_log.warning("Competitor store unavailable (%s): %s", path, e)
+            return None
+        return store
+
+
+# Process-wide, read-mostly copy of the competitors data shared by every
+# session. Sessions keep a reference plus the version it was published under;
+# saves bump the version, and a change in the source files' mtime/size (e.g.
+# another process wrote them) invalidates the copy.
+_shared_competitors: dict = {"data": None, "loaded": False, "stamp": None, "version": 0}
+_shared_competitors_lock = threading.RLock()
+
+
+def _competitor_source_stamp() -> tuple:
+    """(path, mtime_ns, size) for every file load_competitors_data() reads."""
+    db_path = _competitor_db_path()
+    stamp = []
+    for path in (db_path, db_path + "-wal", COMPETITORS_DATA_PATH, DEFAULT_COMPETITORS_PATH):
+        try:
+            info = os.stat(path)
+            stamp.append((path, info.st_mtime_ns, info.st_size))
+        except OSError:
+            stamp.append((path, None, None))
+    return tuple(stamp)
+
+
+def _competitors_version() -> int:
+    """Current shared-cache version; drops the shared copy if the sources changed."""
+    stamp = _competitor_source_stamp()
+    with _shared_competitors_lock:
+        if stamp != _shared_competitors["stamp"]:
+            _shared_competitors.update(data=None, loaded=False, stamp=stamp,
+                                       version=_shared_competitors["version"] + 1)
+        return _shared_competitors["version"]
+
+
+def _publish_competitors(data: Optional[dict]) -> int:
+    """Install data as the shared copy under a new version; point this session at it."""
+    with _shared_competitors_lock:
+        version = _shared_competitors["version"] + 1
+        _shared_competitors.update(data=data, loaded=True,
+                                   stamp=_competitor_source_stamp(), version=version)
+    _state()[COMPETITORS_SS_KEY] = data
+    _state()[COMPETITORS_VER_KEY] = version
+    return version
+
+
+def shared_competitors_data() -> Optional[dict]:
+    """The shared copy if it is loaded and current, else None (no I/O beyond stat)."""
+    version = _competitors_version()
+    with _shared_competitors_lock:
+        if _shared_competitors["loaded"] and _shared_competitors["version"] == version:
+            return _shared_competitors["data"]
+    return None
+
+
+def save_competitors_data(data: dict) -> None:
+    """
+    Full snapshot save: to the SQLite store and the JSON export file when
+    possible, then published as the shared copy (bumping its version) and
+    referenced from session_state. Collection itself uses per-competitor
+    upserts (save_competitor_entry) instead of rewriting everything.
+    Treat data as read-only afterwards — other sessions share it.
+    """
+    store = get_competitor_store()
+    if store is not None:
+        try:
+            store.import_json(data)
+        except sqlite3.Error as e:
+            _comp_log.warning("Store save skipped: %s", e)
+    try:
+        os.makedirs(os.path.dirname(COMPETITORS_DATA_PATH), exist_ok=True)
+        with open(COMPETITORS_DATA_PATH, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        _comp_log.info("Saved competitors data to %s", COMPETITORS_DATA_PATH)
+    except (IOError, OSError) as e:
+        _comp_log.warning("File save skipped (Cloud?): %s", e)
+    _publish_competitors(data)
+
+
+def save_competitor_entry(category: str, comp_key: str, comp: dict,
+                          metadata: Optional[dict] = None) -> bool:
+    """Transactional upsert of one competitor. False if the store is unavailable."""
+    store = get_competitor_store()
+    if store is None:
+        return False
+    try:
+        store.upsert_competitor(category, comp_key, comp, metadata)
+        return True
+    except sqlite3.Error as e:
+        _comp_log.warning("Upsert failed for %s/%s: %s", category, comp_key, e)
+        return False
+
+
+def load_competitors_data() -> Optional[dict]:
+    """
+    1st: session_state reference → 2nd: process-wide shared copy →
+    3rd: SQLite store → 4th: JSON file → 5th: default fallback.
+    Sources are read (and validated) once per process and version; every
+    session then holds a reference to the same read-only dict.
+    """
+    # 1st: session_state (valid while its shared version is current)
+    version = _competitors_version()
+    cached = _state().get(COMPETITORS_SS_KEY)
+    if cached is not None and _state().get(COMPETITORS_VER_KEY, version) == version:
+        return cached
+
+    # 2nd: shared copy — loaded under the lock so concurrent sessions parse once
+    with _shared_competitors_lock:
+        data = shared_competitors_data()
+        if data is None and not _shared_competitors["loaded"]:
+            data = _load_competitors_from_sources()
+            _publish_competitors(data)
+            return data
+    _state()[COMPETITORS_SS_KEY] = data
+    _state()[COMPETITORS_VER_KEY] = _shared_competitors["version"]
+    return data
+
+
+def _load_competitors_from_sources() -> Optional[dict]:
+    """SQLite store → JSON file → default file. No session_state access."""
+    # SQLite store (validated on write, so no re-validation here)
+    store = get_competitor_store(create=False)
+    if store is not None:
+        try:
+            if store.categories():
+                data = store.export_json()
+                _comp_log.info("Loaded competitors from %s", store.path)
+                return data
+        except sqlite3.Error as e:
+            _comp_log.error("Competitor store read failed: %s", e)
+
+    # Local JSON file (imported into the store for next time)
+    try:
+        with open(COMPETITORS_DATA_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        _comp_log.info("Loaded competitors from %s", COMPETITORS_DATA_PATH)
+        data = migrate_competitors_schema(data)
+        if data is None:
+            raise DataLoadingError("Schema migration failed — unknown version")
+        validate_competitors_schema(data)
+        store = get_competitor_store()
+        if store is not None:
+            try:
+                store.import_json(data)
+            except sqlite3.Error as e:
+                _comp_log.warning("Could not import %s into store: %s", COMPETITORS_DATA_PATH, e)
+        return data
+    except FileNotFoundError:
+        _comp_log.info("No competitors file at %s", COMPETITORS_DATA_PATH)
+    except json.JSONDecodeError as e:
+        _comp_log.error("Invalid JSON in %s: %s", COMPETITORS_DATA_PATH, e)
+        st.warning("Competitor data file has invalid JSON. Re-collect in Step 4.")
+    except SchemaValidationError as e:
+        _comp_log.error("Schema validation failed for %s: %s", COMPETITORS_DATA_PATH, e)
+        st.warning(f"Competitor data format error: {e}")
+    except DataLoadingError as e:
+        _comp_log.error("Data loading error: %s", e)
+        st.warning(str(e))
+    except (IOError, PermissionError) as e:
+        _comp_log.error("File access error %s: %s", COMPETITORS_DATA_PATH, e)
+        st.warning("Unable to read competitor data file.")
+
+    # Default fallback
+    try:
+        with open(DEFAULT_COMPETITORS_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        _comp_log.info("Loaded default competitors from %s", DEFAULT_COMPETITORS_PATH)
+        data = migrate_competitors_schema(data)
+        if data is None:
+            return None
+        validate_competitors_schema(data)
+        return data
+    except FileNotFoundError:
+        _comp_log.warning("No default competitors file at %s", DEFAULT_COMPETITORS_PATH)
+    except json.JSONDecodeError as e:
+        _comp_log.error("Invalid JSON in default file: %s", e)
+    except SchemaValidationError as e:
+        _comp_log.error("Default file schema error: %s", e)
+    except Exception as e:
+        _comp_log.error("Unexpected error loading defaults: %s", e)
+    return None
+
+
+def _competitor_prompt(comp_data: dict, category: str) -> str:
+    blog_url = comp_data.get("blog_url", "")
+    current_year = datetime.now().year
+    return f"""
+Find the 3 most recent technical articles from {comp_data['name']}:
+Blog: {blog_url}
+
+Category: {category}
+
+Return ONLY a JSON array (no markdown, no wrapping):
+[
+  {{
+    "title": "Article Title",
+    "url": "https://exact-url",
+    "date": "YYYY-MM-DD",
+    "relevance": "Why it matches {category}"
+  }}
+]
+
+Requirements:
+- URLs in valid http/https format
+- Dates in YYYY-MM-DD format only
+- Published in {current_year - 1}-{current_year}
+- Max 3 articles per company
+- No "company" field
+"""
+
+
+COMPETITOR_ARTICLES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "title":     {"type": "string"},
+            "url":       {"type": "string"},
+            "date":      {"type": "string"},
+            "relevance": {"type": "string"},
+        },
+        "required": ["title", "url", "date", "relevance"],
+    },
+    "maxItems": 3,
+}
+
+
+def _parse_competitor_articles(resp, comp_key: str, data: list | None = None) -> list[dict]:
+    """
+    Validated article list from a competitor search response (data, if the
+    search already validated it). Raises ValueError on bad text.
+    """
+    if data is None:
+        data = _parse_validated(_extract_text(resp), COMPETITOR_ARTICLES_SCHEMA)
+    articles = data
+    _comp_log.info("Fetched %d articles for %s", len(articles), comp_key)
+    return articles
+
+
+def fetch_articles_for_competitor(
+    client: genai.Client, comp_key: str, comp_data: dict, category: str
+) -> list[dict]:
+    """Fetch articles using Gemini + Google Search grounding."""
+    prompt = _competitor_prompt(comp_data, category)
+    try:
+        resp, data = _call_search(client, prompt, call_type=f"competitor:{comp_key}",
+                                  schema=COMPETITOR_ARTICLES_SCHEMA)
+        return _parse_competitor_articles(resp, comp_key, data)
+    except (ValueError, json.JSONDecodeError) as e:
+        _comp_log.error("Parse error for %s: %s", comp_key, e)
+        st.warning(f"Could not parse articles for {comp_data.get('name', comp_key)}. Skipping.")
+        return []
+    except Exception as e:
+        _comp_log.error("Gemini API error for %s: %s", comp_key, e)
+        raise GeminiAPIError(f"API call failed for {comp_key}: {e}") from e
+
+
+async def afetch_articles_for_competitor(
+    client: genai.Client, comp_key: str, comp_data: dict, category: str,
+    model: str | None = None, refresh: bool = False,
+) -> tuple[list[dict], str | None]:
+    """
+    Async counterpart of fetch_articles_for_competitor (no Streamlit calls).
+    API failures raise GeminiAPIError and unparseable replies raise
+    CompetitorParseError, so the caller can mark the competitor failed.
+    refresh=True bypasses the response cache. Returns (articles, model_used).
+    """
+    prompt = _competitor_prompt(comp_data, category)
+    try:
+        resp, model_used, data = await _acall_search(
+            client, prompt, model, call_type=f"competitor:{comp_key}", refresh=refresh,
+            schema=COMPETITOR_ARTICLES_SCHEMA,
+        )
+    except Exception as e:
+        _comp_log.error("Gemini API error for %s: %s", comp_key, e)
+        raise GeminiAPIError(f"API call failed for {comp_key}: {e}") from e
+    try:
+        return _parse_competitor_articles(resp, comp_key, data), model_used
+    except (ValueError, json.JSONDecodeError) as e:
+        _comp_log.error("Parse error for %s: %s", comp_key, e)
+        raise CompetitorParseError(f"Unparseable reply for {comp_key}: {e}") from e
+
+
+def _parse_timestamp(ts: str | None) -> Optional[datetime]:
+    """Parse the "<isoformat>Z" timestamps written by collection."""
+    if not ts or not isinstance(ts, str):
+        return None
+    try:
+        return datetime.fromisoformat(ts.rstrip("Z"))
+    except ValueError:
+        return None
+
+
+def is_competitor_stale(comp: Optional[dict], now: Optional[datetime] = None) -> bool:
+    """
+    True if a stored competitor entry should be re-queried: missing, failed
+    last time, never timestamped, or older than its ttl_seconds.
+    """
+    if not comp or comp.get("last_status") == "failed":
+        return True
+    collected = _parse_timestamp(comp.get("collected_timestamp"))
+    if collected is None:
+        return True
+    ttl = comp.get("ttl_seconds", COMPETITOR_TTL_SECONDS)
+    return ((now or datetime.now()) - collected).total_seconds() >= ttl
+
+
+def collect_competitor_articles(
+    max_workers: int = COMPETITOR_FETCH_WORKERS, force_refresh: bool = False
+) -> tuple[int, int] | None:
+    """
+    Collect articles for current category using Gemini + Google Search.
+    Only stale or previously failed competitors are re-queried unless
+    force_refresh is set. Competitors are fetched concurrently (at most
+    max_workers at a time) and merged in completion order, with a progress
+    line per competitor.
+    """
+    try:
+        category = _state().get("category", "")
+
+        if not category:
+            st.warning("No category selected. Please complete Step 1 first.")
+            return None
+
+        _validate_competitor_config()
+        _comp_log.info("Starting collection for category: %s", category)
+
+        # Copy-on-write: the loaded dict is shared with other sessions
+        all_data = dict(load_competitors_data() or {"schema_version": "1.0"})
+
+        if category in all_data:
+            all_data[category] = {
+                **all_data[category],
+                "competitors": dict(all_data[category].get("competitors", {})),
+            }
+        else:
+            all_data[category] = {
+                "metadata": {
+                    "category": category,
+                    "generated_date": datetime.now().strftime("%Y-%m-%d"),
+                    "collected_timestamp": datetime.now().isoformat() + "Z",
+                    "source": "ai_deep_research",
+                },
+                "competitors": {},
+            }
+
+        api_key = _state().get("_api_key") or os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
+        if not api_key:
+            st.warning("Gemini API key not set. Enter it in the sidebar or set GOOGLE_GENERATIVE_AI_API_KEY.")
+            return None
+        client = get_client(api_key)
+
+        if category not in COMPETITORS_BY_CATEGORY:
+            raise CompetitorDataError(f"No competitors defined for category: {category}")
+
+        competitors = COMPETITORS_BY_CATEGORY[category]
+        failed_comps: list[str] = []
+        stored = all_data[category]["competitors"]
+
+        comp_keys = [
+            k for k in competitors
+            if force_refresh or is_competitor_stale(stored.get(k))
+        ]
+        skipped = len(competitors) - len(comp_keys)
+        if skipped:
+            _comp_log.info("Skipping %d fresh competitor(s) for %s", skipped, category)
+        if not comp_keys:
+            st.info(f"All {len(competitors)} competitors are still fresh — nothing re-queried.")
+            return _competitor_counts(all_data[category])
+
+        store_ok = get_competitor_store() is not None
+        futures = get_llm_dispatcher().submit_bounded(
+            [
+                afetch_articles_for_competitor(
+                    client, k, competitors[k], category, MODEL_REASONING, refresh=force_refresh
+                )
+                for k in comp_keys
+            ],
+            max_workers,
+        )
+        comp_by_future = dict(zip(futures, comp_keys))
+        progress = st.progress(0.0, text=f"Collecting 0/{len(comp_keys)} competitors…")
+
+        for done, fut in enumerate(concurrent.futures.as_completed(futures), start=1):
+            comp_key = comp_by_future[fut]
+            comp_data = competitors[comp_key]
+            comp_name = comp_data.get("name", comp_key)
+            try:
+                articles, _state()["model_used"] = fut.result()
+
+                validated_articles = [
+                    a for a in articles
+                    if validate_url_format(a.get("url", ""))
+                ]
+                filtered_count = len(articles) - len(validated_articles)
+                if filtered_count > 0:
+                    _comp_log.info("Filtered %d invalid URLs for %s", filtered_count, comp_key)
+
+                deduped_articles = dedup_articles(validated_articles)
+
+                entry = dict(stored.get(comp_key) or {
+                    "name": comp_data.get("name", ""),
+                    "blog_url": comp_data.get("blog_url", ""),
+                    "tier": comp_data.get("tier", 2),
+                    "editable": False,
+                })
+                entry["articles"] = deduped_articles
+                entry["collected_timestamp"] = datetime.now().isoformat() + "Z"
+                entry["ttl_seconds"] = comp_data.get("ttl_seconds", COMPETITOR_TTL_SECONDS)
+                entry["last_status"] = "ok"
+                validate_competitors_schema(
+                    {"schema_version": "1.0", category: {"competitors": {comp_key: entry}}}
+                )
+                stored[comp_key] = entry
+                store_ok = store_ok and save_competitor_entry(category, comp_key, entry)
+                line = f"✓ {comp_name} — {len(deduped_articles)} article(s)"
+
+            except GeminiAPIError as e:
+                _comp_log.error("API error for %s: %s", comp_key, e)
+                failed_comps.append(comp_name)
+                st.warning(f"API error for {comp_name}. Skipping.")
+                line = f"✗ {comp_name} — API error"
+            except CompetitorParseError:
+                failed_comps.append(comp_name)
+                st.warning(f"Could not parse articles for {comp_name}. Skipping.")
+                line = f"✗ {comp_name} — unparseable reply"
+            except Exception as e:
+                _comp_log.error("Unexpected error for %s: %s", comp_key, e)
+                failed_comps.append(comp_name)
+                st.warning(f"Failed to collect for {comp_name}: {str(e)}")
+                line = f"✗ {comp_name} — failed"
+            if line.startswith("✗") and comp_key in stored:
+                # Keep the previous articles, but retry on the next refresh
+                stored[comp_key] = {**stored[comp_key], "last_status": "failed"}
+                store_ok = store_ok and save_competitor_entry(category, comp_key, stored[comp_key])
+
+            progress.progress(done / len(comp_keys), text=f"{done}/{len(comp_keys)} · {line}")
+            st.caption(line)
+
+        # Only the re-queried competitors can have failed; fresh ones were skipped
+        all_failed = len(failed_comps) == len(comp_keys)
+        metadata = all_data[category]["metadata"]
+        if not all_failed:
+            metadata = all_data[category]["metadata"] = {
+                **metadata, "collected_timestamp": datetime.now().isoformat() + "Z",
+            }
+        if store_ok:
+            try:
+                get_competitor_store().upsert_category_metadata(category, metadata)
+            except sqlite3.Error as e:
+                _comp_log.warning("Metadata upsert failed for %s: %s", category, e)
+                store_ok = False
+        if store_ok:
+            # Competitors were upserted one by one — republish what the store now
+            # holds, so other sessions' updates since all_data was loaded survive
+            with _shared_competitors_lock:
+                try:
+                    all_data = get_competitor_store().export_json()
+                except sqlite3.Error as e:
+                    _comp_log.warning("Store re-read failed after collection: %s", e)
+                    store_ok = False
+                else:
+                    _publish_competitors(all_data)
+        if not store_ok:
+            validate_competitors_schema(all_data)
+            save_competitors_data(all_data)
+        if all_failed:      # failed statuses are saved above, so the next run retries them
+            st.error("All competitor collections failed. Check API key and try again.")
+            return None
+
+        companies_count, articles_count = _competitor_counts(all_data.get(category, {}))
+        _comp_log.info("Collection complete: %d companies, %d articles", companies_count, articles_count)
+        if failed_comps:
+            st.warning(f"Partial collection — skipped: {', '.join(failed_comps)}")
+        if skipped:
+            st.caption(f"{skipped} competitor(s) still fresh — reused without re-querying.")
+        return companies_count, articles_count
+
+    except SchemaValidationError as e:
+        _comp_log.error("Schema validation after collection: %s", e)
+        st.error(f"Data format error after collection: {e}")
+        return None
+    except CompetitorDataError as e:
+        _comp_log.error("Competitor data error: %s", e)
+        st.error(str(e))
+        return None
+    except Exception as e:
+        _comp_log.error("Unexpected collection error: %s", e)
+        st.error(f"Collection failed: {str(e)}")
+        return None
+
+
+def _competitor_counts(cat_data: dict) -> tuple[int, int]:
+    """(companies, articles) totals for one category's data."""
+    comps = cat_data.get("competitors", {})
+    return len(comps), sum(len(c.get("articles", [])) for c in comps.values())
+
+
+def load_competitors_for_category(category: str, available_data: Optional[dict] = None) -> Optional[dict]:
+    """
+    Load competitors matching article category — case-insensitive exact match.
+    Without available_data, uses the shared copy if it is current, else reads
+    only that category from the SQLite store, falling back to the full
+    load_competitors_data() chain.
+    """
+    if available_data is None:
+        available_data = shared_competitors_data()
+    if available_data is None:
+        store = get_competitor_store(create=False)
+        if store is not None:
+            try:
+                cat_data = store.load_category(category)
+                if cat_data is not None:
+                    return cat_data
+            except sqlite3.Error as e:
+                _comp_log.error("Category read failed for %s: %s", category, e)
+        available_data = load_competitors_data()
+    if not available_data:
+        return None
+    if "schema_version" not in available_data:
+        return None
+    for cat_key in available_data:
+        if cat_key != "schema_version" and cat_key.lower() == category.lower():
+            return available_data[cat_key]
+    return None
+
+
+def build_competitive_context(category: str, data: Optional[dict] = None) -> str:
+    """
+    Generate competitor context block for injection into article generation prompt.
+    With data=None the category is read from storage (see load_competitors_for_category).
+    """
+    if data is not None and not data:
+        return ""
+
+    cat_data = load_competitors_for_category(category, data)
+    if not cat_data:
+        return ""
+
+    competitor_lines: list[str] = []
+    for comp in cat_data.get("competitors", {}).values():
+        name = comp.get("name", "")
+        articles = comp.get("articles", [])
+        if articles:
+            titles = [f'  - "{a.get("title", "")}"' for a in articles[:2]]
+            competitor_lines.append(f"**{name}**:")
+            competitor_lines.extend(titles)
+
+    if not competitor_lines:
+        return ""
+
+    lines = ["## Competitive Landscape (for differentiation only)\n"]
+    lines.append("Competitors already covering this space:\n")
+    lines.extend(competitor_lines)
+    lines.append(
+        "\nInstruction: Write from a distinct angle not covered above. "
+        "Avoid duplicating their exact topics. Focus on unique insights, "
+        "different benchmarks, or underexplored sub-problems."
+    )
+    return "\n".join(lines)
+
+
+def render_competitors_dashboard(category: str, category_data: dict) -> None:
+    """Render competitive analysis dashboard inside Step 5 tab."""
+    st.markdown("### Competitive Analysis")
+    metadata = category_data.get("metadata", {})
+    collected = metadata.get("collected_timestamp", "N/A")
+
+    competitors = category_data.get("competitors", {})
+    total_articles = sum(len(c.get("articles", [])) for c in competitors.values())
+
+    st.markdown(
+        f'<p style="color:#64748b;font-size:.82rem">'
+        f'Category: <strong>{category}</strong> &nbsp;|&nbsp; '
+        f'Competitors: {len(competitors)} &nbsp;|&nbsp; '
+        f'Articles: {total_articles} &nbsp;|&nbsp; '
+        f'Collected: {collected}</p>',
+        unsafe_allow_html=True,
+    )
+
+    if not competitors:
+        st.info("No competitor data available for this category.")
+        return
+
+    # Sort by tier (1 first), then name
+    sorted_comps = sorted(
+        competitors.values(),
+        key=lambda c: (c.get("tier", 99), c.get("name", "")),
+    )
+
+    # ── Competitors table ──────────────────────────────────────
+    st.markdown("#### Competitors")
+    table_rows = [
+        {
+            "Company": c.get("name", ""),
+            "Tier": c.get("tier", "—"),
+            "Articles": len(c.get("articles", [])),
+            "Collected": (c.get("collected_timestamp") or "—")[:16].replace("T", " "),
+            "Blog": c.get("blog_url", ""),
+        }
+        for c in sorted_comps
+    ]
+    st.dataframe(
+        table_rows,
+        column_config={
+            "Company": st.column_config.TextColumn(width="large"),
+            "Tier": st.column_config.NumberColumn(width="small"),
+            "Articles": st.column_config.NumberColumn(width="small"),
+            "Collected": st.column_config.TextColumn(width="small"),
+            "Blog": st.column_config.LinkColumn(width="medium"),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+
+    # ── Articles accordion (sorted by tier, CLOSED by default) ─
+    st.markdown("#### Competitor Articles")
+    for comp in sorted_comps:
+        name = comp.get("name", "")
+        articles = comp.get("articles", [])
+        # Articles already sorted by dedup_articles() during collection;
+        # defensive re-sort only if loaded from file/default
+        sorted_articles = sorted(
+            articles, key=lambda a: a.get("date") or "", reverse=True
+        )
+        with st.expander(f"{name} ({len(sorted_articles)} articles)", expanded=False):
+            if not sorted_articles:
+                st.caption("No articles collected.")
+            else:
+                for a in sorted_articles:
+                    url = a.get("url", "")
+                    title_text = a.get("title", "Untitled")
+                    date = a.get("date", "—")
+                    relevance = a.get("relevance", "")
+                    link = f"[{title_text}]({url})" if url else title_text
+                    st.markdown(
+                        f"**{link}**  \n"
+                        f"Published: {date} &nbsp;|&nbsp; Relevance: {relevance}"
+                    )
+
+# ══════════════════════════════════════════════════════════════════
+# 5d · TELEMETRY & TRACING (per-call JSONL records, Chrome-format spans)
+# ══════════════════════════════════════════════════════════════════
+# Set on the script thread by main(); LLMDispatcher.submit carries them into the loop
+_trace_session: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_session", default=None)
+_trace_step: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_step", default=None)
+
+USAGE_KEYS = ("input", "output", "thinking", "cached", "cache_write")
+
+
+def _gemini_usage(resp) -> dict:
+    """Normalized token counts from a Gemini response's usage_metadata."""
+    meta = getattr(resp, "usage_metadata", None)
+
+    def n(attr: str) -> int:
+        value = getattr(meta, attr, 0)
+        return value if isinstance(value, int) else 0
+
+    cached = n("cached_content_token_count")
+    return {
+        "input": max(0, n("prompt_token_count") - cached),
+        "output": n("candidates_token_count"),
+        "thinking": n("thoughts_token_count"),
+        "cached": cached,
+        "cache_write": 0,
+    }
+
+
+def _claude_call_usage(msg) -> dict:
+    """Normalized token counts from a Claude reply (thinking is billed inside output)."""
+    u = _claude_usage(msg)
+    return {"input": u["input"], "output": u["output"], "thinking": 0,
+            "cached": u["cache_read"], "cache_write": u["cache_write"]}
+
+
+def call_cost(model: str, usage: dict) -> float:
+    price = MODEL_PRICES.get(model)
+    if not price or not usage:
+        return 0.0
+    rates = {
+        "input": price["input"], "output": price["output"], "thinking": price["output"],
+        "cached": price.get("cached", price["input"]), "cache_write": price.get("cache_write", price["input"]),
+    }
+    return sum(usage.get(k, 0) * rates[k] for k in USAGE_KEYS) / 1e6
+
+
+class _CallTrack:
+    """Filled in by the caller inside Telemetry.track()."""
+
+    __slots__ = ("usage", "cache_hit", "extra")
+
+    def __init__(self):
+        self.usage: dict | None = None
+        self.cache_hit = False
+        self.extra: dict = {}
+
+
+class Telemetry:
+    """
+    Records one entry per LLM / HTTP call — call-site label, model, latency,
+    input / output / thinking / cached tokens and cost — to a rotating JSONL
+    trace (path=None: memory only) and to per-session, per-step totals.
+    """
+
+    MAX_SESSIONS = 256
+
+    def __init__(self, path: str | None = TELEMETRY_TRACE_PATH,
+                 max_bytes: int = TELEMETRY_TRACE_MAX_BYTES, backups: int = TELEMETRY_TRACE_BACKUPS):
+        self.path = path
+        self._max_bytes, self._backups = max_bytes, backups
+        self._lock = threading.Lock()
+        self._logger: _logging.Logger | None = None
+        self._sessions: collections.OrderedDict[str, dict] = collections.OrderedDict()
+
+    def _trace(self) -> _logging.Logger | None:
+        if self.path and self._logger is None:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                handler = RotatingFileHandler(self.path, maxBytes=self._max_bytes,
+                                              backupCount=self._backups, encoding="utf-8")
+            except OSError as e:
+                _cache_log.warning("Telemetry trace disabled (%s): %s", self.path, e)
+                self.path = None
+                return None
+            handler.setFormatter(_logging.Formatter("%(message)s"))
+            logger = _logging.getLogger(f"telemetry.{id(self)}")
+            logger.propagate = False
+            logger.setLevel(_logging.INFO)
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    @contextlib.contextmanager
+    def track(self, label: str | None, provider: str, model: str):
+        """Time the block and record it; set .usage / .cache_hit / .extra on the yielded handle."""
+        handle = _CallTrack()
+        started = time.monotonic()
+        status, error = "ok", None
+        with span(label or provider, "http" if provider == "http" else "llm", model=model) as s:
+            try:
+                yield handle
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"[:300]
+                raise
+            finally:
+                rec = self.record(label, provider, model, time.monotonic() - started, handle.usage,
+                                  status=status, error=error, cache_hit=handle.cache_hit,
+                                  trace_id=s.trace_id, span_id=s.span_id, **handle.extra)
+                s.args.update({k: rec[k] for k in ("status", "cache_hit", "cost_usd", *USAGE_KEYS)})
+
+    def record(self, label: str | None, provider: str, model: str, latency: float,
+               usage: dict | None = None, status: str = "ok", error: str | None = None,
+               cache_hit: bool = False, **extra) -> dict:
+        usage = {k: (usage or {}).get(k, 0) for k in USAGE_KEYS}
+        rec = {
+            "ts": datetime.now().isoformat() + "Z",
+            "session": _trace_session.get(),
+            "step": _trace_step.get(),
+            "label": label or "uncategorized",
+            "provider": provider,
+            "model": model,
+            "latency_s": round(latency, 3),
+            "status": status,
+            "cache_hit": cache_hit,
+            **usage,
+            "cost_usd": round(call_cost(model, usage), 6),
+            **extra,
+        }
+        if error:
+            rec["error"] = error
+        self._aggregate(rec)
+        logger = self._trace()
+        if logger is not None:
+            logger.info(json.dumps(rec, default=str))
+        return rec
+
+    def _aggregate(self, rec: dict) -> None:
+        session = rec["session"] or "-"
+        with self._lock:
+            totals = self._sessions.setdefault(session, {"steps": {}, "labels": {}})
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > self.MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+            for group, key in (("steps", rec["step"] or "-"), ("labels", rec["label"])):
+                row = totals[group].setdefault(
+                    key, {"calls": 0, "errors": 0, "latency_s": 0.0, "cost_usd": 0.0,
+                          **dict.fromkeys(USAGE_KEYS, 0)}
+                )
+                row["calls"] += 1
+                row["errors"] += rec["status"] == "error"
+                row["latency_s"] += rec["latency_s"]
+                row["cost_usd"] += rec["cost_usd"]
+                for k in USAGE_KEYS:
+                    row[k] += rec[k]
+
+    def summary(self, session: str | None) -> dict:
+        """{"steps": {step: totals}, "labels": {label: totals}} for one session (empty if unseen)."""
+        with self._lock:
+            totals = self._sessions.get(session or "-", {"steps": {}, "labels": {}})
+            return {group: {k: dict(v) for k, v in rows.items()} for group, rows in totals.items()}
+
+
+telemetry = Telemetry()
+
+
+def set_trace_context(session: str | None = None, step=None) -> None:
+    """Attribute subsequent calls on this thread (and coroutines it submits) to a session / step."""
+    if session is not None:
+        _trace_session.set(session)
+    if step is not None:
+        _trace_step.set(str(step))
+
+
+# ── Spans: workflow run → step → rerun → calls / parse / QA / render ──
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+_script_thread: contextvars.ContextVar[int | None] = contextvars.ContextVar("script_thread", default=None)
+
+SCRIPT_LANE = 1     # Chrome trace tid for the session's script-thread spans (run / steps / reruns)
+
+
+def _lane() -> int:
+    """Trace lane (tid): one per asyncio task, the script lane for the session's script thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task) % 10_000_000 + 10
+    ident = threading.get_ident()
+    return SCRIPT_LANE if _script_thread.get() == ident else ident % 10_000_000 + 10
+
+
+class Span:
+    """One timed unit of work; times are epoch seconds so spans line up across reruns."""
+
+    __slots__ = ("name", "cat", "trace_id", "span_id", "parent_id", "start", "end", "args", "lane")
+
+    def __init__(self, name: str, cat: str = "app", parent: "Span | None" = None,
+                 args: dict | None = None, trace_id: str | None = None,
+                 span_id: str | None = None, start: float | None = None):
+        self.name, self.cat = name, cat
+        self.trace_id = trace_id or (parent.trace_id if parent else uuid.uuid4().hex)
+        self.span_id = span_id or uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time() if start is None else start
+        self.end: float | None = None
+        self.args = dict(args or {})
+        self.lane = _lane()
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "cat": self.cat, "trace_id": self.trace_id,
+                "span_id": self.span_id, "parent_id": self.parent_id, "start": self.start}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Span":
+        s = cls(d["name"], d["cat"], trace_id=d["trace_id"], span_id=d["span_id"], start=d["start"])
+        s.parent_id = d["parent_id"]
+        s.lane = SCRIPT_LANE
+        return s
+
+
+class ChromeTraceExporter:
+    """
+    Appends spans as Chrome Trace Event Format events to a JSON array file
+    (the format allows the closing "]" to be omitted, so the file is always
+    loadable) — open it in Perfetto (ui.perfetto.dev) or chrome://tracing.
+    One process (pid) per workflow run; one thread (tid) per lane.
+    """
+
+    def __init__(self, path: str | None = SPANS_TRACE_PATH, max_bytes: int = SPANS_TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pid(span: Span) -> int:
+        return int(span.trace_id[:7], 16)
+
+    def _event(self, span: Span, ph: str, **extra) -> dict:
+        return {
+            "name": span.name, "cat": span.cat, "ph": ph, "pid": self._pid(span), "tid": span.lane,
+            "ts": round(span.start * 1e6), **extra,
+            "args": {"trace_id": span.trace_id, "span_id": span.span_id,
+                     "parent_id": span.parent_id, **span.args},
+        }
+
+    def complete(self, span: Span) -> None:
+        self._write(self._event(span, "X", dur=round(((span.end or time.time()) - span.start) * 1e6)))
+
+    def begin(self, span: Span, process_name: str | None = None) -> None:
+        """Open a long-lived span (run / step) — closed later by end(), possibly from another rerun."""
+        events = [self._event(span, "B")]
+        if process_name:
+            events.insert(0, {"name": "process_name", "ph": "M", "pid": self._pid(span),
+                              "args": {"name": process_name}})
+        self._write(*events)
+
+    def end(self, span: Span) -> None:
+        end = span.end or time.time()
+        self._write({"name": span.name, "cat": span.cat, "ph": "E", "pid": self._pid(span),
+                     "tid": span.lane, "ts": round(end * 1e6), "args": span.args})
+
+    def _write(self, *events: dict) -> None:
+        if not self.path:
+            return
+        lines = "".join(json.dumps(e, default=str) + ",\n" for e in events)
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                new = not os.path.exists(self.path)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(("[\n" if new else "") + lines)
+            except OSError as e:
+                _cache_log.warning("Span export disabled (%s): %s", self.path, e)
+                self.path = None
+
+
+span_exporter = ChromeTraceExporter()
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str = "app", **args):
+    """Child span of the current one (or a new trace); exported when the block exits."""
+    s = Span(name, cat, parent=_current_span.get(), args=args)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except Exception as e:      # not st.rerun() / st.stop() control flow
+        s.args["error"] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current_span.reset(token)
+        s.end = time.time()
+        span_exporter.complete(s)
+
+
+def traced(name: str | None = None, cat: str = "app"):
+    """Decorator: run the function inside span(name or function name)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*a, **kw):
+            with span(name or fn.__name__, cat):
+                return fn(*a, **kw)
+        return inner
+    return wrap
+
+
+def begin_trace_rerun(step) -> Span:
+    """
+    Resume this session's workflow-run span and its current step span (IDs
+    live in session "trace_run", so they survive reruns), opening a new step
+    span when the step changed. Returns the step span to parent the rerun.
+    """
+    _script_thread.set(threading.get_ident())
+    run = st.session_state.get("trace_run")
+    if run is None:
+        root = Span("workflow run", "workflow", trace_id=st.session_state.get("trace_session"))
+        root.lane = SCRIPT_LANE
+        span_exporter.begin(root, process_name=f"techaudit run {root.trace_id[:8]}")
+        run = st.session_state["trace_run"] = {"run": root.to_dict(), "step": None, "step_no": None}
+    if run["step"] is not None and run["step_no"] != step:
+        span_exporter.end(Span.from_dict(run["step"]))
+        run["step"] = None
+    if run["step"] is None:
+        step_span = Span(f"step {step}", "step", parent=Span.from_dict(run["run"]))
+        step_span.lane = SCRIPT_LANE
+        span_exporter.begin(step_span)
+        run["step"], run["step_no"] = step_span.to_dict(), step
+    step_span = Span.from_dict(run["step"])
+    _current_span.set(step_span)
+    return step_span
+
+
+def end_trace_run() -> None:
+    """Close the session's open step and workflow-run spans (e.g. on "New Article")."""
+    run = st.session_state.get("trace_run")
+    if not run:
+        return
+    if run["step"] is not None:
+        span_exporter.end(Span.from_dict(run["step"]))
+    span_exporter.end(Span.from_dict(run["run"]))
+    st.session_state["trace_run"] = None
+
+
+
+# ══════════════════════════════════════════════════════════════════
+# 5e · SPECULATIVE PREFETCH (per-session future cache, budgeted)
+# ══════════════════════════════════════════════════════════════════
+_prefetch_pool: concurrent.futures.ThreadPoolExecutor | None = None
+_prefetch_pool_lock = threading.Lock()
+
+
+def _get_prefetch_pool() -> concurrent.futures.ThreadPoolExecutor:
+    """Process-wide worker pool shared by every session's speculative jobs."""
+    global _prefetch_pool
+    with _prefetch_pool_lock:
+        if _prefetch_pool is None:
+            _prefetch_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        return _prefetch_pool
+
+
+class PrefetchCache:
+    """
+    One session's speculative results, keyed by (kind, subject). start()
+    submits a job unless it is already known or would exceed the call / token
+    budget; take() hands the result to the click that needs it, waiting if
+    the job is still in flight. A failed job is a miss — the caller just
+    makes the call itself.
+    """
+
+    def __init__(self, max_calls: int | None = None, max_tokens: int | None = None):
+        self.max_calls = PREFETCH_MAX_CALLS if max_calls is None else max_calls
+        self.max_tokens = PREFETCH_MAX_TOKENS if max_tokens is None else max_tokens
+        self._lock = threading.Lock()
+        self._futures: dict[tuple, concurrent.futures.Future] = {}
+        self.calls = self.tokens = 0
+        self.hits = self.misses = self.wasted = 0
+
+    def start(self, kind: str, subject: str, fn, *args) -> bool:
+        """Run fn(*args) in the background unless known or over budget."""
+        calls, tokens = PREFETCH_COSTS.get(kind, (1, 0))
+        key = (kind, subject)
+        with self._lock:
+            if key in self._futures:
+                return False
+            if self.calls + calls > self.max_calls or self.tokens + tokens > self.max_tokens:
+                return False
+            self.calls += calls
+            self.tokens += tokens
+            ctx = contextvars.copy_context()     # keep the session's telemetry / trace attribution
+            self._futures[key] = _get_prefetch_pool().submit(ctx.run, _speculate, kind, subject, fn, args)
+        return True
+
+    def take(self, kind: str, subject: str, timeout: float | None = None):
+        """The prefetched result (waiting for it if in flight), else None."""
+        with self._lock:
+            fut = self._futures.pop((kind, subject), None)
+        if fut is None or fut.cancelled():
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            result = fut.result(timeout=timeout)
+        except Exception as e:       # failed or timed out — caller falls back to a normal call
+            _llm_log.info("Prefetch %s:%r unusable: %s", kind, subject[:60], e)
+            result = None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def discard(self, kind: str | None = None) -> None:
+        """Drop speculative jobs of kind (all if None); queued ones are cancelled and refunded."""
+        with self._lock:
+            keys = [k for k in self._futures if kind is None or k[0] == kind]
+            for key in keys:
+                if self._futures.pop(key).cancel():
+                    calls, tokens = PREFETCH_COSTS.get(key[0], (1, 0))
+                    self.calls -= calls
+                    self.tokens -= tokens
+                else:
+                    self.wasted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "tokens": self.tokens, "pending": len(self._futures),
+                    "hits": self.hits, "misses": self.misses, "wasted": self.wasted}
+
+
+def _speculate(kind: str, subject: str, fn, args: tuple):
+    """Worker body: a scratch RunState keeps incidental state writes off the session."""
+    with bind_state(RunState.new()), span(f"prefetch:{kind}", "prefetch", subject=subject[:80]):
+        return fn(*args)
+
+
+def session_prefetch() -> PrefetchCache | None:
+    """This session's PrefetchCache, or None while speculative prefetch is off."""
+    state = _state()
+    if not state.get("speculative_prefetch"):
+        return None
+    if state.get("prefetch") is None:
+        state["prefetch"] = PrefetchCache()
+    return state["prefetch"]
+
+
+def prefetch_titles(client, topics: list[dict]) -> None:
+    """Step 2: speculatively fetch titles for every listed topic."""
+    cache = session_prefetch()
+    if cache is not None:
+        for topic in topics:
+            cache.start("titles", topic.get("title", ""), functools.partial(workflow.run, client=client),
+                        "titles", {"topic": topic})
+
+
+def prefetch_research(client, titles: list[dict]) -> None:
+    """Step 3: speculatively research the PREFETCH_RESEARCH_TOP top-ranked titles."""
+    cache = session_prefetch()
+    if cache is not None:
+        for t in titles[:PREFETCH_RESEARCH_TOP]:
+            cache.start("research", t["title"], functools.partial(workflow.run, client=client),
+                        "research", {"title": t["title"]})
+
+
+def take_prefetched(kind: str, subject: str):
+    """Consume a prefetched result for the click that needs it; None if there is none."""
+    cache = _state().get("prefetch")
+    return None if cache is None else cache.take(kind, subject)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 5f · JOB QUEUE (SQLite, durable, idempotent by input hash)
+# ══════════════════════════════════════════════════════════════════
+_job_log = _logging.getLogger("job_queue")
+
+
+class JobQueue:
+    """
+    Durable job table shared by every session — and every process — using
+    the file. A job's id is the hash of its kind and inputs, so submitting
+    the same work again returns the existing job: a finished result is
+    reused, a failed job is re-queued. Workers claim the oldest queued job
+    (or a running one whose worker went silent) in an IMMEDIATE transaction.
+    """
+
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.wakeup = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                   id         TEXT PRIMARY KEY,
+                   kind       TEXT NOT NULL,
+                   status     TEXT NOT NULL,
+                   inputs     TEXT NOT NULL,
+                   meta       TEXT NOT NULL,
+                   result     TEXT,
+                   error      TEXT NOT NULL DEFAULT '',
+                   progress   TEXT NOT NULL DEFAULT '',
+                   attempts   INTEGER NOT NULL DEFAULT 0,
+                   worker     TEXT,
+                   created_at REAL NOT NULL,
+                   updated_at REAL NOT NULL
+               )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+
+    @staticmethod
+    def job_id(kind: str, inputs: dict) -> str:
+        return hashlib.sha256(
+            (kind + "\x00" + json.dumps(inputs, sort_keys=True, default=str)).encode("utf-8")
+        ).hexdigest()[:32]
+
+    def submit(self, kind: str, inputs: dict, meta: dict | None = None) -> str:
+        """Queue a job (meta is stored but not hashed); the id of the new or existing job."""
+        job_id = self.job_id(kind, inputs)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    self._db.execute(
+                        "INSERT INTO jobs (id, kind, status, inputs, meta, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, kind, self.QUEUED, json.dumps(inputs, default=str),
+                         json.dumps(meta or {}, default=str), now, now),
+                    )
+                elif row[0] == self.FAILED:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, meta = ?, error = '', progress = '', "
+                        "created_at = ?, updated_at = ? WHERE id = ?",
+                        (self.QUEUED, json.dumps(meta or {}, default=str), now, now, job_id),
+                    )
+                self._db.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                    (self.DONE, self.FAILED, now - JOB_RETENTION_SECONDS),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self.wakeup.set()
+        return job_id
+
+    def claim(self, worker: str) -> dict | None:
+        """Mark the next runnable job as running for worker and return it."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = ? OR (status = ? AND updated_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (self.QUEUED, self.RUNNING, now - JOB_STALE_SECONDS),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                        "progress = 'Starting…', updated_at = ? WHERE id = ?",
+                        (self.RUNNING, worker, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return None if row is None else self.get(row[0])
+
+    def _set(self, job_id: str, where_running: bool = True, **cols) -> None:
+        cols["updated_at"] = time.time()
+        sql = f"UPDATE jobs SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?"
+        args = [*cols.values(), job_id]
+        if where_running:
+            sql += " AND status = ?"
+            args.append(self.RUNNING)
+        with self._lock:
+            self._db.execute(sql, args)
+
+    def update(self, job_id: str, progress: str) -> None:
+        """Progress message; doubles as the worker's heartbeat."""
+        self._set(job_id, progress=progress)
+
+    def finish(self, job_id: str, result: dict) -> None:
+        self._set(job_id, status=self.DONE, progress="Done",
+                  result=json.dumps(result, default=str))
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._set(job_id, status=self.FAILED, progress="", error=error)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            cur = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cur.fetchone()
+            names = [d[0] for d in cur.description]
+        if row is None:
+            return None
+        job = dict(zip(names, row))
+        for col in ("inputs", "meta", "result"):
+            job[col] = json.loads(job[col]) if job[col] else None
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in (self.QUEUED, self.RUNNING, self.DONE, self.FAILED)} | dict(rows)
+
+
+# kind → fn(inputs, meta, progress) -> result dict; progress(msg) reports status
+JOB_HANDLERS: dict[str, object] = {}
+
+_job_queue: JobQueue | None = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue | None:
+    """Process-wide JobQueue with its JOB_WORKERS worker threads, or None if the file cannot be opened."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None or _job_queue.path != JOBS_DB_PATH:
+            try:
+                _job_queue = JobQueue(JOBS_DB_PATH)
+            except (sqlite3.Error, OSError) as e:
+                _job_log.warning("Job queue disabled: %s", e)
+                return None
+            for i in range(JOB_WORKERS):
+                threading.Thread(target=_job_worker, args=(_job_queue, f"{os.getpid()}-{i}"),
+                                 name=f"job-worker-{i}", daemon=True).start()
+        return _job_queue
+
+
+def _job_worker(queue: JobQueue, name: str) -> None:
+    while True:
+        try:
+            job = queue.claim(name)
+        except sqlite3.Error as e:
+            _job_log.warning("Job claim failed: %s", e)
+            job = None
+        if job is None:
+            queue.wakeup.wait(JOB_POLL_SECONDS)
+            queue.wakeup.clear()
+            continue
+        run_job(queue, job)
+
+
+def run_job(queue: JobQueue, job: dict) -> None:
+    """Run one claimed job in a fresh context and record its outcome."""
+    handler = JOB_HANDLERS.get(job["kind"])
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']!r}")
+        progress = functools.partial(queue.update, job["id"])
+        result = contextvars.Context().run(handler, job["inputs"], job["meta"], progress)
+    except Exception as e:
+        _job_log.warning("Job %s (%s) failed: %s", job["id"], job["kind"], e)
+        queue.fail(job["id"], str(e))
+    else:
+        queue.finish(job["id"], result)
+
+
+# ── API keys for queued jobs: held in memory only, never written to the queue ──
+_job_keys: dict[str, str] = {}
+_job_keys_lock = threading.Lock()
+
+
+def _register_job_key(api_key: str | None) -> str | None:
+    if not api_key:
+        return None
+    key_id = _key_id(api_key)
+    with _job_keys_lock:
+        _job_keys[key_id] = api_key
+    return key_id
+
+
+def _job_api_key(provider: str, key_id: str | None) -> str | None:
+    """The key a job was submitted with (or the configured default if it is the same key)."""
+    if key_id is None:
+        return None
+    with _job_keys_lock:
+        key = _job_keys.get(key_id)
+    if key is None:
+        default = default_api_key(provider)
+        key = default if default and _key_id(default) == key_id else None
+    if key is None:
+        raise RuntimeError(f"The {provider} API key for this job is no longer available — resubmit it.")
+    return key
+
+
+# ══════════════════════════════════════════════════════════════════
+# 5g · WORKFLOW GRAPH (memoized DAG of the five steps)
+# ══════════════════════════════════════════════════════════════════
+def _value_fingerprint(value) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class WorkflowNode:
+    def __init__(self, name: str, fn, inputs: tuple[str, ...], runtime: tuple[str, ...] = (),
+                 version: int = 1, keep=None):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs        # upstream node names or run() params — part of the fingerprint
+        self.runtime = runtime      # run() kwargs passed through (clients, callbacks) — not fingerprinted
+        self.version = version      # bump when the node's prompt / logic changes
+        self.keep = keep            # keep(value, args) → False: return value but don't memoize it
+
+
+class WorkflowGraph:
+    """
+    The workflow as a dependency graph. A node's fingerprint hashes its
+    name / version with its inputs — params and upstream outputs, both by
+    value — and its output is memoized under it (LRU, WORKFLOW_MEMO_TTL).
+    A re-seeded or recomputed upstream output thus invalidates everything
+    downstream even when its own inputs did not change. run() therefore recomputes only the nodes whose
+    inputs changed; concurrent runs of the same fingerprint share one call.
+    Empty outputs (None, [], {}) are returned but not memoized, so a step
+    that failed softly runs again next time.
+    """
+
+    def __init__(self, max_entries: int = WORKFLOW_MEMO_ENTRIES):
+        self.nodes: dict[str, WorkflowNode] = {}
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memo: collections.OrderedDict[str, tuple[float, object]] = collections.OrderedDict()
+        self._inflight: dict[str, concurrent.futures.Future] = {}
+        self.hits = self.misses = 0
+
+    def node(self, name: str, inputs: tuple[str, ...], runtime: tuple[str, ...] = (), version: int = 1,
+             keep=None):
+        """Decorator registering fn as node name."""
+        if name in inputs:
+            raise ValueError(f"Node {name!r} cannot depend on itself")
+
+        def register(fn):
+            self.nodes[name] = WorkflowNode(name, fn, inputs, runtime, version, keep)
+            return fn
+        return register
+
+    def fingerprint(self, name: str, params: dict, values: dict | None = None) -> str:
+        """
+        values supplies upstream outputs (run() passes the ones it computed);
+        otherwise each is read from the memo. An upstream output that is not
+        known yet contributes its own fingerprint, marked so that it never
+        matches a key run() stores — name is then simply stale.
+        """
+        node = self.nodes[name]
+        h = hashlib.sha256(f"{name}\x00{node.version}".encode())
+        for dep in node.inputs:
+            if dep not in self.nodes:
+                part = _value_fingerprint(params[dep])
+            elif values is not None and dep in values:
+                part = _value_fingerprint(values[dep])
+            else:
+                dep_fp = self.fingerprint(dep, params)
+                with self._lock:
+                    found, value = self._lookup(dep_fp)
+                part = _value_fingerprint(value) if found else "?" + dep_fp
+            h.update(b"\x00" + dep.encode() + b"=" + part.encode())
+        return h.hexdigest()
+
+    def _lookup(self, fp: str):
+        """(True, value) on a live memo entry. Caller holds the lock."""
+        entry = self._memo.get(fp)
+        if entry is None or entry[0] <= time.time():
+            self._memo.pop(fp, None)
+            return False, None
+        self._memo.move_to_end(fp)
+        return True, entry[1]
+
+    def _store(self, fp: str, value) -> None:
+        self._memo[fp] = (time.time() + WORKFLOW_MEMO_TTL, value)
+        self._memo.move_to_end(fp)
+        while len(self._memo) > self.max_entries:
+            self._memo.popitem(last=False)
+
+    def seed(self, name: str, params: dict, value) -> None:
+        """Record a node output computed elsewhere (e.g. research restored from session state)."""
+        fp = self.fingerprint(name, params)
+        with self._lock:
+            self._store(fp, value)
+
+    def is_fresh(self, name: str, params: dict) -> bool:
+        """True if name's output for params is memoized (running it makes no calls)."""
+        fp = self.fingerprint(name, params)
+        with self._lock:
+            return self._lookup(fp)[0]
+
+    def stale(self, name: str, params: dict) -> list[str]:
+        """Nodes that run(name, params) would compute, upstream first."""
+        order: list[str] = []
+
+        def visit(n: str) -> None:
+            if n in order or self.is_fresh(n, params):
+                return
+            for dep in self.nodes[n].inputs:
+                if dep in self.nodes:
+                    visit(dep)
+            order.append(n)
+        visit(name)
+        return order
+
+    def run(self, name: str, params: dict, given: dict | None = None, **runtime):
+        """
+        name's output for params, computing stale upstream nodes first.
+        given supplies upstream outputs directly (e.g. a draft its node chose
+        not to memoize); nothing computed from them is memoized or looked up.
+        """
+        if given:
+            node = self.nodes[name]
+            args = {dep: given[dep] if dep in given
+                    else self.run(dep, params, given, **runtime) if dep in self.nodes
+                    else params[dep]
+                    for dep in node.inputs}
+            args.update({k: runtime[k] for k in node.runtime if k in runtime})
+            return node.fn(**args)
+        node = self.nodes[name]
+        # Upstream first: this node's fingerprint covers the values they produce
+        args = {dep: self.run(dep, params, **runtime) if dep in self.nodes else params[dep]
+                for dep in node.inputs}
+        fp = self.fingerprint(name, params, args)
+        with self._lock:
+            found, value = self._lookup(fp)
+            if found:
+                self.hits += 1
+                return value
+            fut = self._inflight.get(fp)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[fp] = concurrent.futures.Future()
+                self.misses += 1
+        if not owner:
+            return fut.result()
+
+        try:
+            args.update({k: runtime[k] for k in node.runtime if k in runtime})
+            value = node.fn(**args)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(fp, None)
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            if (value is not None and value != [] and value != {}
+                    and (node.keep is None or node.keep(value, args))):
+                self._store(fp, value)
+            self._inflight.pop(fp, None)
+        fut.set_result(value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memo.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._memo)}
+
+
+workflow = WorkflowGraph()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 6 · IMAGE GENERATION  (Pollinations.ai — no key required)
+# ══════════════════════════════════════════════════════════════════
+def pollinations_url(prompt: str, w: int = 1200, h: int = 630, seed: int = 42) -> str:
+    """Return a Pollinations.ai Flux image URL (no API key needed)."""
+    enc = quote(prompt[:400])
+    return (
+        f"https://image.pollinations.ai/prompt/{enc}"
+        f"?width={w}&height={h}&model=flux&nologo=true&enhance=true&seed={seed}"
+    )
+
+
+def _seed(text: str) -> int:
+    return int(hashlib.md5(text.encode()).hexdigest(), 16) % 100_000
+
+# ══════════════════════════════════════════════════════════════════
+# 7 · WORKFLOW HELPERS
+# ══════════════════════════════════════════════════════════════════
+
+# ── Step 2: trending topics ────────────────────────────────────
+TOPICS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "title":        {"type": "string"},
+            "description":  {"type": "string"},
+            "trend_signal": {"type": "string"},
+        },
+        "required": ["title", "description"],
+    },
+    "minItems": 1,
+}
+
+
+@traced(cat="workflow")
+def fetch_topics(client, category: str) -> list[dict]:
+    prompt = f"""
+You are a senior technical analyst. Using Google Search, identify EXACTLY 5 highly-specific,
+trending technical topics within "{category}" based on 2025-2026 data (conferences, papers,
+benchmark announcements, product launches).
+
+Return ONLY a JSON array of 5 objects:
+[
+  {{"title": "<concise topic name>", "description": "<2-sentence technical rationale, cite data point or event>", "trend_signal": "<what makes it trending in 2025-2026>"}},
+  ...
+]
+Strict: no markdown wrappers, pure JSON only.
+"""
+    topics, _ = _call_json(client, prompt, TOPICS_SCHEMA, call_type="fetch_topics", search=True)
+    return topics
+
+
+# ── Step 3: SEO/AEO title optimization ────────────────────────
+TITLES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "title":           {"type": "string"},
+            "angle":           {"type": "string"},
+            "primary_keyword": {"type": "string"},
+            "seo_rationale":   {"type": "string"},
+        },
+        "required": ["title"],
+    },
+    "minItems": 1,
+}
+
+
+@traced(cat="workflow")
+def fetch_titles(client, topic: dict) -> list[dict]:
+    prompt = f"""
+You are an SEO strategist specializing in AEO (Answer Engine Optimization) for technical content.
+Given the topic below, generate EXACTLY 5 article titles — each with a distinct technical angle.
+
+Topic: {topic['title']}
+Description: {topic['description']}
+
+Requirements per title:
+- Optimized for Google's AI Overviews and featured snippets
+- Contains a primary keyword (measurable/quantitative angle preferred)
+- 55–70 characters
+- Distinct angle: e.g. benchmark-focused, cost-analysis, architectural deep-dive, failure-case, comparative
+
+Return JSON array only:
+[
+  {{
+    "title": "<full article title>",
+    "angle": "<one of: benchmark | cost-analysis | architecture | failure-case | comparative>",
+    "primary_keyword": "<exact keyword string>",
+    "seo_rationale": "<1-sentence reason this title wins in SERPs/AEO>"
+  }},
+  ...5 items...
+]
+"""
+    titles, _ = _call_json(client, prompt, TITLES_SCHEMA, call_type="fetch_titles")
+    return titles
+
+
+# ── Step 4: deep research — 8 high-authority sources ──────────
+SOURCES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id":             {"type": "integer"},
+            "title":          {"type": "string"},
+            "url":            {"type": "string"},
+            "publisher":      {"type": "string"},
+            "date":           {"type": "string"},
+            "tier":           {"type": "string"},
+            "snippet":        {"type": "string"},
+            "key_data_point": {"type": "string"},
+        },
+        "required": ["id", "title", "url", "publisher", "date", "tier", "snippet"],
+    },
+    "minItems": 1,
+}
+
+
+@traced(cat="workflow")
+def deep_research(client, title: str) -> tuple[list[dict], str]:
+    """
+    Returns (sources_list, notebooklm_context_text).
+    Uses Google Search grounding to find real, verifiable sources.
+    """
+    prompt = f"""
+You are a technical research auditor. Using Google Search, find EXACTLY 8 high-authority sources
+for the following article title. Sources MUST be published between 2023 and 2026.
+
+Article Title: "{title}"
+
+Authority tiers (you MUST cover all):
+- Tier 1 (2 sources): Peer-reviewed papers (arXiv, IEEE, ACM, Nature)
+- Tier 2 (2 sources): Official vendor whitepapers or technical documentation
+- Tier 3 (2 sources): Tier-1 tech journalism (The Register, Ars Technica, AnandTech, Tom's Hardware, IEEE Spectrum)
+- Tier 4 (2 sources): Independent benchmarks or audit reports (MLCommons, SPEC, Phoronix, TPC)
+
+For each source return:
+{{
+  "id": 1,
+  "title": "<exact article/paper title>",
+  "url": "<full URL>",
+  "publisher": "<publisher/venue>",
+  "date": "<YYYY-MM or YYYY>",
+  "tier": "<Tier 1|2|3|4>",
+  "snippet": "<2-sentence key finding or claim from this source>",
+  "key_data_point": "<specific number, metric, or fact from this source>"
+}}
+
+Return ONLY a JSON array of 8 objects.
+"""
+    sources, resp = _call_json(client, prompt, SOURCES_SCHEMA, call_type="deep_research", search=True)
+
+    # Extract any real grounding citations from the API response
+    real_urls: list[str] = []
+    try:
+        for chunk in resp.candidates[0].grounding_metadata.grounding_chunks:
+            if chunk.web and chunk.web.uri:
+                real_urls.append(chunk.web.uri)
+    except Exception:
+        pass
+
+    # Annotate sources with "verified" flag if URL appears in grounding
+    for src in sources:
+        src["grounded"] = any(
+            src.get("url", "").split("/")[2] in u for u in real_urls
+        )
+
+    # Simulate NotebookLM context synthesis
+    context = _build_notebooklm_context(client, title, sources)
+    return sources, context
+
+
+@traced("notebooklm_context", cat="workflow")
+def _build_notebooklm_context(client, title: str, sources: list[dict]) -> str:
+    """Synthesize a NotebookLM-style cross-reference knowledge base."""
+    sources_text = "\n".join(
+        f"[{s['id']}] ({s['tier']}) {s['title']} ({s['date']}) — {s['snippet']} KEY DATA: {s.get('key_data_point','N/A')}"
+        for s in sources
+    )
+    prompt = f"""
+You are simulating Google NotebookLM's deep contextual understanding layer.
+Given 8 research sources for the article "{title}", produce a structured knowledge synthesis:
+
+SOURCES:
+{sources_text}
+
+Produce a concise knowledge synthesis (400–500 words) that:
+1. Identifies 3 consensus findings across ≥3 sources
+2. Flags 2 conflicting claims between sources (with source IDs)
+3. Lists 3 critical knowledge gaps NOT covered by these sources
+4. Extracts the 5 most important quantitative data points with source IDs
+5. Rates overall evidence strength: STRONG / MODERATE / WEAK with justification
+
+Format as plain prose with labeled sections. This will be injected as context for article generation.
+"""
+    resp = _call(client, prompt, _plain_cfg(), call_type="notebooklm")
+    return _extract_text(resp)
+
+
+# ── Step 5: Article generation ─────────────────────────────────
+ARTICLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "article_title":       {"type": "string"},
+        "executive_summary":   {"type": "string"},
+        "sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "heading":        {"type": "string"},
+                    "content":        {"type": "string"},
+                    "chart_suggestion": {"type": "string"},
+                    "image_prompt":   {"type": "string"},
+                },
+                "required": ["heading", "content"],
+            },
+            "minItems": 1,
+        },
+        "comparison": {
+            "type": "object",
+            "properties": {
+                "heading":      {"type": "string"},
+                "alternatives": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name":     {"type": "string"},
+                            "pros":     {"type": "string"},
+                            "cons":     {"type": "string"},
+                            "tco_note": {"type": "string"},
+                            "best_for": {"type": "string"},
+                        },
+                    },
+                },
+                "content": {"type": "string"},
+            },
+        },
+        "anti_recommendation": {
+            "type": "object",
+            "properties": {
+                "heading": {"type": "string"},
+                "content": {"type": "string"},
+            },
+        },
+        "tco_analysis": {
+            "type": "object",
+            "properties": {
+                "heading": {"type": "string"},
+                "content": {"type": "string"},
+            },
+        },
+        "conclusion":   {"type": "string"},
+        "references":   {"type": "array", "items": {"type": "string"}},
+        "metadata": {
+            "type": "object",
+            "properties": {
+                "seo_slug":        {"type": "string"},
+                "meta_description": {"type": "string"},
+                "title_tag":       {"type": "string"},
+                "word_count":      {"type": "integer"},
+            },
+        },
+        "quality_audit": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "check":  {"type": "string"},
+                    "passed": {"type": "boolean"},
+                    "note":   {"type": "string"},
+                },
+            },
+        },
+    },
+    "required": ["article_title", "executive_summary", "sections"],
+}
+
+
+# Static Gemini article instructions — the system_instruction of the
+# context cache (see ensure_article_context_cache) or the prompt prefix.
+_GEMINI_ARTICLE_RULES = """You are the world's most rigorous technical content auditor writing for a senior engineering audience.
+Produce a complete article JSON adhering to every rule below.
+
+━━━━━━━━━━━━ STRICT CONTENT RULES ━━━━━━━━━━━━
+WORD COUNT      : 1,000–1,500 words total (executive summary + all sections + comparison + anti-rec + tco + conclusion).
+EXECUTIVE SUMMARY: Exactly 100 words. No bullets. Opening paragraph that captures the full argument.
+PARAGRAPHS      : No bullet points anywhere. Use 2–3 sentence paragraphs for scannability.
+EVIDENCE        : Every quantitative claim MUST include: value, source [N], methodology/test-condition, and independent-vs-vendor label.
+                  Include at least 3 perspectives per major claim.
+CRITICAL ANALYSIS: Address vendor lock-in, hidden infrastructure/training costs, and performance limitations.
+                  Include conservative AND optimistic estimates side-by-side.
+ANTI-RECOMMENDATION: Explain precisely when engineers should AVOID this technology (failure scenarios, scale limits, alternative-is-better situations).
+TCO ANALYSIS    : Cover licensing, infrastructure, training/onboarding, maintenance, and exit costs over a 3-year horizon.
+COMPARISON      : Compare 2–3 direct alternatives on: latency, throughput, cost/unit, vendor-lock-in risk, maturity.
+ACRONYMS        : Define every acronym on first use. Example: "FP8 (8-bit floating-point)".
+PHYSICAL LIMITS : Address thermal envelope, power budget, or scaling bottleneck relevant to the topic.
+
+━━━━━━━━━━━━ OUTPUT SCHEMA ━━━━━━━━━━━━
+Return a single JSON object (no markdown fences) with these keys:
+
+article_title        : string  — final optimized title
+executive_summary    : string  — exactly 100 words, paragraph form
+sections             : array of objects, each with:
+  heading            : H2 text
+  content            : 3–4 paragraphs of body text (no bullets)
+  chart_suggestion   : specific chart type + axes + what it should visualize
+  image_prompt       : detailed Flux/Stable-Diffusion prompt for a professional technical illustration
+comparison           : object with heading, alternatives (array), content
+anti_recommendation  : object with heading, content
+tco_analysis         : object with heading, content
+conclusion           : string — 1 strong closing paragraph
+references           : array of formatted citation strings [1]–[8]
+metadata             : object with seo_slug, meta_description (≤155 chars), title_tag, word_count
+quality_audit        : array of 4 objects (check, passed, note) verifying:
+  1. All numbers cited with methodology + independent validation
+  2. All acronyms defined at first use
+  3. Physical constraints (thermal/power/scaling) addressed
+  4. No repetition — themes consolidated
+
+Output ONLY the JSON. No preamble, no explanation."""
+
+
+def _gemini_article_context(title: str, sources: list[dict], context: str,
+                            competitive_context: str = "") -> str:
+    """Session-stable research block for the Gemini writer (title, NotebookLM context, sources)."""
+    sources_block = "\n".join(
+        f"[{s['id']}] {s['title']} ({s['publisher']}, {s['date']}) | {s['snippet']} | KEY DATA: {s.get('key_data_point','')}"
+        for s in sources
+    )
+    block = f"""━━━━━━━━━━━━ ARTICLE TITLE ━━━━━━━━━━━━
+{title}
+
+━━━━━━━━━━━━ NOTEBOOKLM CONTEXT (cross-reference this) ━━━━━━━━━━━━
+{context}
+
+━━━━━━━━━━━━ VERIFIED SOURCES (cite as [1]–[8]) ━━━━━━━━━━━━
+{sources_block}"""
+    if competitive_context:
+        block += f"\n\n{competitive_context}"
+    return block
+
+
+# ── Gemini explicit context cache (Step 4/5 research context) ──
+def _context_cache_key(model: str, research_block: str) -> str:
+    return hashlib.sha256(
+        "\x1f".join((model, _GEMINI_ARTICLE_RULES, research_block)).encode("utf-8")
+    ).hexdigest()
+
+
+def ensure_article_context_cache(client, title: str, sources: list[dict], context: str,
+                                 competitive_context: str = "") -> str | None:
+    """
+    Upload the article rules + research block once as a Gemini cached
+    content object and return its name (None if caching is unavailable,
+    e.g. below the model's minimum cacheable size). Reused while the
+    research is unchanged; TTL is GEMINI_CONTEXT_CACHE_TTL, extended on use,
+    and drop_article_context_cache() deletes it on "🔄 New Article".
+    """
+    model = model_health.preferred(MODEL_REASONING, MODEL_FALLBACK)
+    research = _gemini_article_context(title, sources, context, competitive_context)
+    key = _context_cache_key(model, research)
+    entry = _state().get("gemini_context_cache")
+    now = time.time()
+
+    if entry and entry["key"] == key:
+        if entry["name"] is None:                       # creation already failed for this research
+            return None
+        if entry["expires_at"] - now < GEMINI_CONTEXT_CACHE_TTL / 2:
+            try:
+                client.caches.update(name=entry["name"], config=types.UpdateCachedContentConfig(
+                    ttl=f"{GEMINI_CONTEXT_CACHE_TTL}s"))
+                entry["expires_at"] = now + GEMINI_CONTEXT_CACHE_TTL
+            except Exception:
+                if entry["expires_at"] <= now:
+                    entry = None
+        if entry:
+            return entry["name"]
+    drop_article_context_cache(client)
+
+    try:
+        with telemetry.track("context_cache", "gemini", model):
+            cache = client.caches.create(model=model, config=types.CreateCachedContentConfig(
+                display_name=f"techaudit:{title[:60]}",
+                system_instruction=_GEMINI_ARTICLE_RULES,
+                contents=[research],
+                ttl=f"{GEMINI_CONTEXT_CACHE_TTL}s",
+            ))
+        name = cache.name
+    except Exception:
+        name = None     # fall back to sending the research inline
+    _state()["gemini_context_cache"] = {
+        "key": key, "name": name, "model": model, "expires_at": now + GEMINI_CONTEXT_CACHE_TTL,
+    }
+    return name
+
+
+def drop_article_context_cache(client) -> None:
+    """Delete this session's Gemini context cache, if any (best effort)."""
+    entry = _state().get("gemini_context_cache")
+    if entry and entry.get("name") and client is not None:
+        try:
+            client.caches.delete(name=entry["name"])
+        except Exception:
+            pass
+    _state()["gemini_context_cache"] = None
+
+
+def _is_context_cache_miss(exc: Exception) -> bool:
+    """True if a request on cached_content failed because the cache is missing or expired."""
+    status = getattr(exc, "status_code", None)
+    if not isinstance(status, int):
+        status = getattr(exc, "code", None)
+    return status in (400, 403, 404) and "cache" in str(exc).lower()
+
+
+@traced(cat="workflow")
+def generate_article(client, title: str, sources: list[dict], context: str, competitive_context: str = "",
+                     on_part=None, cached_content: str | None = None) -> dict:
+    """
+    Write the article with Gemini. With on_part(path, value), the response is
+    streamed and each completed JSON value is reported as it closes.
+    cached_content (from ensure_article_context_cache) replaces the rules and
+    research block in the request; if that cache is missing or expired, the
+    full prompt is sent instead. Any other failure propagates.
+    """
+    if cached_content:
+        try:
+            return _write_gemini_article(
+                client, "Write the article now.",
+                _json_cfg(ARTICLE_SCHEMA, cached_content=cached_content), on_part,
+            )
+        except Exception as e:
+            if not _is_context_cache_miss(e):
+                raise
+            _llm_log.warning("Context cache %s unusable, sending the full prompt: %s", cached_content, e)
+    research = _gemini_article_context(title, sources, context, competitive_context)
+    prompt = f"{_GEMINI_ARTICLE_RULES}\n\n{research}"
+    return _write_gemini_article(client, prompt, _json_cfg(ARTICLE_SCHEMA), on_part)
+
+
+def _write_gemini_article(client, prompt: str, cfg, on_part=None) -> dict:
+    if on_part is None:
+        resp = _call(client, prompt, cfg, call_type="article")
+        return _parse_validated(_extract_text(resp), ARTICLE_SCHEMA)
+    parser = None
+
+    def restart() -> None:
+        nonlocal parser
+        parser = TolerantJSONParser(on_complete=on_part)
+        on_part(STREAM_RESTART, None)
+
+    text = _call_stream(client, prompt, cfg, lambda t: parser.feed(t), call_type="article",
+                        on_attempt=restart)
+    return _parse_validated(text, ARTICLE_SCHEMA)
+
+
+# ── Claude article generation ───────────────────────────────────
+def _claude_tool_kwargs(schema: dict, name: str, description: str) -> dict:
+    """messages.create kwargs that force one tool call whose input follows schema."""
+    return {
+        "tools": [{"name": name, "description": description, "input_schema": schema}],
+        "tool_choice": {"type": "tool", "name": name},
+    }
+
+
+def _claude_tool_result(msg, schema: dict) -> dict:
+    """Validated tool input from a forced tool_use reply (text blocks are parsed as a fallback)."""
+    for block in msg.content:
+        if getattr(block, "type", None) == "tool_use":
+            return validate_response(block.input, schema)
+    return validate_response(_parse_json(msg.content[0].text), schema)
+
+
+def _claude_stream(anthropic_client, on_text, **kwargs):
+    """messages.stream with tool-input / text deltas fed to on_text; returns the final message."""
+    with anthropic_client.messages.stream(**kwargs) as stream:
+        for event in stream:
+            if event.type != "content_block_delta":
+                continue
+            if event.delta.type == "input_json_delta":
+                on_text(event.delta.partial_json)
+            elif event.delta.type == "text_delta":
+                on_text(event.delta.text)
+        return stream.get_final_message()
+
+
+# Static system prompt: identical across titles, sessions and QA re-runs, so
+# it (together with the tool schema) forms the first prompt-cache prefix.
+_CLAUDE_ARTICLE_SYSTEM = """You are the world's most rigorous technical content auditor writing for senior engineers.
+Produce a complete article as a single JSON object following every rule below.
+
+━━━━━━━━━━━━ STRICT CONTENT RULES ━━━━━━━━━━━━
+WORD COUNT       : 1,000–1,500 words total.
+EXECUTIVE SUMMARY: Exactly 100 words. Paragraph form. No bullets.
+PARAGRAPHS       : NO bullet points anywhere. 2–3 sentence paragraphs only.
+EVIDENCE         : Every quantitative claim must include value + [sourceN] + methodology/test condition + (VENDOR CLAIM) or (INDEPENDENT).
+                   Include ≥3 perspectives per major claim.
+CRITICAL ANALYSIS: Address vendor lock-in, hidden infra/training costs, scaling limits.
+                   Pair conservative estimates with optimistic ones.
+ANTI-REC         : Explain exactly when NOT to use this technology (failure thresholds, scale limits, better alternatives exist).
+TCO              : Cover licensing, infra, training/onboarding, maintenance, exit costs over 3 years.
+COMPARISON       : 2–3 direct alternatives on latency, throughput, $/unit, lock-in risk, maturity.
+ACRONYMS         : Define every acronym on first use, e.g. "FP8 (8-bit floating-point)".
+PHYSICAL LIMITS  : Explicitly address thermal envelope, power budget, or scaling bottleneck.
+
+━━━━━━━━━━━━ OUTPUT SCHEMA ━━━━━━━━━━━━
+Return ONE JSON object — no markdown fences, no preamble:
+
+{
+  "article_title": "final optimized title string",
+  "executive_summary": "exactly 100 words paragraph",
+  "sections": [
+    {
+      "heading": "H2 text",
+      "content": "3-4 paragraphs no bullets",
+      "chart_suggestion": "chart type + axes + what to visualize",
+      "image_prompt": "detailed Flux prompt for technical illustration"
+    }
+  ],
+  "comparison": {
+    "heading": "string",
+    "alternatives": [
+      {"name":"string","pros":"string","cons":"string","tco_note":"string","best_for":"string"}
+    ],
+    "content": "analysis paragraph"
+  },
+  "anti_recommendation": {"heading":"string","content":"paragraph"},
+  "tco_analysis":        {"heading":"string","content":"paragraph"},
+  "conclusion": "strong closing paragraph",
+  "references": ["[1] formatted citation", "..."],
+  "metadata": {
+    "seo_slug": "kebab-case",
+    "meta_description": "≤155 chars",
+    "title_tag": "SEO title",
+    "word_count": 1200
+  },
+  "quality_audit": [
+    {"check":"All numbers cited with methodology","passed":true,"note":"..."},
+    {"check":"All acronyms defined at first use","passed":true,"note":"..."},
+    {"check":"Physical constraints addressed","passed":true,"note":"..."},
+    {"check":"No repetition — themes consolidated","passed":true,"note":"..."}
+  ]
+}
+
+Output ONLY the JSON. Nothing else."""
+
+
+def _claude_article_request(
+    title: str,
+    accepted_sources: list[dict],
+    all_sources: list[dict],
+    context: str,
+    qa_feedback: str = "",
+    competitive_context: str = "",
+) -> dict:
+    """
+    messages.create kwargs (minus model) for the Claude article, shared by
+    the sync and async writers. Laid out for Anthropic prompt caching:
+      1. system rules + output schema (static)          ← cache breakpoint
+      2. title, NotebookLM context, sources, competitors ← cache breakpoint
+         (stable for the session)
+      3. per-attempt qa_feedback (never cached)
+    so QA re-runs only pay full price for the last block.
+    """
+    # Separate accepted vs. declined for the prompt
+    accepted_ids = {s.get("id") for s in accepted_sources}
+    declined = [s for s in all_sources if s.get("id") not in accepted_ids]
+
+    primary_block = "\n".join(
+        f"[{s['id']}] {s['title']} ({s['publisher']}, {s['date']})\n"
+        f"    Snippet: {s['snippet']}\n"
+        f"    Key data: {s.get('key_data_point','')}"
+        for s in accepted_sources
+    )
+    supp_block = (
+        "\n".join(
+            f"[{s['id']}] {s['title']} — context only, do NOT cite"
+            for s in declined
+        )
         if declined else "None"
     )
-    qa_note = (
-        f"\n\nPREVIOUS DRAFT FAILED THESE QA CHECKS — fix them in this version:\n{qa_feedback}"
-        if qa_feedback else ""
+
+    session_block = f"""━━━━━━━━━━━━ ARTICLE TITLE ━━━━━━━━━━━━
+{title}
+
+━━━━━━━━━━━━ NOTEBOOKLM CONTEXT ━━━━━━━━━━━━
+{context}
+
+━━━━━━━━━━━━ PRIMARY SOURCES — CITE THESE (accepted by editor) ━━━━━━━━━━━━
+{primary_block}
+
+━━━━━━━━━━━━ SUPPLEMENTARY CONTEXT — DO NOT CITE ━━━━━━━━━━━━
+{supp_block}"""
+    if competitive_context:
+        session_block += f"\n\n{competitive_context}"
+
+    attempt_block = (
+        f"PREVIOUS DRAFT FAILED THESE QA CHECKS — fix them in this version:\n{qa_feedback}\n\n"
+        if qa_feedback else ""
+    ) + "Write the article now."
+
+    return dict(
+        max_tokens=8000,
+        system=[{"type": "text", "text": _CLAUDE_ARTICLE_SYSTEM,
+                 "cache_control": {"type": "ephemeral"}}],
+        messages=[{"role": "user", "content": [
+            {"type": "text", "text": session_block, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": attempt_block},
+        ]}],
+        **_ARTICLE_TOOL,
+    )
+
+
+def _claude_usage(msg) -> dict:
+    """Token counts from a Claude reply, incl. prompt-cache reads / writes."""
+    usage = getattr(msg, "usage", None)
+    counts = {}
+    for key, attr in (("input", "input_tokens"), ("output", "output_tokens"),
+                      ("cache_read", "cache_read_input_tokens"),
+                      ("cache_write", "cache_creation_input_tokens")):
+        value = getattr(usage, attr, 0)
+        counts[key] = value if isinstance(value, int) else 0
+    return counts
+
+
+def _record_claude_usage(msg) -> None:
+    """Add a reply's token counts to the session totals shown in the sidebar."""
+    usage = _claude_usage(msg)
+    totals = dict(getattr(_state(), "claude_usage", None) or {})
+    for key, value in usage.items():
+        totals[key] = totals.get(key, 0) + value
+    totals["calls"] = totals.get("calls", 0) + 1
+    totals["last"] = usage
+    _state().claude_usage = totals
+
+
+@traced(cat="workflow")
+def generate_article_claude(
+    anthropic_client,
+    title: str,
+    accepted_sources: list[dict],
+    all_sources: list[dict],
+    context: str,
+    qa_feedback: str = "",
+    competitive_context: str = "",
+    on_part=None,
+) -> dict:
+    """
+    Generate the full article using Claude. Falls back to error dict on failure.
+    With on_part(path, value), the reply is streamed and each completed JSON
+    value is reported as it closes (e.g. ("sections", 2) → that section).
+    """
+    base_request = _claude_article_request(
+        title, accepted_sources, all_sources, context,
+        qa_feedback=qa_feedback, competitive_context=competitive_context,
+    )
+
+    def send(client, request: dict):
+        if on_part is None:
+            return client.messages.create(**request)
+        on_part(STREAM_RESTART, None)
+        parser = TolerantJSONParser(on_complete=on_part)
+        return _claude_stream(client, parser.feed, **request)
+
+    tokens = _estimate_tokens(base_request["system"], base_request["messages"])
+
+    def attempt(model: str) -> dict:
+        request = dict(base_request, model=model)
+        with telemetry.track("article", "anthropic", model) as t:
+            msg = pooled("anthropic", anthropic_client, model, tokens, lambda c: send(c, request))
+            t.usage = _claude_call_usage(msg)
+        _record_claude_usage(msg)
+        return _claude_tool_result(msg, ARTICLE_SCHEMA)
+
+    result, _state().claude_model_used = call_routed(
+        "anthropic", attempt, CLAUDE_MODEL, CLAUDE_FALLBACK
     )
+    return result
 
-    prompt = f"""You are the world's most rigorous technical content auditor writing for senior engineers.
-Produce a complete article as a single JSON object following every rule below.{qa_note}
 
-━━━━━━━━━━━━ ARTICLE TITLE ━━━━━━━━━━━━
-{title}
+async def agenerate_article_claude(
+    async_anthropic_client,
+    title: str,
+    accepted_sources: list[dict],
+    all_sources: list[dict],
+    context: str,
+    qa_feedback: str = "",
+    competitive_context: str = "",
+) -> tuple[dict, str]:
+    """Async counterpart of generate_article_claude. Returns (article, model_used)."""
+    request = _claude_article_request(
+        title, accepted_sources, all_sources, context,
+        qa_feedback=qa_feedback, competitive_context=competitive_context,
+    )
 
-━━━━━━━━━━━━ NOTEBOOKLM CONTEXT ━━━━━━━━━━━━
-{context}
+    tokens = _estimate_tokens(request["system"], request["messages"])
 
-━━━━━━━━━━━━ PRIMARY SOURCES — CITE THESE (accepted by editor) ━━━━━━━━━━━━
-{primary_block}
+    async def attempt(model: str) -> dict:
+        with telemetry.track("article", "anthropic", model) as t:
+            msg = await apooled(
+                "anthropic", async_anthropic_client, model, tokens,
+                lambda c: c.messages.create(model=model, **request),
+            )
+            t.usage = _claude_call_usage(msg)
+        return _claude_tool_result(msg, ARTICLE_SCHEMA)
+
+    return await get_llm_dispatcher().call("anthropic", attempt, CLAUDE_MODEL, CLAUDE_FALLBACK)
+
+
+# ── Targeted QA re-runs: rewrite only the fields a failed check concerns ──
+# Targets are top-level article fields ("tco_analysis", "executive_summary", …)
+# or "sections.N" for one body section; see qa_fix_targets().
+def _revision_schema(targets: list[str]) -> dict:
+    """ARTICLE_SCHEMA cut down to the targeted fields; rewritten sections carry their index."""
+    props = {t: ARTICLE_SCHEMA["properties"][t] for t in targets if not t.startswith("sections.")}
+    if any(t.startswith("sections.") for t in targets):
+        item = ARTICLE_SCHEMA["properties"]["sections"]["items"]
+        props["sections"] = {"type": "array", "items": {
+            **item,
+            "properties": {"index": {"type": "integer"}, **item["properties"]},
+            "required": ["index", *item["required"]],
+        }}
+    return {"type": "object", "properties": props, "required": list(props)}
+
+
+# Article and revision requests send the same two tools so the cached
+# tools → system prefix is shared; tool_choice picks which one is forced.
+# submit_revision accepts any targetable field — the reply is validated
+# against _revision_schema(targets) instead.
+_ARTICLE_TOOL = {
+    "tools": [
+        *_claude_tool_kwargs(
+            ARTICLE_SCHEMA, "submit_article", "Submit the finished article as structured JSON."
+        )["tools"],
+        *_claude_tool_kwargs(
+            {**_revision_schema(["executive_summary", "comparison", "anti_recommendation",
+                                 "tco_analysis", "conclusion", "sections.0"]), "required": []},
+            "submit_revision", "Submit the rewritten article fields as structured JSON.",
+        )["tools"],
+    ],
+    "tool_choice": {"type": "tool", "name": "submit_article"},
+}
 
-━━━━━━━━━━━━ SUPPLEMENTARY CONTEXT — DO NOT CITE ━━━━━━━━━━━━
-{supp_block}
 
-━━━━━━━━━━━━ STRICT CONTENT RULES ━━━━━━━━━━━━
-WORD COUNT       : 1,000–1,500 words total.
-EXECUTIVE SUMMARY: Exactly 100 words. Paragraph form. No bullets.
-PARAGRAPHS       : NO bullet points anywhere. 2–3 sentence paragraphs only.
-EVIDENCE         : Every quantitative claim must include value + [sourceN] + methodology/test condition + (VENDOR CLAIM) or (INDEPENDENT).
-                   Include ≥3 perspectives per major claim.
-CRITICAL ANALYSIS: Address vendor lock-in, hidden infra/training costs, scaling limits.
-                   Pair conservative estimates with optimistic ones.
-ANTI-REC         : Explain exactly when NOT to use this technology (failure thresholds, scale limits, better alternatives exist).
-TCO              : Cover licensing, infra, training/onboarding, maintenance, exit costs over 3 years.
-COMPARISON       : 2–3 direct alternatives on latency, throughput, $/unit, lock-in risk, maturity.
-ACRONYMS         : Define every acronym on first use, e.g. "FP8 (8-bit floating-point)".
-PHYSICAL LIMITS  : Explicitly address thermal envelope, power budget, or scaling bottleneck.
+def _describe_targets(targets: list[str]) -> str:
+    names = []
+    for t in targets:
+        if t.startswith("sections."):
+            names.append(f"section {int(t.split('.', 1)[1]) + 1}")
+        else:
+            names.append(t.replace("_", " "))
+    return ", ".join(names)
 
-━━━━━━━━━━━━ OUTPUT SCHEMA ━━━━━━━━━━━━
-Return ONE JSON object — no markdown fences, no preamble:
 
-{{
-  "article_title": "final optimized title string",
-  "executive_summary": "exactly 100 words paragraph",
-  "sections": [
-    {{
-      "heading": "H2 text",
-      "content": "3-4 paragraphs no bullets",
-      "chart_suggestion": "chart type + axes + what to visualize",
-      "image_prompt": "detailed Flux prompt for technical illustration"
-    }}
-  ],
-  "comparison": {{
-    "heading": "string",
-    "alternatives": [
-      {{"name":"string","pros":"string","cons":"string","tco_note":"string","best_for":"string"}}
-    ],
-    "content": "analysis paragraph"
-  }},
-  "anti_recommendation": {{"heading":"string","content":"paragraph"}},
-  "tco_analysis":        {{"heading":"string","content":"paragraph"}},
-  "conclusion": "strong closing paragraph",
-  "references": ["[1] formatted citation", "..."],
-  "metadata": {{
-    "seo_slug": "kebab-case",
-    "meta_description": "≤155 chars",
-    "title_tag": "SEO title",
-    "word_count": 1200
-  }},
-  "quality_audit": [
-    {{"check":"All numbers cited with methodology","passed":true,"note":"..."}},
-    {{"check":"All acronyms defined at first use","passed":true,"note":"..."}},
-    {{"check":"Physical constraints addressed","passed":true,"note":"..."}},
-    {{"check":"No repetition — themes consolidated","passed":true,"note":"..."}}
-  ]
-}}
+def _revision_prompt(art: dict, targets: list[str], qa_feedback: str = "") -> str:
+    """Per-attempt instructions: the current draft, the fields to rewrite and why."""
+    draft = {k: v for k, v in art.items() if k not in ("metadata", "quality_audit")}
+    wanted = "\n".join(
+        f"• sections[{t.split('.', 1)[1]}] — return it in \"sections\" with \"index\": {t.split('.', 1)[1]}"
+        if t.startswith("sections.") else f"• {t}"
+        for t in targets
+    )
+    return f"""━━━━━━━━━━━━ CURRENT DRAFT ━━━━━━━━━━━━
+{json.dumps(draft, ensure_ascii=False, indent=1)}
+
+━━━━━━━━━━━━ TARGETED REVISION ━━━━━━━━━━━━
+The draft above is final except for these fields — rewrite ONLY them:
+{wanted}
+
+{("They failed these QA checks:" + chr(10) + qa_feedback + chr(10) + chr(10)) if qa_feedback else ""}Keep every rule above, cite only sources already listed in "references" ([N]), and match
+the tone of the surrounding text. Return a JSON object containing just the rewritten fields."""
+
+
+def splice_article(art: dict, patch: dict, targets: list[str]) -> dict:
+    """art with the targeted fields replaced from patch (art itself is not modified)."""
+    out = dict(art)
+    for t in targets:
+        if t.startswith("sections.") or t not in patch:
+            continue
+        old, new = art.get(t), patch[t]
+        out[t] = {**old, **new} if isinstance(old, dict) and isinstance(new, dict) else new
+    wanted = {int(t.split(".", 1)[1]) for t in targets if t.startswith("sections.")}
+    if wanted and patch.get("sections"):
+        sections = list(art.get("sections", []))
+        for sec in patch["sections"]:
+            i = sec.get("index")
+            if i in wanted and i < len(sections):
+                sections[i] = {**sections[i], **{k: v for k, v in sec.items() if k != "index"}}
+        out["sections"] = sections
+    return out
+
+
+@traced(cat="workflow")
+def revise_fields_gemini(client, title: str, accepted_sources: list[dict], context: str, art: dict,
+                         targets: list[str], qa_feedback: str = "", competitive_context: str = "") -> dict:
+    """Rewrite the targeted fields with Gemini, on the article context cache when there is one."""
+    schema = _revision_schema(targets)
+    ask = _revision_prompt(art, targets, qa_feedback)
+    cached_content = ensure_article_context_cache(
+        client, title, accepted_sources, context, competitive_context=competitive_context,
+    )
+    if cached_content:
+        try:
+            resp = _call(client, ask, _json_cfg(schema, cached_content=cached_content),
+                         call_type="article_revision")
+            return _parse_validated(_extract_text(resp), schema)
+        except Exception as e:
+            if not _is_context_cache_miss(e):
+                raise
+            _llm_log.warning("Context cache %s unusable, sending the full prompt: %s", cached_content, e)
+    research = _gemini_article_context(title, accepted_sources, context, competitive_context)
+    resp = _call(client, f"{_GEMINI_ARTICLE_RULES}\n\n{research}\n\n{ask}", _json_cfg(schema),
+                 call_type="article_revision")
+    return _parse_validated(_extract_text(resp), schema)
+
+
+@traced(cat="workflow")
+def revise_fields_claude(anthropic_client, title: str, accepted_sources: list[dict],
+                         all_sources: list[dict], context: str, art: dict, targets: list[str],
+                         qa_feedback: str = "", competitive_context: str = "") -> dict:
+    """Rewrite the targeted fields with Claude (same system / research blocks as the full article)."""
+    schema = _revision_schema(targets)
+    request = _claude_article_request(title, accepted_sources, all_sources, context,
+                                      competitive_context=competitive_context)
+    request["messages"][0]["content"][-1] = {"type": "text",
+                                             "text": _revision_prompt(art, targets, qa_feedback)}
+    request.update(max_tokens=4000, tool_choice={"type": "tool", "name": "submit_revision"})
+    tokens = _estimate_tokens(request["system"], request["messages"])
+
+    def attempt(model: str) -> dict:
+        with telemetry.track("article_revision", "anthropic", model) as t:
+            msg = pooled("anthropic", anthropic_client, model, tokens,
+                         lambda c: c.messages.create(model=model, **request))
+            t.usage = _claude_call_usage(msg)
+        _record_claude_usage(msg)
+        return _claude_tool_result(msg, schema)
+
+    result, _state().claude_model_used = call_routed(
+        "anthropic", attempt, CLAUDE_MODEL, CLAUDE_FALLBACK
+    )
+    return result
+
+
+# ── Programmatic QA (10-gate, independent of model self-report) ──
+_CITED_NUMBER_RE = re.compile(
+    r'(\d[\d,.]*\s*(?:%|ms|µs|ns|GB|TB|PB|W|kW|MHz|GHz|TFLOPS|TOPS|tokens|fps|x|×)[^[]{0,80}\[\d+\])')
+_BULLET_RE = re.compile(r'(?:^|\n)\s*[-•*]\s')
+
+
+@traced("qa", cat="qa")
+def run_comprehensive_qa(art: dict) -> list[dict]:
+    """Run 10 programmatic quality checks on the generated article."""
+    checks: list[dict] = []
+
+    # Collect all prose
+    exec_sum = art.get("executive_summary", "")
+    body_parts = [s.get("content", "") for s in art.get("sections", [])]
+    cmp_content  = art.get("comparison", {}).get("content", "")
+    tco_content  = art.get("tco_analysis", {}).get("content", "")
+    anti_content = art.get("anti_recommendation", {}).get("content", "")
+    conclusion   = art.get("conclusion", "")
+    all_text = " ".join(filter(None, [exec_sum, *body_parts, cmp_content, tco_content, anti_content, conclusion]))
+    body_text = " ".join(body_parts)
+
+    def add(category: str, check: str, passed: bool, note: str):
+        checks.append({"category": category, "check": check, "passed": passed, "note": note})
+
+    # ── Structure ────────────────────────────────────────────────
+    wc = len(all_text.split())
+    add("Structure", "Word count: 1,000–1,500 words",
+        1000 <= wc <= 1600,
+        f"Detected ~{wc:,} words")
+
+    exec_wc = len(exec_sum.split())
+    add("Structure", "Executive summary ~100 words (±20)",
+        80 <= exec_wc <= 120,
+        f"{exec_wc} words detected — target 80–120")
+
+    n_sections = len(art.get("sections", []))
+    add("Structure", "At least 3 body sections present",
+        n_sections >= 3,
+        f"{n_sections} section(s) found")
+
+    # ── Evidence ─────────────────────────────────────────────────
+    citations = re.findall(r'\[\d+\]', body_text + cmp_content + tco_content + anti_content)
+    add("Evidence", "Source citations [N] present in body (≥3)",
+        len(citations) >= 3,
+        f"{len(citations)} citation reference(s) detected")
+
+    quant_cited = _CITED_NUMBER_RE.findall(all_text)
+    add("Evidence", "Quantitative claims paired with citations (≥3)",
+        len(quant_cited) >= 3,
+        f"{len(quant_cited)} cited numeric claim(s) detected")
+
+    # ── Critical Analysis ─────────────────────────────────────────
+    alts = art.get("comparison", {}).get("alternatives", [])
+    n_alts = sum(1 for a in alts if isinstance(a, dict))
+    add("Critical Analysis", "Comparison section with ≥2 alternatives",
+        n_alts >= 2,
+        f"{n_alts} alternative(s) found")
+
+    add("Critical Analysis", "Anti-recommendation section present (>50 words)",
+        len(anti_content.split()) > 50,
+        f"{len(anti_content.split())} words in anti-rec section")
+
+    add("Critical Analysis", "TCO analysis present (>50 words)",
+        len(tco_content.split()) > 50,
+        f"{len(tco_content.split())} words in TCO section")
+
+    # ── Technical Depth ───────────────────────────────────────────
+    phys_kw = ["thermal","power","watt","TDP","cooling","heat","bottleneck",
+               "bandwidth","latency","scaling limit","memory wall","bandwidth-bound"]
+    found_phys = [kw for kw in phys_kw if kw.lower() in all_text.lower()]
+    add("Technical Depth", "Physical constraints addressed (thermal/power/scaling)",
+        len(found_phys) >= 2,
+        f"Keywords: {', '.join(found_phys[:4]) or 'none detected'}")
+
+    # ── Clarity ───────────────────────────────────────────────────
+    acronym_defs = re.findall(r'[A-Z]{2,}[0-9]*\s*\(', all_text)
+    add("Clarity", "Acronyms defined on first use (ABC (…) pattern)",
+        len(acronym_defs) >= 1,
+        f"{len(acronym_defs)} definition(s): {', '.join(set(d.strip() for d in acronym_defs[:3]))}")
+
+    # ── Style ─────────────────────────────────────────────────────
+    bullets = _BULLET_RE.findall(all_text)
+    add("Style", "No bullet points — paragraph format only",
+        len(bullets) == 0,
+        f"Clean" if not bullets else f"{len(bullets)} bullet(s) detected")
+
+    return checks
+
+
+def _field_texts(art: dict) -> dict[str, str]:
+    """Prose of every targetable field, keyed as in qa_fix_targets()."""
+    texts = {f"sections.{i}": s.get("content", "") for i, s in enumerate(art.get("sections", []))}
+    texts["executive_summary"] = art.get("executive_summary", "")
+    for key in ("comparison", "anti_recommendation", "tco_analysis"):
+        texts[key] = (art.get(key) or {}).get("content", "")
+    texts["conclusion"] = art.get("conclusion", "")
+    return texts
+
+
+def qa_fix_targets(art: dict, qa_checks: list[dict]) -> list[str] | None:
+    """
+    The article fields that would fix the failed QA checks, or None when a
+    failure concerns the whole article (word count, section count, physical
+    constraints) or every section would be rewritten anyway.
+    """
+    texts = _field_texts(art)
+    sections = [k for k in texts if k.startswith("sections.")]
+    targets: list[str] = []
+    for c in qa_checks:
+        if c.get("passed"):
+            continue
+        check = c.get("check", "")
+        if check.startswith("Executive summary") or check.startswith("Acronyms defined"):
+            found = ["executive_summary"]
+        elif check.startswith("Comparison section"):
+            found = ["comparison"]
+        elif check.startswith("Anti-recommendation"):
+            found = ["anti_recommendation"]
+        elif check.startswith("TCO analysis"):
+            found = ["tco_analysis"]
+        elif check.startswith("Source citations"):
+            found = [k for k in sections if not re.search(r"\[\d+\]", texts[k])]
+        elif check.startswith("Quantitative claims"):
+            found = [k for k in sections if not _CITED_NUMBER_RE.search(texts[k])]
+        elif check.startswith("No bullet points"):
+            found = [k for k, text in texts.items() if _BULLET_RE.search(text)]
+        else:
+            return None
+        if not found:
+            return None
+        targets += [t for t in found if t not in targets]
+    if not targets or (sections and set(sections) <= set(targets)):
+        return None
+    return targets
+
+
+RUBRIC_SCHEMA = {
+    "type": "object",
+    "properties": {name: {"type": "number"} for name, _ in RUBRIC_CRITERIA},
+    "required": [name for name, _ in RUBRIC_CRITERIA],
+}
+
+
+@traced("rubric_scoring", cat="qa")
+def score_article_rubric(client, art: dict) -> dict:
+    """Ask Gemini to score the article on RUBRIC_CRITERIA, each 0.0–10.0."""
+    full_text = _article_to_markdown(art)
+    criteria_list = "\n".join(f'"{name}"' for name, _ in RUBRIC_CRITERIA)
+    prompt = f"""You are a rigorous editorial evaluator. Score the following technical article on each criterion below.
+Return ONLY a valid JSON object where keys are the exact criterion names and values are float scores between 0.0 and 10.0.
+
+Criteria:
+{criteria_list}
+
+Article (truncated to first 4000 chars):
+{full_text[:4000]}"""
+    try:
+        scores, _ = _call_json(client, prompt, RUBRIC_SCHEMA, call_type="rubric")
+        # Ensure all criteria are present with float values
+        result = {}
+        for name, _ in RUBRIC_CRITERIA:
+            result[name] = float(scores.get(name, 0.0))
+        return result
+    except Exception:
+        return _zero_rubric()
+
+
+def _no_status(_msg: str):
+    return contextlib.nullcontext()
+
+
+_stage_pool: concurrent.futures.ThreadPoolExecutor | None = None
+_stage_pool_lock = threading.Lock()
+
+
+def _run_stage(fn, *args) -> concurrent.futures.Future:
+    """
+    Start a Step 5 stage on the shared stage pool, in a copy of the caller's
+    context (telemetry / spans stay attributed) with a scratch RunState so it
+    never writes session state from a worker thread.
+    """
+    global _stage_pool
+    with _stage_pool_lock:
+        if _stage_pool is None:
+            _stage_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=STAGE_WORKERS, thread_name_prefix="step5")
+    return _stage_pool.submit(contextvars.copy_context().run, _in_scratch_state, fn, args)
+
+
+def _in_scratch_state(fn, args: tuple):
+    with bind_state(RunState.new()):
+        return fn(*args)
+
+
+def _stage_result(fut: concurrent.futures.Future, timeout: float, default, label: str):
+    """fut's result, or default if the stage failed or is still running after timeout."""
+    try:
+        return fut.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        _llm_log.warning("Step 5 %s still running after %ss — committing without it", label, timeout)
+    except Exception as e:
+        _llm_log.warning("Step 5 %s failed: %s", label, e)
+    return default
+
+
+def _zero_rubric() -> dict:
+    return {name: 0.0 for name, _ in RUBRIC_CRITERIA}
+
+
+def fetch_hero_image(title: str) -> bytes | None:
+    """Download one hero image server-side (avoids browser CSP blocks); None on failure."""
+    hero_prompt = (
+        f"cinematic wide-angle technical illustration for: {title}, "
+        "dark background, indigo and cyan glow, professional tech photography style, "
+        "high detail, 8k, no text"
+    )
+    img_url = pollinations_url(hero_prompt, w=1400, h=500, seed=_seed(title))
+    try:
+        with telemetry.track("hero_image", "http", "pollinations") as t:
+            r = requests.get(img_url, timeout=HERO_IMAGE_TIMEOUT)
+            t.extra = {"http_status": r.status_code, "bytes": len(r.content or b"")}
+        return r.content if r.status_code == 200 else None
+    except Exception:
+        return None
+
+
+def _claude_fallback_reason(exc: Exception) -> str:
+    """Why Gemini wrote instead of Claude (shown in the Step 5 fallback banner)."""
+    if _is_credit_error(exc):
+        # Credit depleted — fall through to Gemini
+        return (
+            f"Anthropic credit balance too low — article written by Gemini ({MODEL_REASONING}) instead. "
+            f"Add credits at console.anthropic.com/billing to use Claude next time."
+        )
+    # Non-billing Claude error — still try Gemini as safety net
+    return f"Claude error ({str(exc)[:120]}) — automatically fell back to Gemini."
+
+
+def write_article(title: str, research: tuple[list[dict], str], accepted_sources: list[dict],
+                  competitive_context: str, qa_feedback: str, client, anthropic_client=None,
+                  on_part=None, status=_no_status) -> dict:
+    """
+    Article generation with smart fallback:
+      1. Claude (if an Anthropic client is given)    → best writing quality
+      2. Gemini 2.5 Pro (auto-fallback on any error) → uses same NotebookLM context
+    Hallucination prevention is maintained in both paths via:
+      - Strict citation rules [N] in prompt
+      - NotebookLM context injected as grounding
+      - Accepted-source whitelist enforced
+    Returns {article, actual_writer, fallback_reason, claude_model_used};
+    raises if Gemini fails too.
+    """
+    sources, notebooklm_context = research
+    fallback_reason = ""
+
+    # ── Attempt 1: Claude ────────────────────────────────────────
+    if anthropic_client:
+        with status(f"✍️ Claude ({_state().get('claude_model_used', CLAUDE_MODEL)}) is writing…"):
+            try:
+                art = generate_article_claude(
+                    anthropic_client,
+                    title,
+                    accepted_sources,
+                    sources,
+                    notebooklm_context,
+                    qa_feedback=qa_feedback,
+                    competitive_context=competitive_context,
+                    on_part=on_part,
+                )
+                return {"article": art, "actual_writer": "claude", "fallback_reason": "",
+                        "claude_model_used": _state().get("claude_model_used", CLAUDE_MODEL)}
+            except Exception as exc:
+                fallback_reason = _claude_fallback_reason(exc)
+
+    # ── Attempt 2: Gemini (primary when no Anthropic key, or fallback) ──
+    writer_label = "Gemini (fallback)" if fallback_reason else f"Gemini ({MODEL_REASONING})"
+    with status(f"✍️ Writing with {writer_label}…"):
+        cached_content = ensure_article_context_cache(
+            client,
+            title,
+            accepted_sources,
+            notebooklm_context,
+            competitive_context=competitive_context,
+        )
+        art = generate_article(
+            client,
+            title,
+            accepted_sources,
+            notebooklm_context,
+            competitive_context=competitive_context,
+            on_part=on_part,
+            cached_content=cached_content,
+        )
+    return {"article": art, "actual_writer": "gemini_fallback" if fallback_reason else "gemini",
+            "fallback_reason": fallback_reason, "claude_model_used": None}
 
-Output ONLY the JSON. Nothing else."""
 
-    if competitive_context:
-        prompt += f"\n\n{competitive_context}"
+def revise_article(title: str, research: tuple[list[dict], str], accepted_sources: list[dict],
+                   competitive_context: str, qa_feedback: str, base_article: dict, targets: list[str],
+                   client, anthropic_client=None, status=_no_status) -> dict:
+    """
+    Targeted QA re-run: rewrite only targets (see qa_fix_targets) and splice
+    them into base_article — Claude first when given, Gemini as fallback.
+    Same return shape as write_article; raises if Gemini fails too.
+    """
+    sources, notebooklm_context = research
+    what = _describe_targets(targets)
+    fallback_reason = ""
+    if anthropic_client:
+        with status(f"✂️ Claude is rewriting {what}…"):
+            try:
+                patch = revise_fields_claude(anthropic_client, title, accepted_sources, sources,
+                                             notebooklm_context, base_article, targets,
+                                             qa_feedback=qa_feedback, competitive_context=competitive_context)
+                return {"article": splice_article(base_article, patch, targets), "actual_writer": "claude",
+                        "fallback_reason": "",
+                        "claude_model_used": _state().get("claude_model_used", CLAUDE_MODEL)}
+            except Exception as exc:
+                fallback_reason = _claude_fallback_reason(exc)
+    with status(f"✂️ Rewriting {what} with Gemini…"):
+        patch = revise_fields_gemini(client, title, accepted_sources, notebooklm_context, base_article,
+                                     targets, qa_feedback=qa_feedback, competitive_context=competitive_context)
+    return {"article": splice_article(base_article, patch, targets),
+            "actual_writer": "gemini_fallback" if fallback_reason else "gemini",
+            "fallback_reason": fallback_reason, "claude_model_used": None}
 
-    model = CLAUDE_MODEL
-    for attempt in range(2):
-        try:
-            msg = anthropic_client.messages.create(
-                model=model,
-                max_tokens=8000,
-                messages=[{"role": "user", "content": prompt}],
-            )
-            raw = msg.content[0].text
-            result = _parse_json(raw)
-            st.session_state.claude_model_used = model
-            return result
-        except Exception as e:
-            if attempt == 0 and CLAUDE_FALLBACK not in model:
-                model = CLAUDE_FALLBACK
-                continue
-            raise e
 
+# ── The five steps as WorkflowGraph nodes ────────────────────────
+# Params: category, topic, title (the chosen title string), accepted_sources,
+# competitive_context, qa_feedback, writer, and for targeted re-runs
+# base_article / fix_targets, the best-of-N candidate index (0 for a single
+# draft) and attempt — a nonce bumped by every QA re-run / failure retry
+# click, so those write a fresh draft. Changing accepted_sources recomputes
+# article → qa / rubric, never research or the NotebookLM synthesis.
+@workflow.node("topics", inputs=("category",), runtime=("client",))
+def _topics_node(category: str, client) -> list[dict]:
+    return fetch_topics(client, category)
 
-# ── Programmatic QA (10-gate, independent of model self-report) ──
-def run_comprehensive_qa(art: dict) -> list[dict]:
-    """Run 10 programmatic quality checks on the generated article."""
-    checks: list[dict] = []
 
-    # Collect all prose
-    exec_sum = art.get("executive_summary", "")
-    body_parts = [s.get("content", "") for s in art.get("sections", [])]
-    cmp_content  = art.get("comparison", {}).get("content", "")
-    tco_content  = art.get("tco_analysis", {}).get("content", "")
-    anti_content = art.get("anti_recommendation", {}).get("content", "")
-    conclusion   = art.get("conclusion", "")
-    all_text = " ".join(filter(None, [exec_sum, *body_parts, cmp_content, tco_content, anti_content, conclusion]))
-    body_text = " ".join(body_parts)
+@workflow.node("titles", inputs=("topic",), runtime=("client",))
+def _titles_node(topic: dict, client) -> list[dict]:
+    return fetch_titles(client, topic)
 
-    def add(category: str, check: str, passed: bool, note: str):
-        checks.append({"category": category, "check": check, "passed": passed, "note": note})
 
-    # ── Structure ────────────────────────────────────────────────
-    wc = len(all_text.split())
-    add("Structure", "Word count: 1,000–1,500 words",
-        1000 <= wc <= 1600,
-        f"Detected ~{wc:,} words")
+@workflow.node("research", inputs=("title",), runtime=("client",))
+def _research_node(title: str, client) -> tuple[list[dict], str]:
+    return deep_research(client, title)
 
-    exec_wc = len(exec_sum.split())
-    add("Structure", "Executive summary ~100 words (±20)",
-        80 <= exec_wc <= 120,
-        f"{exec_wc} words detected — target 80–120")
 
-    n_sections = len(art.get("sections", []))
-    add("Structure", "At least 3 body sections present",
-        n_sections >= 3,
-        f"{n_sections} section(s) found")
+def _keep_draft(draft: dict, args: dict) -> bool:
+    """Memoize a draft only if the requested writer wrote it — not a Claude → Gemini fallback."""
+    return draft["actual_writer"] == args["writer"]
 
-    # ── Evidence ─────────────────────────────────────────────────
-    citations = re.findall(r'\[\d+\]', body_text + cmp_content + tco_content + anti_content)
-    add("Evidence", "Source citations [N] present in body (≥3)",
-        len(citations) >= 3,
-        f"{len(citations)} citation reference(s) detected")
 
-    quant_cited = re.findall(
-        r'(\d[\d,.]*\s*(?:%|ms|µs|ns|GB|TB|PB|W|kW|MHz|GHz|TFLOPS|TOPS|tokens|fps|x|×)[^[]{0,80}\[\d+\])',
-        all_text)
-    add("Evidence", "Quantitative claims paired with citations (≥3)",
-        len(quant_cited) >= 3,
-        f"{len(quant_cited)} cited numeric claim(s) detected")
+def _draft_given(draft: dict, params: dict) -> dict | None:
+    """workflow.run(given=…) for a draft's QA / rubric when the memo didn't keep the draft."""
+    return None if _keep_draft(draft, params) else {"article": draft}
 
-    # ── Critical Analysis ─────────────────────────────────────────
-    alts = art.get("comparison", {}).get("alternatives", [])
-    n_alts = sum(1 for a in alts if isinstance(a, dict))
-    add("Critical Analysis", "Comparison section with ≥2 alternatives",
-        n_alts >= 2,
-        f"{n_alts} alternative(s) found")
 
-    add("Critical Analysis", "Anti-recommendation section present (>50 words)",
-        len(anti_content.split()) > 50,
-        f"{len(anti_content.split())} words in anti-rec section")
+@workflow.node("article",
+               inputs=("title", "research", "accepted_sources", "competitive_context", "qa_feedback", "writer",
+                       "base_article", "fix_targets", "candidate", "attempt"),
+               runtime=("client", "anthropic_client", "on_part", "status"),
+               keep=_keep_draft)
+def _article_node(title, research, accepted_sources, competitive_context, qa_feedback, writer,
+                  base_article, fix_targets, candidate, attempt, client, anthropic_client=None,
+                  on_part=None, status=_no_status) -> dict:
+    # candidate / attempt only separate drafts in the memo; each is sampled afresh
+    anthropic_client = anthropic_client if writer == "claude" else None
+    if base_article and fix_targets:
+        return revise_article(title, research, accepted_sources, competitive_context, qa_feedback,
+                              base_article, fix_targets, client, anthropic_client, status=status)
+    return write_article(title, research, accepted_sources, competitive_context, qa_feedback,
+                         client, anthropic_client, on_part=on_part, status=status)
 
-    add("Critical Analysis", "TCO analysis present (>50 words)",
-        len(tco_content.split()) > 50,
-        f"{len(tco_content.split())} words in TCO section")
 
-    # ── Technical Depth ───────────────────────────────────────────
-    phys_kw = ["thermal","power","watt","TDP","cooling","heat","bottleneck",
-               "bandwidth","latency","scaling limit","memory wall","bandwidth-bound"]
-    found_phys = [kw for kw in phys_kw if kw.lower() in all_text.lower()]
-    add("Technical Depth", "Physical constraints addressed (thermal/power/scaling)",
-        len(found_phys) >= 2,
-        f"Keywords: {', '.join(found_phys[:4]) or 'none detected'}")
+@workflow.node("qa", inputs=("article",))
+def _qa_node(article: dict) -> list[dict]:
+    return run_comprehensive_qa(article["article"])
 
-    # ── Clarity ───────────────────────────────────────────────────
-    acronym_defs = re.findall(r'[A-Z]{2,}[0-9]*\s*\(', all_text)
-    add("Clarity", "Acronyms defined on first use (ABC (…) pattern)",
-        len(acronym_defs) >= 1,
-        f"{len(acronym_defs)} definition(s): {', '.join(set(d.strip() for d in acronym_defs[:3]))}")
 
-    # ── Style ─────────────────────────────────────────────────────
-    bullets = re.findall(r'(?:^|\n)\s*[-•*]\s', all_text)
-    add("Style", "No bullet points — paragraph format only",
-        len(bullets) == 0,
-        f"Clean" if not bullets else f"{len(bullets)} bullet(s) detected")
+@workflow.node("rubric", inputs=("article",), runtime=("client",))
+def _rubric_node(article: dict, client) -> dict | None:
+    scores = score_article_rubric(client, article["article"])
+    return scores if any(scores.values()) else None     # all-zero = scoring failed; don't memoize
 
-    return checks
 
+@workflow.node("hero_image", inputs=("title",))
+def _hero_image_node(title: str) -> bytes | None:
+    return fetch_hero_image(title)
 
-def score_article_rubric(client, art: dict) -> dict:
-    """Ask Gemini to score the article on RUBRIC_CRITERIA, each 0.0–10.0."""
-    full_text = _article_to_markdown(art)
-    criteria_list = "\n".join(f'"{name}"' for name, _ in RUBRIC_CRITERIA)
-    prompt = f"""You are a rigorous editorial evaluator. Score the following technical article on each criterion below.
-Return ONLY a valid JSON object where keys are the exact criterion names and values are float scores between 0.0 and 10.0.
 
-Criteria:
-{criteria_list}
+def _write_candidate(params: dict, cache_entry: dict | None, client, anthropic_client,
+                     rank_by_rubric: bool) -> dict:
+    """Stage body for one best-of-N candidate: article, QA and (optionally) rubric."""
+    state = _state()
+    state.gemini_context_cache = cache_entry        # share the session's Gemini context cache
+    try:
+        draft = workflow.run("article", params, client=client, anthropic_client=anthropic_client)
+    finally:
+        if state.gemini_context_cache is not cache_entry:
+            drop_article_context_cache(client)      # this candidate had to create its own
+    return {
+        "params": params,
+        "draft": draft,
+        "qa": workflow.run("qa", params, _draft_given(draft, params)),
+        "rubric": (workflow.run("rubric", params, _draft_given(draft, params), client=client)
+                   if rank_by_rubric else None),
+        "claude_usage": state.claude_usage,
+    }
 
-Article (truncated to first 4000 chars):
-{full_text[:4000]}"""
+
+def _candidate_score(cand: dict) -> tuple[int, float]:
+    """Rank: QA checks passed, then mean rubric score (0 when not scored)."""
+    rubric = cand["rubric"] or {}
+    return (sum(1 for c in cand["qa"] if c.get("passed")),
+            sum(rubric.values()) / len(rubric) if rubric else 0.0)
+
+
+def _merge_claude_usage(totals: dict | None, usage: dict | None) -> dict | None:
+    if not usage:
+        return totals
+    merged = dict(totals or {})
+    for key, value in usage.items():
+        if key != "last":
+            merged[key] = merged.get(key, 0) + value
+    merged["last"] = usage.get("last")
+    return merged
+
+
+@traced("best_of_n", cat="workflow")
+def write_candidates(params: dict, n: int, client, anthropic_client=None, mix_writers: bool = False,
+                     rank_by_rubric: bool = False, status=_no_status) -> tuple[dict, dict]:
+    """
+    Best-of-N: write n candidate articles in parallel on the stage pool
+    (alternating Claude and Gemini with mix_writers), QA each — rubric-score
+    it too with rank_by_rubric — and keep the best; ties go to the earlier
+    candidate. Returns (draft, params) of the winner and records a summary
+    per candidate in _state().candidates. Raises the first error if every
+    candidate failed.
+    """
+    state = _state()
+    n = max(1, min(n, BEST_OF_MAX))
+    writers = ["claude" if anthropic_client and not (mix_writers and i % 2) else "gemini"
+               for i in range(n)]
+    variants = [dict(params, candidate=i, writer=w) for i, w in enumerate(writers)]
+    if "gemini" in writers:
+        # Create the context cache once, here, rather than once per candidate
+        _, context = workflow.run("research", params, client=client)
+        ensure_article_context_cache(client, params["title"], params["accepted_sources"], context,
+                                     competitive_context=params["competitive_context"])
+    cache_entry = state.get("gemini_context_cache")
+    futures = [_run_stage(_write_candidate, v, cache_entry, client, anthropic_client, rank_by_rubric)
+               for v in variants]
+
+    results, errors = [], []
+    with status(f"✍️ Writing {n} candidate articles in parallel…"):
+        for fut in futures:
+            try:
+                results.append(fut.result())
+            except Exception as exc:
+                _llm_log.warning("Best-of-%d candidate failed: %s", n, exc)
+                errors.append(exc)
+    for cand in results:
+        state.claude_usage = _merge_claude_usage(state.get("claude_usage"), cand["claude_usage"])
+    if not results:
+        raise errors[0]
+
+    best = max(results, key=_candidate_score)
+    state.candidates = [{
+        "candidate": cand["params"]["candidate"],
+        "writer": cand["draft"]["actual_writer"],
+        "qa_passed": _candidate_score(cand)[0],
+        "qa_total": len(cand["qa"]),
+        "rubric": round(_candidate_score(cand)[1], 2) if cand["rubric"] else None,
+        "chosen": cand is best,
+    } for cand in results]
+    return best["draft"], best["params"]
+
+
+@traced("generate", cat="workflow")
+def produce_article(title: str, accepted_sources: list[dict], qa_feedback: str = "",
+                    competitive_context: str = "", on_part=None, status=_no_status,
+                    base_article: dict | None = None, fix_targets: list[str] | None = None,
+                    candidates: int = 1, mix_writers: bool = False,
+                    rank_by_rubric: bool = False, attempt: int = 0) -> Optional[dict]:
+    """
+    Step 5 through the workflow graph: article (write_article), then QA, rubric
+    and hero image (the image downloads during generation, QA runs alongside
+    the rubric). Unchanged inputs reuse memoized outputs — re-running with a
+    new accepted-source set only rewrites, re-checks and re-scores.
+    With base_article and fix_targets, only those fields are rewritten
+    (revise_article) and spliced into base_article. With candidates > 1,
+    write_candidates() drafts that many in parallel and keeps the best.
+    attempt distinguishes explicit re-runs with otherwise identical inputs.
+    Reads clients / research from _state() and writes the results back to it;
+    status(msg) wraps each phase (st.spinner in the UI). None on failure (see gen_error).
+    """
+    state = _state()
+    anthropic_client = state.get("_anthropic_client")
+    params = {
+        "title": title,
+        "accepted_sources": accepted_sources,
+        "competitive_context": competitive_context,
+        "qa_feedback": qa_feedback,
+        "writer": "claude" if anthropic_client else "gemini",
+        "base_article": base_article if fix_targets else None,
+        "fix_targets": list(fix_targets or []) if base_article else [],
+        "candidate": 0,
+        "attempt": attempt,
+    }
+    if state.get("sources"):
+        # Research may come from a prefetch or a job's inputs — make it the graph's
+        workflow.seed("research", params, (state.sources, state.notebooklm_context))
+    # The hero prompt depends only on the title — download while the article is written
+    hero = _run_stage(workflow.run, "hero_image", params)
+    state.candidates = []
     try:
-        resp = _call(client, prompt, _json_cfg())
-        text = _extract_text(resp)
-        scores = _parse_json(text)
-        # Ensure all criteria are present with float values
-        result = {}
-        for name, _ in RUBRIC_CRITERIA:
-            result[name] = float(scores.get(name, 0.0))
-        return result
-    except Exception:
-        return {name: 0.0 for name, _ in RUBRIC_CRITERIA}
+        if candidates > 1 and not params["fix_targets"]:
+            draft, params = write_candidates(params, candidates, state._client, anthropic_client,
+                                             mix_writers=mix_writers, rank_by_rubric=rank_by_rubric,
+                                             status=status)
+        else:
+            draft = workflow.run("article", params, client=state._client,
+                                 anthropic_client=anthropic_client, on_part=on_part, status=status)
+    except Exception as exc:
+        hero.cancel()
+        state.gen_error = str(exc)
+        return None
+    art = draft["article"]
+
+    # ── QA here, rubric in the background, hero image already in flight ──
+    given = _draft_given(draft, params)
+    rubric = _run_stage(functools.partial(workflow.run, client=state._client), "rubric", params, given)
+    qa_checks = workflow.run("qa", params, given)
+    with status("📊 Scoring article and fetching hero image…"):
+        rubric_scores = _stage_result(rubric, RUBRIC_TIMEOUT, None, "rubric") or _zero_rubric()
+        hero_bytes = _stage_result(hero, HERO_IMAGE_TIMEOUT + 5, None, "hero image")
+
+    # ── Commit results (all at once, after every stage finished / timed out) ──
+    state.article          = art
+    state.metadata         = art.get("metadata", {})
+    state.audit            = art.get("quality_audit", [])
+    state.qa_checks        = qa_checks
+    state.rubric_scores    = rubric_scores
+    state.hero_image_bytes = hero_bytes
+    state.actual_writer    = draft["actual_writer"]
+    state.fallback_reason  = draft["fallback_reason"]
+    if draft["claude_model_used"]:
+        state.claude_model_used = draft["claude_model_used"]
+    state.gen_error        = ""
+    return art
+
+
+# ── Step 5 as a background job (see JobQueue) ────────────────────
+JOB_RESULT_KEYS = (
+    "article", "metadata", "audit", "qa_checks", "rubric_scores",
+    "actual_writer", "fallback_reason", "claude_model_used", "candidates",
+)
+
+
+def submit_generation_job(title: str, accepted_sources: list[dict], qa_feedback: str = "",
+                          competitive_context: str = "", base_article: dict | None = None,
+                          fix_targets: list[str] | None = None, candidates: int = 1,
+                          mix_writers: bool = False, rank_by_rubric: bool = False,
+                          attempt: int = 0) -> str | None:
+    """
+    Queue produce_article() for the current state's research; the job id, or
+    None without a queue. The session id and attempt are hashed with the
+    inputs, so an explicit re-run or retry is a new job rather than the
+    finished one it repeats.
+    """
+    queue = get_job_queue()
+    if queue is None:
+        return None
+    state = _state()
+    anthropic_key = state.get("_anthropic_key") if state.get("_anthropic_client") else None
+    inputs = {
+        "title": title,
+        "accepted_sources": accepted_sources,
+        "sources": state.get("sources") or [],
+        "notebooklm_context": state.get("notebooklm_context", ""),
+        "qa_feedback": qa_feedback,
+        "competitive_context": competitive_context,
+        "base_article": base_article,
+        "fix_targets": fix_targets,
+        "candidates": candidates,
+        "mix_writers": mix_writers,
+        "rank_by_rubric": rank_by_rubric,
+        "session": state.get("trace_session"),
+        "attempt": attempt,
+        "gemini_key": _register_job_key(state.get("_api_key")),
+        "anthropic_key": _register_job_key(anthropic_key),
+    }
+    meta = {key: state.get(key) for key in ("trace_session", "category", "topic", "title")}
+    meta["context_cache"] = state.get("gemini_context_cache")     # not hashed: expires_at moves
+    return queue.submit("generate", inputs, meta)
+
+
+def _generation_job(inputs: dict, meta: dict, progress) -> dict:
+    """
+    JobQueue handler: run produce_article() against a RunState rebuilt from
+    the job inputs. The session's Gemini context cache comes in via meta and
+    goes back in the result; a cache created by a failed job is deleted.
+    """
+    gemini_key = _job_api_key("gemini", inputs["gemini_key"])
+    if not gemini_key:
+        raise RuntimeError("No Gemini API key was given for this job.")
+    anthropic_key = _job_api_key("anthropic", inputs["anthropic_key"])
+    state = RunState.new(
+        _client=get_client(gemini_key),
+        _api_key=gemini_key,
+        _anthropic_client=get_anthropic_client(anthropic_key) if anthropic_key else None,
+        sources=inputs["sources"],
+        notebooklm_context=inputs["notebooklm_context"],
+        gemini_context_cache=meta.get("context_cache"),     # reuse the session's Gemini context cache
+    )
+    parts = 0
+
+    def on_part(path: tuple, value) -> None:
+        nonlocal parts
+        if path == STREAM_RESTART:
+            parts = 0
+            return
+        parts += 1
+        progress(f"✍️ Drafting — {parts} part{'s' if parts != 1 else ''} of the article received…")
+
+    def status(msg: str):
+        progress(msg)
+        return contextlib.nullcontext()
+
+    shared = (meta.get("context_cache") or {}).get("name")
+    art = None
+    with bind_state(state):
+        set_trace_context(session=meta.get("trace_session"), step=5)
+        try:
+            art = produce_article(inputs["title"], inputs["accepted_sources"],
+                                  qa_feedback=inputs["qa_feedback"],
+                                  competitive_context=inputs["competitive_context"],
+                                  on_part=on_part, status=status,
+                                  base_article=inputs.get("base_article"),
+                                  fix_targets=inputs.get("fix_targets"),
+                                  candidates=inputs.get("candidates", 1),
+                                  mix_writers=inputs.get("mix_writers", False),
+                                  rank_by_rubric=inputs.get("rank_by_rubric", False),
+                                  attempt=inputs.get("attempt", 0))
+        finally:
+            own = (state.gemini_context_cache or {}).get("name")
+            if art is None and own != shared:
+                drop_article_context_cache(state._client)   # no result will hand it back to the session
+    if art is None:
+        raise RuntimeError(state.gen_error or "Article generation failed.")
+    result = {key: state.get(key) for key in JOB_RESULT_KEYS}
+    hero = state.hero_image_bytes
+    result["hero_image_b64"] = base64.b64encode(hero).decode("ascii") if hero else None
+    result["context_cache"] = state.gemini_context_cache     # handed back to the session
+    return result
+
+
+JOB_HANDLERS["generate"] = _generation_job
+
+
+def apply_generation_result(result: dict) -> None:
+    """Commit a finished generation job's outputs to the current state."""
+    state = _state()
+    for key in JOB_RESULT_KEYS:
+        state[key] = result.get(key)
+    hero = result.get("hero_image_b64")
+    state["hero_image_bytes"] = base64.b64decode(hero) if hero else None
+    state["gen_error"] = ""
+    if "context_cache" in result:
+        state["gemini_context_cache"] = result["context_cache"]
 
 
 # ══════════════════════════════════════════════════════════════════
@@ -1551,34 +5456,74 @@ def render_source_card(src: dict, idx: int):
 
 
 
-def render_article(art: dict):
-    article_title = art.get("article_title", "")
-
-    # ── Executive summary ─────────────────────────────────────────
+def _render_executive_summary(text: str):
     st.markdown(f"""
 <div class="executive-summary">
   <strong style="color:#a5b4fc;font-style:normal">Executive Summary</strong><br><br>
-  {art.get('executive_summary','')}
+  {text}
 </div>""", unsafe_allow_html=True)
 
-    # ── Body sections — full-width image above each section ───────
-    for sec in art.get("sections", []):
-        heading = sec.get("heading", "")
-        st.markdown(f'<div class="article-h2">{heading}</div>', unsafe_allow_html=True)
 
-        # Section body paragraphs
-        for para in sec.get("content", "").split("\n\n"):
-            if para.strip():
-                st.markdown(f'<p class="article-p">{para.strip()}</p>',
-                            unsafe_allow_html=True)
+def _render_section(sec: dict):
+    heading = sec.get("heading", "")
+    st.markdown(f'<div class="article-h2">{heading}</div>', unsafe_allow_html=True)
 
-        # Chart hint
-        if sec.get("chart_suggestion"):
-            st.markdown(
-                f'<div class="chart-hint">📊 <span>Suggested visualization:</span>'
-                f' {sec["chart_suggestion"]}</div>',
-                unsafe_allow_html=True,
-            )
+    # Section body paragraphs
+    for para in sec.get("content", "").split("\n\n"):
+        if para.strip():
+            st.markdown(f'<p class="article-p">{para.strip()}</p>',
+                        unsafe_allow_html=True)
+
+    # Chart hint
+    if sec.get("chart_suggestion"):
+        st.markdown(
+            f'<div class="chart-hint">📊 <span>Suggested visualization:</span>'
+            f' {sec["chart_suggestion"]}</div>',
+            unsafe_allow_html=True,
+        )
+
+
+class ArticlePreview:
+    """
+    Progressive render of a streaming article: pass on_part to the writer;
+    the executive summary and each sections[i] are drawn as soon as they
+    close. Each part owns a placeholder; a new attempt (STREAM_RESTART)
+    empties them all, so no part of an abandoned attempt stays on screen.
+    """
+
+    def __init__(self):
+        st.caption("Streaming draft — the full article appears when generation completes.")
+        self._root = st.container()
+        self._slots: dict[tuple, object] = {}
+
+    def _slot(self, path: tuple):
+        if path not in self._slots:
+            with self._root:
+                self._slots[path] = st.empty()
+        return self._slots[path]
+
+    def on_part(self, path: tuple, value) -> None:
+        if path == STREAM_RESTART:
+            for slot in self._slots.values():
+                slot.empty()
+        elif path == ("executive_summary",) and isinstance(value, str):
+            with self._slot(path).container():
+                _render_executive_summary(value)
+        elif len(path) == 2 and path[0] == "sections" and isinstance(value, dict):
+            with self._slot(path).container():
+                _render_section(value)
+
+
+@traced(cat="render")
+def render_article(art: dict):
+    article_title = art.get("article_title", "")
+
+    # ── Executive summary ─────────────────────────────────────────
+    _render_executive_summary(art.get('executive_summary',''))
+
+    # ── Body sections — full-width image above each section ───────
+    for sec in art.get("sections", []):
+        _render_section(sec)
 
     # ── Comparison section ────────────────────────────────────────
     cmp = art.get("comparison", {})
@@ -1646,20 +5591,38 @@ def render_article(art: dict):
                         unsafe_allow_html=True)
 
 
-def _generate_rerun_strategies(qa_checks: list[dict]) -> list[dict]:
-    """Return 3 targeted regeneration strategy dicts based on which QA checks failed."""
+def _generate_rerun_strategies(qa_checks: list[dict], art: dict | None = None) -> list[dict]:
+    """
+    Return 3 targeted regeneration strategy dicts based on which QA checks
+    failed — plus, first, a section-scoped "Targeted Fix" when every failure
+    maps to specific article fields (see qa_fix_targets).
+    """
     failed = [c for c in qa_checks if not c.get("passed")]
     if not failed:
         return []
 
+    targeted = []
+    targets = qa_fix_targets(art, qa_checks) if art else None
+    if targets:
+        targeted.append({
+            "icon": "✂️",
+            "label": "Targeted Fix",
+            "description": (
+                f"Rewrite only {_describe_targets(targets)} and keep the rest of the "
+                "article as is — a fraction of a full regeneration's tokens and time."
+            ),
+            "guidance": "\n".join(f"• [{c.get('category','?')}] {c['check']}" for c in failed),
+            "targets": targets,
+        })
+
+    strategies = []
+
     # Group failures by category
     failed_cats: dict[str, list[str]] = {}
     for c in failed:
         cat = c.get("category", "Other")
         failed_cats.setdefault(cat, []).append(c["check"])
 
-    strategies = []
-
     # Strategy A — deep fix on worst category
     top_cat = max(failed_cats, key=lambda k: len(failed_cats[k]))
     top_checks = failed_cats[top_cat]
@@ -1736,17 +5699,19 @@ def _generate_rerun_strategies(qa_checks: list[dict]) -> list[dict]:
             ),
         })
 
-    return strategies[:3]
+    return targeted + strategies[:3]
 
 
+@traced(cat="render")
 def render_quality_audit(qa_checks: list[dict], model_audit: list[dict] | None = None,
-                          on_rerun=None, rubric_scores: dict | None = None):
+                          on_rerun=None, rubric_scores: dict | None = None, art: dict | None = None):
     """
     Rich visual QA panel.
     qa_checks     — programmatic 10-gate checks from run_comprehensive_qa()
     model_audit   — 4-gate self-report from the AI (optional)
-    on_rerun      — callable; if provided, shows a Re-generate button
+    on_rerun      — callable(failed, guidance, targets); if provided, shows a Re-generate button
     rubric_scores — dict {criterion: score} from score_article_rubric()
+    art           — the checked article; enables the section-scoped "Targeted Fix" strategy
     """
     st.markdown("### 🔍 Publication Quality Audit")
 
@@ -1877,7 +5842,7 @@ def render_quality_audit(qa_checks: list[dict], model_audit: list[dict] | None =
         )
         rerun_count = st.session_state.get("qa_rerun_count", 0)
         if rerun_count < 2:
-            strategies = _generate_rerun_strategies(qa_checks)
+            strategies = _generate_rerun_strategies(qa_checks, art)
             selected_strategy = st.session_state.get("qa_rerun_strategy")
             selected_label = selected_strategy["label"] if selected_strategy else None
 
@@ -1910,7 +5875,7 @@ def render_quality_audit(qa_checks: list[dict], model_audit: list[dict] | None =
                     key="qa_rerun_btn",
                     type="primary",
                 ):
-                    on_rerun(all_failed, selected_strategy["guidance"])
+                    on_rerun(all_failed, selected_strategy["guidance"], selected_strategy.get("targets"))
             else:
                 st.info("Select a strategy above, then click Regenerate.")
         else:
@@ -1995,13 +5960,44 @@ def _article_to_markdown(art: dict) -> str:
 # ══════════════════════════════════════════════════════════════════
 # 9 · SIDEBAR
 # ══════════════════════════════════════════════════════════════════
+def render_telemetry_panel():
+    """Per-step latency / tokens / cost for this session (from telemetry)."""
+    summary = telemetry.summary(st.session_state.get("trace_session"))
+    if not summary["steps"]:
+        return
+    rows = summary["steps"]
+    total_cost = sum(r["cost_usd"] for r in rows.values())
+    total_time = sum(r["latency_s"] for r in rows.values())
+    with st.sidebar.expander(f"📈 Session cost ${total_cost:.3f} · {total_time:.0f}s in API calls"):
+        lines = ["| Step | Calls | Latency | Tokens in/out | Cost |", "|---|---:|---:|---:|---:|"]
+        for step, r in sorted(rows.items()):
+            calls = str(r["calls"]) + (f" ({r['errors']} ✗)" if r["errors"] else "")
+            lines.append(
+                f"| {step} | {calls} "
+                f"| {r['latency_s']:.1f}s | {r['input'] + r['cached']:,}/{r['output'] + r['thinking']:,} "
+                f"| ${r['cost_usd']:.3f} |"
+            )
+        st.markdown("\n".join(lines))
+        slowest = sorted(summary["labels"].items(), key=lambda kv: -kv[1]["latency_s"])[:5]
+        st.caption("Slowest call sites: " + " · ".join(
+            f"{label} {r['latency_s']:.1f}s/{r['calls']}" for label, r in slowest
+        ))
+        if telemetry.path:
+            st.caption(f"Trace: `{os.path.relpath(telemetry.path, BASE_DIR)}`")
+        if span_exporter.path:
+            st.caption(
+                f"Spans: `{os.path.relpath(span_exporter.path, BASE_DIR)}` — "
+                "open in ui.perfetto.dev or chrome://tracing"
+            )
+
+
 def render_sidebar():
     st.sidebar.markdown("## ⚙️ Configuration")
 
     api_key = st.sidebar.text_input(
         "Gemini API Key  *(research)*",
         type="password",
-        value=os.environ.get("GEMINI_API_KEY", ""),
+        value=os.environ.get("GEMINI_API_KEY", "") or default_api_key("gemini"),
         help="Used for Steps 1–4 (topic search, source gathering). Get one at aistudio.google.com",
     )
     if api_key:
@@ -2010,7 +6006,7 @@ def render_sidebar():
     anthropic_key = st.sidebar.text_input(
         "Anthropic API Key  *(article writing)*",
         type="password",
-        value=os.environ.get("ANTHROPIC_API_KEY", ""),
+        value=os.environ.get("ANTHROPIC_API_KEY", "") or default_api_key("anthropic"),
         help=f"Used for Step 5 article generation ({CLAUDE_MODEL}). Get one at console.anthropic.com",
     )
     if anthropic_key:
@@ -2026,6 +6022,109 @@ def render_sidebar():
     st.sidebar.markdown(f"**Writing:** `{st.session_state.get('claude_model_used', CLAUDE_MODEL)}`")
     st.sidebar.markdown(f"**Step:** {st.session_state.step} / 5")
 
+    cache = get_response_cache()
+    if cache is not None:
+        cs = cache.stats()
+        st.sidebar.caption(
+            f"Response cache: {cs['hits']} hits · {cs['misses']} misses · "
+            f"{cs['entries']} entries ({cs['bytes'] / 1e6:.1f} MB)"
+        )
+    health = [
+        f"{'🟢' if h['state'] == ModelHealth.CLOSED else '🔴' if h['state'] == ModelHealth.OPEN else '🟡'} "
+        f"{key} {h['error_rate']:.0%} err"
+        + (f" · {h['latency_ewma']:.1f}s" if h["latency_ewma"] is not None else "")
+        for key, h in model_health.snapshot().items()
+        if not key.startswith("provider:")
+    ]
+    if health:
+        st.sidebar.caption("Model health: " + " | ".join(health))
+    pools = [
+        f"{p} {ks['keys']} keys" + (f" ({ks['quarantined']} quarantined)" if ks["quarantined"] else "")
+        for p in ("gemini", "anthropic")
+        if (pool := get_key_pool(p)) is not None and (ks := pool.stats())
+    ]
+    if pools:
+        st.sidebar.caption(f"Key pool ({KEY_POOL_STRATEGY.replace('_', '-')}): " + " · ".join(pools))
+    jq = get_job_queue()
+    if jq is not None:
+        js = jq.stats()
+        if js["queued"] or js["running"]:
+            st.sidebar.caption(f"Generation jobs: {js['running']} running · {js['queued']} queued")
+    wf = workflow.stats()
+    if wf["hits"]:
+        st.sidebar.caption(f"Workflow memo: {wf['hits']} step{'s' if wf['hits'] != 1 else ''} reused · "
+                           f"{wf['misses']} computed")
+    rl = rate_limiter.totals()
+    if rl["waits"] or rl["throttled"]:
+        st.sidebar.caption(
+            f"Rate limiter: {rl['queued']} queued · {rl['waits']} waited "
+            f"(avg {rl['wait_avg']:.1f}s, max {rl['wait_max']:.1f}s) · {rl['throttled']} × 429"
+        )
+    cu = st.session_state.get("claude_usage")
+    if cu:
+        st.sidebar.caption(
+            f"Claude prompt cache: {cu['cache_read']:,} read · {cu['cache_write']:,} written · "
+            f"{cu['input']:,} uncached input tokens ({cu['calls']} call{'s' if cu['calls'] != 1 else ''})"
+        )
+
+    render_telemetry_panel()
+
+    st.sidebar.checkbox(
+        "Hedge grounded search",
+        key="hedge_search",
+        help=(
+            "When a Google Search call is slower than "
+            f"p{round(SEARCH_HEDGE_PERCENTILE * 100)} of recent ones, start a JSON-mode call "
+            "in parallel and keep whichever usable answer arrives first. "
+            "Cuts tail latency on Steps 1→2 and 3→4 at the cost of extra API calls."
+        ),
+    )
+    if st.session_state.get("hedge_search"):
+        hedged = won = 0
+        for counts in hedge_tracker.stats().values():
+            hedged += counts["hedged"]
+            won += counts["hedge_won"]
+        if hedged:
+            st.sidebar.caption(
+                f"Hedges fired: {hedged} · won by JSON mode: {won} ({won / hedged:.0%}) · "
+                f"by search: {hedged - won}"
+            )
+
+    st.sidebar.checkbox(
+        "Speculative prefetch",
+        key="speculative_prefetch",
+        help=(
+            "While you read the topics, fetch titles for all of them in the background; "
+            f"while you read the titles, start research for the top {PREFETCH_RESEARCH_TOP}. "
+            "The click then picks up the finished (or in-flight) result. "
+            f"Budget per article: {PREFETCH_MAX_CALLS} speculative calls, "
+            f"~{PREFETCH_MAX_TOKENS:,} tokens."
+        ),
+    )
+    pf = st.session_state.get("prefetch")
+    if st.session_state.get("speculative_prefetch") and pf:
+        ps = pf.stats()
+        st.sidebar.caption(
+            f"Prefetch: {ps['hits']} used · {ps['wasted']} unused · {ps['pending']} pending · "
+            f"budget {ps['calls']}/{pf.max_calls} calls, ~{ps['tokens']:,}/{pf.max_tokens:,} tokens"
+        )
+
+    st.sidebar.selectbox(
+        "Candidate articles (best of N)",
+        options=list(range(1, BEST_OF_MAX + 1)),
+        key="best_of_n",
+        help=(
+            "Write this many drafts in parallel, run the QA gates on each and keep the one "
+            "that passes the most. Costs N× the article tokens up front, but often saves "
+            "one or more manual re-runs. 1 = off."
+        ),
+    )
+    if st.session_state.get("best_of_n", 1) > 1:
+        st.sidebar.checkbox("Mix Claude and Gemini drafts", key="best_of_mix",
+                            help="Alternate writers across candidates (needs an Anthropic key).")
+        st.sidebar.checkbox("Rank candidates by rubric too", key="best_of_rubric",
+                            help="Break QA ties with the AI rubric score (one extra call per candidate).")
+
     st.sidebar.markdown("---")
     st.sidebar.markdown("### Workflow Overview")
     for i, (_, label) in enumerate(STEPS, 1):
@@ -2081,7 +6180,7 @@ def step_1_category(client):
                 st.session_state.category = cat
                 st.session_state.step = 2
                 with st.spinner(f"Searching 2025-2026 trends in {cat}…"):
-                    st.session_state.topics = fetch_topics(client, cat)
+                    st.session_state.topics = workflow.run("topics", {"category": cat}, client=client)
                 st.rerun()
 
 
@@ -2090,6 +6189,7 @@ def step_2_topics():
     st.markdown(f"## Step 2 · Trending Topics in *{st.session_state.category}*")
     st.markdown('<p style="color:#94a3b8">Based on 2025–2026 data · Google Search grounded</p>',
                 unsafe_allow_html=True)
+    prefetch_titles(st.session_state._client, st.session_state.topics)
 
     for i, t in enumerate(st.session_state.topics):
         st.markdown(f"""
@@ -2102,9 +6202,11 @@ def step_2_topics():
             st.session_state.topic = t
             st.session_state.step = 3
             with st.spinner("Generating SEO/AEO-optimized titles…"):
-                st.session_state.titles = fetch_titles(
-                    st.session_state._client, t
+                st.session_state.titles = take_prefetched("titles", t["title"]) or workflow.run(
+                    "titles", {"topic": t}, client=st.session_state._client
                 )
+            if st.session_state.prefetch:
+                st.session_state.prefetch.discard("titles")
             st.rerun()
 
 
@@ -2123,6 +6225,7 @@ def step_3_titles():
         "failure-case":   "#ef4444",
         "comparative":    "#8b5cf6",
     }
+    prefetch_research(st.session_state._client, st.session_state.titles)
 
     for i, t in enumerate(st.session_state.titles):
         angle = t.get("angle", "")
@@ -2141,11 +6244,13 @@ def step_3_titles():
             st.session_state.title = t
             st.session_state.step = 4
             with st.spinner("Conducting deep research — searching 8 high-authority sources…"):
-                srcs, ctx = deep_research(
-                    st.session_state._client, t["title"]
+                srcs, ctx = take_prefetched("research", t["title"]) or workflow.run(
+                    "research", {"title": t["title"]}, client=st.session_state._client
                 )
                 st.session_state.sources = srcs
                 st.session_state.notebooklm_context = ctx
+            if st.session_state.prefetch:
+                st.session_state.prefetch.discard("research")
             st.rerun()
 
 
@@ -2265,15 +6370,24 @@ def step_4_research():
         )
 
     # ── Competitor Collection Button ─────────────────────────────
-    collect_button = st.button(
-        "📥 Collect Competitor Articles",
-        disabled=st.session_state.get("collection_in_progress", False),
-    )
+    col_collect, col_force = st.columns([2, 1])
+    with col_collect:
+        collect_button = st.button(
+            "📥 Collect Competitor Articles",
+            disabled=st.session_state.get("collection_in_progress", False),
+        )
+    with col_force:
+        force_refresh = st.checkbox(
+            "Force refresh",
+            key="competitor_force_refresh",
+            help="Re-query every competitor, even ones collected within the last "
+                 f"{COMPETITOR_TTL_SECONDS // 3600} h.",
+        )
     if collect_button and not st.session_state.get("collection_in_progress", False):
         st.session_state.collection_in_progress = True
         try:
             with st.spinner("🔍 AI collecting articles..."):
-                result = collect_competitor_articles()
+                result = collect_competitor_articles(force_refresh=force_refresh)
             if result is not None:
                 companies, articles = result
                 st.success(f"Competitor data collected! {companies} companies, {articles} articles")
@@ -2305,10 +6419,7 @@ def step_4_research():
             st.session_state.sources_confirmed = True
             st.session_state.step = 5
             st.session_state.qa_rerun_count = 0
-            competitors_data = load_competitors_data()
-            competitive_ctx = build_competitive_context(
-                st.session_state.get("category", ""), competitors_data
-            )
+            competitive_ctx = build_competitive_context(st.session_state.get("category", ""))
             st.session_state.competitive_context = competitive_ctx
             _do_generate(title, accepted_sources, qa_feedback="", competitive_context=competitive_ctx)
             st.rerun()
@@ -2330,100 +6441,104 @@ def _is_credit_error(exc: Exception) -> bool:
     return any(k in msg for k in _CREDIT_ERRORS)
 
 
-def _do_generate(title: str, accepted_sources: list[dict], qa_feedback: str = "", competitive_context: str = ""):
+def _do_generate(title: str, accepted_sources: list[dict], qa_feedback: str = "", competitive_context: str = "",
+                 base_article: dict | None = None, fix_targets: list[str] | None = None,
+                 rerun: bool = False):
     """
-    Article generation with smart fallback:
-      1. Claude (if Anthropic key present)           → best writing quality
-      2. Gemini 2.5 Pro (auto-fallback on any error) → uses same NotebookLM context
-    Hallucination prevention is maintained in both paths via:
-      - Strict citation rules [N] in prompt
-      - NotebookLM context injected as grounding
-      - Accepted-source whitelist enforced
+    Queue Step 5 generation as a background job — Step 5 then polls it, so
+    reruns and reloads neither interrupt nor repeat it. Without a job queue,
+    runs produce_article() inline with spinners and a live preview.
+    base_article / fix_targets make it a targeted re-run (see revise_article);
+    the sidebar's best-of-N settings apply to every other run. rerun (QA
+    re-runs, failure retries) bumps gen_attempt for a fresh draft; otherwise
+    unchanged inputs reuse the memoized one.
     """
-    anthropic_client = st.session_state.get("_anthropic_client")
-    art = None
+    if rerun:
+        st.session_state.gen_attempt = st.session_state.get("gen_attempt", 0) + 1
+    best_of = dict(
+        candidates=int(st.session_state.get("best_of_n", 1) or 1),
+        mix_writers=bool(st.session_state.get("best_of_mix", False)),
+        rank_by_rubric=bool(st.session_state.get("best_of_rubric", False)),
+    )
+    job_id = submit_generation_job(title, accepted_sources, qa_feedback=qa_feedback,
+                                   competitive_context=competitive_context,
+                                   base_article=base_article, fix_targets=fix_targets,
+                                   attempt=st.session_state.gen_attempt, **best_of)
+    if job_id is None:
+        produce_article(title, accepted_sources, qa_feedback=qa_feedback,
+                        competitive_context=competitive_context,
+                        on_part=ArticlePreview().on_part, status=st.spinner,
+                        base_article=base_article, fix_targets=fix_targets,
+                        attempt=st.session_state.gen_attempt, **best_of)
+        return
+    st.session_state.gen_job = job_id
+    st.session_state.gen_error = ""
+    st.query_params["job"] = job_id
 
-    # ── Attempt 1: Claude ────────────────────────────────────────
-    if anthropic_client:
-        spinner_msg = f"✍️ Claude ({st.session_state.get('claude_model_used', CLAUDE_MODEL)}) is writing…"
-        with st.spinner(spinner_msg):
-            try:
-                art = generate_article_claude(
-                    anthropic_client,
-                    title,
-                    accepted_sources,
-                    st.session_state.sources,
-                    st.session_state.notebooklm_context,
-                    qa_feedback=qa_feedback,
-                    competitive_context=competitive_context,
-                )
-                st.session_state.actual_writer   = "claude"
-                st.session_state.fallback_reason = ""
-            except Exception as exc:
-                if _is_credit_error(exc):
-                    # Credit depleted — fall through to Gemini
-                    st.session_state.fallback_reason = (
-                        f"Anthropic credit balance too low — article written by Gemini ({MODEL_REASONING}) instead. "
-                        f"Add credits at console.anthropic.com/billing to use Claude next time."
-                    )
-                else:
-                    # Non-billing Claude error — still try Gemini as safety net
-                    st.session_state.fallback_reason = (
-                        f"Claude error ({str(exc)[:120]}) — automatically fell back to Gemini."
-                    )
 
-    # ── Attempt 2: Gemini (primary when no Anthropic key, or fallback) ──
-    if art is None:
-        writer_label = (
-            "Gemini (fallback)" if st.session_state.fallback_reason
-            else f"Gemini ({MODEL_REASONING})"
-        )
-        with st.spinner(f"✍️ Writing with {writer_label}…"):
-            try:
-                art = generate_article(
-                    st.session_state._client,
-                    title,
-                    accepted_sources,
-                    st.session_state.notebooklm_context,
-                    competitive_context=competitive_context,
-                )
-                st.session_state.actual_writer = (
-                    "gemini_fallback" if st.session_state.fallback_reason else "gemini"
-                )
-            except Exception as exc2:
-                st.session_state.gen_error = str(exc2)
-                return
+def _poll_generation_job() -> bool:
+    """
+    Show the session's generation job progress; True while it is pending
+    (a rerun is scheduled). A finished job's result is applied, a failed
+    one becomes gen_error.
+    """
+    queue = get_job_queue()
+    job = queue.get(st.session_state.gen_job) if queue else None
+    st.session_state.gen_job = None
+    if job is None:
+        st.session_state.gen_error = "The generation job was lost — please retry."
+        st.query_params.pop("job", None)     # don't re-attach to it on the next rerun / reload
+        return False
+    if job["status"] == JobQueue.DONE:
+        apply_generation_result(job["result"])
+        return False
+    if job["status"] == JobQueue.FAILED:
+        st.session_state.gen_error = job["error"] or "Generation failed."
+        st.query_params.pop("job", None)
+        return False
 
-    # ── Commit results ───────────────────────────────────────────
-    st.session_state.article   = art
-    st.session_state.metadata  = art.get("metadata", {})
-    st.session_state.audit     = art.get("quality_audit", [])
-    st.session_state.qa_checks = run_comprehensive_qa(art)
-    st.session_state.gen_error = ""
-    with st.spinner("📊 Scoring article on rubric criteria…"):
-        st.session_state.rubric_scores = score_article_rubric(
-            st.session_state._client, art
-        )
+    st.session_state.gen_job = job["id"]
+    waited = time.time() - job["created_at"]
+    label = job["progress"] if job["status"] == JobQueue.RUNNING else "Queued — waiting for a worker…"
+    st.info(f"⏳ {label}  ({waited:.0f}s)")
+    st.caption("Generation runs in the background — reloading this page or clicking elsewhere won't interrupt it.")
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
+    return True
 
-    # ── Download 1 hero image server-side (avoids browser CSP blocks) ─
-    hero_prompt = (
-        f"cinematic wide-angle technical illustration for: {title}, "
-        "dark background, indigo and cyan glow, professional tech photography style, "
-        "high detail, 8k, no text"
-    )
-    img_url = pollinations_url(hero_prompt, w=1400, h=500, seed=_seed(title))
-    try:
-        with st.spinner("🖼 Generating hero image…"):
-            r = requests.get(img_url, timeout=35)
-        st.session_state.hero_image_bytes = r.content if r.status_code == 200 else None
-    except Exception:
-        st.session_state.hero_image_bytes = None
+
+def _resume_job_from_url() -> None:
+    """After a reload, re-attach this new session to the queued / running generation job in the URL (?job=…)."""
+    job_id = st.query_params.get("job")
+    if not job_id or st.session_state.gen_job or st.session_state.article:
+        return
+    queue = get_job_queue()
+    job = queue.get(job_id) if queue else None
+    if (job is None or job["kind"] != "generate"
+            or job["status"] not in (JobQueue.QUEUED, JobQueue.RUNNING)):
+        st.query_params.pop("job", None)
+        return
+    inputs, meta = job["inputs"], job["meta"] or {}
+    st.session_state.category           = meta.get("category")
+    st.session_state.topic              = meta.get("topic")
+    st.session_state.title              = meta.get("title") or {"title": inputs["title"]}
+    st.session_state.sources            = inputs["sources"]
+    st.session_state.accepted_sources   = inputs["accepted_sources"]
+    st.session_state.notebooklm_context = inputs["notebooklm_context"]
+    st.session_state.competitive_context = inputs["competitive_context"]
+    st.session_state.sources_confirmed  = True
+    st.session_state.step               = 5
+    st.session_state.gen_job            = job_id
 
 
 def step_5_article():
     """Render generated article + quality audit with re-generate support."""
     title = st.session_state.title["title"]
 
+    # ── Background generation job still running ──────────────────
+    if st.session_state.get("gen_job") and _poll_generation_job():
+        return
+
     # ── Generation error ─────────────────────────────────────────
     if st.session_state.gen_error:
         st.error(f"Generation error: {st.session_state.gen_error}")
@@ -2436,7 +6551,7 @@ def step_5_article():
             if st.button("🔁 Retry Generation"):
                 _do_generate(
                     title, st.session_state.accepted_sources,
-                    competitive_context=st.session_state.get("competitive_context", ""),
+                    competitive_context=st.session_state.get("competitive_context", ""), rerun=True,
                 )
                 st.rerun()
         return
@@ -2457,6 +6572,17 @@ def step_5_article():
     if hero_bytes:
         st.image(hero_bytes, use_container_width=True)
 
+    # ── Best-of-N summary ─────────────────────────────────────────
+    cands = st.session_state.get("candidates") or []
+    if len(cands) > 1:
+        st.caption(f"Best of {len(cands)}: " + " · ".join(
+            f"{'**' if c['chosen'] else ''}#{c['candidate'] + 1} {c['writer']} "
+            f"{c['qa_passed']}/{c['qa_total']} QA"
+            + (f", rubric {c['rubric']:.1f}" if c.get("rubric") is not None else "")
+            + ("** ✓" if c["chosen"] else "")
+            for c in cands
+        ))
+
     # ── Fallback banner ───────────────────────────────────────────
     fallback_reason = st.session_state.get("fallback_reason", "")
     if fallback_reason:
@@ -2515,7 +6641,8 @@ def step_5_article():
         qa_checks    = st.session_state.qa_checks
         model_audit  = st.session_state.audit
 
-        def handle_rerun(failed_labels: list[str], strategy_guidance: str = ""):
+        def handle_rerun(failed_labels: list[str], strategy_guidance: str = "",
+                         targets: list[str] | None = None):
             st.session_state.qa_rerun_count += 1
             st.session_state.qa_rerun_strategy = None   # reset selection for next round
             feedback = strategy_guidance or (
@@ -2524,6 +6651,7 @@ def step_5_article():
             _do_generate(
                 title, st.session_state.accepted_sources, qa_feedback=feedback,
                 competitive_context=st.session_state.get("competitive_context", ""),
+                base_article=art if targets else None, fix_targets=targets, rerun=True,
             )
             st.rerun()
 
@@ -2532,6 +6660,7 @@ def step_5_article():
             model_audit=model_audit,
             on_rerun=handle_rerun,
             rubric_scores=st.session_state.get("rubric_scores"),
+            art=art,
         )
 
     with tab_meta:
@@ -2542,18 +6671,17 @@ def step_5_article():
         render_export_buttons(art)
 
     with tab_competitors:
-        competitors_data = load_competitors_data()
         category = st.session_state.get("category", "")
-        if competitors_data:
-            matched = load_competitors_for_category(category, competitors_data)
-            if matched:
-                render_competitors_dashboard(category, matched)
-            else:
-                st.warning(f"No competitors for '{category}'")
-                avail = [k for k in competitors_data if k != "schema_version"]
-                if avail:
-                    sel = st.selectbox("Select category to view:", avail)
-                    render_competitors_dashboard(sel, competitors_data[sel])
+        matched = load_competitors_for_category(category)
+        competitors_data = None if matched else load_competitors_data()
+        if matched:
+            render_competitors_dashboard(category, matched)
+        elif competitors_data:
+            st.warning(f"No competitors for '{category}'")
+            avail = [k for k in competitors_data if k != "schema_version"]
+            if avail:
+                sel = st.selectbox("Select category to view:", avail)
+                render_competitors_dashboard(sel, competitors_data[sel])
         else:
             st.info("No competitor data yet. Use Step 4 to collect.")
 
@@ -2566,6 +6694,11 @@ def step_5_article():
             st.rerun()
     with col_new:
         if st.button("🔄 New Article"):
+            drop_article_context_cache(st.session_state.get("_client"))
+            if st.session_state.get("prefetch"):
+                st.session_state.prefetch.discard()
+            end_trace_run()
+            st.query_params.clear()
             for k in list(st.session_state.keys()):
                 if k not in ("_api_key", "_client", "_anthropic_client"):
                     del st.session_state[k]
@@ -2576,6 +6709,11 @@ def step_5_article():
 # 11 · MAIN ROUTER
 # ══════════════════════════════════════════════════════════════════
 def main():
+    _setup_page()
+    _init()
+    _resume_job_from_url()
+    set_trace_context(session=st.session_state.trace_session, step=st.session_state.step)
+    begin_trace_rerun(st.session_state.step)
     render_header()
 
     # Sidebar — get API keys
@@ -2602,19 +6740,20 @@ def main():
 
     # Route to correct step
     s = st.session_state.step
-    if s == 1:
-        step_1_category(client)
-    elif s == 2:
-        step_2_topics()
-    elif s == 3:
-        step_3_titles()
-    elif s == 4:
-        step_4_research()
-    elif s == 5:
-        step_5_article()
-    else:
-        st.session_state.step = 1
-        st.rerun()
+    with span(f"rerun · step {s}", "rerun"):
+        if s == 1:
+            step_1_category(client)
+        elif s == 2:
+            step_2_topics()
+        elif s == 3:
+            step_3_titles()
+        elif s == 4:
+            step_4_research()
+        elif s == 5:
+            step_5_article()
+        else:
+            st.session_state.step = 1
+            st.rerun()
 
 
 if __name__ == "__main__":
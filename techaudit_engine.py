@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Headless batch pipeline: category → topics → titles → research → article →
+QA → export, without the Streamlit UI.
+
+Each article runs against its own RunState (bound with bind_state), so the
+core functions in techaudit_agent never touch st.session_state and jobs can
+run side by side on a thread pool — or a process pool, where every worker
+builds its own engine from the same settings.
+
+    python techaudit_engine.py --category "AI Performance Engineering" \\
+        --topics 3 --titles 2 --workers 4 --out exports/
+
+Keys come from --gemini-key / --anthropic-key or the same environment
+variables the sidebar reads (GEMINI_API_KEY, ANTHROPIC_API_KEY, then the
+*_API_KEYS pools).
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import techaudit_agent as ta  # noqa: E402
+
+_log = logging.getLogger("techaudit_engine")
+
+
+@dataclass
+class ArticleJob:
+    """One article to produce: the chosen topic and title dicts from Steps 2–3."""
+    category: str
+    topic: dict
+    title: dict
+
+
+@dataclass
+class ArticleResult:
+    job: ArticleJob
+    ok: bool
+    writer: str = ""                 # "claude" | "gemini" | "gemini_fallback"
+    fallback_reason: str = ""
+    qa_failed: int = 0               # QA checks that did not pass
+    rubric: dict = field(default_factory=dict)
+    paths: list[str] = field(default_factory=list)
+    error: str = ""
+    seconds: float = 0.0
+
+
+def _slugify(text: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+    return slug[:80] or "article"
+
+
+class PipelineEngine:
+    """
+    Runs the workflow headlessly. plan() expands a category into jobs,
+    run_job() researches, writes, checks and exports one title, and
+    run_batch() fans jobs out over a thread or process pool.
+    """
+
+    def __init__(self, gemini_key: str, anthropic_key: str | None = None,
+                 out_dir: str = "exports", competitive: bool = True):
+        if not gemini_key:
+            raise ValueError("A Gemini API key is required.")
+        self.gemini_key = gemini_key
+        self.anthropic_key = anthropic_key or None
+        self.out_dir = out_dir
+        self.competitive = competitive
+        self.client = ta.get_client(gemini_key)
+        self.anthropic_client = (
+            ta.get_anthropic_client(self.anthropic_key) if self.anthropic_key else None
+        )
+
+    def settings(self) -> dict:
+        """Constructor kwargs — enough to rebuild this engine in another process."""
+        return {"gemini_key": self.gemini_key, "anthropic_key": self.anthropic_key,
+                "out_dir": self.out_dir, "competitive": self.competitive}
+
+    def new_state(self, **overrides) -> ta.RunState:
+        """Fresh per-article state carrying this engine's clients."""
+        return ta.RunState.new(_client=self.client, _anthropic_client=self.anthropic_client,
+                               _api_key=self.gemini_key, **overrides)
+
+    # ── Planning (Steps 1–3) ─────────────────────────────────────
+    def plan(self, category: str, n_topics: int = 3, titles_per_topic: int = 1,
+             workers: int = 4) -> list[ArticleJob]:
+        """Trending topics for category, then titles for each topic in parallel."""
+        state = self.new_state(category=category, step=2)
+
+        def titles_for(topic: dict) -> list[ArticleJob]:
+            with ta.bind_state(state):
+                titles = ta.workflow.run("titles", {"topic": topic}, client=self.client)[:titles_per_topic]
+            return [ArticleJob(category, topic, t) for t in titles]
+
+        with ta.bind_state(state):
+            topics = ta.workflow.run("topics", {"category": category}, client=self.client)[:n_topics]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            batches = pool.map(lambda t: contextvars.copy_context().run(titles_for, t), topics)
+            return [job for batch in batches for job in batch]
+
+    # ── One article (Steps 4–5 + export) ─────────────────────────
+    def run_job(self, job: ArticleJob) -> ArticleResult:
+        """Research, write, QA and export one title. Errors land in the result."""
+        return contextvars.copy_context().run(self._run_job, job)
+
+    def _run_job(self, job: ArticleJob) -> ArticleResult:
+        t0 = time.monotonic()
+        title = job.title.get("title", "")
+        state = self.new_state(category=job.category, topic=job.topic, title=job.title, step=4)
+        with ta.bind_state(state):
+            ta.set_trace_context(session=state.trace_session, step=4)
+            try:
+                # Memoized per title: repeated titles in a batch share one research pass
+                state.sources, state.notebooklm_context = ta.workflow.run(
+                    "research", {"title": title}, client=self.client)
+                # Headless: every source is accepted, as in the UI's default
+                state.accepted_sources = list(state.sources)
+                state.sources_confirmed = True
+                if not state.accepted_sources:
+                    raise RuntimeError("Research returned no sources.")
+                state.competitive_context = (
+                    ta.build_competitive_context(job.category) if self.competitive else ""
+                )
+                state.step = 5
+                ta.set_trace_context(session=state.trace_session, step=5)
+                art = ta.produce_article(title, state.accepted_sources,
+                                         competitive_context=state.competitive_context)
+                if art is None:
+                    raise RuntimeError(state.gen_error or "Article generation failed.")
+                paths = self.export(state)
+            except Exception as exc:
+                _log.warning("Job failed for %r: %s", title, exc)
+                return ArticleResult(job, ok=False, error=str(exc),
+                                     seconds=time.monotonic() - t0)
+            finally:
+                ta.drop_article_context_cache(self.client)
+        return ArticleResult(
+            job, ok=True,
+            writer=state.actual_writer,
+            fallback_reason=state.fallback_reason,
+            qa_failed=sum(1 for c in state.qa_checks if not c.get("passed")),
+            rubric=state.rubric_scores or {},
+            paths=paths,
+            seconds=time.monotonic() - t0,
+        )
+
+    def export(self, state: ta.RunState) -> list[str]:
+        """Write <slug>.md, <slug>.json (article + QA + rubric) and the hero image."""
+        art = state.article
+        slug = _slugify((state.metadata or {}).get("seo_slug") or art.get("article_title", ""))
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, slug)
+        paths = [base + ".md", base + ".json"]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            f.write(ta._article_to_markdown(art))
+        with open(paths[1], "w", encoding="utf-8") as f:
+            json.dump({
+                "category": state.category,
+                "topic": state.topic,
+                "title": state.title,
+                "article": art,
+                "accepted_sources": state.accepted_sources,
+                "qa_checks": state.qa_checks,
+                "rubric_scores": state.rubric_scores,
+                "writer": state.actual_writer,
+                "fallback_reason": state.fallback_reason,
+            }, f, indent=2, default=str)
+        if state.hero_image_bytes:
+            paths.append(base + ".jpg")
+            with open(paths[-1], "wb") as f:
+                f.write(state.hero_image_bytes)
+        return paths
+
+    # ── Batch ────────────────────────────────────────────────────
+    def run_batch(self, jobs: list[ArticleJob], workers: int = 4, processes: bool = False,
+                  on_result: Optional[Callable[[ArticleResult], None]] = None) -> list[ArticleResult]:
+        """Run jobs concurrently; results come back in job order."""
+        if processes:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=max(1, workers))
+            submit = lambda job: pool.submit(_process_job, self.settings(), job)  # noqa: E731
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+            submit = lambda job: pool.submit(self.run_job, job)  # noqa: E731
+        with pool:
+            futures = {submit(job): i for i, job in enumerate(jobs)}
+            results: list[Optional[ArticleResult]] = [None] * len(jobs)
+            for fut in concurrent.futures.as_completed(futures):
+                i = futures[fut]
+                try:
+                    results[i] = fut.result()
+                except Exception as exc:     # worker process died, pickling error, …
+                    results[i] = ArticleResult(jobs[i], ok=False, error=str(exc))
+                if on_result:
+                    on_result(results[i])
+        return results
+
+
+_worker_engine: Optional[PipelineEngine] = None
+
+
+def _process_job(settings: dict, job: ArticleJob) -> ArticleResult:
+    """Process-pool entry point: one engine (and client set) per worker process."""
+    global _worker_engine
+    if _worker_engine is None or _worker_engine.settings() != settings:
+        _worker_engine = PipelineEngine(**settings)
+    return _worker_engine.run_job(job)
+
+
+# ══════════════════════════════════════════════════════════════════
+# CLI
+# ══════════════════════════════════════════════════════════════════
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a batch of TechAudit articles headlessly.")
+    parser.add_argument("--category", action="append", required=True, choices=ta.CATEGORIES,
+                        help="category to plan from (repeatable)")
+    parser.add_argument("--topics", type=int, default=3, help="trending topics per category")
+    parser.add_argument("--titles", type=int, default=1, help="titles per topic")
+    parser.add_argument("--workers", type=int, default=4, help="articles generated in parallel")
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    parser.add_argument("--out", default="exports", help="export directory")
+    parser.add_argument("--no-competitive", action="store_true", help="skip competitor context")
+    parser.add_argument("--plan-only", action="store_true", help="print the planned titles and exit")
+    parser.add_argument("--gemini-key",
+                        default=os.environ.get("GEMINI_API_KEY", "") or ta.default_api_key("gemini"))
+    parser.add_argument("--anthropic-key",
+                        default=os.environ.get("ANTHROPIC_API_KEY", "") or ta.default_api_key("anthropic"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if not args.gemini_key:
+        parser.error("no Gemini API key: pass --gemini-key or set GEMINI_API_KEY")
+    engine = PipelineEngine(args.gemini_key, args.anthropic_key, out_dir=args.out,
+                            competitive=not args.no_competitive)
+
+    jobs = [job for cat in args.category
+            for job in engine.plan(cat, args.topics, args.titles, workers=args.workers)]
+    for job in jobs:
+        print(f"[plan] {job.category} · {job.topic.get('title', '')} → {job.title.get('title', '')}")
+    if args.plan_only or not jobs:
+        return 0
+
+    def report(r: ArticleResult) -> None:
+        status = f"ok ({r.writer}, {r.qa_failed} QA issues)" if r.ok else f"FAILED: {r.error[:120]}"
+        print(f"[{r.seconds:6.1f}s] {r.job.title.get('title', '')} — {status}")
+
+    os.makedirs(args.out, exist_ok=True)
+    results = engine.run_batch(jobs, workers=args.workers, processes=args.processes, on_result=report)
+    with open(os.path.join(args.out, "batch_summary.json"), "w", encoding="utf-8") as f:
+        json.dump([asdict(r) for r in results], f, indent=2, default=str)
+    failed = sum(1 for r in results if not r.ok)
+    print(f"{len(results) - failed}/{len(results)} articles exported to {args.out}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Shared fixtures. Model health, rate limits and telemetry are process-wide, so
+each test gets fresh instances — failures or 429s injected by one test must not
+open circuits or pause buckets in the next, and no test writes the on-disk traces.
+The workflow graph's memo is cleared too, so no step output leaks between tests.
+
+Streamlit and the provider SDKs are replaced by MagicMocks before any test
+module imports techaudit_agent. Importing it no longer touches them (they are
+lazy), but the code under test does: tests drive session_state as a plain
+dict, and fake Gemini responses round-trip through the mocked genai types.
+The suite therefore needs none of the SDKs installed.
+"""
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+if "techaudit_agent" not in sys.modules:
+    _mock_st = MagicMock()
+    _mock_st.session_state = {}
+    _mock_st.cache_resource = lambda f: f  # passthrough decorator
+    sys.modules["streamlit"] = _mock_st
+    sys.modules["google"] = MagicMock()
+    sys.modules["google.genai"] = MagicMock()
+    sys.modules["google.genai.types"] = MagicMock()
+    sys.modules["anthropic"] = MagicMock()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def _fresh_llm_state():
+    ta = sys.modules.get("techaudit_agent")
+    if ta is None:
+        yield
+        return
+    with patch.object(ta, "model_health", ta.HealthRegistry()), \
+         patch.object(ta, "rate_limiter", ta.RateLimiter()), \
+         patch.object(ta, "telemetry", ta.Telemetry(path=None)), \
+         patch.object(ta, "span_exporter", ta.ChromeTraceExporter(path=None)):
+        ta.workflow.clear()
+        yield
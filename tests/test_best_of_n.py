@@ -0,0 +1,89 @@
+"""
+Unit tests for best-of-N Step 5: parallel candidates, writer mixing, QA /
+rubric-based selection and partial failures.
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+
+SOURCES = [{"id": 1, "title": "S", "publisher": "P", "date": "2025", "snippet": "x"}]
+
+
+def _qa(art: dict) -> list[dict]:
+    """QA stub: art["quality"] checks pass out of 5."""
+    return [{"check": f"c{i}", "passed": i < art["quality"]} for i in range(5)]
+
+
+@pytest.fixture
+def step5():
+    """Stub everything below produce_article; yields run(quality_seq, **produce_kwargs) → (art, state)."""
+    quality = {"seq": iter([])}
+    lock = threading.Lock()
+
+    def draft(*_a, **_k):
+        with lock:
+            q = next(quality["seq"])
+        if isinstance(q, Exception):
+            raise q
+        return {"article_title": f"q{q}", "quality": q, "metadata": {}}
+
+    with patch.object(ta, "ensure_article_context_cache", return_value=None), \
+         patch.object(ta, "generate_article", side_effect=draft) as gemini, \
+         patch.object(ta, "generate_article_claude", side_effect=draft) as claude, \
+         patch.object(ta, "run_comprehensive_qa", side_effect=_qa), \
+         patch.object(ta, "score_article_rubric", side_effect=lambda c, a: {"Clarity": 10.0 - a["quality"]}), \
+         patch.object(ta, "fetch_hero_image", return_value=None):
+        def run(seq, anthropic=False, **kwargs):
+            quality["seq"] = iter(seq)
+            state = ta.RunState.new(_client=MagicMock(), sources=SOURCES, notebooklm_context="ctx",
+                                    _anthropic_client=MagicMock() if anthropic else None)
+            with ta.bind_state(state):
+                art = ta.produce_article("T", SOURCES, **kwargs)
+            return art, state
+        run.gemini, run.claude = gemini, claude
+        yield run
+
+
+class TestBestOfN:
+    def test_keeps_the_candidate_passing_most_checks(self, step5):
+        art, state = step5([2, 4, 3], candidates=3)
+        assert art["quality"] == 4 and state.article is art
+        assert step5.gemini.call_count == 3
+        # Candidates run concurrently, so which index drew which draft varies
+        assert sorted(c["qa_passed"] for c in state.candidates) == [2, 3, 4]
+        assert [c["qa_passed"] for c in state.candidates if c["chosen"]] == [4]
+        assert state.qa_checks == _qa(art)
+
+    def test_single_run_records_no_candidates(self, step5):
+        art, state = step5([3])
+        assert art["quality"] == 3 and state.candidates == []
+
+    def test_mixed_writers_alternate(self, step5):
+        _, state = step5([1, 2, 3, 4], anthropic=True, candidates=4, mix_writers=True)
+        assert step5.claude.call_count == step5.gemini.call_count == 2
+        assert [c["writer"] for c in state.candidates] == ["claude", "gemini", "claude", "gemini"]
+
+    def test_rubric_breaks_qa_ties(self, step5):
+        with patch.object(ta, "run_comprehensive_qa", return_value=[{"check": "c", "passed": True}]):
+            art, state = step5([4, 1], candidates=2, rank_by_rubric=True)
+        assert art["quality"] == 1                      # rubric = 10 - quality
+        assert sorted(c["rubric"] for c in state.candidates) == [6.0, 9.0]
+        assert [c["rubric"] for c in state.candidates if c["chosen"]] == [9.0]
+
+    def test_failed_candidates_are_skipped(self, step5):
+        art, state = step5([RuntimeError("500"), 2], candidates=2)
+        assert art["quality"] == 2 and len(state.candidates) == 1
+
+    def test_all_failed_reports_error(self, step5):
+        art, state = step5(itertools.repeat(RuntimeError("500")), candidates=2)
+        assert art is None and state.gen_error == "500"
+
+    def test_candidate_count_is_capped(self, step5):
+        step5(range(10), candidates=ta.BEST_OF_MAX + 3)
+        assert step5.gemini.call_count == ta.BEST_OF_MAX
@@ -12,25 +12,9 @@ from unittest.mock import MagicMock, patch
 
 import pytest
 
-# ── Mock Streamlit before importing techaudit_agent ──────────────
-# techaudit_agent.py calls st.set_page_config() at module level,
-# so we must mock streamlit before the import.
-_mock_st = MagicMock()
-_mock_st.session_state = {}
-_mock_st.cache_resource = lambda f: f  # passthrough decorator
-sys.modules["streamlit"] = _mock_st
-
-# Mock google.genai to avoid import errors
-_mock_genai = MagicMock()
-sys.modules["google"] = MagicMock()
-sys.modules["google.genai"] = _mock_genai
-sys.modules["google.genai.types"] = MagicMock()
-
-# Mock anthropic
-sys.modules["anthropic"] = MagicMock()
-
-# Now import the functions under test
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Streamlit is mocked in conftest.py; session_state is a plain dict there
+_mock_st = sys.modules["streamlit"]
+
 from techaudit_agent import (
     CATEGORIES,
     COMPETITORS_BY_CATEGORY,
@@ -531,3 +515,322 @@ class TestDefaultCompetitorsFile:
             data = json.load(f)
         for cat in CATEGORIES:
             assert cat in data, f"Missing category: {cat}"
+
+
+# ══════════════════════════════════════════════════════════════════
+# 11. Concurrent collection (collect_competitor_articles)
+# ══════════════════════════════════════════════════════════════════
+
+class _CollectionHarness:
+    """Shared fixture + fake fetcher for collect_competitor_articles tests."""
+    CATEGORY = "GPU Computing & Hardware"
+
+    @pytest.fixture
+    def collect_env(self, tmp_path):
+        _mock_st.session_state["category"] = self.CATEGORY
+        _mock_st.session_state["_api_key"] = "test-key"
+        _mock_st.session_state[COMPETITORS_SS_KEY] = None
+        with patch("techaudit_agent.COMPETITORS_DATA_PATH", str(tmp_path / "data.json")), \
+             patch("techaudit_agent.DEFAULT_COMPETITORS_PATH", str(tmp_path / "none.json")), \
+             patch("techaudit_agent.get_client", return_value=MagicMock()):
+            yield tmp_path
+
+    @staticmethod
+    def _fake_fetch(delay: float = 0.0, fail: set[str] = frozenset(), calls: list | None = None):
+        import asyncio
+
+        async def fetch(client, comp_key, comp_data, category, model=None, refresh=False):
+            if calls is not None:
+                calls.append(comp_key)
+            await asyncio.sleep(delay)
+            if comp_key in fail:
+                raise GeminiAPIError(f"API call failed for {comp_key}")
+            return [
+                {"title": f"{comp_key} post", "url": f"https://{comp_key}.com/post",
+                 "date": "2025-01-01", "relevance": "r"},
+                {"title": "bad", "url": "not-a-url", "date": "2025-01-01", "relevance": "r"},
+            ], model
+        return fetch
+
+
+class TestConcurrentCollection(_CollectionHarness):
+    def test_all_competitors_merged(self, collect_env):
+        from techaudit_agent import collect_competitor_articles
+
+        with patch("techaudit_agent.afetch_articles_for_competitor", self._fake_fetch()):
+            result = collect_competitor_articles()
+        n = len(COMPETITORS_BY_CATEGORY[self.CATEGORY])
+        assert result == (n, n)  # invalid URL filtered out
+        saved = _mock_st.session_state[COMPETITORS_SS_KEY][self.CATEGORY]["competitors"]
+        assert set(saved) == set(COMPETITORS_BY_CATEGORY[self.CATEGORY])
+
+    def test_runs_in_parallel(self, collect_env):
+        import time
+        from techaudit_agent import collect_competitor_articles
+
+        n = len(COMPETITORS_BY_CATEGORY[self.CATEGORY])
+        with patch("techaudit_agent.afetch_articles_for_competitor", self._fake_fetch(delay=0.2)):
+            start = time.perf_counter()
+            result = collect_competitor_articles(max_workers=n)
+            elapsed = time.perf_counter() - start
+        assert result is not None
+        assert elapsed < 0.2 * n / 2  # well under the serial time
+
+    def test_partial_failure_accounting(self, collect_env):
+        from techaudit_agent import collect_competitor_articles
+
+        fetch = self._fake_fetch(fail={"semianalysis"})
+        with patch("techaudit_agent.afetch_articles_for_competitor", fetch):
+            result = collect_competitor_articles()
+        assert result is not None
+        warnings = " ".join(str(c) for c in _mock_st.warning.call_args_list)
+        assert "Partial collection" in warnings and "SemiAnalysis" in warnings
+
+    def test_unparseable_reply_marks_competitor_failed(self, collect_env):
+        from techaudit_agent import CompetitorParseError, collect_competitor_articles
+        fetch = self._fake_fetch()
+
+        async def garbled(client, comp_key, *args, **kwargs):
+            if comp_key == "amd_gpuopen":
+                raise CompetitorParseError("Unparseable reply for amd_gpuopen")
+            return await fetch(client, comp_key, *args, **kwargs)
+
+        with patch("techaudit_agent.afetch_articles_for_competitor", fetch):
+            collect_competitor_articles()
+        with patch("techaudit_agent.afetch_articles_for_competitor", garbled):
+            assert collect_competitor_articles(force_refresh=True) is not None
+        comps = _mock_st.session_state[COMPETITORS_SS_KEY][self.CATEGORY]["competitors"]
+        assert comps["amd_gpuopen"]["last_status"] == "failed" and comps["amd_gpuopen"]["articles"]
+        warnings = " ".join(str(c) for c in _mock_st.warning.call_args_list)
+        assert "Partial collection" in warnings and "AMD" in warnings
+
+    def test_all_failed_saves_statuses_before_returning(self, collect_env):
+        from techaudit_agent import collect_competitor_articles
+        with patch("techaudit_agent.get_competitor_store", return_value=None):   # JSON-only save path
+            with patch("techaudit_agent.afetch_articles_for_competitor", self._fake_fetch()):
+                collect_competitor_articles()
+            fetch = self._fake_fetch(fail=set(COMPETITORS_BY_CATEGORY[self.CATEGORY]))
+            with patch("techaudit_agent.afetch_articles_for_competitor", fetch):
+                assert collect_competitor_articles(force_refresh=True) is None
+        saved = json.loads((collect_env / "data.json").read_text(encoding="utf-8"))
+        comps = saved[self.CATEGORY]["competitors"]
+        assert {c["last_status"] for c in comps.values()} == {"failed"}
+
+    def test_all_failed_returns_none(self, collect_env):
+        from techaudit_agent import collect_competitor_articles
+
+        fetch = self._fake_fetch(fail=set(COMPETITORS_BY_CATEGORY[self.CATEGORY]))
+        with patch("techaudit_agent.afetch_articles_for_competitor", fetch):
+            assert collect_competitor_articles() is None
+        _mock_st.error.assert_called()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 12. Freshness-aware incremental refresh
+# ══════════════════════════════════════════════════════════════════
+
+class TestCompetitorFreshness:
+    def test_missing_entry_is_stale(self):
+        from techaudit_agent import is_competitor_stale
+        assert is_competitor_stale(None) is True
+
+    def test_no_timestamp_is_stale(self, valid_data):
+        from techaudit_agent import is_competitor_stale
+        comp = valid_data["GPU Computing & Hardware"]["competitors"]["nextplatform"]
+        assert is_competitor_stale(comp) is True
+
+    def test_recent_entry_is_fresh(self):
+        from datetime import datetime, timedelta
+        from techaudit_agent import is_competitor_stale
+        now = datetime(2026, 3, 9, 12, 0)
+        comp = {"collected_timestamp": (now - timedelta(hours=1)).isoformat() + "Z",
+                "ttl_seconds": 3 * 3600, "last_status": "ok"}
+        assert is_competitor_stale(comp, now=now) is False
+        assert is_competitor_stale(comp, now=now + timedelta(hours=2)) is True
+
+    def test_failed_entry_is_stale(self):
+        from datetime import datetime
+        from techaudit_agent import is_competitor_stale
+        comp = {"collected_timestamp": datetime.now().isoformat() + "Z", "last_status": "failed"}
+        assert is_competitor_stale(comp) is True
+
+
+class TestIncrementalCollection(_CollectionHarness):
+    def _collect(self, **kwargs) -> list[str]:
+        from techaudit_agent import collect_competitor_articles
+        calls: list[str] = []
+        with patch("techaudit_agent.afetch_articles_for_competitor",
+                   self._fake_fetch(calls=calls, fail=kwargs.pop("fail", frozenset()))):
+            collect_competitor_articles(**kwargs)
+        return calls
+
+    def test_second_collection_skips_fresh(self, collect_env):
+        assert len(self._collect()) == len(COMPETITORS_BY_CATEGORY[self.CATEGORY])
+        assert self._collect() == []
+        _mock_st.info.assert_called()
+
+    def test_force_refresh_requeries_all(self, collect_env):
+        self._collect()
+        assert len(self._collect(force_refresh=True)) == len(COMPETITORS_BY_CATEGORY[self.CATEGORY])
+
+    def test_failed_competitor_retried(self, collect_env):
+        self._collect()
+        self._collect(force_refresh=True, fail={"amd_gpuopen"})
+        comps = _mock_st.session_state[COMPETITORS_SS_KEY][self.CATEGORY]["competitors"]
+        assert comps["amd_gpuopen"]["last_status"] == "failed"
+        assert comps["amd_gpuopen"]["articles"]  # previous articles kept
+        assert self._collect() == ["amd_gpuopen"]
+
+    def test_publish_keeps_other_sessions_updates(self, collect_env):
+        from techaudit_agent import collect_competitor_articles, load_competitors_data, save_competitor_entry
+        load_competitors_data()                     # this session's snapshot, taken before the update
+        fetch = self._fake_fetch()
+
+        async def fetch_while_another_session_saves(client, comp_key, *args, **kwargs):
+            save_competitor_entry("Other Category", "other", {"name": "Other", "articles": []})
+            return await fetch(client, comp_key, *args, **kwargs)
+
+        with patch("techaudit_agent.afetch_articles_for_competitor", fetch_while_another_session_saves):
+            assert collect_competitor_articles() is not None
+        data = _mock_st.session_state[COMPETITORS_SS_KEY]
+        assert "other" in data["Other Category"]["competitors"]
+        assert set(data[self.CATEGORY]["competitors"]) == set(COMPETITORS_BY_CATEGORY[self.CATEGORY])
+
+    def test_per_competitor_timestamps_written(self, collect_env):
+        self._collect()
+        comps = _mock_st.session_state[COMPETITORS_SS_KEY][self.CATEGORY]["competitors"]
+        for comp in comps.values():
+            assert comp["collected_timestamp"].endswith("Z")
+            assert comp["last_status"] == "ok"
+
+
+# ══════════════════════════════════════════════════════════════════
+# 13. SQLite competitor store
+# ══════════════════════════════════════════════════════════════════
+
+class TestCompetitorStore:
+    CATEGORY = "GPU Computing & Hardware"
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        from techaudit_agent import CompetitorStore
+        return CompetitorStore(str(tmp_path / "store.sqlite3"))
+
+    def test_default_file_roundtrip(self, store):
+        from techaudit_agent import DEFAULT_COMPETITORS_PATH
+        with open(DEFAULT_COMPETITORS_PATH, encoding="utf-8") as f:
+            original = json.load(f)
+        store.import_json(original)
+        assert store.export_json() == original
+
+    def test_load_category_case_insensitive(self, store, valid_data):
+        store.import_json(valid_data)
+        cat = store.load_category(self.CATEGORY.lower())
+        assert cat == valid_data[self.CATEGORY]
+        assert store.load_category("Quantum Computing") is None
+
+    def test_upsert_replaces_articles(self, store, valid_data):
+        store.import_json(valid_data)
+        comp = dict(valid_data[self.CATEGORY]["competitors"]["amd_gpuopen"])
+        comp["articles"] = [{"title": "New", "url": "https://gpuopen.com/new",
+                             "date": "2025-03-01", "relevance": "r"}]
+        store.upsert_competitor(self.CATEGORY, "amd_gpuopen", comp)
+        comps = store.load_category(self.CATEGORY)["competitors"]
+        assert [a["title"] for a in comps["amd_gpuopen"]["articles"]] == ["New"]
+        assert list(comps) == ["nextplatform", "amd_gpuopen"]  # order preserved
+
+    def test_load_prefers_store_over_json(self, valid_data, tmp_path):
+        json_path = tmp_path / "competitors_data.json"
+        with patch("techaudit_agent.COMPETITORS_DATA_PATH", str(json_path)):
+            save_competitors_data(valid_data)
+            json_path.write_text(json.dumps({"schema_version": "1.0"}), encoding="utf-8")
+            _mock_st.session_state[COMPETITORS_SS_KEY] = None
+            result = load_competitors_data()
+        assert self.CATEGORY in result
+
+    def test_json_file_imported_into_store(self, valid_data, tmp_path):
+        from techaudit_agent import get_competitor_store
+        json_path = tmp_path / "competitors_data.json"
+        json_path.write_text(json.dumps(valid_data), encoding="utf-8")
+        with patch("techaudit_agent.COMPETITORS_DATA_PATH", str(json_path)), \
+             patch("techaudit_agent.DEFAULT_COMPETITORS_PATH", str(tmp_path / "none.json")):
+            _mock_st.session_state[COMPETITORS_SS_KEY] = None
+            load_competitors_data()
+            assert get_competitor_store(create=False).categories() == [self.CATEGORY]
+
+    def test_category_read_without_full_load(self, valid_data, tmp_path):
+        with patch("techaudit_agent.COMPETITORS_DATA_PATH", str(tmp_path / "c.json")):
+            save_competitors_data(valid_data)
+            _mock_st.session_state[COMPETITORS_SS_KEY] = None
+            with patch("techaudit_agent.load_competitors_data") as full_load:
+                cat = load_competitors_for_category(self.CATEGORY)
+        full_load.assert_not_called()
+        assert set(cat["competitors"]) == {"nextplatform", "amd_gpuopen"}
+
+
+# ══════════════════════════════════════════════════════════════════
+# 14. Process-wide shared competitors cache
+# ══════════════════════════════════════════════════════════════════
+
+class TestSharedCompetitorsCache:
+    CATEGORY = "GPU Computing & Hardware"
+
+    @pytest.fixture
+    def data_env(self, valid_data, tmp_path):
+        json_path = tmp_path / "competitors_data.json"
+        json_path.write_text(json.dumps(valid_data), encoding="utf-8")
+        with patch("techaudit_agent.COMPETITORS_DATA_PATH", str(json_path)), \
+             patch("techaudit_agent.DEFAULT_COMPETITORS_PATH", str(tmp_path / "none.json")):
+            yield tmp_path
+
+    @staticmethod
+    def _new_session():
+        _mock_st.session_state.clear()
+
+    def test_sessions_share_one_copy(self, data_env):
+        import techaudit_agent as ta
+        with patch.object(ta, "_load_competitors_from_sources",
+                          wraps=ta._load_competitors_from_sources) as loader:
+            first = load_competitors_data()
+            self._new_session()
+            second = load_competitors_data()
+        assert first is second
+        assert loader.call_count == 1
+
+    def test_save_bumps_version_for_other_sessions(self, data_env, valid_data):
+        stale = load_competitors_data()
+        other_session = dict(_mock_st.session_state)
+        updated = {**valid_data, "Quantum": {"metadata": {}, "competitors": {}}}
+        save_competitors_data(updated)
+        _mock_st.session_state.clear()
+        _mock_st.session_state.update(other_session)      # still points at the old copy
+        assert _mock_st.session_state[COMPETITORS_SS_KEY] is stale
+        assert load_competitors_data() is updated
+
+    def test_external_write_invalidates(self, data_env, valid_data):
+        from techaudit_agent import CompetitorStore, _competitor_db_path
+        load_competitors_data()
+        other_process = CompetitorStore(_competitor_db_path())
+        comp = {**valid_data[self.CATEGORY]["competitors"]["amd_gpuopen"], "articles": []}
+        other_process.upsert_competitor(self.CATEGORY, "amd_gpuopen", comp)
+        data = load_competitors_data()
+        assert data[self.CATEGORY]["competitors"]["amd_gpuopen"]["articles"] == []
+
+    def test_collection_does_not_mutate_shared_copy(self, data_env):
+        import asyncio
+        from techaudit_agent import collect_competitor_articles
+
+        async def fetch(client, comp_key, comp_data, category, model=None, refresh=False):
+            await asyncio.sleep(0)
+            return [{"title": "t", "url": f"https://{comp_key}.com/x",
+                     "date": "2025-01-01", "relevance": "r"}], model
+
+        shared = load_competitors_data()
+        before = json.dumps(shared, sort_keys=True)
+        _mock_st.session_state["category"] = self.CATEGORY
+        _mock_st.session_state["_api_key"] = "test-key"
+        with patch("techaudit_agent.get_client", return_value=MagicMock()), \
+             patch("techaudit_agent.afetch_articles_for_competitor", fetch):
+            collect_competitor_articles()
+        assert json.dumps(shared, sort_keys=True) == before
+        assert load_competitors_data() is not shared
@@ -0,0 +1,128 @@
+"""
+Unit tests for the Gemini explicit context cache used by generate_article.
+"""
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+
+SOURCES = [{"id": 1, "title": "S", "publisher": "P", "date": "2025", "snippet": "x"}]
+
+
+class _State(dict):
+    """dict-backed session_state that also supports attribute access."""
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+
+@pytest.fixture
+def state():
+    s = _State(model_used=ta.MODEL_REASONING, gemini_context_cache=None)
+    with patch.object(ta.st, "session_state", s):
+        yield s
+
+
+class _ApiError(Exception):
+    """Stand-in for a google.genai APIError: an HTTP status in .code."""
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _client(name="cachedContents/abc"):
+    client = MagicMock()
+    client.caches.create.return_value = SimpleNamespace(name=name)
+    return client
+
+
+class TestEnsureArticleContextCache:
+    def test_created_once_per_research(self, state):
+        client = _client()
+        first = ta.ensure_article_context_cache(client, "T", SOURCES, "ctx")
+        second = ta.ensure_article_context_cache(client, "T", SOURCES, "ctx")
+        assert first == second == "cachedContents/abc"
+        assert client.caches.create.call_count == 1
+        assert client.caches.create.call_args.kwargs["model"] == ta.MODEL_REASONING
+
+    def test_changed_sources_replace_cache(self, state):
+        client = _client()
+        ta.ensure_article_context_cache(client, "T", SOURCES, "ctx")
+        ta.ensure_article_context_cache(client, "T", SOURCES[:0], "ctx")
+        client.caches.delete.assert_called_once_with(name="cachedContents/abc")
+        assert client.caches.create.call_count == 2
+
+    def test_failed_creation_not_retried_for_same_research(self, state):
+        client = _client()
+        client.caches.create.side_effect = RuntimeError("below minimum token count")
+        assert ta.ensure_article_context_cache(client, "T", SOURCES, "ctx") is None
+        assert ta.ensure_article_context_cache(client, "T", SOURCES, "ctx") is None
+        assert client.caches.create.call_count == 1
+
+    def test_ttl_extended_when_half_spent(self, state):
+        client = _client()
+        ta.ensure_article_context_cache(client, "T", SOURCES, "ctx")
+        state["gemini_context_cache"]["expires_at"] = ta.time.time() + 60
+        ta.ensure_article_context_cache(client, "T", SOURCES, "ctx")
+        client.caches.update.assert_called_once()
+        assert state["gemini_context_cache"]["expires_at"] > ta.time.time() + 60
+
+    def test_drop_deletes_and_clears(self, state):
+        client = _client()
+        ta.ensure_article_context_cache(client, "T", SOURCES, "ctx")
+        ta.drop_article_context_cache(client)
+        client.caches.delete.assert_called_once_with(name="cachedContents/abc")
+        assert state["gemini_context_cache"] is None
+
+
+class TestGenerateArticleWithCache:
+    ARTICLE = {"article_title": "T", "executive_summary": "S",
+               "sections": [{"heading": "H", "content": "C"}]}
+
+    def test_cached_call_sends_short_prompt(self, state):
+        client = MagicMock()
+        client.models.generate_content.return_value = SimpleNamespace(text=json.dumps(self.ARTICLE))
+        with patch.object(ta, "_json_cfg", wraps=ta._json_cfg) as json_cfg:
+            art = ta.generate_article(client, "T", SOURCES, "ctx", cached_content="cachedContents/abc")
+        assert art == self.ARTICLE
+        assert client.models.generate_content.call_args.kwargs["contents"] == "Write the article now."
+        json_cfg.assert_called_once_with(ta.ARTICLE_SCHEMA, cached_content="cachedContents/abc")
+
+    def test_cache_failure_falls_back_to_inline_prompt(self, state):
+        client = MagicMock()
+        client.models.generate_content.side_effect = [
+            _ApiError(400, "Cache content cachedContents/x is expired."),
+            SimpleNamespace(text=json.dumps(self.ARTICLE)),
+        ]
+        art = ta.generate_article(client, "T", SOURCES, "NOTEBOOK-CTX", cached_content="cachedContents/x")
+        assert art == self.ARTICLE
+        assert "NOTEBOOK-CTX" in client.models.generate_content.call_args.kwargs["contents"]
+
+    def test_other_failures_are_not_masked_by_the_fallback(self, state):
+        client = MagicMock()
+        client.models.generate_content.side_effect = _ApiError(503, "model overloaded")
+        with pytest.raises(_ApiError):
+            ta.generate_article(client, "T", SOURCES, "NOTEBOOK-CTX", cached_content="cachedContents/x")
+        assert all(c.kwargs["contents"] == "Write the article now."
+                   for c in client.models.generate_content.call_args_list)
+
+    def test_revision_falls_back_only_on_a_missing_cache(self, state):
+        art = dict(self.ARTICLE, tco_analysis={"heading": "TCO", "content": "x"})
+        patch_ = json.dumps({"tco_analysis": {"content": "Longer TCO."}})
+        client = MagicMock()
+        missing = _ApiError(404, "CachedContent not found (or permission denied)")
+        client.models.generate_content.side_effect = [missing, missing, SimpleNamespace(text=patch_)]
+        with patch.object(ta, "ensure_article_context_cache", return_value="cachedContents/x"):
+            out = ta.revise_fields_gemini(client, "T", SOURCES, "NOTEBOOK-CTX", art, ["tco_analysis"])
+            assert out == json.loads(patch_)
+            assert "NOTEBOOK-CTX" in client.models.generate_content.call_args.kwargs["contents"]
+            client.models.generate_content.reset_mock(side_effect=True)
+            client.models.generate_content.side_effect = _ApiError(401, "API key not valid")
+            with pytest.raises(_ApiError):
+                ta.revise_fields_gemini(client, "T", SOURCES, "NOTEBOOK-CTX", art, ["tco_analysis"])
+        assert all("NOTEBOOK-CTX" not in c.kwargs["contents"]
+                   for c in client.models.generate_content.call_args_list)
@@ -0,0 +1,181 @@
+"""
+Unit tests for the headless pipeline: RunState / bind_state isolation,
+produce_article against explicit state, and PipelineEngine jobs, batches
+and the CLI.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+import techaudit_engine as te
+from techaudit_engine import ArticleJob, PipelineEngine
+
+SOURCES = [{"id": 1, "title": "S", "publisher": "P", "date": "2025", "snippet": "x"}]
+ARTICLE = {
+    "article_title": "Fast Kernels",
+    "executive_summary": "Summary.",
+    "sections": [{"heading": "Intro", "content": "Body [1]."}],
+    "metadata": {"seo_slug": "fast-kernels"},
+    "references": ["[1] S"],
+}
+
+
+@pytest.fixture
+def pipeline():
+    """Stub the LLM-backed workflow steps; yields the patched module namespace."""
+    with patch.object(ta, "fetch_topics", return_value=[{"title": "T1"}, {"title": "T2"}, {"title": "T3"}]), \
+         patch.object(ta, "fetch_titles", side_effect=lambda c, t: [{"title": f"{t['title']}-a"},
+                                                                    {"title": f"{t['title']}-b"}]), \
+         patch.object(ta, "deep_research", return_value=(SOURCES, "ctx")), \
+         patch.object(ta, "build_competitive_context", return_value=""), \
+         patch.object(ta, "ensure_article_context_cache", return_value=None), \
+         patch.object(ta, "generate_article", side_effect=lambda *a, **k: dict(ARTICLE)), \
+         patch.object(ta, "score_article_rubric", return_value={"Clarity": 8.0}), \
+         patch.object(ta.requests, "get", return_value=MagicMock(status_code=200, content=b"img")):
+        yield ta
+
+
+def _job(title="Fast Kernels") -> ArticleJob:
+    return ArticleJob("AI Performance Engineering", {"title": "T"}, {"title": title})
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. Explicit state
+# ══════════════════════════════════════════════════════════════════
+
+class TestRunState:
+    def test_defaults_and_attribute_access(self):
+        state = ta.RunState.new(step=4)
+        assert state.step == state["step"] == 4
+        assert state.get("article") is None and state.qa_checks == []
+        state.article = {"x": 1}
+        assert state["article"] == {"x": 1}
+        with pytest.raises(AttributeError):
+            state.missing
+
+    def test_fresh_states_do_not_share_mutables(self):
+        assert ta.RunState.new().sources is not ta.RunState.new().sources
+
+    def test_bind_state_routes_core_writes(self):
+        session = {}
+        state = ta.RunState.new()
+        with patch.object(ta.st, "session_state", session):
+            with ta.bind_state(state):
+                assert ta._state() is state
+                ta._record_claude_usage(MagicMock(usage=None))
+            assert ta._state() is session
+        assert state.claude_usage["calls"] == 1
+        assert session == {}
+
+    def test_bindings_are_per_thread(self):
+        seen = {}
+
+        def worker(name):
+            with ta.bind_state(ta.RunState.new(category=name)):
+                barrier.wait()
+                seen[name] = ta._state().category
+
+        barrier = threading.Barrier(2)
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker, n)) for n in "ab"]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert seen == {"a": "a", "b": "b"}
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. produce_article
+# ══════════════════════════════════════════════════════════════════
+
+class TestProduceArticle:
+    def test_claude_credit_error_falls_back_to_gemini(self, pipeline):
+        claude = MagicMock()
+        state = ta.RunState.new(_client=MagicMock(), _anthropic_client=claude, sources=SOURCES)
+        with patch.object(ta, "generate_article_claude", side_effect=RuntimeError("credit balance is too low")), \
+             ta.bind_state(state):
+            art = ta.produce_article("Fast Kernels", SOURCES)
+        assert art["article_title"] == "Fast Kernels"
+        assert state.actual_writer == "gemini_fallback"
+        assert "credit balance" in state.fallback_reason
+        assert state.rubric_scores == {"Clarity": 8.0} and state.hero_image_bytes == b"img"
+        assert state.qa_checks and state.article is art
+
+    def test_hero_image_downloads_while_article_is_written(self, pipeline):
+        fetched = threading.Event()
+
+        def hero_get(url, timeout):
+            fetched.set()
+            return MagicMock(status_code=200, content=b"img")
+
+        def write(*a, **k):
+            assert fetched.wait(5), "hero image fetch did not start before generation finished"
+            return dict(ARTICLE)
+
+        state = ta.RunState.new(_client=MagicMock())
+        with patch.object(ta.requests, "get", side_effect=hero_get), \
+             patch.object(ta, "generate_article", side_effect=write), ta.bind_state(state):
+            ta.produce_article("Fast Kernels", SOURCES)
+        assert state.hero_image_bytes == b"img"
+
+    def test_slow_stages_time_out_and_results_commit_together(self, pipeline):
+        release = threading.Event()
+        state = ta.RunState.new(_client=MagicMock())
+        with patch.object(ta, "score_article_rubric", side_effect=lambda c, a: release.wait(5) or {}), \
+             patch.object(ta, "RUBRIC_TIMEOUT", 0.05), ta.bind_state(state):
+            art = ta.produce_article("Fast Kernels", SOURCES)
+        release.set()
+        assert state.article is art and state.qa_checks
+        assert state.rubric_scores == ta._zero_rubric()
+        assert state.hero_image_bytes == b"img"
+
+    def test_failure_sets_gen_error(self, pipeline):
+        state = ta.RunState.new(_client=MagicMock())
+        with patch.object(ta, "generate_article", side_effect=RuntimeError("503")), ta.bind_state(state):
+            assert ta.produce_article("T", SOURCES) is None
+        assert state.gen_error == "503"
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. PipelineEngine & CLI
+# ══════════════════════════════════════════════════════════════════
+
+class TestPipelineEngine:
+    def test_plan_expands_topics_into_titles(self, pipeline):
+        jobs = PipelineEngine("k").plan("AI Performance Engineering", n_topics=2, titles_per_topic=1)
+        assert [j.title["title"] for j in jobs] == ["T1-a", "T2-a"]
+
+    def test_run_job_exports_article(self, pipeline, tmp_path):
+        result = PipelineEngine("k", out_dir=str(tmp_path)).run_job(_job())
+        assert result.ok and result.writer == "gemini"
+        assert sorted(os.path.basename(p) for p in result.paths) == [
+            "fast-kernels.jpg", "fast-kernels.json", "fast-kernels.md"]
+        assert (tmp_path / "fast-kernels.md").read_text().startswith("# Fast Kernels")
+        exported = json.loads((tmp_path / "fast-kernels.json").read_text())
+        assert exported["accepted_sources"] == SOURCES and exported["rubric_scores"] == {"Clarity": 8.0}
+
+    def test_failed_job_is_reported_not_raised(self, pipeline, tmp_path):
+        with patch.object(ta, "deep_research", return_value=([], "")):
+            result = PipelineEngine("k", out_dir=str(tmp_path)).run_job(_job())
+        assert not result.ok and "no sources" in result.error
+
+    def test_batch_keeps_job_order_and_isolates_state(self, pipeline, tmp_path):
+        jobs = [_job(f"title {i}") for i in range(6)]
+        with patch.object(ta, "generate_article",
+                          side_effect=lambda c, title, *a, **k: dict(ARTICLE, article_title=title, metadata={})):
+            results = PipelineEngine("k", out_dir=str(tmp_path)).run_batch(jobs, workers=3)
+        assert [r.job for r in results] == jobs
+        assert all(r.ok for r in results)
+        assert sorted(p.name for p in tmp_path.glob("*.md")) == [f"title-{i}.md" for i in range(6)]
+
+    def test_cli_plan_only(self, pipeline, capsys):
+        assert te.main(["--category", "AI Performance Engineering", "--topics", "1",
+                        "--titles", "2", "--plan-only", "--gemini-key", "k"]) == 0
+        assert capsys.readouterr().out.count("[plan]") == 2
@@ -0,0 +1,55 @@
+"""
+Import-cost regression tests: importing techaudit_agent (or the headless
+engine) must not load Streamlit, the provider SDKs or requests, nor run any
+Streamlit command — checked with `python -X importtime` in a fresh process.
+"""
+from __future__ import annotations
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import techaudit_agent as ta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ("streamlit", "google.genai", "anthropic", "requests", "asyncio")
+
+
+def _imported_modules(module: str) -> set[str]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT),
+                          capture_output=True, text=True, check=True, timeout=60)
+    return set(re.findall(r"^import time:.*\|\s*(\S+)$", proc.stderr, re.M))
+
+
+@pytest.mark.parametrize("module", ["techaudit_agent", "techaudit_engine"])
+def test_import_loads_no_ui_or_sdk(module):
+    loaded = _imported_modules(module)
+    assert module in loaded
+    assert not {m for m in loaded if any(m == h or m.startswith(h + ".") for h in HEAVY)}
+
+
+class TestLazyModule:
+    def test_import_deferred_until_attribute_access(self, monkeypatch):
+        monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+        lazy = ta._LazyModule("colorsys")
+        assert "colorsys" not in sys.modules
+        assert lazy.rgb_to_hsv(1, 0, 0) == (0.0, 1.0, 1.0)
+        assert "colorsys" in sys.modules
+
+    def test_missing_module_raises_on_use(self):
+        lazy = ta._LazyModule("no_such_module_xyz")
+        with pytest.raises(ImportError):
+            lazy.anything
+
+    def test_installed_checks_without_importing(self):
+        assert ta._installed("json") and not ta._installed("no_such_module_xyz")
+
+    def test_cache_resource_without_streamlit(self, monkeypatch):
+        monkeypatch.delitem(sys.modules, "streamlit")
+        make = ta._cache_resource(lambda key: object())
+        assert make("a") is make("a") and make("a") is not make("b")
@@ -0,0 +1,260 @@
+"""
+Unit tests for the durable Step 5 job queue: idempotent submission, claims
+and stale-job recovery, job handlers, and the Step 5 polling helpers.
+"""
+from __future__ import annotations
+
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import JobQueue
+
+SOURCES = [{"id": 1, "title": "S", "publisher": "P", "date": "2025", "snippet": "x"}]
+ARTICLE = {"article_title": "Fast Kernels", "sections": [], "metadata": {"seo_slug": "fast-kernels"}}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    """A queue on a temp file, installed as the process queue without worker threads."""
+    q = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    with patch.object(ta, "get_job_queue", lambda: q):
+        yield q
+
+
+class _State(dict):
+    """dict-backed session_state that also supports attribute access."""
+    __getattr__ = dict.get
+    __setattr__ = dict.__setitem__
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. JobQueue
+# ══════════════════════════════════════════════════════════════════
+
+class TestJobQueue:
+    def test_same_inputs_same_job(self, queue):
+        first = queue.submit("generate", {"title": "T", "n": 1}, {"session": "a"})
+        again = queue.submit("generate", {"n": 1, "title": "T"}, {"session": "b"})
+        other = queue.submit("generate", {"title": "T", "n": 2})
+        assert first == again != other
+        assert queue.stats()["queued"] == 2
+
+    def test_claim_finish_and_reuse(self, queue):
+        job_id = queue.submit("generate", {"title": "T"})
+        job = queue.claim("w1")
+        assert (job["id"], job["status"], job["attempts"]) == (job_id, "running", 1)
+        assert queue.claim("w2") is None
+        queue.update(job_id, "halfway")
+        assert queue.get(job_id)["progress"] == "halfway"
+        queue.finish(job_id, {"ok": True})
+        assert queue.submit("generate", {"title": "T"}) == job_id
+        assert queue.get(job_id)["status"] == "done" and queue.get(job_id)["result"] == {"ok": True}
+
+    def test_failed_job_requeued_on_resubmit(self, queue):
+        job_id = queue.submit("generate", {"title": "T"})
+        queue.claim("w1")
+        queue.fail(job_id, "503")
+        assert queue.get(job_id)["error"] == "503"
+        queue.submit("generate", {"title": "T"})
+        job = queue.get(job_id)
+        assert (job["status"], job["error"]) == ("queued", "")
+
+    def test_stale_running_job_is_reclaimed(self, queue):
+        job_id = queue.submit("generate", {"title": "T"})
+        queue.claim("dead-worker")
+        with patch.object(ta, "JOB_STALE_SECONDS", -1):
+            job = queue.claim("w2")
+        assert (job["id"], job["worker"], job["attempts"]) == (job_id, "w2", 2)
+
+    def test_queue_survives_reopen(self, queue):
+        job_id = queue.submit("generate", {"title": "T"})
+        assert JobQueue(queue.path).get(job_id)["status"] == "queued"
+
+    def test_old_finished_jobs_pruned(self, queue):
+        job_id = queue.submit("generate", {"title": "old"})
+        queue.claim("w")
+        queue.finish(job_id, {})
+        with patch.object(ta, "JOB_RETENTION_SECONDS", -1):
+            queue.submit("generate", {"title": "new"})
+        assert queue.get(job_id) is None
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Running jobs
+# ══════════════════════════════════════════════════════════════════
+
+class TestRunJob:
+    def test_handler_result_and_progress(self, queue):
+        def handler(inputs, meta, progress):
+            progress("working")
+            assert queue.get(job["id"])["progress"] == "working"
+            return {"echo": inputs["x"], "session": meta["s"]}
+
+        queue.submit("echo", {"x": 1}, {"s": "abc"})
+        job = queue.claim("w")
+        with patch.dict(ta.JOB_HANDLERS, {"echo": handler}):
+            ta.run_job(queue, job)
+        assert queue.get(job["id"])["result"] == {"echo": 1, "session": "abc"}
+
+    def test_handler_error_and_unknown_kind_fail_the_job(self, queue):
+        queue.submit("mystery", {})
+        job = queue.claim("w")
+        ta.run_job(queue, job)
+        assert "Unknown job kind" in queue.get(job["id"])["error"]
+
+    def test_worker_thread_picks_up_submitted_job(self, tmp_path):
+        with patch.object(ta, "JOBS_DB_PATH", str(tmp_path / "jobs.sqlite3")), \
+             patch.object(ta, "_job_queue", None), \
+             patch.dict(ta.JOB_HANDLERS, {"echo": lambda inputs, meta, progress: inputs}):
+            q = ta.get_job_queue()
+            job_id = q.submit("echo", {"x": 2})
+            deadline = time.monotonic() + 5
+            while q.get(job_id)["status"] != "done" and time.monotonic() < deadline:
+                time.sleep(0.02)
+        assert q.get(job_id)["result"] == {"x": 2}
+
+    def test_generation_job_round_trip(self, queue):
+        state = ta.RunState.new(_api_key="gem-key", _client=MagicMock(), sources=SOURCES,
+                                notebooklm_context="ctx", trace_session="s1")
+        with ta.bind_state(state):
+            job_id = ta.submit_generation_job("Fast Kernels", SOURCES)
+        job = queue.claim("w")
+        assert job["id"] == job_id and "gem-key" not in str(job)      # keys stay in memory
+
+        def fake_produce(title, accepted, qa_feedback="", competitive_context="", on_part=None, status=None,
+                         **_options):
+            on_part(("sections", 0), {})
+            s = ta._state()
+            s.update(article=ARTICLE, actual_writer="gemini", qa_checks=[{"passed": True}],
+                     rubric_scores={"Clarity": 8.0}, hero_image_bytes=b"img")
+            return ARTICLE
+
+        with patch.object(ta, "produce_article", side_effect=fake_produce):
+            ta.run_job(queue, job)
+        done = queue.get(job_id)
+        assert done["status"] == "done", done["error"]
+
+        target = ta.RunState.new()
+        with ta.bind_state(target):
+            ta.apply_generation_result(done["result"])
+        assert target.article == ARTICLE and target.hero_image_bytes == b"img"
+        assert target.rubric_scores == {"Clarity": 8.0} and target.actual_writer == "gemini"
+
+    def test_job_shares_and_returns_the_session_context_cache(self, queue):
+        entry = {"key": "k", "name": "cachedContents/s", "model": "m", "expires_at": 1e12}
+        state = ta.RunState.new(_api_key="gem-key", _client=MagicMock(), sources=SOURCES,
+                                notebooklm_context="ctx", gemini_context_cache=entry)
+        with ta.bind_state(state):
+            job_id = ta.submit_generation_job("Fast Kernels", SOURCES)
+        seen = []
+
+        def fake_produce(*_a, **_k):
+            seen.append(ta._state().gemini_context_cache)
+            ta._state().update(article=ARTICLE)
+            return ARTICLE
+
+        with patch.object(ta, "produce_article", side_effect=fake_produce):
+            ta.run_job(queue, queue.claim("w"))
+        assert seen == [entry] and queue.get(job_id)["result"]["context_cache"] == entry
+
+    def test_failed_job_drops_the_cache_it_created(self, queue):
+        state = ta.RunState.new(_api_key="gem-key", _client=MagicMock(), sources=SOURCES,
+                                notebooklm_context="ctx")
+        with ta.bind_state(state):
+            job_id = ta.submit_generation_job("Fast Kernels", SOURCES)
+
+        def fake_produce(*_a, **_k):
+            ta._state().gemini_context_cache = {"key": "k", "name": "cachedContents/job"}
+            ta._state().gen_error = "500"
+
+        client = MagicMock()
+        with patch.object(ta, "produce_article", side_effect=fake_produce), \
+             patch.object(ta, "get_client", return_value=client):
+            ta.run_job(queue, queue.claim("w"))
+        assert queue.get(job_id)["status"] == "failed"
+        client.caches.delete.assert_called_once_with(name="cachedContents/job")
+
+    def test_explicit_rerun_is_a_new_job(self, queue):
+        state = ta.RunState.new(_api_key="gem-key", _client=MagicMock(), sources=SOURCES,
+                                notebooklm_context="ctx", trace_session="s1")
+        with ta.bind_state(state):
+            first = ta.submit_generation_job("Fast Kernels", SOURCES, qa_feedback="• fix", attempt=1)
+            queue.finish(queue.claim("w")["id"], {"article": ARTICLE})
+            assert ta.submit_generation_job("Fast Kernels", SOURCES, qa_feedback="• fix", attempt=1) == first
+            rerun = ta.submit_generation_job("Fast Kernels", SOURCES, qa_feedback="• fix", attempt=2)
+        assert rerun != first and queue.get(rerun)["status"] == "queued"
+
+    def test_unknown_key_after_restart_fails_cleanly(self, queue):
+        queue.submit("generate", {"title": "T", "accepted_sources": [], "sources": [],
+                                  "notebooklm_context": "", "qa_feedback": "", "competitive_context": "",
+                                  "gemini_key": "feedfacecafe", "anthropic_key": None})
+        job = queue.claim("w")
+        ta.run_job(queue, job)
+        assert "no longer available" in queue.get(job["id"])["error"]
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. Step 5 polling
+# ══════════════════════════════════════════════════════════════════
+
+class TestPolling:
+    @pytest.fixture
+    def session(self):
+        state = _State(ta._state_defaults())
+        with patch.object(ta.st, "session_state", state), patch.object(ta.time, "sleep"):
+            yield state
+
+    def test_pending_job_keeps_polling(self, queue, session):
+        session.gen_job = queue.submit("generate", {"title": "T"})
+        assert ta._poll_generation_job() is True
+        assert session.gen_job
+
+    def test_done_job_is_applied(self, queue, session):
+        session.gen_job = queue.submit("generate", {"title": "T"})
+        queue.claim("w")
+        queue.finish(session.gen_job, {"article": ARTICLE, "qa_checks": [], "hero_image_b64": None})
+        assert ta._poll_generation_job() is False
+        assert session.article == ARTICLE and session.gen_job is None
+
+    def test_failed_job_becomes_gen_error(self, queue, session):
+        session.gen_job = queue.submit("generate", {"title": "T"})
+        queue.claim("w")
+        queue.fail(session.gen_job, "Claude error")
+        url = {"job": session.gen_job}
+        with patch.object(ta.st, "query_params", url):
+            assert ta._poll_generation_job() is False
+            assert session.gen_error == "Claude error" and url == {}
+            ta._resume_job_from_url()                   # "← Back to Sources" rerun stays put
+        assert session.step == 1
+
+    def test_reload_resumes_job_from_url(self, queue, session):
+        job_id = queue.submit("generate", {"title": "T", "sources": SOURCES, "accepted_sources": SOURCES,
+                                           "notebooklm_context": "ctx", "competitive_context": ""},
+                              {"category": "AI Performance Engineering", "title": {"title": "T"}})
+        with patch.object(ta.st, "query_params", {"job": job_id}):
+            ta._resume_job_from_url()
+        assert (session.step, session.gen_job, session.accepted_sources) == (5, job_id, SOURCES)
+        assert session.category == "AI Performance Engineering"
+
+    def test_regenerate_with_unchanged_inputs_reuses_the_draft(self, queue, session):
+        session.update(_api_key="gem-key", sources=SOURCES, notebooklm_context="ctx")
+        with patch.object(ta.st, "query_params", {}):
+            ta._do_generate("Fast Kernels", SOURCES)
+            first = session.gen_job
+            queue.finish(queue.claim("w")["id"], {"article": ARTICLE})
+            ta._do_generate("Fast Kernels", SOURCES)       # ← Back to Sources, then Generate again
+            assert session.gen_job == first and session.gen_attempt == 0
+            ta._do_generate("Fast Kernels", SOURCES, rerun=True)
+        assert session.gen_job != first and session.gen_attempt == 1
+
+    def test_reload_ignores_finished_jobs(self, queue, session):
+        job_id = queue.submit("generate", {"title": "T"})
+        queue.claim("w")
+        queue.fail(job_id, "boom")
+        url = {"job": job_id}
+        with patch.object(ta.st, "query_params", url):
+            ta._resume_job_from_url()
+        assert session.step == 1 and session.gen_job is None and url == {}
@@ -0,0 +1,146 @@
+"""
+Unit tests for _parse_json / TolerantJSONParser (single-pass tolerant parsing).
+"""
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from techaudit_agent import TolerantJSONParser, _parse_json
+
+GROUNDED = (
+    "According to the results [1][2], the latest posts are:\n"
+    '[{"title": "A", "url": "https://a.com/1",}, {"title": "B", "url": "https://b.com/2"}]\n'
+    "Sources: [1] https://a.com [2] https://b.com"
+)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. _parse_json
+# ══════════════════════════════════════════════════════════════════
+
+class TestParseJson:
+    def test_plain_and_fenced(self):
+        assert _parse_json('{"a": 1}') == {"a": 1}
+        assert _parse_json('```json\n[1, 2]\n```') == [1, 2]
+
+    def test_empty_raises(self):
+        with pytest.raises(ValueError, match="Empty response"):
+            _parse_json("")
+
+    def test_prose_and_footnotes_pick_the_payload(self):
+        result = _parse_json(GROUNDED)
+        assert [a["title"] for a in result] == ["A", "B"]
+
+    def test_object_wrapped_in_prose_keeps_nested_lists(self):
+        text = 'Here it is: {"sections": [{"h": "x"}], "sources": [1, 2]} Done.'
+        assert _parse_json(text) == {"sections": [{"h": "x"}], "sources": [1, 2]}
+
+    def test_repairs(self):
+        text = ('```json\n{"a": [1, 2,], // note\n "b": “smart”, /* x */ '
+                '"c": "line1\nline2", "d": "it’s",}\n```')
+        assert _parse_json(text) == {"a": [1, 2], "b": "smart", "c": "line1\nline2", "d": "it’s"}
+
+    def test_skips_bracketed_prose(self):
+        assert _parse_json('[see below] then {"ok": true, "n": -1.5e2}') == {"ok": True, "n": -150.0}
+
+    def test_truncated_raises(self):
+        with pytest.raises(ValueError, match="Could not parse JSON"):
+            _parse_json('{"a": [1, 2')
+
+    def test_truncated_root_does_not_return_an_inner_value(self):
+        text = '{"article_title": "x", "sections": [{"heading":"a","content":"b"}, {"heading": "b"'
+        with pytest.raises(ValueError, match="Could not parse JSON"):
+            _parse_json(text)
+        with pytest.raises(ValueError, match="truncated"):
+            TolerantJSONParser().feed('Note [1]. ' + text).close()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. TolerantJSONParser streaming
+# ══════════════════════════════════════════════════════════════════
+
+class TestTolerantJSONParser:
+    @pytest.mark.parametrize("size", [1, 2, 5, 13])
+    def test_chunked_feed_matches_whole(self, size):
+        parser = TolerantJSONParser()
+        for i in range(0, len(GROUNDED), size):
+            parser.feed(GROUNDED[i : i + size])
+        assert parser.close() == _parse_json(GROUNDED)
+
+    def test_literal_and_number_split_across_chunks(self):
+        parser = TolerantJSONParser()
+        for chunk in ('{"a": tr', 'ue, "b": 12', '34, "c": nu', "ll}"):
+            parser.feed(chunk)
+        assert parser.close() == {"a": True, "b": 1234, "c": None}
+
+    def test_on_complete_reports_paths(self):
+        done = []
+        parser = TolerantJSONParser(on_complete=lambda path, value: done.append(path))
+        parser.feed('{"sections": [{"h": "a"}, {"h": "b"}], ')
+        assert ("sections", 1) in done and () not in done
+        parser.feed('"t": 1}')
+        parser.close()
+        assert done[-1] == ()
+
+    def test_partial_exposes_root_while_streaming(self):
+        parser = TolerantJSONParser()
+        parser.feed('{"title": "T", "sections": [{"h": "a"}')
+        assert parser.partial == {"title": "T", "sections": [{"h": "a"}]}
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. Response schema validation
+# ══════════════════════════════════════════════════════════════════
+
+class TestValidateResponse:
+    def test_valid_data_returned_unchanged(self):
+        from techaudit_agent import TOPICS_SCHEMA, validate_response
+        topics = [{"title": "T", "description": "D", "trend_signal": "S"}]
+        assert validate_response(topics, TOPICS_SCHEMA) is topics
+
+    @pytest.mark.parametrize("data, match", [
+        ({"title": "T"}, r"\$: expected array"),
+        ([], r"expected ≥1"),
+        ([{"title": "T"}], r"\$\[0\]: missing 'description'"),
+        ([{"title": 1, "description": "D"}], r"\$\[0\]\.title: expected string"),
+    ])
+    def test_violations(self, data, match):
+        from techaudit_agent import TOPICS_SCHEMA, ResponseSchemaError, validate_response
+        with pytest.raises(ResponseSchemaError, match=match):
+            validate_response(data, TOPICS_SCHEMA)
+
+    def test_bool_is_not_a_number(self):
+        from techaudit_agent import RUBRIC_SCHEMA, ResponseSchemaError, validate_response
+        scores = {name: 8 for name in RUBRIC_SCHEMA["required"]}
+        validate_response(scores, RUBRIC_SCHEMA)
+        scores[RUBRIC_SCHEMA["required"][0]] = True
+        with pytest.raises(ResponseSchemaError):
+            validate_response(scores, RUBRIC_SCHEMA)
+
+    def test_schema_error_is_a_value_error(self):
+        from techaudit_agent import ResponseSchemaError
+        assert issubclass(ResponseSchemaError, ValueError)
+
+    def test_article_schema_requires_core_fields(self):
+        from techaudit_agent import ARTICLE_SCHEMA, ResponseSchemaError, validate_response
+        art = {"article_title": "T", "executive_summary": "S",
+               "sections": [{"heading": "H", "content": "C"}]}
+        validate_response(art, ARTICLE_SCHEMA)
+        with pytest.raises(ResponseSchemaError, match="missing 'content'"):
+            validate_response(dict(art, sections=[{"heading": "H"}]), ARTICLE_SCHEMA)
+        with pytest.raises(ResponseSchemaError):
+            validate_response(dict(art, sections=[]), ARTICLE_SCHEMA)
+        with pytest.raises(ResponseSchemaError):            # a lone section dict is not an article
+            validate_response({"heading": "a", "content": "b"}, ARTICLE_SCHEMA)
+
+    def test_conforming_search_text_is_parsed_once(self):
+        import techaudit_agent as ta
+        schema = {"type": "array", "items": {"type": "integer"}}
+        client = MagicMock()
+        resp = client.models.generate_content.return_value = MagicMock(text="[1, 2]")
+        with patch.object(ta, "_parse_json", wraps=ta._parse_json) as parse:
+            data, out = ta._call_json(client, "p", schema, search=True)
+        assert data == [1, 2] and out is resp and parse.call_count == 1
+        assert ta._conforms("[1, x", schema) == (False, None)
@@ -0,0 +1,133 @@
+"""
+Unit tests for API key pools: KeyPool dispatch strategies, quarantine on
+credit errors, key loading, and pooled() / apooled() client selection.
+"""
+from __future__ import annotations
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import KeyPool
+
+
+class _Client:
+    def __init__(self, key: str):
+        self.key = key
+
+
+@pytest.fixture
+def pool_env():
+    """A three-key gemini pool whose clients are plain objects named after the key."""
+    pool = KeyPool("gemini", ["k1", "k2", "k3"])
+    with patch.object(ta, "get_key_pool", lambda provider: pool), \
+         patch.object(ta, "_pool_client", lambda provider, key, use_async=False: _Client(key)):
+        yield pool
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. KeyPool
+# ══════════════════════════════════════════════════════════════════
+
+class TestKeyPool:
+    def test_least_loaded_spreads_in_flight_calls(self):
+        pool = KeyPool("gemini", ["a", "b", "c"])
+        assert [pool.pick("m") for _ in range(3)] == ["a", "b", "c"]
+        pool.done("b")
+        assert pool.pick("m") == "b"
+
+    def test_least_loaded_avoids_rate_limited_key(self):
+        pool = KeyPool("gemini", ["a", "b"])
+        ta.rate_limiter.bucket(ta._key_id("a"), "m").backoff(30.0, 0)
+        assert pool.pick("m") == "b"
+        pool.done("b")
+        assert pool.pick("m") == "b"
+
+    def test_round_robin_cycles_and_skips_waiting_keys(self):
+        pool = KeyPool("gemini", ["a", "b", "c"], strategy="round_robin")
+        assert [pool.pick("m") for _ in range(4)] == ["a", "b", "c", "a"]
+        ta.rate_limiter.bucket(ta._key_id("b"), "m").backoff(30.0, 0)
+        assert pool.pick("m") == "c"
+
+    def test_quarantined_key_is_skipped_until_expiry(self):
+        pool = KeyPool("gemini", ["a", "b"])
+        pool.quarantine("a")
+        assert pool.pick("m") == "b"
+        assert pool.stats()["quarantined"] == 1
+        with patch.object(ta, "KEY_QUARANTINE_SECONDS", 0):
+            pool.quarantine("a")
+        pool.done("b")
+        assert pool.pick("m") == "a"
+
+    def test_duplicate_and_empty_keys_dropped(self):
+        assert KeyPool("gemini", ["a", "", "a", "b"]).keys == ["a", "b"]
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Key loading
+# ══════════════════════════════════════════════════════════════════
+
+class TestLoadApiKeys:
+    def test_env_and_file_merged(self, tmp_path, monkeypatch):
+        path = tmp_path / "keys.json"
+        path.write_text(json.dumps({"anthropic": ["f1"], "gemini": ["g9"]}))
+        monkeypatch.setenv("ANTHROPIC_API_KEYS", "e1, e2\ne3")
+        with patch.object(ta, "API_KEYS_FILE", str(path)):
+            assert ta._load_api_keys("anthropic") == ["e1", "e2", "e3", "f1"]
+
+    def test_single_key_means_no_pool(self, monkeypatch):
+        monkeypatch.setenv("GEMINI_API_KEYS", "only")
+        with patch.object(ta, "_key_pools", {}), patch.object(ta, "API_KEYS_FILE", ""):
+            assert ta.get_key_pool("gemini") is None
+            assert ta.default_api_key("gemini") == "only"
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. pooled / apooled
+# ══════════════════════════════════════════════════════════════════
+
+class TestPooled:
+    def test_calls_use_pool_clients(self, pool_env):
+        used = [ta.pooled("gemini", _Client("session"), "m", 10, lambda c: c.key) for _ in range(2)]
+        assert used == ["k1", "k1"]     # done() after each call → k1 stays least loaded
+
+    def test_credit_error_quarantines_and_moves_on(self, pool_env):
+        def fn(c):
+            if c.key == "k1":
+                raise RuntimeError("Your credit balance is too low")
+            return c.key
+
+        assert ta.pooled("gemini", _Client("session"), "m", 10, fn) == "k2"
+        assert pool_env.stats() == {"keys": 3, "quarantined": 1, "in_flight": 0}
+        assert ta.pooled("gemini", _Client("session"), "m", 10, fn) == "k2"
+
+    def test_other_errors_are_not_retried_across_keys(self, pool_env):
+        calls = []
+
+        def fn(c):
+            calls.append(c.key)
+            raise RuntimeError("503")
+
+        with pytest.raises(RuntimeError):
+            ta.pooled("gemini", _Client("session"), "m", 10, fn)
+        assert calls == ["k1"]
+        assert pool_env.stats()["quarantined"] == 0
+
+    def test_pin_keeps_session_client(self, pool_env):
+        assert ta.pooled("gemini", _Client("session"), "m", 10, lambda c: c.key, pin=True) == "session"
+
+    def test_all_keys_quarantined_falls_back_to_session_client(self, pool_env):
+        for k in pool_env.keys:
+            pool_env.quarantine(k)
+        assert ta.pooled("gemini", _Client("session"), "m", 10, lambda c: c.key) == "session"
+
+    def test_apooled(self, pool_env):
+        async def fn(c):
+            if c.key == "k1":
+                raise RuntimeError("insufficient_quota")
+            return c.key
+
+        out = ta.get_llm_dispatcher().run(ta.apooled("gemini", _Client("session"), "m", 10, fn), timeout=5)
+        assert out == "k2"
@@ -0,0 +1,285 @@
+"""
+Unit tests for the asyncio LLM layer: LLMDispatcher limits / fallback and
+the async call paths (_acall, afetch_articles_for_competitor, agenerate_article_claude).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import GeminiAPIError, LLMDispatcher
+
+MINIMAL_ARTICLE = {"article_title": "T", "executive_summary": "S",
+                   "sections": [{"heading": "H", "content": "C"}]}
+
+
+@pytest.fixture(autouse=True)
+def _no_response_cache():
+    """Keep async tests off the on-disk response cache."""
+    with patch.object(ta, "RESPONSE_CACHE_TTLS", {}):
+        yield
+
+
+def _gemini_client(*side_effect) -> MagicMock:
+    client = MagicMock()
+    client.aio.models.generate_content = AsyncMock(side_effect=list(side_effect))
+    return client
+
+
+def _resp(text: str) -> MagicMock:
+    resp = MagicMock()
+    resp.text = text
+    return resp
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. LLMDispatcher
+# ══════════════════════════════════════════════════════════════════
+
+class TestLLMDispatcher:
+    def test_provider_limit_bounds_in_flight_calls(self):
+        dispatcher = LLMDispatcher(limits={"gemini": 2})
+        in_flight, peak = 0, 0
+
+        async def work(model):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+            return model
+
+        async def fan_out():
+            return await asyncio.gather(
+                *(dispatcher.call("gemini", work, "m") for _ in range(6))
+            )
+
+        results = dispatcher.run(fan_out(), timeout=5)
+        assert [r for r, _ in results] == ["m"] * 6
+        assert peak == 2
+
+    def test_providers_have_independent_limits(self):
+        dispatcher = LLMDispatcher(limits={"gemini": 1, "anthropic": 1})
+        started = []
+
+        async def work(model):
+            started.append(model)
+            await asyncio.sleep(0.05)
+            return model
+
+        async def both():
+            return await asyncio.gather(
+                dispatcher.call("gemini", work, "g"),
+                dispatcher.call("anthropic", work, "a"),
+            )
+
+        dispatcher.run(both(), timeout=5)
+        assert sorted(started) == ["a", "g"]
+
+    def test_fallback_on_primary_error(self):
+        dispatcher = LLMDispatcher()
+
+        async def work(model):
+            if model == "primary":
+                raise RuntimeError("boom")
+            return "ok"
+
+        assert dispatcher.run(dispatcher.call("gemini", work, "primary", "fallback")) == ("ok", "fallback")
+
+    def test_no_second_call_when_already_on_fallback(self):
+        dispatcher = LLMDispatcher()
+        calls = []
+
+        async def work(model):
+            calls.append(model)
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            dispatcher.run(dispatcher.call("gemini", work, "fallback", "fallback"))
+        assert calls == ["fallback"]
+
+    def test_submit_returns_future(self):
+        dispatcher = LLMDispatcher()
+
+        async def value():
+            return 42
+
+        assert dispatcher.submit(value()).result(timeout=5) == 42
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Async call paths
+# ══════════════════════════════════════════════════════════════════
+
+class TestAsyncCallPaths:
+    def test_acall_falls_back_to_flash(self):
+        client = _gemini_client(RuntimeError("503"), _resp("hello"))
+        resp, model = ta.get_llm_dispatcher().run(
+            ta._acall(client, "p", {"cfg": 1}, ta.MODEL_REASONING)
+        )
+        assert resp.text == "hello"
+        assert model == ta.MODEL_FALLBACK
+
+    def test_acall_search_retries_in_json_mode_when_no_text(self):
+        empty = _resp("")
+        empty.candidates = []
+        client = _gemini_client(empty, _resp("[]"))
+        resp, model, _ = ta.get_llm_dispatcher().run(
+            ta._acall_search(client, "p", ta.MODEL_REASONING)
+        )
+        assert resp.text == "[]"
+        assert model == ta.MODEL_REASONING
+        assert client.aio.models.generate_content.await_count == 2
+
+    def test_afetch_articles_parses_list(self):
+        client = _gemini_client(_resp('[{"title": "T", "url": "https://x.com/1", '
+                                      '"date": "2025-01-01", "relevance": "r"}]'))
+        articles, _ = ta.get_llm_dispatcher().run(
+            ta.afetch_articles_for_competitor(client, "x", {"name": "X"}, "Cat")
+        )
+        assert articles[0]["url"] == "https://x.com/1"
+
+    def test_afetch_articles_parse_error_raises(self):
+        # Unparseable grounded text is retried once in schema-enforced JSON mode
+        client = _gemini_client(_resp("no json here"), _resp("still no json"))
+        with pytest.raises(ta.CompetitorParseError):
+            ta.get_llm_dispatcher().run(
+                ta.afetch_articles_for_competitor(client, "x", {"name": "X"}, "Cat")
+            )
+        assert client.aio.models.generate_content.await_count == 2
+
+    def test_afetch_articles_invalid_grounded_output_retried_with_schema(self):
+        client = _gemini_client(
+            _resp('[{"title": "T", "url": "https://x.com/1"}]'),   # missing date / relevance
+            _resp('[{"title": "T", "url": "https://x.com/1", "date": "2025-01-01", "relevance": "r"}]'),
+        )
+        with patch.object(ta, "_json_cfg", wraps=ta._json_cfg) as json_cfg:
+            articles, _ = ta.get_llm_dispatcher().run(
+                ta.afetch_articles_for_competitor(client, "x", {"name": "X"}, "Cat")
+            )
+        assert articles[0]["date"] == "2025-01-01"
+        json_cfg.assert_called_once_with(ta.COMPETITOR_ARTICLES_SCHEMA)
+
+    def test_afetch_articles_api_error_raises(self):
+        client = _gemini_client(RuntimeError("down"), RuntimeError("down"))
+        with pytest.raises(GeminiAPIError):
+            ta.get_llm_dispatcher().run(
+                ta.afetch_articles_for_competitor(client, "x", {"name": "X"}, "Cat")
+            )
+
+    def test_agenerate_article_claude_uses_tool_input(self):
+        block = MagicMock(type="tool_use", input=dict(MINIMAL_ARTICLE))
+        client = MagicMock()
+        client.messages.create = AsyncMock(return_value=MagicMock(content=[block]))
+        art, model = ta.get_llm_dispatcher().run(
+            ta.agenerate_article_claude(client, "T", [], [], "ctx")
+        )
+        assert art == MINIMAL_ARTICLE
+        kwargs = client.messages.create.await_args.kwargs
+        assert kwargs["tools"][0]["input_schema"] is ta.ARTICLE_SCHEMA
+        assert kwargs["tool_choice"] == {"type": "tool", "name": "submit_article"}
+
+    def test_agenerate_article_claude_fallback(self):
+        msg = MagicMock()
+        msg.content = [MagicMock(text=json.dumps(MINIMAL_ARTICLE))]
+        client = MagicMock()
+        client.messages.create = AsyncMock(side_effect=[RuntimeError("overloaded"), msg])
+        art, model = ta.get_llm_dispatcher().run(
+            ta.agenerate_article_claude(client, "T", [], [], "ctx")
+        )
+        assert art == MINIMAL_ARTICLE
+        assert model == ta.CLAUDE_FALLBACK
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. Hedged grounded search
+# ══════════════════════════════════════════════════════════════════
+
+class TestHedgedSearch:
+    @pytest.fixture(autouse=True)
+    def _hedge_env(self):
+        tracker = ta.HedgeTracker()
+        with patch.object(ta, "hedge_tracker", tracker), \
+             patch.object(ta, "SEARCH_HEDGE_DEFAULT_DELAY", 0.05), \
+             patch.object(ta, "_search_cfg", return_value="search"), \
+             patch.object(ta, "_json_cfg", side_effect=lambda schema=None, cached_content=None: "json"):
+            yield tracker
+
+    @staticmethod
+    def _client(delays: dict, texts: dict, log: list):
+        async def generate_content(model, contents, config):
+            log.append(("start", config))
+            try:
+                await asyncio.sleep(delays[config])
+            except asyncio.CancelledError:
+                log.append(("cancelled", config))
+                raise
+            return _resp(texts[config])
+        client = MagicMock()
+        client.aio.models.generate_content = generate_content
+        return client
+
+    def _run(self, client, **kw):
+        resp, model, _ = ta.get_llm_dispatcher().run(
+            ta._acall_search(client, "p", ta.MODEL_REASONING, call_type="fetch_topics", **kw),
+            timeout=5,
+        )
+        return resp, model
+
+    def test_slow_grounded_call_loses_to_hedge(self, _hedge_env):
+        log = []
+        client = self._client({"search": 1.0, "json": 0.01}, {"search": "[1]", "json": "[2]"}, log)
+        resp, _ = self._run(client, hedge=True)
+        assert resp.text == "[2]"
+        assert ("cancelled", "search") in log
+        assert _hedge_env.stats()["fetch_topics"]["hedge_won"] == 1
+
+    def test_cancelled_grounded_call_records_no_latency(self, _hedge_env):
+        client = self._client({"search": 1.0, "json": 0.01}, {"search": "[1]", "json": "[2]"}, [])
+        self._run(client, hedge=True)
+        assert not _hedge_env._latencies.get("fetch_topics")
+
+    def test_fast_grounded_call_never_hedges(self, _hedge_env):
+        log = []
+        client = self._client({"search": 0.0, "json": 0.0}, {"search": "[1]", "json": "[2]"}, log)
+        resp, _ = self._run(client, hedge=True)
+        assert resp.text == "[1]"
+        assert log == [("start", "search")]
+        assert _hedge_env.stats()["fetch_topics"]["no_hedge"] == 1
+
+    def test_primary_can_still_win_after_hedge_starts(self, _hedge_env):
+        log = []
+        client = self._client({"search": 0.1, "json": 1.0}, {"search": "[1]", "json": "[2]"}, log)
+        resp, _ = self._run(client, hedge=True)
+        assert resp.text == "[1]"
+        assert ("cancelled", "json") in log
+        assert _hedge_env.stats()["fetch_topics"]["primary_won"] == 1
+
+    def test_unusable_hedge_winner_is_skipped(self, _hedge_env):
+        log = []
+        client = self._client({"search": 0.1, "json": 0.06}, {"search": "[1]", "json": ""}, log)
+        resp, _ = self._run(client, hedge=True, schema={"type": "array"})
+        assert resp.text == "[1]"
+
+    def test_without_hedge_grounded_call_is_awaited(self, _hedge_env):
+        log = []
+        client = self._client({"search": 0.1, "json": 0.0}, {"search": "[1]", "json": "[2]"}, log)
+        resp, _ = self._run(client)
+        assert resp.text == "[1]"
+        assert log == [("start", "search")]
+
+    def test_sync_unhedged_call_records_latency(self, _hedge_env):
+        with patch.object(ta, "_call", return_value=_resp("[1]")):
+            ta._call_search(MagicMock(), "p", call_type="fetch_topics:x", hedge=False)
+        assert len(_hedge_env._latencies["fetch_topics"]) == 1
+
+    def test_delay_tracks_latency_percentile(self):
+        tracker = ta.HedgeTracker(percentile=0.9)
+        assert tracker.delay("k") == ta.SEARCH_HEDGE_DEFAULT_DELAY
+        for s in range(1, 11):
+            tracker.record_latency("k", float(s))
+        assert tracker.delay("k") == 9.0
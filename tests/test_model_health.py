@@ -0,0 +1,174 @@
+"""
+Unit tests for model / provider health: ModelHealth circuit states and the
+call_routed / acall_routed routing used by _call, the dispatcher and Claude.
+"""
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import CircuitOpenError, ModelHealth
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _worker(calls: list, failing: set, exc=None):
+    def fn(model):
+        calls.append(model)
+        if model in failing:
+            raise exc or RuntimeError("503 overloaded")
+        return f"ok:{model}"
+    return fn
+
+
+def _trip(model: str = "primary"):
+    h = ta.model_health[model]
+    for _ in range(ta.HEALTH_CONSECUTIVE_FAILURES):
+        h.record(False, 1.0)
+    return h
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. ModelHealth
+# ══════════════════════════════════════════════════════════════════
+
+class TestModelHealth:
+    def test_consecutive_failures_open_circuit(self):
+        h = _trip()
+        assert h.state == ModelHealth.OPEN
+        assert not h.acquire()
+
+    def test_error_rate_opens_circuit(self):
+        h = ModelHealth()
+        for ok in (True, False, True, False):
+            h.record(ok)
+        assert h.state == ModelHealth.OPEN
+
+    def test_occasional_error_keeps_circuit_closed(self):
+        h = ModelHealth()
+        for ok in (True, True, False, True, True):
+            h.record(ok)
+        assert h.state == ModelHealth.CLOSED
+        assert h.snapshot()["error_rate"] == pytest.approx(0.2)
+
+    def test_half_open_admits_a_single_probe(self):
+        h = _trip()
+        with patch.object(ta, "HEALTH_OPEN_SECONDS", 0.0):
+            assert h.acquire()
+            assert h.state == ModelHealth.HALF_OPEN
+            assert not h.acquire()
+            h.record(True)
+        assert h.state == ModelHealth.CLOSED
+
+    def test_failed_probe_reopens(self):
+        h = _trip()
+        with patch.object(ta, "HEALTH_OPEN_SECONDS", 0.0):
+            assert h.acquire()
+        h.record(False)
+        assert h.state == ModelHealth.OPEN
+
+    def test_latency_ewma(self):
+        h = ModelHealth()
+        h.record(True, 10.0)
+        h.record(True, 20.0)
+        assert h.latency_ewma == pytest.approx(10.0 + ta.HEALTH_LATENCY_ALPHA * 10.0)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Routing
+# ══════════════════════════════════════════════════════════════════
+
+class TestRouting:
+    def test_retryable_error_falls_back(self):
+        calls = []
+        assert ta.call_routed("gemini", _worker(calls, {"primary"}), "primary", "fallback") \
+            == ("ok:fallback", "fallback")
+        assert calls == ["primary", "fallback"]
+
+    def test_open_primary_is_skipped(self):
+        _trip()
+        calls = []
+        assert ta.call_routed("gemini", _worker(calls, set()), "primary", "fallback")[1] == "fallback"
+        assert calls == ["fallback"]
+        assert ta.model_health.preferred("primary", "fallback") == "fallback"
+
+    def test_traffic_returns_after_successful_probe(self):
+        _trip()
+        calls = []
+        with patch.object(ta, "HEALTH_OPEN_SECONDS", 0.0):
+            ta.call_routed("gemini", _worker(calls, set()), "primary", "fallback")
+        ta.call_routed("gemini", _worker(calls, set()), "primary", "fallback")
+        assert calls == ["primary", "primary"]
+        assert ta.model_health["primary"].state == ModelHealth.CLOSED
+
+    @pytest.mark.parametrize("status", [400, 401, 403])
+    def test_non_retryable_error_skips_fallback(self, status):
+        calls = []
+        with pytest.raises(_StatusError):
+            ta.call_routed("gemini", _worker(calls, {"primary"}, _StatusError(status)),
+                           "primary", "fallback")
+        assert calls == ["primary"]
+        assert ta.model_health["primary"].snapshot()["calls"] == 0
+
+    def test_credit_error_skips_fallback(self):
+        calls = []
+        with pytest.raises(RuntimeError):
+            ta.call_routed("anthropic",
+                           _worker(calls, {"primary"}, RuntimeError("credit balance is too low")),
+                           "primary", "fallback")
+        assert calls == ["primary"]
+
+    def test_output_error_retries_without_hurting_health(self):
+        calls = []
+        ta.call_routed("gemini", _worker(calls, {"primary"}, ValueError("bad json")),
+                       "primary", "fallback")
+        assert calls == ["primary", "fallback"]
+        assert ta.model_health["primary"].snapshot()["error_rate"] == 0.0
+
+    def test_all_models_open_fails_fast(self):
+        _trip("primary")
+        _trip("fallback")
+        calls = []
+        with pytest.raises(CircuitOpenError):
+            ta.call_routed("gemini", _worker(calls, set()), "primary", "fallback")
+        assert calls == []
+
+    def test_open_provider_fails_fast(self):
+        _trip("provider:anthropic")
+        with pytest.raises(CircuitOpenError):
+            ta.call_routed("anthropic", _worker([], set()), "primary", "fallback")
+
+    def test_async_route_matches_sync(self):
+        _trip()
+
+        async def fn(model):
+            return model
+
+        assert ta.get_llm_dispatcher().run(ta.acall_routed("gemini", fn, "primary", "fallback")) \
+            == ("fallback", "fallback")
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. _call integration
+# ══════════════════════════════════════════════════════════════════
+
+class TestCallRouting:
+    def test_call_returns_to_reasoning_model_after_recovery(self):
+        state = {}
+        client = MagicMock()
+        client.models.generate_content.return_value = MagicMock(text="x")
+        _trip(ta.MODEL_REASONING)
+        with patch.object(ta.st, "session_state", state):
+            ta._call(client, "p", {"cfg": 1})
+            assert state["model_used"] == ta.MODEL_FALLBACK
+            with patch.object(ta, "HEALTH_OPEN_SECONDS", 0.0):
+                ta._call(client, "p", {"cfg": 1})
+            assert state["model_used"] == ta.MODEL_REASONING
+        models = [c.kwargs["model"] for c in client.models.generate_content.call_args_list]
+        assert models == [ta.MODEL_FALLBACK, ta.MODEL_REASONING]
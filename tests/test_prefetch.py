@@ -0,0 +1,106 @@
+"""
+Unit tests for speculative prefetch: the per-session future cache, its
+call / token budget, cancellation, and the Step 2 / Step 3 helpers.
+"""
+from __future__ import annotations
+
+import concurrent.futures
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import PrefetchCache
+
+
+@pytest.fixture
+def single_worker():
+    """A one-thread prefetch pool, so later jobs queue behind the first."""
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    with patch.object(ta, "_get_prefetch_pool", lambda: pool):
+        yield pool
+    pool.shutdown(wait=True)
+
+
+class TestPrefetchCache:
+    def test_result_is_taken_once(self):
+        cache = PrefetchCache()
+        assert cache.start("titles", "t", lambda x: [x], "a")
+        assert not cache.start("titles", "t", lambda x: [x], "b")     # already known
+        assert cache.take("titles", "t", timeout=5) == ["a"]
+        assert cache.take("titles", "t") is None
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+    def test_take_waits_for_in_flight_job(self):
+        release = threading.Event()
+        cache = PrefetchCache()
+        cache.start("research", "t", lambda: release.wait(5) and ("srcs", "ctx"))
+        threading.Timer(0.05, release.set).start()
+        assert cache.take("research", "t", timeout=5) == ("srcs", "ctx")
+
+    def test_failed_job_is_a_miss(self):
+        cache = PrefetchCache()
+
+        def boom():
+            raise RuntimeError("503")
+
+        cache.start("titles", "t", boom)
+        assert cache.take("titles", "t", timeout=5) is None
+        assert cache.stats()["misses"] == 1
+
+    def test_budget_limits_calls_and_tokens(self):
+        calls_only = PrefetchCache(max_calls=3, max_tokens=10**9)
+        started = [calls_only.start("research", str(i), lambda: None) for i in range(3)]
+        assert started == [True, False, False]              # research costs 2 calls
+        tokens_only = PrefetchCache(max_calls=100, max_tokens=ta.PREFETCH_COSTS["titles"][1] * 2)
+        assert [tokens_only.start("titles", str(i), lambda: None) for i in range(3)] == [True, True, False]
+
+    def test_discard_cancels_and_refunds_queued_jobs(self, single_worker):
+        started, gate = threading.Event(), threading.Event()
+        cache = PrefetchCache()
+        cache.start("titles", "running", lambda: (started.set(), gate.wait(5)))
+        cache.start("titles", "queued", lambda: "never")
+        assert started.wait(5)
+        calls_before = cache.stats()["calls"]
+        cache.discard("titles")
+        gate.set()
+        stats = cache.stats()
+        assert stats["pending"] == 0 and stats["wasted"] == 1
+        assert stats["calls"] == calls_before - ta.PREFETCH_COSTS["titles"][0]
+
+    def test_jobs_write_to_scratch_state(self):
+        session = ta.RunState.new()
+
+        def job():
+            ta._state()["model_used"] = "speculative"
+            return 1
+
+        with ta.bind_state(session):
+            cache = PrefetchCache()
+            cache.start("titles", "t", job)
+            assert cache.take("titles", "t", timeout=5) == 1
+        assert session.model_used == ta.MODEL_REASONING
+
+
+class TestPrefetchSteps:
+    def test_off_by_default(self):
+        with ta.bind_state(ta.RunState.new()):
+            ta.prefetch_titles(MagicMock(), [{"title": "A"}])
+            assert ta.session_prefetch() is None and ta.take_prefetched("titles", "A") is None
+
+    def test_titles_for_all_topics_and_research_for_top_titles(self):
+        state = ta.RunState.new(speculative_prefetch=True)
+        client = MagicMock()
+        titles = [{"title": f"T{i}"} for i in range(5)]
+        with ta.bind_state(state), \
+             patch.object(ta, "fetch_titles", side_effect=lambda c, t: [{"title": t["title"] + "!"}]) as ft, \
+             patch.object(ta, "deep_research", side_effect=lambda c, t: ([t], "ctx")) as dr:
+            ta.prefetch_titles(client, [{"title": "A"}, {"title": "B"}])
+            assert ta.take_prefetched("titles", "B") == [{"title": "B!"}]
+            ta.prefetch_research(client, titles)
+            assert ta.take_prefetched("research", "T1") == (["T1"], "ctx")
+            assert ta.take_prefetched("research", "T4") is None       # not top-ranked
+            assert ta.take_prefetched("titles", "A") and ta.take_prefetched("research", "T0")
+        assert ft.call_count == 2
+        assert sorted(c.args[1] for c in dr.call_args_list) == ["T0", "T1"]
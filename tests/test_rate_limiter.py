@@ -0,0 +1,171 @@
+"""
+Unit tests for the process-wide rate limiter: TokenBucket accounting,
+retry-after parsing, and 429 backoff in throttled / athrottled.
+"""
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import TokenBucket
+
+
+class _RateLimited(Exception):
+    def __init__(self, msg: str = "429 RESOURCE_EXHAUSTED", retry_after: str | None = None):
+        super().__init__(msg)
+        self.status_code = 429
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+def _flaky(failures: int, exc_factory=_RateLimited):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise exc_factory()
+        return "ok"
+    return fn, calls
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. TokenBucket
+# ══════════════════════════════════════════════════════════════════
+
+class TestTokenBucket:
+    def test_requests_within_rpm_do_not_wait(self):
+        bucket = TokenBucket(rpm=60, tpm=10_000)
+        assert all(bucket.reserve() == 0 for _ in range(60))
+
+    def test_request_over_rpm_waits_for_refill(self):
+        bucket = TokenBucket(rpm=60, tpm=10_000)
+        for _ in range(60):
+            bucket.reserve()
+        assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+        assert bucket.reserve() == pytest.approx(2.0, abs=0.05)   # queued behind the first
+
+    def test_token_budget_limits_large_prompts(self):
+        bucket = TokenBucket(rpm=1000, tpm=6000)
+        assert bucket.reserve(6000) == 0
+        assert bucket.reserve(600) == pytest.approx(6.0, abs=0.05)
+
+    def test_backoff_blocks_bucket(self):
+        bucket = TokenBucket(rpm=1000, tpm=10_000)
+        assert bucket.backoff(5.0, 0) == 5.0
+        assert bucket.reserve() == pytest.approx(5.0, abs=0.05)
+        assert bucket.stats()["throttled"] == 1
+
+    def test_backoff_without_hint_is_jittered_exponential(self):
+        bucket = TokenBucket(rpm=1000, tpm=10_000)
+        delay = bucket.backoff(None, 2)
+        base = ta.RATE_LIMIT_BACKOFF_BASE * 4
+        assert base * 0.5 <= delay <= base * 1.5
+
+    def test_wait_metrics_and_queue_depth(self):
+        bucket = TokenBucket(rpm=600, tpm=10_000)
+        for _ in range(600):
+            bucket.reserve()
+
+        async def probe():
+            task = asyncio.ensure_future(bucket.aacquire())
+            await asyncio.sleep(0.02)
+            depth = bucket.stats()["queued"]
+            await task
+            return depth
+
+        assert ta.get_llm_dispatcher().run(probe(), timeout=5) == 1
+        stats = bucket.stats()
+        assert stats["queued"] == 0
+        assert stats["waits"] == 1
+        assert stats["wait_max"] == pytest.approx(0.1, abs=0.02)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Retry-after parsing
+# ══════════════════════════════════════════════════════════════════
+
+class TestRetryAfter:
+    def test_header(self):
+        assert ta._retry_after(_RateLimited(retry_after="7")) == 7.0
+
+    def test_gemini_retry_delay(self):
+        exc = RuntimeError("429 RESOURCE_EXHAUSTED. {'@type': 'type.googleapis.com/google.rpc.RetryInfo', "
+                           "'retryDelay': '31s'}")
+        assert ta._retry_after(exc) == 31.0
+
+    def test_gemini_please_retry_in(self):
+        assert ta._retry_after(RuntimeError("Please retry in 12.5s.")) == 12.5
+
+    def test_no_hint(self):
+        assert ta._retry_after(RuntimeError("boom")) is None
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. throttled / routing
+# ══════════════════════════════════════════════════════════════════
+
+class TestThrottled:
+    @pytest.fixture(autouse=True)
+    def _no_sleep(self):
+        with patch.object(ta.time, "sleep") as sleep:
+            yield sleep
+
+    def test_429_is_retried_after_backoff(self, _no_sleep):
+        fn, calls = _flaky(2, lambda: _RateLimited(retry_after="3"))
+        assert ta.throttled("k", "m", 10, fn) == "ok"
+        assert len(calls) == 3
+        assert _no_sleep.call_args_list[-1].args[0] == pytest.approx(3.0, abs=0.05)
+
+    def test_gives_up_after_retries(self):
+        fn, calls = _flaky(99)
+        with pytest.raises(_RateLimited):
+            ta.throttled("k", "m", 10, fn)
+        assert len(calls) == ta.RATE_LIMIT_RETRIES + 1
+
+    def test_long_retry_hint_is_not_waited_out(self):
+        fn, calls = _flaky(1, lambda: _RateLimited(retry_after="3600"))
+        with pytest.raises(_RateLimited):
+            ta.throttled("k", "m", 10, fn)
+        assert len(calls) == 1
+
+    def test_other_errors_pass_through(self):
+        fn, calls = _flaky(1, lambda: RuntimeError("503"))
+        with pytest.raises(RuntimeError):
+            ta.throttled("k", "m", 10, fn)
+        assert len(calls) == 1
+
+    def test_buckets_are_per_key_and_model(self):
+        assert ta.rate_limiter.bucket("a", "m") is ta.rate_limiter.bucket("a", "m")
+        assert ta.rate_limiter.bucket("a", "m") is not ta.rate_limiter.bucket("b", "m")
+        assert ta.rate_limiter.bucket("a", ta.MODEL_REASONING).rpm == ta.RATE_LIMITS[ta.MODEL_REASONING][0]
+
+    def test_persistent_429_falls_back_without_hurting_health(self):
+        def fn(m):
+            if m == "primary":
+                raise _RateLimited(retry_after="3600")
+            return m
+
+        assert ta.call_routed("gemini", fn, "primary", "fallback") == ("fallback", "fallback")
+        assert ta.model_health["primary"].snapshot()["calls"] == 0
+
+    def test_acall_retries_429(self):
+        client = MagicMock()
+        resp = MagicMock(text="hi")
+
+        async def gen(**kw):
+            if client.calls == 0:
+                client.calls += 1
+                raise _RateLimited(retry_after="0.01")
+            return resp
+
+        client.calls = 0
+        client.aio.models.generate_content = gen
+        with patch.object(ta, "RESPONSE_CACHE_TTLS", {}):
+            out, model = ta.get_llm_dispatcher().run(ta._acall(client, "p", {"cfg": 1}), timeout=5)
+        assert out is resp
+        assert model == ta.MODEL_REASONING
+        assert ta.rate_limiter.totals()["throttled"] == 1
@@ -0,0 +1,151 @@
+"""
+Unit tests for the SQLite response cache behind _call / _call_search.
+"""
+from __future__ import annotations
+
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import ResponseCache, response_cache_key
+
+
+@pytest.fixture
+def cache(tmp_path) -> ResponseCache:
+    return ResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000)
+
+
+@pytest.fixture
+def isolated_cache(tmp_path):
+    """Point the process-wide cache at a temp file for _call tests."""
+    with patch.object(ta, "RESPONSE_CACHE_PATH", str(tmp_path / "rc.sqlite3")), \
+         patch.object(ta, "_response_cache", None):
+        yield ta.get_response_cache()
+
+
+def _fake_resp(text: str = "payload") -> MagicMock:
+    resp = MagicMock()
+    resp.text = text
+    resp.model_dump_json.return_value = f'{{"text": "{text}"}}'
+    return resp
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. ResponseCache
+# ══════════════════════════════════════════════════════════════════
+
+class TestResponseCache:
+    def test_roundtrip_and_counters(self, cache):
+        assert cache.get("k") is None
+        cache.put("k", "fetch_topics", "value", ttl=60)
+        assert cache.get("k") == "value"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+        assert stats["bytes"] == len("value")
+
+    def test_expired_entry_is_miss(self, cache):
+        cache.put("k", "fetch_topics", "value", ttl=60)
+        with patch("techaudit_agent.time.time", return_value=ta.time.time() + 61):
+            assert cache.get("k") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_lru_eviction_by_bytes(self, tmp_path):
+        cache = ResponseCache(str(tmp_path / "lru.sqlite3"), max_bytes=250)
+        now = ta.time.time()
+        for i, key in enumerate(("a", "b", "c")):
+            with patch("techaudit_agent.time.time", return_value=now + i):
+                cache.put(key, "t", "x" * 100, ttl=600)
+        # "c" pushed the total to 300 → oldest ("a") evicted
+        assert cache.stats()["entries"] == 2
+        with patch("techaudit_agent.time.time", return_value=now + 10):
+            assert cache.get("b") is not None      # touch "b"
+        with patch("techaudit_agent.time.time", return_value=now + 11):
+            cache.put("d", "t", "x" * 100, ttl=600)
+        assert cache.get("b") is not None
+        assert cache.get("c") is None              # least recently used
+        assert cache.get("a") is None
+
+    def test_oversized_payload_not_stored(self, cache):
+        cache.put("big", "t", "x" * 2000, ttl=60)
+        assert cache.stats()["entries"] == 0
+
+    def test_clear(self, cache):
+        cache.put("k", "t", "v", ttl=60)
+        cache.clear()
+        assert cache.stats()["entries"] == 0
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Cache key
+# ══════════════════════════════════════════════════════════════════
+
+class TestResponseCacheKey:
+    def test_stable(self):
+        assert response_cache_key("m", "p", {"t": 1}) == response_cache_key("m", "p", {"t": 1})
+
+    def test_varies_by_model_prompt_and_cfg(self):
+        base = response_cache_key("m", "p", {"t": 1})
+        assert response_cache_key("m2", "p", {"t": 1}) != base
+        assert response_cache_key("m", "p2", {"t": 1}) != base
+        assert response_cache_key("m", "p", {"t": 2}) != base
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. _call integration
+# ══════════════════════════════════════════════════════════════════
+
+class TestCallCaching:
+    def test_repeat_call_served_from_cache(self, isolated_cache):
+        client = MagicMock()
+        client.models.generate_content.return_value = _fake_resp()
+        ta._call(client, "prompt", {"cfg": 1}, model=ta.MODEL_REASONING, call_type="fetch_topics")
+        ta._call(client, "prompt", {"cfg": 1}, model=ta.MODEL_REASONING, call_type="fetch_topics")
+        assert client.models.generate_content.call_count == 1
+        assert isolated_cache.stats()["hits"] == 1
+
+    def test_uncached_call_type_always_calls_api(self, isolated_cache):
+        client = MagicMock()
+        client.models.generate_content.return_value = _fake_resp()
+        ta._call(client, "prompt", {"cfg": 1}, model=ta.MODEL_REASONING, call_type="article")
+        ta._call(client, "prompt", {"cfg": 1}, model=ta.MODEL_REASONING, call_type="article")
+        assert client.models.generate_content.call_count == 2
+        assert isolated_cache.stats()["entries"] == 0
+
+    def test_empty_response_not_cached(self, isolated_cache):
+        client = MagicMock()
+        client.models.generate_content.return_value = _fake_resp(text="")
+        resp = client.models.generate_content.return_value
+        resp.candidates = []
+        ta._call(client, "prompt", {"cfg": 1}, model=ta.MODEL_REASONING, call_type="deep_research")
+        assert isolated_cache.stats()["entries"] == 0
+
+    def test_competitor_call_type_uses_prefix_ttl(self):
+        assert ta._cache_ttl("competitor:nvidia_tech") == ta.RESPONSE_CACHE_TTLS["competitor"]
+        assert ta._cache_ttl(None) == 0
+
+    def test_malformed_reply_is_not_cached(self, isolated_cache):
+        schema = {"type": "array", "items": {"type": "integer"}}
+        client = MagicMock()
+        client.models.generate_content.side_effect = [_fake_resp("[1, 2"), _fake_resp("[1, 2]")]
+        with patch.object(ta.types.GenerateContentResponse, "model_validate_json",
+                          side_effect=lambda payload: _fake_resp(json.loads(payload)["text"])):
+            with pytest.raises(ValueError):
+                ta._call_json(client, "prompt", schema, call_type="fetch_titles")
+            assert isolated_cache.stats()["entries"] == 0
+            assert ta._call_json(client, "prompt", schema, call_type="fetch_titles")[0] == [1, 2]
+            assert ta._call_json(client, "prompt", schema, call_type="fetch_titles")[0] == [1, 2]
+        assert client.models.generate_content.call_count == 2      # the good reply was cached
+
+    def test_competitor_retry_does_not_replay_a_bad_reply(self, isolated_cache):
+        client = MagicMock()
+        good = '[{"title": "T", "url": "https://x.com/1", "date": "2025-01-01", "relevance": "r"}]'
+        client.aio.models.generate_content = AsyncMock(side_effect=[
+            _fake_resp("[{"), _fake_resp("[{"), _fake_resp(good)])    # grounded + JSON retry, then good
+        fetch = lambda: ta.get_llm_dispatcher().run(
+            ta.afetch_articles_for_competitor(client, "x", {"name": "X"}, "Cat"), timeout=5)
+        with pytest.raises(ta.CompetitorParseError):
+            fetch()
+        articles, _ = fetch()
+        assert [a["title"] for a in articles] == ["T"]
@@ -0,0 +1,200 @@
+"""
+Unit tests for streaming article generation (Claude messages.stream and
+Gemini generate_content_stream) with incremental section callbacks.
+"""
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+
+ARTICLE = {
+    "article_title": "T",
+    "executive_summary": "Summary.",
+    "sections": [{"heading": "H1", "content": "C1"}, {"heading": "H2", "content": "C2"}],
+    "conclusion": "End.",
+}
+ARTICLE_JSON = json.dumps(ARTICLE)
+
+
+def _chunks(text: str, size: int = 7) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+class _Recorder:
+    """on_part callback that records paths and how much text had streamed by then."""
+
+    def __init__(self):
+        self.parts: list[tuple] = []
+        self.fed = 0
+
+    def on_part(self, path, value):
+        if path == ("executive_summary",) or (len(path) == 2 and path[0] == "sections"):
+            self.parts.append((path, self.fed))
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. Claude messages.stream
+# ══════════════════════════════════════════════════════════════════
+
+class _FakeClaudeStream:
+    def __init__(self, deltas, final, rec):
+        self._deltas, self._final, self._rec = deltas, final, rec
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        yield SimpleNamespace(type="message_start")
+        for d in self._deltas:
+            self._rec.fed += len(d)
+            yield SimpleNamespace(
+                type="content_block_delta",
+                delta=SimpleNamespace(type="input_json_delta", partial_json=d),
+            )
+
+    def get_final_message(self):
+        return self._final
+
+
+class TestClaudeStreaming:
+    def test_sections_reported_before_stream_ends(self):
+        rec = _Recorder()
+        final = SimpleNamespace(content=[SimpleNamespace(type="tool_use", input=ARTICLE)])
+        client = MagicMock()
+        client.messages.stream.side_effect = lambda **kw: _FakeClaudeStream(
+            _chunks(ARTICLE_JSON), final, rec)
+        with patch.object(ta.st, "session_state", SimpleNamespace()):
+            art = ta.generate_article_claude(client, "T", [], [], "ctx", on_part=rec.on_part)
+        assert art == ARTICLE
+        assert [p for p, _ in rec.parts] == [
+            ("executive_summary",), ("sections", 0), ("sections", 1)]
+        # The summary closed well before the whole payload had streamed
+        assert rec.parts[0][1] < len(ARTICLE_JSON) / 2
+        client.messages.create.assert_not_called()
+        assert client.messages.stream.call_args.kwargs["tool_choice"]["name"] == "submit_article"
+
+    def test_without_callback_uses_blocking_create(self):
+        client = MagicMock()
+        client.messages.create.return_value = SimpleNamespace(
+            content=[SimpleNamespace(type="tool_use", input=ARTICLE)])
+        with patch.object(ta.st, "session_state", SimpleNamespace()):
+            assert ta.generate_article_claude(client, "T", [], [], "ctx") == ARTICLE
+        client.messages.stream.assert_not_called()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Gemini generate_content_stream
+# ══════════════════════════════════════════════════════════════════
+
+class TestGeminiStreaming:
+    @staticmethod
+    def _client(rec, fail_first=False):
+        def stream(model, contents, config):
+            if fail_first and model != ta.MODEL_FALLBACK:
+                raise RuntimeError("503")
+            for c in _chunks(ARTICLE_JSON):
+                rec.fed += len(c)
+                yield SimpleNamespace(text=c)
+        client = MagicMock()
+        client.models.generate_content_stream.side_effect = stream
+        return client
+
+    def test_generate_article_streams_sections(self):
+        rec = _Recorder()
+        state = SimpleNamespace(model_used=ta.MODEL_REASONING)
+        with patch.object(ta.st, "session_state", state):
+            art = ta.generate_article(self._client(rec), "T", [], "ctx", on_part=rec.on_part)
+        assert art == ARTICLE
+        assert len(rec.parts) == 3
+        assert rec.parts[0][1] < len(ARTICLE_JSON) / 2
+
+    def test_stream_falls_back_to_flash(self):
+        rec = _Recorder()
+        state = SimpleNamespace(model_used=ta.MODEL_REASONING)
+        with patch.object(ta.st, "session_state", state):
+            art = ta.generate_article(self._client(rec, fail_first=True), "T", [], "ctx",
+                                      on_part=rec.on_part)
+        assert art == ARTICLE
+        assert state.model_used == ta.MODEL_FALLBACK
+
+    def test_mid_stream_fallback_restarts_parts(self):
+        parts = []
+
+        def stream(model, contents, config):
+            if model == ta.MODEL_FALLBACK:
+                yield from (SimpleNamespace(text=c) for c in _chunks(ARTICLE_JSON))
+                return
+            abandoned = json.dumps(dict(ARTICLE, executive_summary="Abandoned."))
+            yield from (SimpleNamespace(text=c) for c in _chunks(abandoned[:70]))
+            raise RuntimeError("503")
+
+        client = MagicMock()
+        client.models.generate_content_stream.side_effect = stream
+        with patch.object(ta.st, "session_state", SimpleNamespace(model_used=ta.MODEL_REASONING)):
+            art = ta.generate_article(client, "T", [], "ctx", on_part=lambda p, v: parts.append((p, v)))
+        assert art == ARTICLE
+        restarts = [i for i, (p, _) in enumerate(parts) if p == ta.STREAM_RESTART]
+        assert len(restarts) == 2
+        assert (("executive_summary",), "Abandoned.") in parts[:restarts[1]]
+        summaries = [v for p, v in parts[restarts[1]:] if p == ("executive_summary",)]
+        assert summaries == ["Summary."]                 # the retry's parts only
+
+    def test_invalid_streamed_article_raises(self):
+        client = MagicMock()
+        client.models.generate_content_stream.return_value = iter(
+            [SimpleNamespace(text='{"sections": [{"heading": "H"}]}')])
+        with patch.object(ta.st, "session_state", SimpleNamespace(model_used=ta.MODEL_REASONING)):
+            with pytest.raises(ta.ResponseSchemaError):
+                ta.generate_article(client, "T", [], "ctx", on_part=lambda p, v: None)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. Anthropic prompt caching layout + usage reporting
+# ══════════════════════════════════════════════════════════════════
+
+class TestClaudePromptCaching:
+    SOURCES = [{"id": 1, "title": "S", "publisher": "P", "date": "2025", "snippet": "x"}]
+
+    def _request(self, qa_feedback=""):
+        return ta._claude_article_request("T", self.SOURCES, self.SOURCES, "ctx",
+                                          qa_feedback=qa_feedback, competitive_context="COMP")
+
+    def test_breakpoints_order_static_session_attempt(self):
+        req = self._request("fix citations")
+        assert req["system"][-1]["cache_control"] == {"type": "ephemeral"}
+        session, attempt = req["messages"][0]["content"]
+        assert session["cache_control"] == {"type": "ephemeral"}
+        assert "ctx" in session["text"] and "COMP" in session["text"]
+        assert "cache_control" not in attempt
+        assert "fix citations" in attempt["text"]
+        assert "fix citations" not in session["text"]
+
+    def test_cached_prefix_identical_across_qa_reruns(self):
+        first, rerun = self._request(), self._request("Failed checks to fix: word count")
+        assert first["system"] == rerun["system"]
+        assert first["tools"] == rerun["tools"]
+        assert first["messages"][0]["content"][0] == rerun["messages"][0]["content"][0]
+
+    def test_usage_accumulates_in_session(self):
+        usage = SimpleNamespace(input_tokens=50, output_tokens=900,
+                                cache_read_input_tokens=4000, cache_creation_input_tokens=0)
+        msg = SimpleNamespace(usage=usage,
+                              content=[SimpleNamespace(type="tool_use", input=ARTICLE)])
+        client = MagicMock()
+        client.messages.create.return_value = msg
+        state = SimpleNamespace()
+        with patch.object(ta.st, "session_state", state):
+            ta.generate_article_claude(client, "T", [], [], "ctx")
+            ta.generate_article_claude(client, "T", [], [], "ctx", qa_feedback="again")
+        assert state.claude_usage["cache_read"] == 8000
+        assert state.claude_usage["calls"] == 2
+        assert state.claude_usage["last"]["output"] == 900
+        assert client.messages.create.call_args.kwargs["system"][0]["cache_control"]
@@ -0,0 +1,112 @@
+"""
+Unit tests for section-scoped QA re-runs: mapping failed checks to article
+fields, the cut-down revision schema, splicing, and produce_article
+rewriting only the targeted fields.
+"""
+from __future__ import annotations
+
+import json
+from unittest.mock import MagicMock, patch
+
+import techaudit_agent as ta
+
+SOURCES = [{"id": 1, "title": "S", "publisher": "P", "date": "2025", "snippet": "x"}]
+ARTICLE = {
+    "article_title": "Fast Kernels",
+    "executive_summary": "Summary.",
+    "sections": [
+        {"heading": "A", "content": "Latency fell 40% under load [1]."},
+        {"heading": "B", "content": "No citations here."},
+        {"heading": "C", "content": "Throughput rose 2x on H100 [1]."},
+    ],
+    "tco_analysis": {"heading": "TCO", "content": "Too short."},
+    "conclusion": "Done.",
+    "metadata": {"seo_slug": "fast-kernels"},
+    "references": ["[1] S"],
+}
+
+
+def _failed(*checks: str) -> list[dict]:
+    return [{"category": "X", "check": c, "passed": False, "note": ""} for c in checks] + [
+        {"category": "Y", "check": "Passing check", "passed": True, "note": ""}]
+
+
+class TestFixTargets:
+    def test_field_checks_map_to_their_fields(self):
+        checks = _failed("TCO analysis present (>50 words)", "Anti-recommendation section present (>50 words)")
+        assert ta.qa_fix_targets(ARTICLE, checks) == ["tco_analysis", "anti_recommendation"]
+
+    def test_citation_checks_target_uncited_sections(self):
+        checks = _failed("Source citations [N] present in body (≥3)")
+        assert ta.qa_fix_targets(ARTICLE, checks) == ["sections.1"]
+
+    def test_whole_article_checks_need_a_full_rewrite(self):
+        assert ta.qa_fix_targets(ARTICLE, _failed("Word count: 1,000–1,500 words")) is None
+        art = dict(ARTICLE, sections=[{"heading": "A", "content": "plain"}] * 3)
+        assert ta.qa_fix_targets(art, _failed("Source citations [N] present in body (≥3)")) is None
+
+    def test_targeted_strategy_offered_first(self):
+        strategies = ta._generate_rerun_strategies(_failed("TCO analysis present (>50 words)"), ARTICLE)
+        assert strategies[0]["label"] == "Targeted Fix" and strategies[0]["targets"] == ["tco_analysis"]
+        assert all("targets" not in s for s in ta._generate_rerun_strategies(
+            _failed("TCO analysis present (>50 words)")))
+
+    def test_targeted_strategy_keeps_all_base_strategies(self):
+        failed = _failed("TCO analysis present (>50 words)")
+        base = [s["label"] for s in ta._generate_rerun_strategies(failed)]
+        assert len(base) == 3
+        assert [s["label"] for s in ta._generate_rerun_strategies(failed, ARTICLE)] == ["Targeted Fix"] + base
+
+
+class TestSplice:
+    def test_schema_contains_only_targets(self):
+        schema = ta._revision_schema(["tco_analysis", "sections.1"])
+        assert set(schema["properties"]) == {"tco_analysis", "sections"}
+        assert "index" in schema["properties"]["sections"]["items"]["required"]
+
+    def test_splice_replaces_targets_only(self):
+        patch_ = {"tco_analysis": {"content": "Longer TCO."},
+                  "sections": [{"index": 1, "heading": "B2", "content": "Now cited [1]."},
+                               {"index": 2, "heading": "ignored", "content": "not targeted"}]}
+        out = ta.splice_article(ARTICLE, patch_, ["tco_analysis", "sections.1"])
+        assert out["tco_analysis"] == {"heading": "TCO", "content": "Longer TCO."}
+        assert out["sections"][1]["heading"] == "B2" and out["sections"][2] == ARTICLE["sections"][2]
+        assert ARTICLE["sections"][1]["heading"] == "B"                 # original untouched
+
+
+class TestTargetedProduce:
+    def test_rewrites_only_targets(self):
+        patch_ = {"tco_analysis": {"heading": "TCO", "content": "Three-year TCO [1]."}}
+        resp = MagicMock(text=json.dumps(patch_))
+        with patch.object(ta, "ensure_article_context_cache", return_value=None), \
+             patch.object(ta, "_call", return_value=resp) as call, \
+             patch.object(ta, "generate_article") as full, \
+             patch.object(ta, "deep_research") as research, \
+             patch.object(ta, "score_article_rubric", return_value={"Clarity": 8.0}), \
+             patch.object(ta, "fetch_hero_image", return_value=None):
+            state = ta.RunState.new(_client=MagicMock(), sources=SOURCES, notebooklm_context="ctx")
+            with ta.bind_state(state):
+                art = ta.produce_article("Fast Kernels", SOURCES, qa_feedback="• TCO too short",
+                                         base_article=ARTICLE, fix_targets=["tco_analysis"])
+        full.assert_not_called()
+        research.assert_not_called()
+        assert art["tco_analysis"]["content"] == "Three-year TCO [1]."
+        assert art["sections"] == ARTICLE["sections"] and state.article is art
+        prompt = call.call_args.args[1]
+        assert "rewrite ONLY them" in prompt and "• tco_analysis" in prompt
+        assert call.call_args.kwargs["call_type"] == "article_revision"
+
+    def test_claude_revision_keeps_the_article_tool_prefix(self):
+        client = MagicMock()
+        client.messages.create.return_value = MagicMock(content=[MagicMock(
+            type="tool_use", input={"tco_analysis": {"heading": "TCO", "content": "Longer."}})])
+        state = ta.RunState.new()
+        with ta.bind_state(state):
+            out = ta.revise_fields_claude(client, "Fast Kernels", SOURCES, SOURCES, "ctx",
+                                          ARTICLE, ["tco_analysis"])
+        assert out == {"tco_analysis": {"heading": "TCO", "content": "Longer."}}
+        sent = client.messages.create.call_args.kwargs
+        article = ta._claude_article_request("Fast Kernels", SOURCES, SOURCES, "ctx")
+        assert json.dumps(sent["tools"]) == json.dumps(article["tools"])
+        assert sent["system"] == article["system"]
+        assert sent["tool_choice"] == {"type": "tool", "name": "submit_revision"}
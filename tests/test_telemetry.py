@@ -0,0 +1,128 @@
+"""
+Unit tests for per-call telemetry: usage normalization, cost, the JSONL
+trace, per-session / per-step summaries and the _call / _acall hooks.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import Telemetry
+
+
+@pytest.fixture(autouse=True)
+def _no_response_cache():
+    with patch.object(ta, "RESPONSE_CACHE_TTLS", {}):
+        yield
+
+
+def _gemini_resp(prompt=1000, out=200, thoughts=300, cached=0) -> SimpleNamespace:
+    return SimpleNamespace(text="x", usage_metadata=SimpleNamespace(
+        prompt_token_count=prompt, candidates_token_count=out,
+        thoughts_token_count=thoughts, cached_content_token_count=cached,
+    ))
+
+
+def _in_session(fn, session="s1", step=3):
+    """Run fn in a fresh context attributed to a session / step."""
+    def run():
+        ta.set_trace_context(session=session, step=step)
+        return fn()
+    return contextvars.copy_context().run(run)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. Usage & cost
+# ══════════════════════════════════════════════════════════════════
+
+class TestUsage:
+    def test_gemini_usage_splits_cached_input(self):
+        assert ta._gemini_usage(_gemini_resp(cached=400)) == {
+            "input": 600, "output": 200, "thinking": 300, "cached": 400, "cache_write": 0,
+        }
+
+    def test_missing_usage_is_zero(self):
+        assert set(ta._gemini_usage(MagicMock()).values()) == {0}
+
+    def test_claude_usage(self):
+        msg = SimpleNamespace(usage=SimpleNamespace(
+            input_tokens=10, output_tokens=20, cache_read_input_tokens=30, cache_creation_input_tokens=40))
+        assert ta._claude_call_usage(msg) == {
+            "input": 10, "output": 20, "thinking": 0, "cached": 30, "cache_write": 40,
+        }
+
+    def test_cost_bills_thinking_as_output(self):
+        usage = {"input": 1_000_000, "output": 0, "thinking": 1_000_000, "cached": 0, "cache_write": 0}
+        price = ta.MODEL_PRICES[ta.MODEL_REASONING]
+        assert ta.call_cost(ta.MODEL_REASONING, usage) == pytest.approx(price["input"] + price["output"])
+
+    def test_unknown_model_costs_nothing(self):
+        assert ta.call_cost("mystery", {"input": 10**6}) == 0.0
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Telemetry recorder
+# ══════════════════════════════════════════════════════════════════
+
+class TestTelemetry:
+    def test_track_records_error_and_reraises(self):
+        with pytest.raises(RuntimeError):
+            with ta.telemetry.track("rubric", "gemini", "m"):
+                raise RuntimeError("boom")
+        row = ta.telemetry.summary(None)["labels"]["rubric"]
+        assert (row["calls"], row["errors"]) == (1, 1)
+
+    def test_summary_by_session_and_step(self):
+        _in_session(lambda: ta.telemetry.record("fetch_topics", "gemini", "m", 2.0), step=2)
+        _in_session(lambda: ta.telemetry.record("deep_research", "gemini", "m", 5.0), step=4)
+        _in_session(lambda: ta.telemetry.record("deep_research", "gemini", "m", 9.0), session="other")
+        summary = ta.telemetry.summary("s1")
+        assert {k: v["latency_s"] for k, v in summary["steps"].items()} == {"2": 2.0, "4": 5.0}
+        assert ta.telemetry.summary("other")["labels"]["deep_research"]["calls"] == 1
+
+    def test_jsonl_trace_rotates(self, tmp_path):
+        path = tmp_path / "trace.jsonl"
+        tel = Telemetry(str(path), max_bytes=600, backups=2)
+        for i in range(10):
+            tel.record(f"competitor:c{i}", "gemini", "m", 0.1, {"input": i})
+        lines = path.read_text().splitlines()
+        rec = json.loads(lines[-1])
+        assert rec["label"] == "competitor:c9" and rec["input"] == 9
+        assert (tmp_path / "trace.jsonl.1").exists()
+        assert not (tmp_path / "trace.jsonl.3").exists()
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. Call-site hooks
+# ══════════════════════════════════════════════════════════════════
+
+class TestCallHooks:
+    def test_call_records_usage_cost_and_fallback_error(self):
+        client = MagicMock()
+        client.models.generate_content.side_effect = [RuntimeError("503"), _gemini_resp()]
+        _in_session(lambda: ta._call(client, "p", {"cfg": 1}, call_type="notebooklm"))
+        labels = ta.telemetry.summary("s1")["labels"]["notebooklm"]
+        assert (labels["calls"], labels["errors"]) == (2, 1)
+        assert labels["thinking"] == 300
+        assert labels["cost_usd"] == pytest.approx(
+            ta.call_cost(ta.MODEL_FALLBACK, ta._gemini_usage(_gemini_resp())))
+
+    def test_cache_hit_recorded_without_cost(self):
+        client = MagicMock()
+        with patch.object(ta, "_cache_lookup", return_value=_gemini_resp()):
+            ta._call(client, "p", {"cfg": 1}, call_type="fetch_titles")
+        rec = ta.telemetry.summary(None)["labels"]["fetch_titles"]
+        assert rec["cost_usd"] == 0 and rec["input"] == 0
+        client.models.generate_content.assert_not_called()
+
+    def test_async_calls_keep_the_submitting_session(self):
+        client = MagicMock()
+        client.aio.models.generate_content = AsyncMock(return_value=_gemini_resp())
+        _in_session(lambda: ta.get_llm_dispatcher().run(
+            ta._acall(client, "p", {"cfg": 1}, call_type="competitor:nvidia"), timeout=5), step=1)
+        assert ta.telemetry.summary("s1")["steps"]["1"]["calls"] == 1
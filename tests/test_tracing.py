@@ -0,0 +1,143 @@
+"""
+Unit tests for span tracing: nesting, the Chrome Trace Event exporter,
+run / step spans persisted across reruns, and spans from LLM calls.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import ChromeTraceExporter
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    """Export spans to a temp file; yields a loader returning the parsed events."""
+    path = tmp_path / "trace.json"
+    with patch.object(ta, "span_exporter", ChromeTraceExporter(str(path))):
+        def events():
+            # Trace Event Format allows the closing "]" to be missing — viewers add it
+            return json.loads(path.read_text().rstrip().rstrip(",") + "]")
+        yield events
+
+
+def _isolated(fn):
+    """Run fn in a fresh context (no current span)."""
+    return contextvars.Context().run(fn)
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. Spans & exporter
+# ══════════════════════════════════════════════════════════════════
+
+class TestSpans:
+    def test_nested_spans_share_trace_and_link_parent(self, trace_file):
+        def work():
+            with ta.span("outer") as outer:
+                with ta.span("inner", "parse", chars=3):
+                    pass
+            return outer
+
+        outer = _isolated(work)
+        inner, parent = trace_file()
+        assert (inner["name"], parent["name"]) == ("inner", "outer")
+        assert inner["ph"] == parent["ph"] == "X"
+        assert inner["args"]["parent_id"] == outer.span_id
+        assert inner["args"]["trace_id"] == outer.trace_id
+        assert inner["args"]["chars"] == 3
+        assert parent["ts"] <= inner["ts"] and inner["dur"] <= parent["dur"]
+
+    def test_error_recorded_and_reraised(self, trace_file):
+        def work():
+            with ta.span("boom"):
+                raise ValueError("bad")
+
+        with pytest.raises(ValueError):
+            _isolated(work)
+        assert trace_file()[0]["args"]["error"] == "ValueError: bad"
+
+    def test_traced_decorator(self, trace_file):
+        @ta.traced("scored", cat="qa")
+        def score(x):
+            return x * 2
+
+        assert _isolated(lambda: score(2)) == 4
+        assert trace_file()[0]["name"] == "scored" and trace_file()[0]["cat"] == "qa"
+
+    def test_async_spans_keep_parent_on_their_own_lane(self, trace_file):
+        async def child():
+            with ta.span("async child"):
+                pass
+
+        def work():
+            with ta.span("caller") as caller:
+                ta.get_llm_dispatcher().run(child(), timeout=5)
+            return caller
+
+        caller = _isolated(work)
+        child_ev = next(e for e in trace_file() if e["name"] == "async child")
+        assert child_ev["args"]["parent_id"] == caller.span_id
+        assert child_ev["tid"] != caller.lane
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. Workflow run / step spans across reruns
+# ══════════════════════════════════════════════════════════════════
+
+class TestWorkflowSpans:
+    def test_ids_survive_reruns_and_steps_rotate(self, trace_file):
+        state = {"trace_session": "ab" * 16}
+        with patch.object(ta.st, "session_state", state):
+            first = _isolated(lambda: ta.begin_trace_rerun(1))
+            again = _isolated(lambda: ta.begin_trace_rerun(1))
+            assert again.span_id == first.span_id
+            second = _isolated(lambda: ta.begin_trace_rerun(2))
+            assert second.span_id != first.span_id
+            assert second.parent_id == first.parent_id == state["trace_run"]["run"]["span_id"]
+            _isolated(ta.end_trace_run)
+            assert state["trace_run"] is None
+
+        phases = [(e["ph"], e["name"]) for e in trace_file()]
+        assert phases == [
+            ("M", "process_name"), ("B", "workflow run"), ("B", "step 1"),
+            ("E", "step 1"), ("B", "step 2"), ("E", "step 2"), ("E", "workflow run"),
+        ]
+        assert {e["pid"] for e in trace_file()} == {int("abababa", 16)}
+
+    def test_rerun_spans_nest_under_step(self, trace_file):
+        state = {"trace_session": "cd" * 16}
+
+        def rerun():
+            step = ta.begin_trace_rerun(3)
+            with ta.span("rerun · step 3", "rerun"):
+                pass
+            return step
+
+        with patch.object(ta.st, "session_state", state):
+            step = _isolated(rerun)
+        rerun_ev = next(e for e in trace_file() if e["ph"] == "X")
+        assert rerun_ev["args"]["parent_id"] == step.span_id
+        assert rerun_ev["tid"] == ta.SCRIPT_LANE
+
+
+# ══════════════════════════════════════════════════════════════════
+# 3. LLM call spans
+# ══════════════════════════════════════════════════════════════════
+
+class TestCallSpans:
+    def test_call_span_carries_tokens_and_matches_telemetry(self, trace_file):
+        client = MagicMock()
+        client.models.generate_content.return_value = MagicMock(
+            text="x", usage_metadata=MagicMock(prompt_token_count=10, candidates_token_count=5,
+                                               thoughts_token_count=0, cached_content_token_count=0))
+        with patch.object(ta, "RESPONSE_CACHE_TTLS", {}), \
+             patch.object(ta.telemetry, "record", wraps=ta.telemetry.record) as record:
+            _isolated(lambda: ta._call(client, "p", {"cfg": 1}, call_type="rubric"))
+        ev = trace_file()[0]
+        assert (ev["name"], ev["cat"]) == ("rubric", "llm")
+        assert ev["args"]["input"] == 10 and ev["args"]["output"] == 5
+        assert record.call_args.kwargs["span_id"] == ev["args"]["span_id"]
@@ -0,0 +1,214 @@
+"""
+Unit tests for the memoized workflow graph: fingerprints, incremental
+re-execution, in-flight sharing, and produce_article reusing step outputs.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import techaudit_agent as ta
+from techaudit_agent import WorkflowGraph
+
+SOURCES = [{"id": 1, "title": "S1"}, {"id": 2, "title": "S2"}]
+ARTICLE = {"article_title": "T", "sections": [{"heading": "H", "content": "Body [1]."}],
+           "metadata": {}, "references": ["[1] S1"]}
+
+
+@pytest.fixture
+def graph():
+    """research ← title; article ← research, sources; qa ← article. Yields (graph, calls)."""
+    g, calls = WorkflowGraph(), []
+
+    @g.node("research", inputs=("title",))
+    def research(title):
+        calls.append("research")
+        return f"ctx:{title}"
+
+    @g.node("article", inputs=("research", "sources"))
+    def article(research, sources):
+        calls.append("article")
+        return f"{research}|{','.join(sources)}"
+
+    @g.node("qa", inputs=("article",))
+    def qa(article):
+        calls.append("qa")
+        return [article]
+
+    yield g, calls
+
+
+# ══════════════════════════════════════════════════════════════════
+# 1. WorkflowGraph
+# ══════════════════════════════════════════════════════════════════
+
+class TestWorkflowGraph:
+    def test_fingerprint_changes_only_downstream(self, graph):
+        g, _ = graph
+        a = {"title": "T", "sources": ["s1", "s2"]}
+        b = {"title": "T", "sources": ["s1"]}
+        assert g.fingerprint("research", a) == g.fingerprint("research", b)
+        assert g.fingerprint("article", a) != g.fingerprint("article", b)
+        assert g.fingerprint("qa", a) != g.fingerprint("qa", b)
+
+    def test_rerun_recomputes_only_changed_nodes(self, graph):
+        g, calls = graph
+        assert g.run("qa", {"title": "T", "sources": ["s1", "s2"]}) == ["ctx:T|s1,s2"]
+        assert calls == ["research", "article", "qa"]
+        calls.clear()
+        params = {"title": "T", "sources": ["s1"]}
+        assert g.stale("qa", params) == ["article", "qa"]
+        assert g.run("qa", params) == ["ctx:T|s1"]
+        assert calls == ["article", "qa"]
+        calls.clear()
+        g.run("qa", params)
+        assert calls == [] and g.stats()["hits"] >= 1
+
+    def test_seed_and_runtime_kwargs(self):
+        g = WorkflowGraph()
+        seen = []
+
+        @g.node("research", inputs=("title",), runtime=("client",))
+        def research(title, client):
+            seen.append(client)
+            return "fresh"
+
+        @g.node("article", inputs=("research",))
+        def article(research):
+            return research.upper()
+
+        g.seed("research", {"title": "T"}, "seeded")
+        assert g.run("article", {"title": "T"}, client="c1") == "SEEDED"
+        assert g.run("research", {"title": "U"}, client="c2") == "fresh"
+        assert seen == ["c2"]
+
+    def test_downstream_tracks_upstream_values(self, graph):
+        g, calls = graph
+        params = {"title": "T", "sources": ["s1"]}
+        g.seed("research", params, "ctx:A")
+        assert g.run("qa", params) == ["ctx:A|s1"]
+        g.seed("research", params, "ctx:B")              # same title, new research
+        assert g.stale("qa", params) == ["article", "qa"]
+        assert g.run("qa", params) == ["ctx:B|s1"]
+        calls.clear()
+        g.seed("research", params, "ctx:A")              # back to a value seen before
+        assert g.run("qa", params) == ["ctx:A|s1"] and calls == []
+
+    def test_failures_and_empty_results_are_not_memoized(self):
+        g, results = WorkflowGraph(), [RuntimeError("503"), [], ["ok"]]
+
+        @g.node("titles", inputs=("topic",))
+        def titles(topic):
+            r = results.pop(0)
+            if isinstance(r, Exception):
+                raise r
+            return r
+
+        with pytest.raises(RuntimeError):
+            g.run("titles", {"topic": "t"})
+        assert g.run("titles", {"topic": "t"}) == []
+        assert g.run("titles", {"topic": "t"}) == ["ok"]
+        assert g.run("titles", {"topic": "t"}) == ["ok"]
+
+    def test_concurrent_runs_share_one_call(self):
+        g, calls, gate = WorkflowGraph(), [], threading.Event()
+
+        @g.node("research", inputs=("title",))
+        def research(title):
+            calls.append(title)
+            gate.wait(5)
+            return "ctx"
+
+        out = []
+        threads = [threading.Thread(target=lambda: out.append(g.run("research", {"title": "T"})))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        gate.set()
+        for t in threads:
+            t.join(5)
+        assert out == ["ctx"] * 3 and calls == ["T"]
+
+    def test_lru_and_ttl(self, graph):
+        g, calls = graph
+        g.max_entries = 1
+        g.run("research", {"title": "A"})
+        g.run("research", {"title": "B"})
+        g.run("research", {"title": "A"})
+        assert calls == ["research"] * 3
+        with patch.object(ta, "WORKFLOW_MEMO_TTL", 0):
+            g.run("research", {"title": "C"})
+            g.run("research", {"title": "C"})
+        assert len(calls) == 5
+
+
+# ══════════════════════════════════════════════════════════════════
+# 2. produce_article through the graph
+# ══════════════════════════════════════════════════════════════════
+
+class TestIncrementalArticle:
+    def test_changing_accepted_sources_skips_research(self):
+        with patch.object(ta, "deep_research", return_value=(SOURCES, "ctx")) as research, \
+             patch.object(ta, "ensure_article_context_cache", return_value=None), \
+             patch.object(ta, "generate_article",
+                          side_effect=lambda *a, **k: dict(ARTICLE, references=[s["title"] for s in a[2]])) as gen, \
+             patch.object(ta, "run_comprehensive_qa", return_value=[{"passed": True}]) as qa, \
+             patch.object(ta, "score_article_rubric", return_value={"Clarity": 8.0}) as rubric, \
+             patch.object(ta, "fetch_hero_image", return_value=b"img") as hero:
+            state = ta.RunState.new(_client=MagicMock())
+            with ta.bind_state(state):
+                state.sources, state.notebooklm_context = ta.workflow.run(
+                    "research", {"title": "T"}, client=state._client)
+                ta.produce_article("T", SOURCES)
+                ta.produce_article("T", SOURCES)             # unchanged: all memo hits
+                ta.produce_article("T", SOURCES[:1])         # new accepted set
+        assert research.call_count == 1 and hero.call_count == 1
+        assert gen.call_count == qa.call_count == rubric.call_count == 2
+        assert gen.call_args.args[1] == "T" and gen.call_args.args[2] == SOURCES[:1]
+        assert state.rubric_scores == {"Clarity": 8.0} and state.hero_image_bytes == b"img"
+
+    def test_failed_generation_is_retried(self):
+        with patch.object(ta, "ensure_article_context_cache", return_value=None), \
+             patch.object(ta, "generate_article", side_effect=[RuntimeError("500"), dict(ARTICLE)]), \
+             patch.object(ta, "score_article_rubric", return_value={"Clarity": 8.0}), \
+             patch.object(ta, "fetch_hero_image", return_value=None):
+            state = ta.RunState.new(_client=MagicMock(), sources=SOURCES, notebooklm_context="ctx")
+            with ta.bind_state(state):
+                assert ta.produce_article("T", SOURCES) is None
+                assert state.gen_error == "500"
+                assert ta.produce_article("T", SOURCES) is not None
+        assert state.gen_error == "" and state.actual_writer == "gemini"
+
+    def test_explicit_rerun_attempt_writes_a_fresh_draft(self):
+        with patch.object(ta, "ensure_article_context_cache", return_value=None), \
+             patch.object(ta, "generate_article", side_effect=lambda *a, **k: dict(ARTICLE)) as gen, \
+             patch.object(ta, "score_article_rubric", return_value={"Clarity": 8.0}), \
+             patch.object(ta, "fetch_hero_image", return_value=None):
+            state = ta.RunState.new(_client=MagicMock(), sources=SOURCES, notebooklm_context="ctx")
+            with ta.bind_state(state):
+                ta.produce_article("T", SOURCES, qa_feedback="• fix TCO", attempt=1)
+                ta.produce_article("T", SOURCES, qa_feedback="• fix TCO", attempt=1)
+                ta.produce_article("T", SOURCES, qa_feedback="• fix TCO", attempt=2)
+        assert gen.call_count == 2
+
+    def test_fallback_draft_is_not_memoized(self):
+        claude = MagicMock(side_effect=[RuntimeError("overloaded"), dict(ARTICLE, article_title="C")])
+        with patch.object(ta, "generate_article_claude", claude), \
+             patch.object(ta, "ensure_article_context_cache", return_value=None), \
+             patch.object(ta, "generate_article", side_effect=lambda *a, **k: dict(ARTICLE)), \
+             patch.object(ta, "run_comprehensive_qa", side_effect=lambda art: [{"t": art["article_title"]}]), \
+             patch.object(ta, "score_article_rubric", return_value={"Clarity": 8.0}), \
+             patch.object(ta, "fetch_hero_image", return_value=None):
+            state = ta.RunState.new(_client=MagicMock(), _anthropic_client=MagicMock(),
+                                    sources=SOURCES, notebooklm_context="ctx")
+            with ta.bind_state(state):
+                ta.produce_article("T", SOURCES)
+                assert state.actual_writer == "gemini_fallback" and state.qa_checks == [{"t": "T"}]
+                ta.produce_article("T", SOURCES)
+        assert claude.call_count == 2
+        assert state.actual_writer == "claude" and state.article["article_title"] == "C"
+        assert state.qa_checks == [{"t": "C"}]             # QA of the new draft, not the fallback's